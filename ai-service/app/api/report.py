@@ -3,6 +3,7 @@ Endpoints para análise de relatórios XP.
 """
 import asyncio
 import json
+from datetime import datetime, timezone
 from typing import Any, Dict, List
 
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
@@ -26,6 +27,7 @@ from app.workflows.report_workflow import create_report_analysis_workflow, creat
 from app.services.report_analyzer.batch_processing import process_batch_reports
 from app.services.report_analyzer.ultra_batch_processing import process_ultra_batch_reports  
 from app.services.report_analyzer.signed_url import generate_signed_url_for_upload
+from app.services.report_analyzer.result_store import build_result_key, get_stored_result, save_result
 
 from pydantic import BaseModel
 
@@ -33,11 +35,20 @@ from app.config import get_firestore_client, logger
 from firebase_admin import firestore  
 import uuid
 from app.services.metrics import record_metric_call, record_ultra_batch_start, record_ultra_batch_complete
-from app.services.digital_whitelist import is_digital
+from app.services.digital_whitelist import get_whitelist_cache_stats, is_digital
+from app.services.metrics_summary import get_metrics_summaries_sync
 from app.services.report_analyzer.google_sheets_service import (
     backfill_sheets_from_results_sync,
     create_spreadsheet_for_job,
     get_sheets_config,
+    get_sheets_config_cache_stats,
+    get_sheets_client_stats,
+    is_backfill_stale,
+)
+from app.services.report_analyzer.sheets_rate_limiter import get_quota_stats
+from app.services.report_analyzer.sheets_outbox import (
+    get_outbox_stats,
+    recover_pending_sheets_rows_sync,
 )
 
 
@@ -51,9 +62,30 @@ class CheckWhitelistRequest(BaseModel):
     user_id: str
 
 
+class RecoverSheetsRequest(BaseModel):
+    user_id: str
+
+
 router = APIRouter(tags=["report"])
 
 
+async def _run_report_workflow(state: dict) -> dict:
+    """
+    Executa o workflow completo consultando antes o store de resultados
+    (hash do PDF + modo + seleção + versão dos prompts).
+    """
+    key = build_result_key(state["file_content"], state["analysis_mode"], state.get("selected_fields"))
+    stored = await get_stored_result(key)
+    if stored is not None:
+        logger.info(f"[result_store] Hit para {state.get('file_name')} ({state['analysis_mode']})")
+        return stored
+
+    app = create_report_analysis_workflow()
+    result = await app.ainvoke(state)
+    await save_result(key, result, state["analysis_mode"])
+    return result
+
+
 @router.post("/analyze-auto", response_model=ReportAnalyzeResponse)
 async def analyze_report_auto(request: ReportAnalyzeAutoRequest):
     """
@@ -74,8 +106,7 @@ async def analyze_report_auto(request: ReportAnalyzeAutoRequest):
             "selected_fields": None
         }
         
-        app = create_report_analysis_workflow()
-        result = await app.ainvoke(state)
+        result = await _run_report_workflow(state)
         
         # Registrar métrica após processamento bem-sucedido
         if result.get("error") is None:
@@ -117,8 +148,7 @@ async def analyze_report_personalized(request: ReportAnalyzePersonalizedRequest)
             "selected_fields": request.selected_fields
         }
         
-        app = create_report_analysis_workflow()
-        result = await app.ainvoke(state)
+        result = await _run_report_workflow(state)
         
         # Registrar métrica após processamento bem-sucedido
         if result.get("error") is None:
@@ -391,6 +421,8 @@ async def ultra_batch_analyze_reports(request: Request, body: UltraBatchReportRe
             'status': 'processing',
             'current_file': 0,
             'created_at': firestore.SERVER_TIMESTAMP,
+            # Mês UTC de criação (YYYY-MM), consultado por igualdade pelo agregador de métricas
+            'created_at_month': datetime.now(timezone.utc).strftime("%Y-%m"),
             'estimated_time_minutes': total_files * 2  # 2 min por arquivo
         }
         
@@ -523,7 +555,6 @@ async def get_ultra_batch_status(job_id: str):
 
 
 def _month_range(from_month: str, to_month: str, max_months: int = 24) -> list[str]:
-    from datetime import datetime
     f = datetime.strptime(from_month, "%Y-%m")
     t = datetime.strptime(to_month, "%Y-%m")
     if f > t:
@@ -548,6 +579,7 @@ async def get_metrics_summary(
     """
     Retorna resumos mensais de métricas do report_analyzer (MAU, volume, intensidade, qualidade, escala).
     Dados pré-agregados pelo job Cloud Scheduler; intervalo limitado a 24 meses.
+    Uma única leitura em lote (fora do event loop); meses fechados vêm do cache.
     """
     try:
         months = _month_range(from_month, to_month)
@@ -556,17 +588,13 @@ async def get_metrics_summary(
                 status_code=400,
                 detail="from_month deve ser anterior ou igual a to_month",
             )
-        db = get_firestore_client()
+        loop = asyncio.get_running_loop()
+        docs = await loop.run_in_executor(None, get_metrics_summaries_sync, months)
         summaries: List[MetricsSummaryItem] = []
-        for month in months:
-            ref = db.collection("metrics_summary").document(month)
-            doc = ref.get()
-            if doc.exists:
-                data = doc.to_dict() or {}
-                data["month"] = month
-                if "updated_at" in data and hasattr(data["updated_at"], "isoformat"):
-                    data["updated_at"] = data["updated_at"].isoformat()
-                summaries.append(MetricsSummaryItem(**data))
+        for data in docs:
+            if "updated_at" in data and hasattr(data["updated_at"], "isoformat"):
+                data["updated_at"] = data["updated_at"].isoformat()
+            summaries.append(MetricsSummaryItem(**data))
         return MetricsSummaryResponse(summaries=summaries)
     except HTTPException:
         raise
@@ -613,7 +641,7 @@ async def configure_sheets(body: ConfigureSheetsRequest, background_tasks: Backg
 
     existing = get_sheets_config(body.job_id)
     if existing and existing.get("enabled"):
-        if existing.get("backfill_status") in ("failed", "pending"):
+        if existing.get("backfill_status") in ("failed", "pending") or is_backfill_stale(existing):
             background_tasks.add_task(backfill_sheets_from_results_sync, body.job_id)
         return {
             "success": True,
@@ -661,6 +689,52 @@ async def get_sheets_config_endpoint(job_id: str):
     return out
 
 
+@router.get("/ultra-batch/sheets-stats")
+async def get_sheets_stats_endpoint():
+    """
+    Métricas do Sheets: pool de clientes (objetos construídos e latência de flush),
+    outbox, limitador de quota (espera, throttling e capacidade estimada de jobs)
+    cache de google_sheets_config e cache do setor digital (gate do Sheets).
+    """
+    return {
+        **get_sheets_client_stats(),
+        "outbox": get_outbox_stats(),
+        "quota": get_quota_stats(),
+        "config_cache": get_sheets_config_cache_stats(),
+        "digital_whitelist": get_whitelist_cache_stats(),
+    }
+
+
+@router.post("/ultra-batch/sheets-recover/{job_id}")
+async def recover_sheets_rows(job_id: str, body: RecoverSheetsRequest, background_tasks: BackgroundTasks):
+    """
+    Reenvia para a planilha as linhas que o outbox não chegou a entregar
+    (resultados com sheets_pending=True). Só para jobs que não estão em processamento;
+    mesmas regras do configure-sheets (usuário na lista digital e dono do job).
+
+    É o único caminho de recuperação e não roda sozinho: depois de um append com
+    resultado incerto (5xx, timeout) o outbox do job para e, se a instância cair,
+    as linhas ficam pendentes. Confira a planilha antes de chamar, senão linhas
+    que chegaram podem ser duplicadas.
+    """
+    loop = asyncio.get_running_loop()
+    authorized = await loop.run_in_executor(None, is_digital, body.user_id)
+    if not authorized:
+        raise HTTPException(status_code=403, detail="Usuário não autorizado")
+
+    db = get_firestore_client()
+    job_doc = db.collection("ultra_batch_jobs").document(job_id).get()
+    if not job_doc.exists:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    job = job_doc.to_dict() or {}
+    if job.get("user_id") != body.user_id:
+        raise HTTPException(status_code=403, detail="Job não pertence ao usuário")
+    if job.get("status") == "processing":
+        raise HTTPException(status_code=409, detail="Job ainda em processamento")
+    background_tasks.add_task(recover_pending_sheets_rows_sync, job_id)
+    return {"success": True, "status": "scheduled"}
+
+
 # ============= STREAMING ENDPOINTS (SSE) =============
 
 @router.post("/analyze-auto-stream")
@@ -684,8 +758,7 @@ async def analyze_report_auto_stream(request: ReportAnalyzeAutoRequest):
         
         # TODO: Implementar analyze_report_with_progress
         # Por enquanto, usar o workflow normal
-        app = create_report_analysis_workflow()
-        result = await app.ainvoke(state)
+        result = await _run_report_workflow(state)
 
         if result.get("error") is None:
             try:
@@ -726,8 +799,7 @@ async def analyze_report_personalized_stream(request: ReportAnalyzePersonalizedR
         
         # TODO: Implementar analyze_report_with_progress
         # Por enquanto, usar o workflow normal
-        app = create_report_analysis_workflow()
-        result = await app.ainvoke(state)
+        result = await _run_report_workflow(state)
 
         if result.get("error") is None:
             try:
@@ -60,6 +60,61 @@ MAX_CONCURRENT_JOBS = 5  # Reduzido de 10 para 3 para evitar OOM
 LLM_MAX_RETRIES = 5       # Aumentado para lidar com backpressure
 LLM_RETRY_DELAY = 2.0     # Delay inicial (base para exponencial)
 
+# Store de resultados (hash do PDF + modo + seleção + versão dos prompts)
+RESULT_STORE_ENABLED = os.getenv("RESULT_STORE_ENABLED", "true").lower() == "true"
+RESULT_STORE_TTL_SECONDS = int(os.getenv("RESULT_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_STORE_MEMORY_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MEMORY_MAX_ENTRIES", "256"))
+
+# Cache por classe da análise personalizada (reaproveitado entre seleções da mesma extração)
+CLASS_ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("CLASS_ANALYSIS_CACHE_TTL_SECONDS", "3600"))
+CLASS_ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("CLASS_ANALYSIS_CACHE_MAX_ENTRIES", "2048"))
+
+# Map-reduce da análise personalizada (uma chamada por classe acima do limite de ativos)
+ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD = int(os.getenv("ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD", "60"))
+ANALYSIS_MAP_REDUCE_MAX_WORKERS = int(os.getenv("ANALYSIS_MAP_REDUCE_MAX_WORKERS", "4"))
+
+# Compactação dos dados embutidos nos prompts (JSON minificado, raw_text sem repetições)
+PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+
+# Outbox do Sheets no ultra batch (um escritor por job, linhas coalescidas em values.append)
+SHEETS_OUTBOX_MAX_ROWS_PER_APPEND = int(os.getenv("SHEETS_OUTBOX_MAX_ROWS_PER_APPEND", "500"))
+SHEETS_OUTBOX_LINGER_SECONDS = float(os.getenv("SHEETS_OUTBOX_LINGER_SECONDS", "2.0"))
+SHEETS_OUTBOX_MAX_RETRIES = int(os.getenv("SHEETS_OUTBOX_MAX_RETRIES", "5"))
+SHEETS_OUTBOX_CONFIG_RECHECK_SECONDS = float(os.getenv("SHEETS_OUTBOX_CONFIG_RECHECK_SECONDS", "15"))
+SHEETS_OUTBOX_CLOSE_TIMEOUT_SECONDS = float(os.getenv("SHEETS_OUTBOX_CLOSE_TIMEOUT_SECONDS", "120"))
+
+# Limitador de quota das APIs Google (token bucket por processo, justo entre jobs)
+SHEETS_QUOTA_REQUESTS_PER_MINUTE = int(os.getenv("SHEETS_QUOTA_REQUESTS_PER_MINUTE", "60"))
+SHEETS_QUOTA_BURST = int(os.getenv("SHEETS_QUOTA_BURST", "10"))
+DRIVE_QUOTA_REQUESTS_PER_MINUTE = int(os.getenv("DRIVE_QUOTA_REQUESTS_PER_MINUTE", "600"))
+GOOGLE_API_MAX_ATTEMPTS = int(os.getenv("GOOGLE_API_MAX_ATTEMPTS", "5"))
+
+# Backfill do Sheets paginado e retomável (cursor por nome de documento)
+SHEETS_BACKFILL_PAGE_SIZE = int(os.getenv("SHEETS_BACKFILL_PAGE_SIZE", "200"))
+SHEETS_BACKFILL_CHUNK_ROWS = int(os.getenv("SHEETS_BACKFILL_CHUNK_ROWS", "500"))
+SHEETS_BACKFILL_STALE_SECONDS = int(os.getenv("SHEETS_BACKFILL_STALE_SECONDS", "600"))
+
+# Cache em processo de google_sheets_config/{job_id} (negativo com TTL menor)
+SHEETS_CONFIG_CACHE_TTL_SECONDS = float(os.getenv("SHEETS_CONFIG_CACHE_TTL_SECONDS", "30"))
+SHEETS_CONFIG_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("SHEETS_CONFIG_CACHE_NEGATIVE_TTL_SECONDS", "5"))
+SHEETS_CONFIG_CACHE_MAX_ENTRIES = int(os.getenv("SHEETS_CONFIG_CACHE_MAX_ENTRIES", "1024"))
+
+# Buffer de métricas (incrementos acumulados e gravados em lote)
+METRICS_BUFFER_ENABLED = os.getenv("METRICS_BUFFER_ENABLED", "true").lower() == "true"
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "5"))
+# Shards do total diário metrics/{date}/total/shard_{i} (escolhido ao acaso a cada escrita)
+METRICS_TOTAL_SHARDS = int(os.getenv("METRICS_TOTAL_SHARDS", "10"))
+
+# Cache do setor digital (uid → email e config/digital_team), stale-while-revalidate
+DIGITAL_WHITELIST_CACHE_TTL_SECONDS = float(os.getenv("DIGITAL_WHITELIST_CACHE_TTL_SECONDS", "300"))
+# Até quanto tempo após o TTL um valor vencido ainda é servido enquanto recarrega
+DIGITAL_WHITELIST_MAX_STALE_SECONDS = float(os.getenv("DIGITAL_WHITELIST_MAX_STALE_SECONDS", "3600"))
+DIGITAL_WHITELIST_CACHE_MAX_ENTRIES = int(os.getenv("DIGITAL_WHITELIST_CACHE_MAX_ENTRIES", "4096"))
+
+# Cache de metrics_summary/{month}: meses fechados ficam em cache indefinidamente
+METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS = float(os.getenv("METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS", "60"))
+METRICS_SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("METRICS_SUMMARY_CACHE_MAX_ENTRIES", "240"))
+
 # Configurações de chunking
 CHUNK_SIZE = 10000  # caracteres por chunk
 CHUNK_OVERLAP = 500
@@ -228,6 +283,36 @@ GCP_LOG_NAME = os.getenv("GCP_LOG_NAME", "bob-ai-service")
 # Ativar apenas em produção
 MONITORING_ACTIVE = MONITORING_ENABLED and MONITORING_ENVIRONMENT == "production"
 
+# Exportação assíncrona para o Cloud Logging (app/monitoring/exporter.py)
+LOG_EXPORT_QUEUE_MAX_ENTRIES = int(os.getenv("LOG_EXPORT_QUEUE_MAX_ENTRIES", "1000"))
+LOG_EXPORT_BATCH_SIZE = int(os.getenv("LOG_EXPORT_BATCH_SIZE", "50"))
+LOG_EXPORT_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_EXPORT_FLUSH_INTERVAL_SECONDS", "2.0"))
+LOG_EXPORT_MAX_RETRIES = int(os.getenv("LOG_EXPORT_MAX_RETRIES", "3"))
+# Fração mantida das entradas abaixo de ERROR com a fila acima da metade
+LOG_EXPORT_OVERLOAD_SAMPLE_RATE = float(os.getenv("LOG_EXPORT_OVERLOAD_SAMPLE_RATE", "0.1"))
+LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS", "5.0"))
+
+# Logs do pipeline de relatórios (app/monitoring/pipeline_log.py)
+PIPELINE_LOG_LEVEL = os.getenv("PIPELINE_LOG_LEVEL", "INFO").upper()
+# "json" (uma linha por entrada, lida pelo Cloud Logging) ou "text" (desenvolvimento)
+PIPELINE_LOG_FORMAT = os.getenv("PIPELINE_LOG_FORMAT", "json").lower()
+# Fração dos jobs com DEBUG completo mesmo com nível INFO (decisão determinística por job_id)
+PIPELINE_LOG_DEBUG_SAMPLE_RATE = float(os.getenv("PIPELINE_LOG_DEBUG_SAMPLE_RATE", "0.0"))
+# Teto de linhas DEBUG por arquivo; o excedente só é contado no resumo
+PIPELINE_LOG_MAX_DEBUG_PER_FILE = int(os.getenv("PIPELINE_LOG_MAX_DEBUG_PER_FILE", "200"))
+
+# Tracing por request (app/monitoring/tracing.py)
+# "none" (desligado), "jsonl" (arquivo local, testes/desenvolvimento) ou "otlp" (OTLP/HTTP JSON)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_JSONL_PATH = os.getenv("TRACING_JSONL_PATH", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+# Cabeçalhos extras do OTLP, no formato "chave=valor,chave2=valor2"
+TRACING_OTLP_HEADERS = os.getenv("TRACING_OTLP_HEADERS", "")
+TRACING_OTLP_TIMEOUT_SECONDS = float(os.getenv("TRACING_OTLP_TIMEOUT_SECONDS", "5.0"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", GCP_LOG_NAME)
+# Fração dos traces exportados (decidida no span raiz; filhos seguem o raiz)
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+
 print(f"[CONFIG] Monitoramento: {'ATIVO' if MONITORING_ACTIVE else 'DESATIVADO'} (env: {MONITORING_ENVIRONMENT})")
 
 
@@ -0,0 +1,67 @@
+"""
+Middleware ASGI que abre um span raiz por request HTTP.
+
+ASGI puro (e não BaseHTTPMiddleware) para que o span cubra respostas em stream
+(SSE do ultra batch) até o último byte. Nome final: "<método> <rota>", com o
+template da rota; job_id dos path params vira atributo (herdado pelos filhos).
+Um cabeçalho W3C traceparent recebido continua o trace do chamador.
+"""
+import re
+
+from app.monitoring.tracing import span, tracing_enabled
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def _traceparent(scope) -> tuple:
+    for key, value in scope.get("headers", []):
+        if key == b"traceparent":
+            match = _TRACEPARENT.match(value.decode("latin-1").strip().lower())
+            if match:
+                return match.group(1), match.group(2)
+    return None, None
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing_enabled():
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "")
+        trace_id, parent_span_id = _traceparent(scope)
+        response = {}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] = response.get("bytes", 0) + len(message.get("body", b""))
+            await send(message)
+
+        with span(
+            f"{method} {scope.get('path', '')}",
+            parent=None,
+            trace_id=trace_id,
+            parent_span_id=parent_span_id,
+            http_method=method,
+            http_path=scope.get("path"),
+        ) as request_span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                route_path = getattr(route, "path", None)
+                if route_path:
+                    request_span.name = f"{method} {route_path}"
+                request_span.set(
+                    http_route=route_path,
+                    http_status_code=response.get("status"),
+                    response_bytes=response.get("bytes"),
+                    job_id=(scope.get("path_params") or {}).get("job_id"),
+                )
+                if response.get("status", 200) >= 500:
+                    request_span.set_error(f"HTTP {response['status']}")
@@ -0,0 +1,201 @@
+"""
+Exportador assíncrono de logs estruturados (Cloud Logging) em lotes.
+
+O request só paga o enqueue: a entrada (traceback, sanitização) é montada e
+enviada por uma thread daemon, em lotes de até LOG_EXPORT_BATCH_SIZE entradas
+por chamada (Logger.batch()), esperando até LOG_EXPORT_FLUSH_INTERVAL_SECONDS
+para juntar mais entradas. Falhas de envio são retentadas com backoff na
+própria thread.
+
+Fila limitada (LOG_EXPORT_QUEUE_MAX_ENTRIES):
+- acima da metade, entradas abaixo de ERROR são amostradas
+  (LOG_EXPORT_OVERLOAD_SAMPLE_RATE)
+- cheia, novas entradas são descartadas
+- o próximo lote leva uma entrada WARNING com a contagem de descartes
+  (report_drops=False desliga a entrada; os descartes ficam só em get_stats())
+
+flush()/stop() drenam a fila (usados no shutdown da aplicação).
+"""
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config import (
+    LOG_EXPORT_BATCH_SIZE,
+    LOG_EXPORT_FLUSH_INTERVAL_SECONDS,
+    LOG_EXPORT_MAX_RETRIES,
+    LOG_EXPORT_OVERLOAD_SAMPLE_RATE,
+    LOG_EXPORT_QUEUE_MAX_ENTRIES,
+)
+
+# Severidades nunca amostradas quando a fila está carregada
+_PRIORITY_SEVERITIES = {"ERROR", "CRITICAL"}
+BACKOFF_MAX_SECONDS = 5.0
+
+LogEntry = Tuple[Dict[str, Any], str]
+WriteBatch = Callable[[List[LogEntry]], None]
+
+
+class LogExporter:
+    """Fila limitada de entradas de log drenada em lotes por uma thread em background."""
+
+    def __init__(
+        self,
+        write_batch: WriteBatch,
+        max_queue: int = LOG_EXPORT_QUEUE_MAX_ENTRIES,
+        batch_size: int = LOG_EXPORT_BATCH_SIZE,
+        flush_interval_seconds: float = LOG_EXPORT_FLUSH_INTERVAL_SECONDS,
+        max_retries: int = LOG_EXPORT_MAX_RETRIES,
+        overload_sample_rate: float = LOG_EXPORT_OVERLOAD_SAMPLE_RATE,
+        backoff_base_seconds: float = 0.1,
+        report_drops: bool = True,
+    ):
+        self.write_batch = write_batch
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_retries = max(1, max_retries)
+        self.overload_sample_rate = overload_sample_rate
+        self.backoff_base_seconds = backoff_base_seconds
+        self.report_drops = report_drops
+        self._cond = threading.Condition()
+        self._queue: Deque[Tuple[str, Callable[[], Dict[str, Any]]]] = deque()
+        self._in_flight = 0
+        self._flush_waiters = 0
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        # Descartes ainda não reportados no Cloud Logging
+        self._unreported_drops = 0
+        self.stats = {
+            "enqueued": 0,
+            "exported": 0,
+            "batches": 0,
+            "dropped": 0,
+            "sampled_out": 0,
+            "retries": 0,
+            "failed": 0,
+            "build_errors": 0,
+        }
+
+    def submit(self, severity: str, build: Callable[[], Dict[str, Any]]) -> bool:
+        """
+        Enfileira uma entrada; build() monta o payload na thread do exportador.
+        Retorna False se a entrada foi descartada ou amostrada.
+        """
+        with self._cond:
+            size = len(self._queue)
+            if self._stopping or size >= self.max_queue:
+                self.stats["dropped"] += 1
+                self._unreported_drops += 1
+                return False
+            if (
+                size >= self.max_queue // 2
+                and severity not in _PRIORITY_SEVERITIES
+                and random.random() >= self.overload_sample_rate
+            ):
+                self.stats["sampled_out"] += 1
+                self._unreported_drops += 1
+                return False
+            self._queue.append((severity, build))
+            self.stats["enqueued"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        self._ensure_started()
+        return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue) + self._in_flight
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {**self.stats, "pending": len(self._queue) + self._in_flight}
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Espera a fila esvaziar (sem esperar o intervalo de lote). True se drenou a tempo."""
+        with self._cond:
+            if not self._queue and not self._in_flight:
+                return True
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+            finally:
+                self._flush_waiters -= 1
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """Drena o que restou e encerra a thread; novas entradas passam a ser descartadas."""
+        drained = self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return drained
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._stopping or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name="log-exporter", daemon=True)
+            self._thread.start()
+
+    def _batch_ready(self) -> bool:
+        return len(self._queue) >= self.batch_size or self._flush_waiters > 0 or self._stopping
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._stopping)
+                if not self._queue:
+                    return
+                # Espera completar o lote (ou flush/stop) até o intervalo de exportação
+                self._cond.wait_for(self._batch_ready, self.flush_interval_seconds)
+                count = min(self.batch_size, len(self._queue))
+                items = [self._queue.popleft() for _ in range(count)]
+                self._in_flight = count
+                drops, self._unreported_drops = self._unreported_drops, 0
+            try:
+                self._export(items, drops)
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _export(self, items: List[Tuple[str, Callable[[], Dict[str, Any]]]], drops: int) -> None:
+        entries: List[LogEntry] = []
+        for severity, build in items:
+            try:
+                entries.append((build(), severity))
+            except Exception as e:
+                with self._cond:
+                    self.stats["build_errors"] += 1
+                print(f"[LOG-EXPORTER] ❌ Erro ao montar entrada de log: {e}")
+        if drops and self.report_drops:
+            entries.append(({
+                "message": "Entradas de log descartadas (fila do exportador cheia)",
+                "dropped": drops,
+            }, "WARNING"))
+        if not entries:
+            return
+
+        for attempt in range(self.max_retries):
+            try:
+                self.write_batch(entries)
+                with self._cond:
+                    self.stats["exported"] += len(entries)
+                    self.stats["batches"] += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    with self._cond:
+                        self.stats["failed"] += len(entries)
+                    print(f"[LOG-EXPORTER] ❌ {len(entries)} logs não enviados após {self.max_retries} tentativas: {e}")
+                    return
+                with self._cond:
+                    self.stats["retries"] += 1
+                time.sleep(min(self.backoff_base_seconds * 2 ** attempt, BACKOFF_MAX_SECONDS))
@@ -1,20 +1,26 @@
 """
 Logger estruturado para Cloud Logging
+
+As entradas são enviadas em lotes por LogExporter (thread em background): no
+request, log_exception/log_struct só enfileiram.
 """
 
 from google.cloud import logging as cloud_logging
 import traceback
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime
-import time 
 
 from app.config import (
     MONITORING_ACTIVE,
     GCP_PROJECT_ID,
     GCP_LOG_NAME,
     MONITORING_ENVIRONMENT,
-    MONITORING_MIN_SEVERITY
+    MONITORING_MIN_SEVERITY,
+    LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS,
 )
+from app.monitoring.exporter import LogEntry, LogExporter
+
+MAX_TRACEBACK_LENGTH = 5000  # 5 KB
 
 
 class StructuredLogger:
@@ -22,12 +28,14 @@ class StructuredLogger:
     
     def __init__(self):
         self.enabled = MONITORING_ACTIVE
+        self.exporter: Optional[LogExporter] = None
         
         if self.enabled:
             try:
                 # Cliente Cloud Logging
                 self.client = cloud_logging.Client(project=GCP_PROJECT_ID)
                 self.logger = self.client.logger(GCP_LOG_NAME)
+                self.exporter = LogExporter(self._write_batch)
                 print(f"[LOGGER] ✅ Cloud Logging configurado: {GCP_PROJECT_ID}/{GCP_LOG_NAME}")
             except Exception as e:
                 print(f"[LOGGER] ❌ Erro ao configurar Cloud Logging: {e}")
@@ -64,49 +72,33 @@ class StructuredLogger:
         if not self.enabled or not self._should_log(severity):
             return
 
-            # ✅ ADICIONAR VALIDAÇÃO
-        if self.logger is None:
+        if self.exporter is None:
             print(f"[LOGGER] ⚠️  Logger não inicializado, pulando log")
             return
-    
 
-                # ✅ LIMITAR TRACEBACK
-        full_traceback = traceback.format_exc()
-        max_traceback_length = 5000  # 5 KB
-        
-        if len(full_traceback) > max_traceback_length:
-            truncated = full_traceback[:max_traceback_length]
-            traceback_value = truncated + "\n\n... [TRUNCADO]"
-        else:
-            traceback_value = full_traceback
-        
-        # Estruturar log
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "severity": severity,
-            "exception_type": type(exception).__name__,
-            "exception_message": str(exception),
-            "traceback": traceback_value,
-            "context": context or {}
-        }
-        
-        # Sanitizar dados sensíveis
-        log_entry = self._sanitize(log_entry)
-
-        max_retries = 3
+        timestamp = datetime.utcnow().isoformat()
+        context = dict(context or {})
 
-        for attempt in range(max_retries):
-            try:
-                # Enviar para Cloud Logging
-                self.logger.log_struct(log_entry, severity=severity)
-                print(f"[LOGGER] 📤 Log enviado: {severity} - {type(exception).__name__}")
-                return
-            except Exception as e:
-                print(f"[LOGGER] ❌ Erro ao enviar log: {e}")
+        def build() -> Dict[str, Any]:
+            # Montada na thread do exportador (traceback vem da própria exceção)
+            full_traceback = "".join(
+                traceback.format_exception(type(exception), exception, exception.__traceback__)
+            )
+            if len(full_traceback) > MAX_TRACEBACK_LENGTH:
+                traceback_value = full_traceback[:MAX_TRACEBACK_LENGTH] + "\n\n... [TRUNCADO]"
             else:
-                # Retry com backoff exponencial
-                wait_time = 0.1 * (2 ** attempt)  # 0.1s, 0.2s, 0.4s
-                time.sleep(wait_time)
+                traceback_value = full_traceback
+
+            return self._sanitize({
+                "timestamp": timestamp,
+                "severity": severity,
+                "exception_type": type(exception).__name__,
+                "exception_message": str(exception),
+                "traceback": traceback_value,
+                "context": context,
+            })
+
+        self.exporter.submit(severity, build)
     
     def log_struct(
         self,
@@ -125,19 +117,35 @@ class StructuredLogger:
         if not self.enabled or not self._should_log(severity):
             return
         
+        if self.exporter is None:
+            return
+
         log_entry = {
             "timestamp": datetime.utcnow().isoformat(),
             "severity": severity,
             "message": message,
             **(extra or {})
         }
-        
-        log_entry = self._sanitize(log_entry)
-        
-        try:
-            self.logger.log_struct(log_entry, severity=severity)
-        except Exception as e:
-            print(f"[LOGGER] ❌ Erro ao enviar log: {e}")
+        self.exporter.submit(severity, lambda: self._sanitize(log_entry))
+
+    def _write_batch(self, entries: List[LogEntry]) -> None:
+        """Envia um lote de entradas numa única chamada ao Cloud Logging."""
+        batch = self.logger.batch()
+        for log_entry, severity in entries:
+            batch.log_struct(log_entry, severity=severity)
+        batch.commit()
+
+    def flush(self, timeout: Optional[float] = LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS) -> bool:
+        """Espera o envio das entradas pendentes. True se drenou dentro do timeout."""
+        if self.exporter is None:
+            return True
+        return self.exporter.flush(timeout)
+
+    def shutdown(self, timeout: Optional[float] = LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS) -> bool:
+        """Drena a fila e encerra o exportador (shutdown da aplicação)."""
+        if self.exporter is None:
+            return True
+        return self.exporter.stop(timeout)
     
     def _sanitize(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Remove dados sensíveis antes de logar"""
@@ -180,3 +188,9 @@ def get_logger() -> StructuredLogger:
         _logger_instance = StructuredLogger()
     return _logger_instance
 
+
+def shutdown_logger() -> bool:
+    """Drena os logs pendentes, se o logger chegou a ser criado."""
+    if _logger_instance is None:
+        return True
+    return _logger_instance.shutdown()
@@ -0,0 +1,243 @@
+"""
+Logs do pipeline de relatórios: níveis, correlação por job/arquivo, DEBUG
+amostrado e uma linha de resumo estruturada por arquivo.
+
+- Cada entrada é uma linha no stdout (JSON com "severity" por padrão, que o
+  Cloud Run/Cloud Logging interpreta), com job_id e file_name do contexto.
+- PIPELINE_LOG_LEVEL define o nível mínimo (INFO por padrão). Uma fração dos
+  jobs (PIPELINE_LOG_DEBUG_SAMPLE_RATE, decidida pelo hash do job_id) sai com
+  DEBUG completo, limitado a PIPELINE_LOG_MAX_DEBUG_PER_FILE linhas por arquivo.
+- file_context() acumula os números do arquivo (páginas, imagens, tentativas,
+  tempo por etapa) e emite um único resumo ("pipeline_file_summary") ao sair.
+
+O contexto vive em contextvars: vale para a task do arquivo e para os nós
+síncronos do LangGraph (executados com cópia do contexto).
+"""
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from app.config import (
+    PIPELINE_LOG_DEBUG_SAMPLE_RATE,
+    PIPELINE_LOG_FORMAT,
+    PIPELINE_LOG_LEVEL,
+    PIPELINE_LOG_MAX_DEBUG_PER_FILE,
+)
+
+SUMMARY_MESSAGE = "pipeline_file_summary"
+
+_job_id: ContextVar[Optional[str]] = ContextVar("pipeline_job_id", default=None)
+_file_name: ContextVar[Optional[str]] = ContextVar("pipeline_file_name", default=None)
+_summary: ContextVar[Optional["FileSummary"]] = ContextVar("pipeline_file_summary", default=None)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Escreve no sys.stdout corrente (respeita redirect_stdout em testes e medições)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+_logger = logging.getLogger("app.pipeline")
+_logger.setLevel(logging.DEBUG)
+_logger.propagate = False
+if not _logger.handlers:
+    _logger.addHandler(_StdoutHandler())
+
+
+def _level_from_name(name: str) -> int:
+    level = logging.getLevelName(name)
+    return level if isinstance(level, int) else logging.INFO
+
+
+_min_level = _level_from_name(PIPELINE_LOG_LEVEL)
+
+
+def set_level(level: str) -> None:
+    """Altera o nível mínimo em tempo de execução (testes e diagnóstico)."""
+    global _min_level
+    _min_level = _level_from_name(level.upper())
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def debug_sampled(job_id: Optional[str], sample_rate: float = None) -> bool:
+    """Decisão determinística por job: todos os arquivos do job têm (ou não) DEBUG."""
+    rate = PIPELINE_LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not job_id or rate <= 0:
+        return False
+    if rate >= 1:
+        return True
+    return zlib.crc32(job_id.encode("utf-8")) % 10_000 < rate * 10_000
+
+
+class FileSummary:
+    """Números de um arquivo, acumulados pelos nós e emitidos numa linha ao final."""
+
+    def __init__(self, file_name: str, job_id: Optional[str]):
+        self.file_name = file_name
+        self.job_id = job_id
+        self.debug_enabled = debug_sampled(job_id)
+        self.started = time.perf_counter()
+        self.fields: Dict[str, Any] = {}
+        self.stages: Dict[str, int] = {}
+        self.debug_lines = 0
+        self.debug_suppressed = 0
+        self._lock = threading.Lock()
+
+    def set(self, **fields: Any) -> None:
+        with self._lock:
+            self.fields.update(fields)
+
+    def incr(self, field: str, amount: int = 1) -> None:
+        with self._lock:
+            self.fields[field] = self.fields.get(field, 0) + amount
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + int(seconds * 1000)
+
+    def allow_debug(self) -> bool:
+        with self._lock:
+            if self.debug_lines >= PIPELINE_LOG_MAX_DEBUG_PER_FILE:
+                self.debug_suppressed += 1
+                return False
+            self.debug_lines += 1
+            return True
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            payload = {
+                "status": "error" if self.fields.get("error") else "success",
+                **self.fields,
+                "duration_ms": int((time.perf_counter() - self.started) * 1000),
+                "stages_ms": dict(self.stages),
+            }
+            if self.debug_suppressed:
+                payload["debug_suppressed"] = self.debug_suppressed
+            return payload
+
+
+def current_summary() -> Optional[FileSummary]:
+    return _summary.get()
+
+
+def summary_set(**fields: Any) -> None:
+    """Registra campos no resumo do arquivo corrente (sem efeito fora de file_context)."""
+    summary = _summary.get()
+    if summary is not None:
+        summary.set(**fields)
+
+
+def summary_incr(field: str, amount: int = 1) -> None:
+    summary = _summary.get()
+    if summary is not None:
+        summary.incr(field, amount)
+
+
+@contextmanager
+def file_context(file_name: str, job_id: Optional[str] = None) -> Iterator[FileSummary]:
+    """Correlaciona os logs com o arquivo/job e emite o resumo do arquivo ao sair."""
+    job_id = job_id or _job_id.get()
+    summary = FileSummary(file_name, job_id)
+    tokens = (_job_id.set(job_id), _file_name.set(file_name), _summary.set(summary))
+    try:
+        yield summary
+    except BaseException as e:
+        summary.set(error=summary.fields.get("error") or str(e))
+        raise
+    finally:
+        _summary.reset(tokens[2])
+        _file_name.reset(tokens[1])
+        _job_id.reset(tokens[0])
+        payload = summary.as_dict()
+        level = logging.ERROR if payload["status"] == "error" else logging.INFO
+        _emit(level, "pipeline", SUMMARY_MESSAGE, {"job_id": job_id, "file_name": file_name, **payload})
+
+
+def timed_stage(stage: str) -> Callable:
+    """Decorator para nós síncronos: soma a duração da etapa no resumo do arquivo."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                summary = _summary.get()
+                if summary is not None:
+                    summary.add_stage(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _emit(level: int, component: str, message: str, fields: Dict[str, Any]) -> None:
+    fields = {k: v for k, v in fields.items() if v is not None}
+    if PIPELINE_LOG_FORMAT == "text":
+        context = " ".join(f"{k}={v}" for k, v in fields.items())
+        line = f"[{component}] {logging.getLevelName(level)} {message}" + (f" | {context}" if context else "")
+    else:
+        line = json.dumps(
+            {"severity": logging.getLevelName(level), "component": component, "message": message, **fields},
+            ensure_ascii=False,
+            default=str,
+        )
+    _logger.log(level, line)
+
+
+class PipelineLogger:
+    """Logger de um componente do pipeline; campos extras vão como chaves da linha."""
+
+    def __init__(self, component: str):
+        self.component = component
+
+    def _enabled(self, level: int) -> bool:
+        if level != logging.DEBUG:
+            return level >= _min_level
+        summary = _summary.get()
+        if _min_level > logging.DEBUG:
+            sampled = summary.debug_enabled if summary is not None else debug_sampled(_job_id.get())
+            if not sampled:
+                return False
+        return summary.allow_debug() if summary is not None else True
+
+    def log(self, level: int, message: str, exc_info: bool = False, **fields: Any) -> None:
+        if not self._enabled(level):
+            return
+        context = {"job_id": _job_id.get(), "file_name": _file_name.get()}
+        context.update(fields)
+        if exc_info:
+            context["traceback"] = traceback.format_exc()
+        _emit(level, self.component, message, context)
+
+    def debug(self, message: str, **fields: Any) -> None:
+        self.log(logging.DEBUG, message, **fields)
+
+    def info(self, message: str, **fields: Any) -> None:
+        self.log(logging.INFO, message, **fields)
+
+    def warning(self, message: str, **fields: Any) -> None:
+        self.log(logging.WARNING, message, **fields)
+
+    def error(self, message: str, exc_info: bool = False, **fields: Any) -> None:
+        self.log(logging.ERROR, message, exc_info=exc_info, **fields)
+
+
+def get_pipeline_logger(component: str) -> PipelineLogger:
+    return PipelineLogger(component)
@@ -0,0 +1,151 @@
+"""
+Testes do exportador de logs em background (lotes, fila limitada, amostragem,
+retry) e do StructuredLogger usando-o.
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from app.monitoring.exporter import LogExporter
+
+
+def _exporter(sink, **kwargs):
+    kwargs.setdefault("flush_interval_seconds", 5.0)
+    kwargs.setdefault("backoff_base_seconds", 0)
+    return LogExporter(sink.append if isinstance(sink, list) else sink, **kwargs)
+
+
+def _entry(i):
+    return lambda: {"message": f"log {i}"}
+
+
+def test_entries_exported_in_order_in_bounded_batches():
+    batches = []
+    exporter = _exporter(batches, batch_size=3)
+    for i in range(7):
+        assert exporter.submit("ERROR", _entry(i))
+
+    assert exporter.flush(timeout=2)
+    assert all(len(batch) <= 3 for batch in batches)
+    assert [entry["message"] for batch in batches for entry, _ in batch] == [f"log {i}" for i in range(7)]
+    assert exporter.get_stats()["exported"] == 7
+    exporter.stop(timeout=1)
+
+
+def test_submit_does_not_wait_for_slow_export_and_builds_off_thread():
+    threads = []
+    release = threading.Event()
+
+    def slow_sink(entries):
+        release.wait(2)
+
+    def build():
+        threads.append(threading.current_thread().name)
+        return {"message": "x"}
+
+    exporter = _exporter(slow_sink, batch_size=1)
+    started = time.perf_counter()
+    for _ in range(20):
+        exporter.submit("ERROR", build)
+    assert time.perf_counter() - started < 0.2
+
+    release.set()
+    assert exporter.flush(timeout=2)
+    assert set(threads) == {"log-exporter"}
+    exporter.stop(timeout=1)
+
+
+def _blocked_exporter(batches, **kwargs):
+    """Exportador com a thread presa no primeiro envio até release.set()."""
+    release = threading.Event()
+    in_export = threading.Event()
+
+    def sink(entries):
+        in_export.set()
+        release.wait(2)
+        batches.append(entries)
+
+    exporter = _exporter(sink, batch_size=1, **kwargs)
+    exporter.submit("ERROR", _entry("first"))
+    assert in_export.wait(1)
+    return exporter, release
+
+
+def test_full_queue_drops_and_reports_drop_count():
+    batches = []
+    exporter, release = _blocked_exporter(batches, max_queue=4, overload_sample_rate=1.0)
+    accepted = [exporter.submit("ERROR", _entry(i)) for i in range(6)]
+    assert accepted == [True] * 4 + [False] * 2
+
+    release.set()
+    assert exporter.flush(timeout=2)
+    entries = [entry for batch in batches for entry in batch]
+    notices = [entry for entry, severity in entries if severity == "WARNING"]
+    assert notices == [{"message": "Entradas de log descartadas (fila do exportador cheia)", "dropped": 2}]
+    assert exporter.get_stats()["dropped"] == 2
+    exporter.stop(timeout=1)
+
+
+def test_overloaded_queue_samples_low_severity_but_keeps_errors():
+    batches = []
+    exporter, release = _blocked_exporter(batches, max_queue=4, overload_sample_rate=0.0)
+    assert exporter.submit("INFO", _entry("a"))
+    assert exporter.submit("INFO", _entry("b"))
+    assert not exporter.submit("INFO", _entry("c"))
+    assert exporter.submit("ERROR", _entry("d"))
+
+    release.set()
+    assert exporter.flush(timeout=2)
+    assert exporter.get_stats()["sampled_out"] == 1
+    exporter.stop(timeout=1)
+
+
+def test_failed_export_is_retried_with_backoff():
+    calls = {"n": 0}
+    delivered = []
+
+    def flaky(entries):
+        calls["n"] += 1
+        if calls["n"] < 3:
+            raise RuntimeError("503")
+        delivered.extend(entries)
+
+    exporter = _exporter(flaky, max_retries=3)
+    exporter.submit("ERROR", _entry(0))
+    assert exporter.flush(timeout=2)
+    assert len(delivered) == 1
+    assert exporter.get_stats()["retries"] == 2
+    exporter.stop(timeout=1)
+
+
+def test_stop_drains_queue_and_rejects_new_entries():
+    batches = []
+    exporter = _exporter(batches, batch_size=100)
+    exporter.submit("ERROR", _entry(0))
+    assert exporter.stop(timeout=2)
+    assert len(batches) == 1
+    assert not exporter.submit("ERROR", _entry(1))
+
+
+def test_structured_logger_enqueues_and_sends_one_batch():
+    with patch("app.monitoring.logger.MONITORING_ACTIVE", True), \
+         patch("app.monitoring.logger.cloud_logging.Client") as client_cls:
+        from app.monitoring.logger import StructuredLogger
+        logger = StructuredLogger()
+    cloud_logger = client_cls.return_value.logger.return_value
+    batch = cloud_logger.batch.return_value
+
+    try:
+        raise ValueError("falhou")
+    except ValueError as e:
+        logger.log_exception(e, severity="ERROR", context={"endpoint": "/x", "api_key": "k"})
+    logger.log_exception(RuntimeError("outra"), severity="CRITICAL")
+    # Nada é enviado no request
+    cloud_logger.log_struct.assert_not_called()
+
+    assert logger.shutdown(timeout=2)
+    sent = [c.args[0] for c in batch.log_struct.call_args_list]
+    assert [e["exception_type"] for e in sent] == ["ValueError", "RuntimeError"]
+    assert "ValueError: falhou" in sent[0]["traceback"]
+    assert sent[0]["context"] == {"endpoint": "/x", "api_key": "***REDACTED***"}
+    batch.commit.assert_called_once()
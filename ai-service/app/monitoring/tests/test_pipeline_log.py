@@ -0,0 +1,113 @@
+"""
+Testes do logging do pipeline: níveis, correlação por job/arquivo, DEBUG
+amostrado/limitado e resumo único por arquivo.
+"""
+import contextlib
+import io
+import json
+from unittest.mock import patch
+
+import pytest
+
+from app.monitoring import pipeline_log
+from app.monitoring.pipeline_log import (
+    SUMMARY_MESSAGE,
+    debug_sampled,
+    file_context,
+    get_pipeline_logger,
+    summary_incr,
+    summary_set,
+    timed_stage,
+)
+
+
+@pytest.fixture(autouse=True)
+def info_level():
+    pipeline_log.set_level("INFO")
+    yield
+    pipeline_log.set_level("INFO")
+
+
+def _capture(fn):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        fn()
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_file_context_correlates_lines_and_emits_one_summary():
+    log = get_pipeline_logger("extract_pdf")
+
+    @timed_stage("extract_pdf")
+    def node():
+        log.debug("página convertida", page=1)
+        log.warning("pdf2image falhou", error="x")
+        summary_set(pages=4, images=3)
+        summary_incr("llm_attempts")
+        summary_incr("llm_attempts")
+
+    def run():
+        with file_context("a.pdf", "job-1"):
+            node()
+
+    lines = _capture(run)
+
+    assert [line["message"] for line in lines] == ["pdf2image falhou", SUMMARY_MESSAGE]
+    warning, summary = lines
+    assert warning["severity"] == "WARNING"
+    assert (warning["job_id"], warning["file_name"], warning["component"]) == ("job-1", "a.pdf", "extract_pdf")
+    assert summary["status"] == "success"
+    assert (summary["pages"], summary["images"], summary["llm_attempts"]) == (4, 3, 2)
+    assert "extract_pdf" in summary["stages_ms"]
+    # Fora do contexto não há correlação nem resumo para atualizar
+    summary_set(pages=1)
+    assert pipeline_log.current_summary() is None
+
+
+def test_summary_is_error_when_error_recorded_or_raised():
+    def recorded():
+        with file_context("b.pdf", "job-1") as summary:
+            summary.set(error="LLM retornou resposta vazia")
+
+    def raised():
+        with file_context("c.pdf", "job-1"):
+            raise RuntimeError("timeout")
+
+    assert _capture(recorded)[-1]["severity"] == "ERROR"
+    with pytest.raises(RuntimeError):
+        _capture(raised)
+
+
+def test_sampled_job_emits_debug_up_to_per_file_cap():
+    log = get_pipeline_logger("extract_data")
+
+    def run():
+        with file_context("d.pdf", "job-sampled"):
+            for page in range(5):
+                log.debug("imagem adicionada", page=page)
+
+    with patch.object(pipeline_log, "PIPELINE_LOG_DEBUG_SAMPLE_RATE", 1.0), \
+         patch.object(pipeline_log, "PIPELINE_LOG_MAX_DEBUG_PER_FILE", 3):
+        lines = _capture(run)
+
+    assert [line.get("page") for line in lines[:-1]] == [0, 1, 2]
+    assert lines[-1]["debug_suppressed"] == 2
+
+
+def test_debug_sampling_is_deterministic_per_job():
+    jobs = [f"job-{i}" for i in range(2000)]
+    sampled = [job for job in jobs if debug_sampled(job, sample_rate=0.1)]
+
+    assert 100 < len(sampled) < 300
+    assert sampled == [job for job in jobs if debug_sampled(job, sample_rate=0.1)]
+    assert not debug_sampled(None, sample_rate=1.0)
+    assert not debug_sampled("job-1", sample_rate=0.0)
+
+
+def test_debug_level_emits_everything():
+    pipeline_log.set_level("DEBUG")
+    log = get_pipeline_logger("batch")
+
+    lines = _capture(lambda: log.debug("semáforo adquirido", in_use=2))
+
+    assert lines == [{"severity": "DEBUG", "component": "batch", "message": "semáforo adquirido", "in_use": 2}]
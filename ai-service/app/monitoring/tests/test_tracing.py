@@ -0,0 +1,197 @@
+"""
+Testes do tracing: aninhamento e herança de job_id, exportadores JSONL/OTLP,
+middleware HTTP e spans do workflow de relatórios de ponta a ponta.
+"""
+import json
+
+import pytest
+from fastapi import FastAPI
+
+from app.middleware.tracing import TracingMiddleware
+from app.monitoring import pipeline_log, tracing
+from app.monitoring.tracing import JsonlSpanExporter, configure_tracing, flush_tracing, span, start_span
+
+
+@pytest.fixture
+def spans_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    configure_tracing(JsonlSpanExporter(str(path)), sample_rate=1.0, flush_interval_seconds=0.05)
+
+    def read():
+        assert flush_tracing(timeout=5)
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    yield read
+    configure_tracing(None)
+
+
+def _by_name(spans):
+    out = {}
+    for s in spans:
+        out.setdefault(s["name"], []).append(s)
+    return out
+
+
+def test_nested_spans_share_trace_and_inherit_job_id(spans_file):
+    with span("ultra_batch.job", job_id="job-1") as root:
+        with span("firestore.get", collection="ultra_batch_uploads") as child:
+            tracing.set_attributes(found=True)
+        waiting = start_span("semaphore.wait")
+        waiting.end()
+    with pytest.raises(RuntimeError):
+        with span("gemini.generate_content"):
+            raise RuntimeError("quota")
+
+    spans = _by_name(spans_file())
+
+    job, get, wait = spans["ultra_batch.job"][0], spans["firestore.get"][0], spans["semaphore.wait"][0]
+    assert get["trace_id"] == wait["trace_id"] == job["trace_id"] == root.trace_id
+    assert get["parent_span_id"] == wait["parent_span_id"] == root.span_id
+    assert job["parent_span_id"] is None
+    assert get["attributes"] == {"job_id": "job-1", "collection": "ultra_batch_uploads", "found": True}
+    assert child.span_id == get["span_id"]
+    failed = spans["gemini.generate_content"][0]
+    assert failed["trace_id"] != root.trace_id
+    assert (failed["status"], failed["status_message"]) == ("ERROR", "RuntimeError: quota")
+
+
+def test_explicit_parent_links_spans_outside_current_context(spans_file):
+    job_span = start_span("ultra_batch.job", parent=None, job_id="job-2")
+    with span("firestore.update", parent=job_span):
+        pass
+    job_span.end()
+
+    update, job = spans_file()
+    assert update["parent_span_id"] == job["span_id"]
+    assert update["attributes"]["job_id"] == "job-2"
+
+
+def test_disabled_tracing_is_noop():
+    configure_tracing(None)
+    with span("gemini.generate_content", model="x") as noop:
+        noop.set(input_tokens=10)
+    assert noop is tracing.NOOP_SPAN
+    assert start_span("semaphore.wait") is tracing.NOOP_SPAN
+
+
+def test_unsampled_root_drops_whole_trace(tmp_path):
+    configure_tracing(JsonlSpanExporter(str(tmp_path / "traces.jsonl")), sample_rate=0.0)
+    try:
+        with span("report.batch") as root:
+            with span("report.file") as child:
+                pass
+        assert not root.sampled and not child.sampled
+        assert tracing.get_tracing_stats()["enqueued"] == 0
+    finally:
+        configure_tracing(None, sample_rate=1.0)
+
+
+def test_queue_overflow_keeps_exporting_real_spans():
+    class OtlpPayloadExporter:
+        def __init__(self):
+            self.payloads = []
+
+        def export(self, spans):
+            self.payloads.append(tracing.to_otlp_payload(spans, "ai-service"))
+
+    exporter = OtlpPayloadExporter()
+    configure_tracing(exporter, sample_rate=1.0, max_queue=2, batch_size=100, flush_interval_seconds=5)
+    try:
+        for i in range(5):
+            with span("report.file", index=i):
+                pass
+        assert flush_tracing(timeout=5)
+        stats = tracing.get_tracing_stats()
+    finally:
+        configure_tracing(None)
+
+    exported = [s for p in exporter.payloads for s in p["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    assert exported and all(s["name"] == "report.file" for s in exported)
+    assert stats["failed"] == 0
+    assert stats["exported"] == len(exported)
+    assert stats["dropped"] + stats["sampled_out"] == 5 - len(exported)
+
+
+def test_otlp_payload_format():
+    spans = [
+        {
+            "trace_id": "a" * 32,
+            "span_id": "b" * 16,
+            "parent_span_id": None,
+            "name": "google.sheets.execute",
+            "start_time_unix_nano": 1,
+            "end_time_unix_nano": 2,
+            "duration_ms": 0.0,
+            "status": "ERROR",
+            "status_message": "HTTP 429",
+            "attributes": {"job_id": "job-1", "attempts": 2, "quota_wait_seconds": 0.5, "retried": True},
+        }
+    ]
+
+    payload = tracing.to_otlp_payload(spans, "ai-service")
+
+    resource_spans = payload["resourceSpans"][0]
+    assert resource_spans["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "ai-service"}}]
+    otlp_span = resource_spans["scopeSpans"][0]["spans"][0]
+    assert "parentSpanId" not in otlp_span
+    assert (otlp_span["startTimeUnixNano"], otlp_span["endTimeUnixNano"]) == ("1", "2")
+    assert otlp_span["status"] == {"code": 2, "message": "HTTP 429"}
+    assert otlp_span["attributes"] == [
+        {"key": "job_id", "value": {"stringValue": "job-1"}},
+        {"key": "attempts", "value": {"intValue": "2"}},
+        {"key": "quota_wait_seconds", "value": {"doubleValue": 0.5}},
+        {"key": "retried", "value": {"boolValue": True}},
+    ]
+
+
+def test_middleware_opens_root_span_per_request(spans_file):
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/jobs/{job_id}")
+    async def get_job(job_id: str):
+        with span("firestore.get"):
+            return {"job_id": job_id}
+
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    response = TestClient(app).get("/jobs/job-9", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+
+    assert response.status_code == 200
+    spans = _by_name(spans_file())
+    request_span = spans["GET /jobs/{job_id}"][0]
+    assert (request_span["trace_id"], request_span["parent_span_id"]) == (trace_id, parent_id)
+    assert request_span["attributes"]["http_status_code"] == 200
+    assert request_span["attributes"]["job_id"] == "job-9"
+    assert spans["firestore.get"][0]["parent_span_id"] == request_span["span_id"]
+
+
+def test_workflow_spans_cover_nodes_and_gemini_calls(spans_file):
+    from app.services.report_analyzer.batch_processing import process_batch_reports
+    from app.services.report_analyzer.tests.log_volume import make_pdf, patched_externals, run_on_private_loop
+
+    pipeline_log.set_level("ERROR")
+    files = [{"name": f"r{i}.pdf", "dataUri": make_pdf()} for i in range(2)]
+    try:
+        with patched_externals():
+            results = run_on_private_loop(process_batch_reports(files, "uid", job_id="job-42"))
+    finally:
+        pipeline_log.set_level("INFO")
+
+    assert all(r["success"] for r in results)
+    spans = spans_file()
+    names = _by_name(spans)
+    assert len({s["trace_id"] for s in spans}) == 1
+    assert all(s["attributes"].get("job_id") == "job-42" for s in spans)
+    assert len(names["report.file"]) == 2
+    assert len(names["semaphore.wait"]) == 2
+    for node in ("extract_pdf", "extract_data", "analyze_report", "format_message_auto"):
+        assert len(names[f"node.{node}"]) == 2
+    purposes = sorted(s["attributes"]["purpose"] for s in names["gemini.generate_content"])
+    assert purposes == ["analysis", "analysis", "extraction", "extraction", "format", "format"]
+    assert all(s["attributes"]["response_chars"] > 0 for s in names["gemini.generate_content"])
+    assert all(s["attributes"]["pdf_bytes"] > 0 for s in names["node.extract_pdf"])
+    assert all(s["attributes"]["attempts"] == 1 for s in names["llm.call_with_retry"])
@@ -0,0 +1,393 @@
+"""
+Tracing leve por request: spans aninhados via contextvars, exportados em lote.
+
+- span("nome", **atributos) abre um span filho do span corrente (ou raiz);
+  start_span() cria um span sem ativá-lo (esperas de semáforo, geradores SSE).
+- job_id passado a um span é herdado por todos os descendentes: os spans de um
+  job de ultra batch podem ser filtrados/ligados por job_id.
+- A amostragem (TRACING_SAMPLE_RATE) é decidida no span raiz; filhos seguem.
+- Spans encerrados vão para um LogExporter (thread em background, lotes, fila
+  limitada) que entrega ao exportador configurado em TRACING_EXPORTER:
+  JsonlSpanExporter (arquivo local, usado nos testes) ou OtlpHttpSpanExporter
+  (OTLP/HTTP JSON, para um collector OpenTelemetry em produção).
+
+Com TRACING_EXPORTER=none, span() devolve um span nulo sem custo relevante.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Protocol
+
+from app.config import (
+    TRACING_EXPORTER,
+    TRACING_JSONL_PATH,
+    TRACING_OTLP_ENDPOINT,
+    TRACING_OTLP_HEADERS,
+    TRACING_OTLP_TIMEOUT_SECONDS,
+    TRACING_SAMPLE_RATE,
+    TRACING_SERVICE_NAME,
+)
+from app.monitoring.exporter import LogEntry, LogExporter
+
+# Atributos propagados do span para todos os descendentes
+INHERITED_ATTRIBUTES = ("job_id",)
+
+_UNSET: Any = object()
+
+
+class Span:
+    """Um span; atributos são valores simples (str, int, float, bool)."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        sampled: bool,
+        inherited: Dict[str, Any],
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.inherited = inherited
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        for key, value in attributes.items():
+            if value is None:
+                continue
+            if key in INHERITED_ATTRIBUTES:
+                self.inherited[key] = value
+            self.attributes[key] = value
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.error = f"{type(exception).__name__}: {exception}"
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        queue = _queue
+        if self.sampled and queue is not None:
+            queue.submit("ERROR" if self.error else "INFO", self.to_dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": end_ns,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "status": "ERROR" if self.error else "OK",
+            "status_message": self.error,
+            "attributes": {**self.inherited, **self.attributes},
+        }
+
+
+class _NoopSpan:
+    """Span nulo (tracing desligado): aceita as mesmas chamadas e não registra nada."""
+
+    name = ""
+    trace_id = None
+    span_id = None
+    sampled = False
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Optional[Span]] = ContextVar("tracing_current_span", default=None)
+
+
+# ========================================
+# EXPORTADORES
+# ========================================
+
+class SpanExporter(Protocol):
+    def export(self, spans: List[Dict[str, Any]]) -> None: ...
+
+
+class JsonlSpanExporter:
+    """Um span por linha num arquivo local (testes e desenvolvimento)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in spans)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp_payload(spans: List[Dict[str, Any]], service_name: str) -> Dict[str, Any]:
+    """Lote de spans no formato OTLP/HTTP JSON (ids em hex, tempos em nanos como string)."""
+    otlp_spans = []
+    for s in spans:
+        otlp_span = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s["start_time_unix_nano"]),
+            "endTimeUnixNano": str(s["end_time_unix_nano"]),
+            "attributes": _otlp_attributes(s["attributes"]),
+            "status": {"code": 2, "message": s["status_message"]} if s["status"] == "ERROR" else {"code": 1},
+        }
+        if s["parent_span_id"]:
+            otlp_span["parentSpanId"] = s["parent_span_id"]
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{"scope": {"name": "app.monitoring.tracing"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+def _parse_headers(raw: str) -> Dict[str, str]:
+    headers = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            headers[key.strip()] = value.strip()
+    return headers
+
+
+class OtlpHttpSpanExporter:
+    """POST de lotes OTLP/HTTP JSON para um collector (ex.: http://collector:4318/v1/traces)."""
+
+    def __init__(
+        self,
+        endpoint: str = TRACING_OTLP_ENDPOINT,
+        service_name: str = TRACING_SERVICE_NAME,
+        headers: Optional[Dict[str, str]] = None,
+        timeout_seconds: float = TRACING_OTLP_TIMEOUT_SECONDS,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.timeout_seconds = timeout_seconds
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        body = json.dumps(to_otlp_payload(spans, self.service_name)).encode("utf-8")
+        request = urllib.request.Request(self.endpoint, data=body, headers=self.headers, method="POST")
+        # Erros HTTP/rede propagam: o LogExporter retenta com backoff
+        with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+            response.read()
+
+
+# ========================================
+# CONFIGURAÇÃO
+# ========================================
+
+_queue: Optional[LogExporter] = None
+_sample_rate = TRACING_SAMPLE_RATE
+
+
+def configure_tracing(exporter: Optional[SpanExporter], sample_rate: Optional[float] = None, **queue_kwargs) -> None:
+    """Troca o exportador (None desliga o tracing); a fila anterior é drenada."""
+    global _queue, _sample_rate
+    previous = _queue
+    if exporter is None:
+        _queue = None
+    else:
+        def write_batch(entries: List[LogEntry]) -> None:
+            exporter.export([entry for entry, _ in entries])
+        # O aviso de descarte não é um span (sem trace_id): descartes só em get_tracing_stats()
+        _queue = LogExporter(write_batch, report_drops=False, **queue_kwargs)
+    if sample_rate is not None:
+        _sample_rate = sample_rate
+    if previous is not None:
+        previous.stop(timeout=5)
+
+
+def _exporter_from_config() -> Optional[SpanExporter]:
+    if TRACING_EXPORTER == "jsonl":
+        return JsonlSpanExporter(TRACING_JSONL_PATH)
+    if TRACING_EXPORTER == "otlp":
+        return OtlpHttpSpanExporter(headers=_parse_headers(TRACING_OTLP_HEADERS))
+    return None
+
+
+def tracing_enabled() -> bool:
+    return _queue is not None
+
+
+def flush_tracing(timeout: Optional[float] = None) -> bool:
+    queue = _queue
+    return queue.flush(timeout) if queue is not None else True
+
+
+def shutdown_tracing(timeout: Optional[float] = None) -> bool:
+    """Exporta os spans pendentes e encerra a thread (shutdown da aplicação)."""
+    queue = _queue
+    return queue.stop(timeout) if queue is not None else True
+
+
+def get_tracing_stats() -> Dict[str, int]:
+    queue = _queue
+    return queue.get_stats() if queue is not None else {}
+
+
+configure_tracing(_exporter_from_config())
+
+
+# ========================================
+# API DE SPANS
+# ========================================
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def set_attributes(**attributes: Any) -> None:
+    """Atributos no span corrente (sem efeito fora de um span)."""
+    span_ = _current.get()
+    if span_ is not None:
+        span_.set(**attributes)
+
+
+def start_span(
+    name: str,
+    parent: Any = _UNSET,
+    trace_id: Optional[str] = None,
+    parent_span_id: Optional[str] = None,
+    **attributes: Any,
+):
+    """
+    Cria um span sem torná-lo corrente (chamar end()). parent=None força um span
+    raiz; trace_id/parent_span_id continuam um trace recebido (traceparent).
+    """
+    if _queue is None:
+        return NOOP_SPAN
+    if parent is _UNSET:
+        parent = _current.get()
+    if isinstance(parent, Span):
+        new_span = Span(name, parent.trace_id, parent.span_id, parent.sampled, dict(parent.inherited), {})
+    else:
+        new_span = Span(
+            name,
+            trace_id or os.urandom(16).hex(),
+            parent_span_id,
+            random.random() < _sample_rate,
+            {},
+            {},
+        )
+    new_span.set(**attributes)
+    return new_span
+
+
+@contextmanager
+def span(name: str, parent: Any = _UNSET, **attributes: Any) -> Iterator[Any]:
+    """Abre um span como corrente; exceções marcam o span como ERROR e propagam."""
+    if _queue is None:
+        yield NOOP_SPAN
+        return
+    new_span = start_span(name, parent=parent, **attributes)
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.record_exception(e)
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Gerador encerrado em outro contexto (ex.: cliente SSE desconectou)
+            pass
+        new_span.end()
+
+
+def traced(name: str, **attributes: Any) -> Callable:
+    """Decorator: um span por chamada (funções síncronas ou async)."""
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def with_current_context(func: Callable, *args: Any) -> Callable[[], Any]:
+    """Para run_in_executor: executa func na thread com uma cópia do contexto atual (span pai)."""
+    return functools.partial(contextvars.copy_context().run, func, *args)
+
+
+def set_gemini_usage(span_: Any, response: Any) -> None:
+    """Tokens (usage_metadata) e tamanho da resposta de uma chamada generate_content."""
+    usage = getattr(response, "usage_metadata", None)
+    for attribute, field in (
+        ("input_tokens", "prompt_token_count"),
+        ("output_tokens", "candidates_token_count"),
+        ("total_tokens", "total_token_count"),
+    ):
+        value = getattr(usage, field, None)
+        if isinstance(value, int):
+            span_.set(**{attribute: value})
+    text = getattr(response, "text", None)
+    if isinstance(text, str):
+        span_.set(response_chars=len(text))
@@ -3,33 +3,100 @@ Serviço de identificação do setor digital.
 
 Fonte de verdade: documento Firestore config/digital_team (campo emails: string[]).
 Resolve uid → email via users/{uid}.email e verifica pertencimento à lista.
+
+Cache em memória:
+- uid → email em LRU limitado (DIGITAL_WHITELIST_CACHE_MAX_ENTRIES) com TTL
+- Stale-while-revalidate: vencido o TTL, o valor antigo continua sendo servido
+  (até DIGITAL_WHITELIST_MAX_STALE_SECONDS) e a releitura roda em background;
+  só um uid nunca visto (ou vencido há muito tempo) lê o Firestore no request
+- prefetch_user_emails resolve vários uids com um único get_all
+- get_whitelist_cache_stats expõe hits/misses e tempos de refresh
 """
 import logging
+import threading
 import time
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
 
-from app.config import get_firestore_client
+from app.config import (
+    DIGITAL_WHITELIST_CACHE_MAX_ENTRIES,
+    DIGITAL_WHITELIST_CACHE_TTL_SECONDS,
+    DIGITAL_WHITELIST_MAX_STALE_SECONDS,
+    get_firestore_client,
+)
 
 logger = logging.getLogger(__name__)
 
-_CACHE_TTL_SECONDS = 300
+_CACHE_TTL_SECONDS = DIGITAL_WHITELIST_CACHE_TTL_SECONDS
+_MAX_STALE_SECONDS = DIGITAL_WHITELIST_MAX_STALE_SECONDS
+_CACHE_MAX_ENTRIES = DIGITAL_WHITELIST_CACHE_MAX_ENTRIES
+# Chave do conjunto de e-mails em _refreshing (uids nunca começam com ":")
+_EMAILS_KEY = ":digital_team"
+
+_lock = threading.Lock()
 _digital_emails_cache: Optional[tuple[float, set[str]]] = None
-_email_resolution_cache: dict[str, tuple[float, Optional[str]]] = {}
+_email_resolution_cache: "OrderedDict[str, tuple[float, Optional[str]]]" = OrderedDict()
+# Chaves com refresh em background em andamento (evita refresh duplicado)
+_refreshing: set[str] = set()
+_refresh_executor: Optional[ThreadPoolExecutor] = None
 
 
-def _get_digital_emails() -> set[str]:
-    """
-    Retorna o conjunto de e-mails do setor digital com cache em memória.
-    Lê config/digital_team.emails no Firestore.
-    """
-    global _digital_emails_cache
+def _empty_stats() -> Dict[str, Any]:
+    return {
+        "hits": 0,
+        "stale_hits": 0,
+        "misses": 0,
+        "evictions": 0,
+        "refreshes": 0,
+        "refresh_errors": 0,
+        "refresh_seconds_total": 0.0,
+        "refresh_seconds_max": 0.0,
+        "prefetch_calls": 0,
+        "prefetched": 0,
+    }
 
-    now = time.monotonic()
-    if _digital_emails_cache is not None:
-        cached_at, cached_set = _digital_emails_cache
-        if now - cached_at < _CACHE_TTL_SECONDS:
-            return cached_set
 
+_stats = _empty_stats()
+
+
+def _record_refresh(seconds: float, error: bool = False) -> None:
+    with _lock:
+        _stats["refreshes"] += 1
+        _stats["refresh_seconds_total"] += seconds
+        _stats["refresh_seconds_max"] = max(_stats["refresh_seconds_max"], seconds)
+        if error:
+            _stats["refresh_errors"] += 1
+
+
+def _submit_refresh(key: str, fn: Callable[[], None]) -> None:
+    """Agenda fn em background, no máximo um refresh por chave por vez."""
+    global _refresh_executor
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="digital-whitelist")
+        executor = _refresh_executor
+
+    def run():
+        try:
+            fn()
+        except Exception as e:
+            logger.warning("Erro no refresh em background do setor digital (%s): %s", key, e)
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+
+    executor.submit(run)
+
+
+def _load_digital_emails() -> set[str]:
+    """Lê config/digital_team.emails no Firestore e atualiza o cache."""
+    global _digital_emails_cache
+
+    started = time.monotonic()
     try:
         db = get_firestore_client()
         doc = db.collection("config").document("digital_team").get()
@@ -39,48 +106,148 @@ def _get_digital_emails() -> set[str]:
         else:
             raw = doc.to_dict().get("emails") or []
             emails = {e.strip().lower() for e in raw if isinstance(e, str) and e.strip()}
-    except Exception as e:
-        logger.error("Erro ao ler config/digital_team: %s", e, exc_info=True)
-        if _digital_emails_cache is not None:
-            return _digital_emails_cache[1]
-        return set()
+    except Exception:
+        _record_refresh(time.monotonic() - started, error=True)
+        raise
 
-    _digital_emails_cache = (now, emails)
+    now = time.monotonic()
+    _record_refresh(now - started)
+    with _lock:
+        _digital_emails_cache = (now, emails)
     return emails
 
 
-def _resolve_email(user_id: str) -> Optional[str]:
+def _get_digital_emails() -> set[str]:
     """
-    Resolve uid → email via documento users/{uid}.
-    Resultado é cacheado com TTL.
+    Retorna o conjunto de e-mails do setor digital com cache em memória.
+    Vencido o TTL, devolve o conjunto anterior e recarrega em background.
     """
     now = time.monotonic()
-    cached = _email_resolution_cache.get(user_id)
+    with _lock:
+        cached = _digital_emails_cache
     if cached is not None:
-        cached_at, cached_email = cached
-        if now - cached_at < _CACHE_TTL_SECONDS:
-            return cached_email
+        cached_at, cached_set = cached
+        age = now - cached_at
+        if age < _CACHE_TTL_SECONDS:
+            return cached_set
+        if age < _CACHE_TTL_SECONDS + _MAX_STALE_SECONDS:
+            _submit_refresh(_EMAILS_KEY, _load_digital_emails)
+            return cached_set
 
+    try:
+        return _load_digital_emails()
+    except Exception as e:
+        logger.error("Erro ao ler config/digital_team: %s", e, exc_info=True)
+        if cached is not None:
+            return cached[1]
+        return set()
+
+
+def _email_from_doc(doc: Any) -> Optional[str]:
+    if not doc.exists:
+        return None
+    email = (doc.to_dict() or {}).get("email")
+    if email and isinstance(email, str):
+        return email.strip().lower()
+    return None
+
+
+def _store_email(user_id: str, email: Optional[str], now: float) -> None:
+    with _lock:
+        _email_resolution_cache[user_id] = (now, email)
+        _email_resolution_cache.move_to_end(user_id)
+        while len(_email_resolution_cache) > _CACHE_MAX_ENTRIES:
+            _email_resolution_cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def _fetch_email(user_id: str) -> Optional[str]:
+    """Lê users/{uid} e atualiza o cache."""
+    started = time.monotonic()
     try:
         db = get_firestore_client()
         doc = db.collection("users").document(user_id).get()
-        if not doc.exists:
-            logger.warning("Usuário %s não encontrado em users/", user_id)
-            email = None
+    except Exception:
+        _record_refresh(time.monotonic() - started, error=True)
+        raise
+    email = _email_from_doc(doc)
+    if not doc.exists:
+        logger.warning("Usuário %s não encontrado em users/", user_id)
+    now = time.monotonic()
+    _record_refresh(now - started)
+    _store_email(user_id, email, now)
+    return email
+
+
+def _resolve_email(user_id: str) -> Optional[str]:
+    """
+    Resolve uid → email via documento users/{uid}.
+    Resultado é cacheado com TTL; vencido, é servido enquanto recarrega em background.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _email_resolution_cache.get(user_id)
+        if cached is not None:
+            _email_resolution_cache.move_to_end(user_id)
+            age = now - cached[0]
+            if age < _CACHE_TTL_SECONDS:
+                _stats["hits"] += 1
+                return cached[1]
+            stale = age < _CACHE_TTL_SECONDS + _MAX_STALE_SECONDS
         else:
-            email = doc.to_dict().get("email")
-            if email and isinstance(email, str):
-                email = email.strip().lower()
-            else:
-                email = None
+            stale = False
+        _stats["stale_hits" if stale else "misses"] += 1
+
+    if stale:
+        _submit_refresh(user_id, lambda: _fetch_email(user_id))
+        return cached[1]
+
+    try:
+        return _fetch_email(user_id)
     except Exception as e:
         logger.error("Erro ao resolver email do usuário %s: %s", user_id, e, exc_info=True)
         if cached is not None:
             return cached[1]
         return None
 
-    _email_resolution_cache[user_id] = (now, email)
-    return email
+
+def prefetch_user_emails(user_ids: Iterable[str]) -> int:
+    """
+    Resolve em lote (um único get_all) os uids ausentes ou vencidos no cache.
+    Falhas são registradas e ignoradas: is_digital volta à leitura individual.
+
+    Returns:
+        Número de uids lidos do Firestore
+    """
+    now = time.monotonic()
+    with _lock:
+        pending = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = _email_resolution_cache.get(user_id)
+            if user_id and (cached is None or now - cached[0] >= _CACHE_TTL_SECONDS):
+                pending.append(user_id)
+        _stats["prefetch_calls"] += 1
+    if not pending:
+        return 0
+
+    started = time.monotonic()
+    try:
+        db = get_firestore_client()
+        users_ref = db.collection("users")
+        docs = {doc.id: doc for doc in db.get_all([users_ref.document(uid) for uid in pending])}
+    except Exception as e:
+        _record_refresh(time.monotonic() - started, error=True)
+        logger.warning("Erro no prefetch de %d usuários do setor digital: %s", len(pending), e)
+        return 0
+
+    now = time.monotonic()
+    _record_refresh(now - started)
+    for user_id in pending:
+        doc = docs.get(user_id)
+        _store_email(user_id, _email_from_doc(doc) if doc is not None else None, now)
+    with _lock:
+        _stats["prefetched"] += len(pending)
+    return len(pending)
 
 
 def is_digital(user_id: str) -> bool:
@@ -96,8 +263,28 @@ def is_digital(user_id: str) -> bool:
     return email in _get_digital_emails()
 
 
+def get_whitelist_cache_stats() -> Dict[str, Any]:
+    """Hits (frescos e vencidos), misses, evicções e tempos de leitura do Firestore."""
+    with _lock:
+        stats = {
+            **_stats,
+            "entries": len(_email_resolution_cache),
+            "max_entries": _CACHE_MAX_ENTRIES,
+            "refreshing": len(_refreshing),
+        }
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 3) if lookups else None
+    stats["refresh_seconds_avg"] = (
+        round(stats["refresh_seconds_total"] / stats["refreshes"], 4) if stats["refreshes"] else None
+    )
+    return stats
+
+
 def clear_cache() -> None:
-    """Limpa caches em memória (útil para testes)."""
-    global _digital_emails_cache
-    _digital_emails_cache = None
-    _email_resolution_cache.clear()
+    """Limpa caches e estatísticas em memória (útil para testes)."""
+    global _digital_emails_cache, _stats
+    with _lock:
+        _digital_emails_cache = None
+        _email_resolution_cache.clear()
+        _refreshing.clear()
+        _stats = _empty_stats()
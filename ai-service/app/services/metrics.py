@@ -1,16 +1,29 @@
 """
 Serviço centralizado para registro de métricas de uso no Firestore.
+
+Contadores (automatica, personalized, ultra_batch_total_files) passam pelo buffer
+de metrics_buffer.py e são gravados em lote. Cada execução de ultra batch é um doc
+em metrics/{date}/users/{userId}/ultra_batch_runs/{jobId}, com contadores
+ultra_batch_run_count / ultra_batch_files no doc do usuário (o array
+ultra_batch_runs é o layout antigo, ainda lido pelo agregador).
+O total diário fica em shards (metrics/{date}/total/shard_{i}); get_daily_total soma.
 """
 from datetime import datetime, timezone
 from typing import Optional
 from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
 from app.config import get_firestore_client
 from app.services.digital_whitelist import is_digital
+from app.services.metrics_buffer import buffer_total_increment, buffer_user_increment
 import logging
 
 logger = logging.getLogger(__name__)
 
 ALLOWED_METRIC_TYPES = ("automatica", "personalized")
+TOTAL_COUNTER_FIELDS = ("automatica", "personalized", "ultra_batch_total_files")
+ULTRA_BATCH_RUNS_SUBCOLLECTION = "ultra_batch_runs"
+FIELD_ULTRA_BATCH_RUN_COUNT = "ultra_batch_run_count"
+FIELD_ULTRA_BATCH_FILES = "ultra_batch_files"
 
 
 def _get_date_string(date: Optional[str] = None) -> str:
@@ -32,9 +45,9 @@ def record_metric_call(user_id: str, metric_type: str, date: Optional[str] = Non
     """
     Registra uma chamada de métrica (automatica ou personalized).
     
-    Incrementa o contador correspondente no documento do usuário para o dia.
-    Usa transação Firestore para garantir atomicidade.
-    _update_daily_total assume metric_type já validado por esta função.
+    Acumula +1 no contador do usuário para o dia e no total diário. A gravação
+    acontece em lote (firestore.Increment) pelo buffer de métricas, fora do request;
+    o sector digital é resolvido no flush.
     
     Args:
         user_id: ID do usuário
@@ -51,98 +64,50 @@ def record_metric_call(user_id: str, metric_type: str, date: Optional[str] = Non
         return
     try:
         date_str = _get_date_string(date)
-        db = get_firestore_client()
-        
-        # Caminho do documento: metrics/days/{date}/users/{userId}
-        # Estrutura: metrics/days/{date}/users/{userId}
-        doc_ref = db.collection('metrics').document(date_str).collection('users').document(user_id)
-        
-        # Usar transação para garantir atomicidade
-        sector_value = "digital" if is_digital(user_id) else None
-
-        @firestore.transactional
-        def update_metric(transaction):
-            doc = doc_ref.get(transaction=transaction)
-            
-            if doc.exists:
-                updates = {
-                    metric_type: (doc.get(metric_type) or 0) + 1,
-                    'last_updated': firestore.SERVER_TIMESTAMP,
-                    'date': date_str
-                }
-                if sector_value:
-                    updates['sector'] = sector_value
-                transaction.update(doc_ref, updates)
-            else:
-                initial_data = {
-                    'automatica': 0,
-                    'personalized': 0,
-                    'ultra_batch_runs': [],
-                    'last_updated': firestore.SERVER_TIMESTAMP,
-                    'date': date_str
-                }
-                initial_data[metric_type] = 1
-                if sector_value:
-                    initial_data['sector'] = sector_value
-                transaction.set(doc_ref, initial_data)
-        
-        transaction = db.transaction()
-        update_metric(transaction)
-
-        _update_daily_total(date_str, metric_type)
-        
-        logger.info(f"✅ Métrica registrada: {metric_type} para usuário {user_id} em {date_str}")
+        # Caminhos: metrics/{date}/users/{userId} e metrics/{date}/total/shard_{i}
+        buffer_user_increment(date_str, user_id, metric_type)
+        buffer_total_increment(date_str, metric_type)
+        logger.debug(f"Métrica acumulada: {metric_type} para usuário {user_id} em {date_str}")
         
     except Exception as e:
         # Não falhar o processamento principal se tracking falhar
         logger.error(f"❌ Erro ao registrar métrica {metric_type} para {user_id}: {e}", exc_info=True)
 
-def _update_daily_total(date_str: str, metric_type: str) -> None:
+
+def get_daily_total(date: Optional[str] = None) -> dict:
     """
-    Atualiza total agregado do dia para uma métrica.
+    Lê o total agregado do dia somando os shards de metrics/{date}/total
+    (inclui o doc único "total" do layout antigo, se ainda existir).
     
     Args:
-        date_str: Data no formato YYYY-MM-DD
-        metric_type: Tipo de métrica ('automatica' ou 'personalized')
+        date: Data no formato YYYY-MM-DD (opcional, usa data atual se não fornecido)
+    
+    Returns:
+        Dict com automatica, personalized e ultra_batch_total_files
     """
-    try:
-        db = get_firestore_client()
-        total_ref = db.collection('metrics').document(date_str).collection('total').document('total')
-        
-        @firestore.transactional
-        def update_total(transaction):
-            doc = total_ref.get(transaction=transaction)
-            
-            if doc.exists:
-                current_value = doc.get(metric_type) or 0
-                transaction.update(total_ref, {
-                    metric_type: current_value + 1,
-                    'last_updated': firestore.SERVER_TIMESTAMP,
-                    'date': date_str
-                })
-            else:
-                initial_data = {
-                    'automatica': 0,
-                    'personalized': 0,
-                    'ultra_batch_total_files': 0,
-                    'last_updated': firestore.SERVER_TIMESTAMP,
-                    'date': date_str
-                }
-                initial_data[metric_type] = 1
-                transaction.set(total_ref, initial_data)
-        
-        transaction = db.transaction()
-        update_total(transaction)
-        
-    except Exception as e:
-        logger.error(f"❌ Erro ao atualizar total diário {metric_type} para {date_str}: {e}", exc_info=True)
+    date_str = _get_date_string(date)
+    db = get_firestore_client()
+    totals = {field: 0 for field in TOTAL_COUNTER_FIELDS}
+    for doc in db.collection('metrics').document(date_str).collection('total').stream():
+        data = doc.to_dict() or {}
+        for field in TOTAL_COUNTER_FIELDS:
+            totals[field] += data.get(field) or 0
+    return totals
+
+
+def _user_metrics_ref(db, date_str: str, user_id: str):
+    """Referência de metrics/{date}/users/{userId}."""
+    return db.collection('metrics').document(date_str).collection('users').document(user_id)
 
 
 def record_ultra_batch_start(user_id: str, job_id: str, file_count: int, date: Optional[str] = None) -> None:
     """
     Registra início de processamento ultra-batch.
     
-    Adiciona entrada no array ultra_batch_runs do documento do usuário.
+    Cria metrics/{date}/users/{userId}/ultra_batch_runs/{jobId} e incrementa os
+    contadores ultra_batch_run_count e ultra_batch_files do documento do usuário,
+    no mesmo WriteBatch (sem ler o documento). O create falha se o job já foi
+    registrado, então os contadores não são incrementados duas vezes.
     
     Args:
         user_id: ID do usuário
@@ -156,76 +121,29 @@ def record_ultra_batch_start(user_id: str, job_id: str, file_count: int, date: O
     try:
         date_str = _get_date_string(date)
         db = get_firestore_client()
-        
-        # Caminho do documento: metrics/days/{date}/users/{userId}
-        # Estrutura: metrics/days/{date}/users/{userId}
-        doc_ref = db.collection('metrics').document(date_str).collection('users').document(user_id)
-        
-        sector_value = "digital" if is_digital(user_id) else None
-
-        @firestore.transactional
-        def update_ultra_batch(transaction):
-            doc = doc_ref.get(transaction=transaction)
-            
-            new_entry = {
-                'jobId': job_id,
-                'file_count': file_count
-            }
-            
-            if doc.exists:
-                current_runs = doc.get('ultra_batch_runs') or []
-                if not any(run.get('jobId') == job_id for run in current_runs):
-                    current_runs.append(new_entry)
-                    updates = {
-                        'ultra_batch_runs': current_runs,
-                        'last_updated': firestore.SERVER_TIMESTAMP,
-                        'date': date_str
-                    }
-                    if sector_value:
-                        updates['sector'] = sector_value
-                    transaction.update(doc_ref, updates)
-            else:
-                initial_data = {
-                    'automatica': 0,
-                    'personalized': 0,
-                    'ultra_batch_runs': [new_entry],
-                    'last_updated': firestore.SERVER_TIMESTAMP,
-                    'date': date_str
-                }
-                if sector_value:
-                    initial_data['sector'] = sector_value
-                transaction.set(doc_ref, initial_data)
-        
-        transaction = db.transaction()
-        update_ultra_batch(transaction)
-        
-        # Atualizar total de arquivos em ultra-batch do dia
+        doc_ref = _user_metrics_ref(db, date_str, user_id)
+        run_ref = doc_ref.collection(ULTRA_BATCH_RUNS_SUBCOLLECTION).document(job_id)
+
+        updates = {
+            FIELD_ULTRA_BATCH_RUN_COUNT: firestore.Increment(1),
+            FIELD_ULTRA_BATCH_FILES: firestore.Increment(file_count),
+            'last_updated': firestore.SERVER_TIMESTAMP,
+            'date': date_str,
+        }
+        if is_digital(user_id):
+            updates['sector'] = "digital"
+
+        batch = db.batch()
+        batch.create(run_ref, {'jobId': job_id, 'file_count': file_count})
+        batch.set(doc_ref, updates, merge=True)
         try:
-            total_ref = db.collection('metrics').document(date_str).collection('total').document('total')
-            
-            @firestore.transactional
-            def update_total_files(transaction):
-                doc = total_ref.get(transaction=transaction)
-                if doc.exists:
-                    current_total = doc.get('ultra_batch_total_files') or 0
-                    transaction.update(total_ref, {
-                        'ultra_batch_total_files': current_total + file_count,
-                        'last_updated': firestore.SERVER_TIMESTAMP,
-                        'date': date_str
-                    })
-                else:
-                    transaction.set(total_ref, {
-                        'automatica': 0,
-                        'personalized': 0,
-                        'ultra_batch_total_files': file_count,
-                        'last_updated': firestore.SERVER_TIMESTAMP,
-                        'date': date_str
-                    })
-            
-            transaction_total = db.transaction()
-            update_total_files(transaction_total)
-        except Exception as e:
-            logger.error(f"Erro ao atualizar total de arquivos ultra-batch do dia: {e}")
+            batch.commit()
+        except AlreadyExists:
+            logger.info(f"Ultra-batch {job_id} já registrado para usuário {user_id} em {date_str}")
+            return
+        
+        # Total de arquivos em ultra-batch do dia (incremento em lote, sem transação)
+        buffer_total_increment(date_str, 'ultra_batch_total_files', file_count)
         
         logger.info(f"✅ Ultra-batch registrado: job {job_id} com {file_count} arquivos para usuário {user_id} em {date_str}")
         
@@ -238,8 +156,9 @@ def record_ultra_batch_complete(user_id: str, job_id: str, date: Optional[str] =
     """
     Marca job de ultra-batch como completo e persiste status no Firestore.
     
-    Atualiza o array ultra_batch_runs no documento do usuário: localiza a entrada
-    com jobId == job_id e adiciona status "completed" e completedAt.
+    Atualiza só o documento da execução (ultra_batch_runs/{jobId}) com status
+    "completed" e completedAt. Jobs iniciados antes da subcoleção existir estão no
+    array ultra_batch_runs do documento do usuário e seguem pelo caminho antigo.
     
     Args:
         user_id: ID do usuário
@@ -252,39 +171,44 @@ def record_ultra_batch_complete(user_id: str, job_id: str, date: Optional[str] =
     try:
         date_str = _get_date_string(date)
         db = get_firestore_client()
-        doc_ref = db.collection("metrics").document(date_str).collection("users").document(user_id)
-
-        sector_value = "digital" if is_digital(user_id) else None
-
-        @firestore.transactional
-        def update_complete(transaction):
-            doc = doc_ref.get(transaction=transaction)
-            if not doc.exists:
-                logger.warning(f"Documento de métricas não encontrado para user {user_id} em {date_str}")
-                return
-            runs = list(doc.get("ultra_batch_runs") or [])
-            for i, run in enumerate(runs):
-                if run.get("jobId") == job_id:
-                    runs[i] = {
-                        **run,
-                        "status": "completed",
-                        "completedAt": datetime.now(timezone.utc).isoformat(),
-                    }
-                    updates = {
-                        "ultra_batch_runs": runs,
-                        "last_updated": firestore.SERVER_TIMESTAMP,
-                        "date": date_str,
-                    }
-                    if sector_value:
-                        updates["sector"] = sector_value
-                    transaction.update(doc_ref, updates)
-                    return
-            logger.warning(f"Job {job_id} não encontrado em ultra_batch_runs para user {user_id}")
-
-        transaction = db.transaction()
-        update_complete(transaction)
+        doc_ref = _user_metrics_ref(db, date_str, user_id)
+        completed_at = datetime.now(timezone.utc).isoformat()
+        try:
+            doc_ref.collection(ULTRA_BATCH_RUNS_SUBCOLLECTION).document(job_id).update(
+                {"status": "completed", "completedAt": completed_at}
+            )
+        except NotFound:
+            _complete_legacy_run(db, doc_ref, user_id, job_id, date_str, completed_at)
         logger.info(f"✅ Ultra-batch completo: job {job_id} para usuário {user_id} em {date_str}")
 
     except Exception as e:
         logger.error(f"❌ Erro ao registrar conclusão de ultra-batch {job_id} para {user_id}: {e}", exc_info=True)
 
+
+def _complete_legacy_run(db, doc_ref, user_id: str, job_id: str, date_str: str, completed_at: str) -> None:
+    """Conclusão no array ultra_batch_runs (layout antigo), em transação."""
+    sector_value = "digital" if is_digital(user_id) else None
+
+    @firestore.transactional
+    def update_complete(transaction):
+        doc = doc_ref.get(transaction=transaction)
+        if not doc.exists:
+            logger.warning(f"Documento de métricas não encontrado para user {user_id} em {date_str}")
+            return
+        runs = list(doc.get("ultra_batch_runs") or [])
+        for i, run in enumerate(runs):
+            if run.get("jobId") == job_id:
+                runs[i] = {**run, "status": "completed", "completedAt": completed_at}
+                updates = {
+                    "ultra_batch_runs": runs,
+                    "last_updated": firestore.SERVER_TIMESTAMP,
+                    "date": date_str,
+                }
+                if sector_value:
+                    updates["sector"] = sector_value
+                transaction.update(doc_ref, updates)
+                return
+        logger.warning(f"Job {job_id} não encontrado em ultra_batch_runs para user {user_id}")
+
+    transaction = db.transaction()
+    update_complete(transaction)
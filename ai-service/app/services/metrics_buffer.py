@@ -0,0 +1,224 @@
+"""
+Buffer em memória dos contadores de métricas, gravados em lote no Firestore.
+
+record_metric_call / record_ultra_batch_start só acumulam incrementos por
+(data, usuário, campo) e por (data, campo) do total diário. Uma thread daemon
+descarrega o buffer a cada METRICS_FLUSH_INTERVAL_SECONDS com WriteBatches de
+firestore.Increment (set com merge), sem transações e fora da latência do request.
+
+- O total diário é distribuído em METRICS_TOTAL_SHARDS docs (sem hotspot)
+- is_digital é resolvido no flush (e-mails dos usuários do lote num único get_all)
+- Se o flush falhar, só os incrementos ainda não gravados voltam ao buffer
+  (os WriteBatches já commitados não são reaplicados na próxima rodada)
+- flush_metrics() no shutdown da aplicação descarrega o que restou
+"""
+import logging
+import random
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from firebase_admin import firestore
+
+from app.config import (
+    METRICS_BUFFER_ENABLED,
+    METRICS_FLUSH_INTERVAL_SECONDS,
+    METRICS_TOTAL_SHARDS,
+    get_firestore_client,
+)
+from app.services.digital_whitelist import is_digital, prefetch_user_emails
+
+logger = logging.getLogger(__name__)
+
+# Limite de operações de um WriteBatch do Firestore
+FIRESTORE_BATCH_LIMIT = 500
+
+# Total diário: metrics/{date}/total/shard_{i}; o doc "total" é o layout antigo
+TOTAL_SHARD_PREFIX = "shard_"
+
+Counters = Dict[str, int]
+
+
+class IncrementsNotWritten(Exception):
+    """Falha no meio do flush: carrega só os incrementos cujos batches não foram commitados."""
+
+    def __init__(self, users: Dict[Tuple[str, str], Counters], totals: Dict[str, Counters], written: int):
+        super().__init__(f"{len(users) + len(totals)} documentos não gravados ({written} gravados)")
+        self.users = users
+        self.totals = totals
+        self.written = written
+
+
+def random_total_shard() -> str:
+    """Id de um shard do total diário escolhido ao acaso."""
+    return f"{TOTAL_SHARD_PREFIX}{random.randrange(max(METRICS_TOTAL_SHARDS, 1))}"
+
+
+class MetricsBuffer:
+    """Acumulador thread-safe de incrementos com flush periódico em background."""
+
+    def __init__(self, flush_interval_seconds: float = METRICS_FLUSH_INTERVAL_SECONDS):
+        self.flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._users: Dict[Tuple[str, str], Counters] = defaultdict(lambda: defaultdict(int))
+        self._totals: Dict[str, Counters] = defaultdict(lambda: defaultdict(int))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"flushes": 0, "writes": 0, "flush_errors": 0}
+
+    def increment_user(self, date_str: str, user_id: str, field: str, amount: int = 1) -> None:
+        with self._lock:
+            self._users[(date_str, user_id)][field] += amount
+        self._ensure_started()
+
+    def increment_total(self, date_str: str, field: str, amount: int = 1) -> None:
+        with self._lock:
+            self._totals[date_str][field] += amount
+        self._ensure_started()
+
+    def pending(self) -> int:
+        """Quantidade de documentos com incrementos pendentes."""
+        with self._lock:
+            return len(self._users) + len(self._totals)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="metrics-buffer-flush", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.flush_interval_seconds):
+            self.flush()
+
+    def _swap(self) -> Tuple[Dict[Tuple[str, str], Counters], Dict[str, Counters]]:
+        with self._lock:
+            users, totals = self._users, self._totals
+            self._users = defaultdict(lambda: defaultdict(int))
+            self._totals = defaultdict(lambda: defaultdict(int))
+        return users, totals
+
+    def _merge_back(self, users, totals) -> None:
+        with self._lock:
+            for key, counters in users.items():
+                for field, amount in counters.items():
+                    self._users[key][field] += amount
+            for date_str, counters in totals.items():
+                for field, amount in counters.items():
+                    self._totals[date_str][field] += amount
+
+    def flush(self) -> int:
+        """Grava os incrementos pendentes. Retorna o número de documentos escritos."""
+        with self._flush_lock:
+            users, totals = self._swap()
+            if not users and not totals:
+                return 0
+            try:
+                written = _write_increments(users, totals)
+            except IncrementsNotWritten as e:
+                self._merge_back(e.users, e.totals)
+                self.stats["flush_errors"] += 1
+                self.stats["writes"] += e.written
+                logger.error(
+                    "❌ Erro ao gravar métricas em lote (%d gravados, restante mantido no buffer): %s",
+                    e.written, e.__cause__, exc_info=True,
+                )
+                return e.written
+            except Exception as e:
+                self._merge_back(users, totals)
+                self.stats["flush_errors"] += 1
+                logger.error("❌ Erro ao gravar métricas em lote (mantidas no buffer): %s", e, exc_info=True)
+                return 0
+            self.stats["flushes"] += 1
+            self.stats["writes"] += written
+            logger.info("✅ Métricas gravadas em lote: %d documentos", written)
+            return written
+
+    def stop(self) -> int:
+        """Para a thread de flush e descarrega o que restou."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval_seconds + 1)
+        return self.flush()
+
+
+def _is_digital_or_none(user_id: str) -> Optional[bool]:
+    """is_digital sem derrubar o flush: em erro o doc é gravado sem sector."""
+    try:
+        return is_digital(user_id)
+    except Exception as e:
+        logger.warning("Não foi possível resolver sector de %s no flush de métricas: %s", user_id, e)
+        return None
+
+
+def _write_increments(users: Dict[Tuple[str, str], Counters], totals: Dict[str, Counters]) -> int:
+    """
+    Grava os incrementos em WriteBatches de até FIRESTORE_BATCH_LIMIT operações.
+    Se um commit falhar, levanta IncrementsNotWritten com os incrementos dos
+    batches não commitados (os anteriores já estão no Firestore).
+    """
+    db = get_firestore_client()
+    # (chave em users ou None, chave em totals ou None, ref, dados)
+    writes = []
+    try:
+        prefetch_user_emails(user_id for _, user_id in users)
+    except Exception as e:
+        logger.warning("Prefetch de e-mails falhou no flush de métricas: %s", e)
+    for (date_str, user_id), counters in users.items():
+        ref = db.collection('metrics').document(date_str).collection('users').document(user_id)
+        data = {field: firestore.Increment(amount) for field, amount in counters.items()}
+        data['last_updated'] = firestore.SERVER_TIMESTAMP
+        data['date'] = date_str
+        if _is_digital_or_none(user_id):
+            data['sector'] = "digital"
+        writes.append(((date_str, user_id), None, ref, data))
+    for date_str, counters in totals.items():
+        ref = db.collection('metrics').document(date_str).collection('total').document(random_total_shard())
+        data = {field: firestore.Increment(amount) for field, amount in counters.items()}
+        data['last_updated'] = firestore.SERVER_TIMESTAMP
+        data['date'] = date_str
+        writes.append((None, date_str, ref, data))
+
+    for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for _, _, ref, data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.set(ref, data, merge=True)
+        try:
+            batch.commit()
+        except Exception as e:
+            remaining = writes[start:]
+            raise IncrementsNotWritten(
+                {user_key: users[user_key] for user_key, _, _, _ in remaining if user_key is not None},
+                {total_key: totals[total_key] for _, total_key, _, _ in remaining if total_key is not None},
+                written=start,
+            ) from e
+    return len(writes)
+
+
+metrics_buffer = MetricsBuffer()
+
+
+def buffer_user_increment(date_str: str, user_id: str, field: str, amount: int = 1) -> None:
+    """Acumula um incremento no doc do usuário (grava direto se o buffer estiver desligado)."""
+    if METRICS_BUFFER_ENABLED:
+        metrics_buffer.increment_user(date_str, user_id, field, amount)
+    else:
+        _write_increments({(date_str, user_id): {field: amount}}, {})
+
+
+def buffer_total_increment(date_str: str, field: str, amount: int = 1) -> None:
+    """Acumula um incremento no total diário (grava direto se o buffer estiver desligado)."""
+    if METRICS_BUFFER_ENABLED:
+        metrics_buffer.increment_total(date_str, field, amount)
+    else:
+        _write_increments({}, {date_str: {field: amount}})
+
+
+def flush_metrics() -> int:
+    """Para o flush periódico e grava tudo o que está pendente (usado no shutdown)."""
+    return metrics_buffer.stop()
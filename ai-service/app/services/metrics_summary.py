@@ -0,0 +1,104 @@
+"""
+Leitura dos resumos mensais pré-agregados (metrics_summary/{YYYY-MM}).
+
+- Todos os meses ausentes do cache são lidos com um único get_all
+- Meses fechados (closed: true) não mudam mais: ficam em cache sem expirar
+- O mês aberto (e meses ainda sem documento) expira em METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS
+- LRU limitado a METRICS_SUMMARY_CACHE_MAX_ENTRIES meses
+
+As leituras são síncronas; o endpoint chama get_metrics_summaries_sync via executor.
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.config import (
+    METRICS_SUMMARY_CACHE_MAX_ENTRIES,
+    METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS,
+    get_firestore_client,
+)
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_METRICS_SUMMARY = "metrics_summary"
+
+_cache_lock = threading.Lock()
+# month -> (cached_at, dados ou None se o documento não existe)
+_summary_cache: "OrderedDict[str, tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+_cache_stats = {"hits": 0, "misses": 0, "round_trips": 0, "evictions": 0}
+
+
+def _is_fresh(entry: tuple[float, Optional[Dict[str, Any]]], now: float) -> bool:
+    cached_at, data = entry
+    if data is not None and data.get("closed"):
+        return True
+    return now - cached_at < METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS
+
+
+def _store(month: str, data: Optional[Dict[str, Any]], now: float) -> None:
+    _summary_cache[month] = (now, data)
+    _summary_cache.move_to_end(month)
+    while len(_summary_cache) > METRICS_SUMMARY_CACHE_MAX_ENTRIES:
+        _summary_cache.popitem(last=False)
+        _cache_stats["evictions"] += 1
+
+
+def get_metrics_summaries_sync(months: List[str]) -> List[Dict[str, Any]]:
+    """
+    Resumos dos meses pedidos, na ordem de `months` (meses sem documento são omitidos).
+    Faz no máximo uma ida ao Firestore; nenhuma se todos estiverem em cache.
+
+    Returns:
+        Cópias dos documentos, com o campo "month" preenchido
+    """
+    now = time.monotonic()
+    found: Dict[str, Optional[Dict[str, Any]]] = {}
+    with _cache_lock:
+        for month in months:
+            entry = _summary_cache.get(month)
+            if entry is not None and _is_fresh(entry, now):
+                _summary_cache.move_to_end(month)
+                found[month] = entry[1]
+                _cache_stats["hits"] += 1
+        missing = [m for m in dict.fromkeys(months) if m not in found]
+        _cache_stats["misses"] += len(missing)
+
+    if missing:
+        db = get_firestore_client()
+        collection = db.collection(COLLECTION_METRICS_SUMMARY)
+        docs = db.get_all([collection.document(month) for month in missing])
+        fetched = {doc.id: (doc.to_dict() or {}) if doc.exists else None for doc in docs}
+        now = time.monotonic()
+        with _cache_lock:
+            _cache_stats["round_trips"] += 1
+            for month in missing:
+                _store(month, fetched.get(month), now)
+        found.update({month: fetched.get(month) for month in missing})
+        logger.debug("metrics_summary: %d meses lidos em um get_all", len(missing))
+
+    out = []
+    for month in months:
+        data = found.get(month)
+        if data is not None:
+            out.append({**copy.deepcopy(data), "month": month})
+    return out
+
+
+def get_metrics_summary_cache_stats() -> Dict[str, Any]:
+    """Hits/misses do cache e número de idas ao Firestore."""
+    with _cache_lock:
+        stats = {**_cache_stats, "entries": len(_summary_cache)}
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    return stats
+
+
+def clear_metrics_summary_cache() -> None:
+    """Esvazia o cache e zera as estatísticas (útil para testes)."""
+    with _cache_lock:
+        _summary_cache.clear()
+        for key in _cache_stats:
+            _cache_stats[key] = 0
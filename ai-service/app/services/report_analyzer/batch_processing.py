@@ -2,79 +2,109 @@
 Serviços de processamento em lote para relatórios XP.
 """
 import asyncio
+import time
 from app.workflows.report_workflow import create_report_analysis_workflow
 from app.config import MAX_CONCURRENT_JOBS
+from app.monitoring import tracing
+from app.monitoring.pipeline_log import file_context, get_pipeline_logger, new_job_id
+from app.services.report_analyzer.result_store import build_result_key, get_stored_result, save_result
+
+log = get_pipeline_logger("batch")
 
 # Semáforo global para limitar concorrência de jobs em toda a instância
 semaphore = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
 
-async def process_batch_reports(files_data: list, user_id: str) -> list:
+async def process_batch_reports(files_data: list, user_id: str, job_id: str = None) -> list:
     """
     Processa múltiplos relatórios em paralelo, respeitando o limite global de concorrência.
+    Cada arquivo gera uma linha de resumo (pipeline_file_summary) correlacionada por job_id;
+    sem job_id (lote avulso), um id é gerado para o lote.
     """
+    job_id = job_id or new_job_id()
+
     async def process_single_file(file_data: dict) -> dict:
-        try:
-            print(f"[batch] Iniciando processamento de: {file_data['name']}")
-            
-            # Adquirir semáforo antes de processar
-            async with semaphore:
-                print(f"[batch] 🟢 Semáforo adquirido para: {file_data['name']} (Livres: {MAX_CONCURRENT_JOBS - semaphore._value})")
+        with file_context(file_data["name"], job_id) as summary, \
+             tracing.span("report.file", file_name=file_data["name"]) as file_span:
+            try:
+                log.debug("Iniciando processamento")
+                
+                # Reaproveitar resultado anterior (mesmo PDF/modo/versão de prompts) sem ocupar o semáforo
+                result_key = build_result_key(file_data["dataUri"], "auto")
+                stored = await get_stored_result(result_key)
+                if stored is not None:
+                    summary.set(status="cached")
+                    file_span.set(result_store="hit")
+                    return {
+                        "success": True,
+                        "file_name": file_data["name"],
+                        "data": stored
+                    }
+                
+                # Adquirir semáforo antes de processar
+                wait_started = time.perf_counter()
+                wait_span = tracing.start_span("semaphore.wait", limit=MAX_CONCURRENT_JOBS)
+                async with semaphore:
+                    wait_span.end()
+                    summary.add_stage("semaphore_wait", time.perf_counter() - wait_started)
+                    log.debug("Semáforo adquirido", in_use=MAX_CONCURRENT_JOBS - semaphore._value)
+                    
+                    state = {
+                        "file_content": file_data["dataUri"],
+                        "file_name": file_data["name"],
+                        "user_id": user_id,
+                        "analysis_mode": "auto",
+                        "selected_fields": None
+                    }
+                    
+                    # Adicionar timeout de 4 minutos por arquivo
+                    try:
+                        app = create_report_analysis_workflow()
+                        result = await asyncio.wait_for(
+                            app.ainvoke(state),
+                            timeout=240.0  # 4 minutos
+                        )
+                        await save_result(result_key, result, "auto")
+                    except asyncio.TimeoutError:
+                        summary.set(status="timeout")
+                        raise Exception(f"Timeout no processamento de {file_data['name']}")
                 
-                state = {
-                    "file_content": file_data["dataUri"],
+                # Semáforo liberado automaticamente aqui
+                if result.get("error"):
+                    summary.set(error=result["error"])
+                    file_span.set_error(result["error"])
+                return {
+                    "success": True,
                     "file_name": file_data["name"],
-                    "user_id": user_id,
-                    "analysis_mode": "auto",
-                    "selected_fields": None
+                    "data": result
                 }
                 
-                print(f"[batch] Chamando report_analysis_app.ainvoke para: {file_data['name']}")
-                
-                # Adicionar timeout de 4 minutos por arquivo
-                try:
-                    app = create_report_analysis_workflow()
-                    result = await asyncio.wait_for(
-                        app.ainvoke(state),
-                        timeout=240.0  # 4 minutos
-                    )
-                    print(f"[batch] ✅ Concluído: {file_data['name']}")
-                except asyncio.TimeoutError:
-                    print(f"[batch] ⏰ Timeout em: {file_data['name']}")
-                    raise Exception(f"Timeout no processamento de {file_data['name']}")
-            
-            # Semáforo liberado automaticamente aqui
-            return {
-                "success": True,
-                "file_name": file_data["name"],
-                "data": result
-            }
-            
-        except Exception as e:
-            print(f"[batch] ❌ Erro em {file_data['name']}: {e}")
-            return {
-                "success": False,
-                "file_name": file_data["name"],
-                "error": str(e)
-            }
+            except Exception as e:
+                summary.set(error=str(e))
+                file_span.record_exception(e)
+                return {
+                    "success": False,
+                    "file_name": file_data["name"],
+                    "error": str(e)
+                }
     
-    print(f"[batch] Iniciando processamento de {len(files_data)} arquivos")
+    log.info("Iniciando lote", job_id=job_id, files=len(files_data))
     
     # Processar em paralelo
     tasks = [process_single_file(file_data) for file_data in files_data]
-    print(f"[batch] Criadas {len(tasks)} tasks")
     
     try:
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        print(f"[batch] Processamento concluído, {len(results)} resultados")
+        # As tasks do gather herdam o span do lote (cópia do contexto)
+        with tracing.span("report.batch", job_id=job_id, files=len(files_data)):
+            results = await asyncio.gather(*tasks, return_exceptions=True)
     except Exception as e:
-        print(f"[batch] Erro no asyncio.gather: {e}")
+        log.error("Erro no asyncio.gather", job_id=job_id, error=str(e))
         return []
     
     # Tratar exceções
     processed_results = []
     for i, result in enumerate(results):
         if isinstance(result, Exception):
-            print(f"[batch] Exceção no arquivo {i}: {result}")
+            log.error("Exceção no arquivo", job_id=job_id, file_name=files_data[i]["name"], error=str(result))
             processed_results.append({
                 "success": False,
                 "file_name": files_data[i]["name"],
@@ -83,5 +113,7 @@ async def process_batch_reports(files_data: list, user_id: str) -> list:
         else:
             processed_results.append(result)
     
-    print(f"[batch] Retornando {len(processed_results)} resultados processados")
-    return processed_results
\ No newline at end of file
+    succeeded = sum(1 for r in processed_results if r.get("success"))
+    log.info("Lote concluído", job_id=job_id, files=len(processed_results),
+             succeeded=succeeded, failed=len(processed_results) - succeeded)
+    return processed_results
@@ -0,0 +1,150 @@
+"""
+Cache por classe de ativo da análise personalizada.
+
+Durante uma mesma sessão de extração (mesmo extracted_data), o assessor alterna
+classes/ativos em selected_fields. Cada classe já analisada fica guardada como
+um "pedaço" ({highlight, detractor}) e uma nova seleção só envia ao LLM as
+classes ainda não vistas; o resultado final é remontado a partir dos pedaços.
+
+Chave: (sessão = hash do extracted_data completo, className, hash do payload da
+classe após o filtro — classPerformance, allAssets da classe e benchmarks).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import CLASS_ANALYSIS_CACHE_MAX_ENTRIES, CLASS_ANALYSIS_CACHE_TTL_SECONDS
+
+# Máximo de detratores exibidos (regra do prompt personalizado)
+MAX_DETRACTORS = 2
+
+_cache: "OrderedDict[Tuple[str, str, str], tuple[float, dict]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _digest(value: Any) -> str:
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:20]
+
+
+def _normalize_class_name(name: Optional[str]) -> str:
+    return (name or "").strip().lower()
+
+
+def parse_difference(diff_str: Any) -> float:
+    """Converte '1,23%' em 1.23 (0.0 quando não numérico)."""
+    try:
+        return float(str(diff_str).replace('%', '').replace(',', '.').strip())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def session_key(extracted_data: Dict[str, Any]) -> str:
+    """Identifica a sessão de extração pelo extracted_data completo (antes do filtro)."""
+    return _digest(extracted_data)
+
+
+def class_payload(filtered_data: Dict[str, Any], class_name: str) -> Dict[str, Any]:
+    """Dados que influenciam a análise de uma classe: linha da classe, ativos e benchmarks."""
+    class_row = next(
+        (c for c in filtered_data.get('classPerformance', []) if c.get('className') == class_name),
+        None,
+    )
+    return {
+        'classPerformance': class_row,
+        'assets': (filtered_data.get('allAssets') or {}).get(class_name),
+        'benchmarkValues': filtered_data.get('benchmarkValues'),
+    }
+
+
+def class_key(session: str, filtered_data: Dict[str, Any], class_name: str) -> Tuple[str, str, str]:
+    return (session, class_name, _digest(class_payload(filtered_data, class_name)))
+
+
+def get_piece(key: Tuple[str, str, str]) -> Optional[dict]:
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is None:
+            return None
+        cached_at, piece = cached
+        if now - cached_at >= CLASS_ANALYSIS_CACHE_TTL_SECONDS:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return piece
+
+
+def put_piece(key: Tuple[str, str, str], piece: dict) -> None:
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), piece)
+        _cache.move_to_end(key)
+        while len(_cache) > CLASS_ANALYSIS_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def subset_for_classes(filtered_data: Dict[str, Any], class_names: List[str]) -> Dict[str, Any]:
+    """Recorta o extracted_data filtrado para apenas as classes informadas."""
+    wanted = set(class_names)
+    subset = {k: v for k, v in filtered_data.items() if k not in ('classPerformance', 'allAssets')}
+    subset['classPerformance'] = [
+        c for c in filtered_data.get('classPerformance', []) if c.get('className') in wanted
+    ]
+    if 'allAssets' in filtered_data:
+        subset['allAssets'] = {
+            name: assets for name, assets in (filtered_data.get('allAssets') or {}).items() if name in wanted
+        }
+    return subset
+
+
+def split_analysis_by_class(
+    analysis: Dict[str, Any],
+    class_names: List[str],
+) -> Tuple[Dict[str, dict], List[dict], List[dict]]:
+    """
+    Separa highlights/detractors da resposta do LLM por classe solicitada.
+
+    Returns:
+        (pieces por className, highlights órfãos, detractors órfãos) — órfãos são itens
+        cujo className não corresponde a nenhuma classe pedida (não são cacheados).
+    """
+    by_normalized = {_normalize_class_name(name): name for name in class_names}
+    pieces: Dict[str, dict] = {name: {'highlight': None, 'detractor': None} for name in class_names}
+    orphan_highlights: List[dict] = []
+    orphan_detractors: List[dict] = []
+
+    for kind, orphans in (('highlight', orphan_highlights), ('detractor', orphan_detractors)):
+        for item in analysis.get(f'{kind}s', []) or []:
+            name = by_normalized.get(_normalize_class_name(item.get('className')))
+            if name is None:
+                orphans.append(item)
+            else:
+                pieces[name][kind] = item
+    return pieces, orphan_highlights, orphan_detractors
+
+
+def assemble_analysis(
+    pieces: List[dict],
+    extra_highlights: Optional[List[dict]] = None,
+    extra_detractors: Optional[List[dict]] = None,
+) -> Dict[str, List[dict]]:
+    """
+    Remonta highlights/detractors a partir dos pedaços por classe.
+    Highlights ordenados pela diferença (maior primeiro); detratores limitados aos
+    MAX_DETRACTORS piores.
+    """
+    highlights = [p['highlight'] for p in pieces if p.get('highlight')] + list(extra_highlights or [])
+    detractors = [p['detractor'] for p in pieces if p.get('detractor')] + list(extra_detractors or [])
+
+    highlights.sort(key=lambda h: parse_difference(h.get('benchmarkDifference', '0%')), reverse=True)
+    detractors.sort(key=lambda d: parse_difference(d.get('benchmarkDifference', '0%')))
+    return {'highlights': highlights, 'detractors': detractors[:MAX_DETRACTORS]}
+
+
+def clear_cache() -> None:
+    """Limpa o cache (útil para testes)."""
+    with _cache_lock:
+        _cache.clear()
@@ -8,22 +8,48 @@ Planilhas criadas em Shared Drive (GOOGLE_SHEETS_SHARED_DRIVE_ID).
 
 Background: backfill e escrita incremental usam funções síncronas (def) executadas
 em thread (BackgroundTasks ou run_in_executor) para não bloquear o event loop.
+google_sheets_config/{job_id} é lido via get_sheets_config, com cache em processo de
+TTL curto, invalidado na criação da planilha e a cada atualização do backfill.
+Backfill paginado por __name__ com cursor persistido (backfill_cursor), retomável.
 Idempotência: cursor por epoch_ms (created_at_epoch_ms / processedAt_epoch_ms)
 para evitar clock skew; fallback para datetime quando epoch ausente.
-Clientes Google são criados por chamada (sem cache global) para thread-safety.
+Clientes Google: credenciais parseadas uma única vez (cache com lock) e serviços
+Sheets/Drive construídos uma vez por thread (threading.local), com discovery
+estático. Objetos httplib2 não são thread-safe, por isso nunca são compartilhados
+entre threads do executor. get_sheets_client_stats() expõe objetos construídos e
+latência dos flushes.
+Toda chamada às APIs passa por execute_with_quota (sheets_rate_limiter.py): token
+bucket por processo, justo entre jobs, com retry de 429/5xx pelo status do HttpError.
+files.create e values.append não são idempotentes: só o 429 é retentado, e a
+criação procura a planilha do job (appProperties) antes de tentar de novo.
+A escrita incremental do ultra batch passa pelo SheetsOutbox (sheets_outbox.py):
+um único escritor por job, que usa is_incremental_row e append_rows_to_sheet_sync.
 """
 import asyncio
 import logging
 import os
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timezone
 from typing import Optional
 
 from firebase_admin import firestore as fb_firestore
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
-
-from app.config import get_firestore_client, get_google_sheets_credentials
+from googleapiclient.errors import HttpError
+
+from app.config import (
+    SHEETS_BACKFILL_CHUNK_ROWS,
+    SHEETS_BACKFILL_PAGE_SIZE,
+    SHEETS_BACKFILL_STALE_SECONDS,
+    SHEETS_CONFIG_CACHE_MAX_ENTRIES,
+    SHEETS_CONFIG_CACHE_NEGATIVE_TTL_SECONDS,
+    SHEETS_CONFIG_CACHE_TTL_SECONDS,
+    get_firestore_client,
+    get_google_sheets_credentials,
+)
+from app.services.report_analyzer.sheets_rate_limiter import execute_with_quota, http_status
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +60,9 @@ SCOPES = [
 
 SHEET_HEADERS = ["account number", "final_message"]
 
+# appProperty gravada na criação; permite achar a planilha de um job num retry
+JOB_APP_PROPERTY = "ultra_batch_job_id"
+
 SHARED_DRIVE_ID = os.getenv("GOOGLE_SHEETS_SHARED_DRIVE_ID", "")
 
 
@@ -58,9 +87,125 @@ def _limpar_resposta_para_sheets(text: Optional[str]) -> str:
     return s
 
 
+# ==================== POOL DE CLIENTES ====================
+
+_credentials_lock = threading.Lock()
+_cached_credentials: Optional[Credentials] = None
+_thread_local = threading.local()
+# Incrementada em reset_sheets_client_pool para invalidar os serviços de todas as threads
+_pool_generation = 0
+
+_stats_lock = threading.Lock()
+_stats: dict = {}
+
+
+def _empty_stats() -> dict:
+    return {
+        "credentials_built": 0,
+        "services_built": {"sheets": 0, "drive": 0},
+        "flushes": 0,
+        "flush_rows": 0,
+        "flush_errors": 0,
+        "flush_latency_ms_total": 0.0,
+        "flush_latency_ms_max": 0.0,
+        "last_flush_latency_ms": None,
+    }
+
+
+_stats = _empty_stats()
+
+
 def _get_credentials() -> Credentials:
-    creds_dict = get_google_sheets_credentials()
-    return Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+    """Credenciais da service account, parseadas uma única vez por processo."""
+    global _cached_credentials
+    if _cached_credentials is not None:
+        return _cached_credentials
+    with _credentials_lock:
+        if _cached_credentials is None:
+            creds_dict = get_google_sheets_credentials()
+            _cached_credentials = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+            with _stats_lock:
+                _stats["credentials_built"] += 1
+        return _cached_credentials
+
+
+def _get_service(api: str, version: str):
+    """
+    Serviço Google da thread atual (construído na primeira chamada da thread).
+    Discovery estático (embutido no pacote) e sem cache de discovery em disco.
+    """
+    services = getattr(_thread_local, "services", None)
+    if services is None or getattr(_thread_local, "generation", None) != _pool_generation:
+        services = {}
+        _thread_local.services = services
+        _thread_local.generation = _pool_generation
+    service = services.get(api)
+    if service is None:
+        service = build(
+            api, version,
+            credentials=_get_credentials(),
+            static_discovery=True,
+            cache_discovery=False,
+        )
+        services[api] = service
+        with _stats_lock:
+            _stats["services_built"][api] = _stats["services_built"].get(api, 0) + 1
+    return service
+
+
+def _get_sheets_service():
+    return _get_service("sheets", "v4")
+
+
+def _get_drive_service():
+    return _get_service("drive", "v3")
+
+
+def _record_flush(rows: int, latency_ms: float, error: bool = False) -> None:
+    with _stats_lock:
+        _stats["flushes"] += 1
+        _stats["flush_rows"] += rows
+        if error:
+            _stats["flush_errors"] += 1
+        _stats["flush_latency_ms_total"] += latency_ms
+        _stats["flush_latency_ms_max"] = max(_stats["flush_latency_ms_max"], latency_ms)
+        _stats["last_flush_latency_ms"] = latency_ms
+
+
+def get_sheets_client_stats() -> dict:
+    """Snapshot dos objetos construídos e da latência dos flushes para o Sheets."""
+    with _stats_lock:
+        snapshot = {**_stats, "services_built": dict(_stats["services_built"])}
+    flushes = snapshot["flushes"]
+    snapshot["flush_latency_ms_avg"] = (
+        round(snapshot["flush_latency_ms_total"] / flushes, 2) if flushes else None
+    )
+    return snapshot
+
+
+def reset_sheets_client_pool() -> None:
+    """Descarta credenciais/serviços em cache e zera as estatísticas (útil para testes)."""
+    global _cached_credentials, _pool_generation, _stats
+    with _credentials_lock:
+        _cached_credentials = None
+        _pool_generation += 1
+    with _stats_lock:
+        _stats = _empty_stats()
+
+
+def _find_job_spreadsheet(drive_service, job_id: str) -> Optional[dict]:
+    """Planilha já criada para o job (appProperties), ou None."""
+    response = execute_with_quota("drive", drive_service.files().list(
+        q=f"appProperties has {{ key='{JOB_APP_PROPERTY}' and value='{job_id}' }} and trashed = false",
+        corpora="drive",
+        driveId=SHARED_DRIVE_ID,
+        includeItemsFromAllDrives=True,
+        supportsAllDrives=True,
+        fields="files(id,webViewLink)",
+        pageSize=1,
+    ), job_id)
+    files = response.get("files") or []
+    return files[0] if files else None
 
 
 def _create_spreadsheet_sync(
@@ -69,7 +214,9 @@ def _create_spreadsheet_sync(
     """
     Cria planilha via Drive API dentro do Shared Drive e configura headers via Sheets API.
     Retorna spreadsheet_id, spreadsheet_url, spreadsheet_name, sheet_name.
-    Usa retry com backoff em falhas de rede transitórias (Connection reset, etc.).
+    Usa retry com backoff em falhas de rede transitórias (Connection reset, etc.) e 5xx;
+    como a criação pode ter sido aplicada mesmo com erro, cada retry procura antes a
+    planilha do job para não criar uma duplicada.
     """
     date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     short_id = job_id[:8] if len(job_id) > 8 else job_id
@@ -79,14 +226,14 @@ def _create_spreadsheet_sync(
     if not SHARED_DRIVE_ID:
         raise ValueError("GOOGLE_SHEETS_SHARED_DRIVE_ID não configurada")
 
-    creds = _get_credentials()
-    drive_service = build("drive", "v3", credentials=creds)
-    sheets_service = build("sheets", "v4", credentials=creds)
+    drive_service = _get_drive_service()
+    sheets_service = _get_sheets_service()
 
     file_metadata = {
         "name": spreadsheet_name,
         "mimeType": "application/vnd.google-apps.spreadsheet",
         "parents": [SHARED_DRIVE_ID],
+        "appProperties": {JOB_APP_PROPERTY: job_id},
     }
 
     max_attempts = 3
@@ -94,11 +241,13 @@ def _create_spreadsheet_sync(
 
     for attempt in range(max_attempts):
         try:
-            created_file = drive_service.files().create(
-                body=file_metadata,
-                fields="id,webViewLink",
-                supportsAllDrives=True,
-            ).execute()
+            created_file = _find_job_spreadsheet(drive_service, job_id) if attempt > 0 else None
+            if created_file is None:
+                created_file = execute_with_quota("drive", drive_service.files().create(
+                    body=file_metadata,
+                    fields="id,webViewLink",
+                    supportsAllDrives=True,
+                ), job_id, idempotent=False)
 
             spreadsheet_id = created_file["id"]
             spreadsheet_url = created_file.get(
@@ -106,20 +255,20 @@ def _create_spreadsheet_sync(
                 f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}",
             )
 
-            sheets_service.spreadsheets().batchUpdate(
+            execute_with_quota("sheets", sheets_service.spreadsheets().batchUpdate(
                 spreadsheetId=spreadsheet_id,
                 body={"requests": [{"updateSheetProperties": {
                     "properties": {"sheetId": 0, "title": sheet_name},
                     "fields": "title",
                 }}]},
-            ).execute()
+            ), job_id)
 
-            sheets_service.spreadsheets().values().update(
+            execute_with_quota("sheets", sheets_service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=f"{sheet_name}!A1:B1",
                 valueInputOption="RAW",
                 body={"values": [SHEET_HEADERS]},
-            ).execute()
+            ), job_id)
 
             logger.info("Planilha criada no Shared Drive: %s (%s)", spreadsheet_name, spreadsheet_id)
 
@@ -129,7 +278,9 @@ def _create_spreadsheet_sync(
                 "spreadsheet_name": spreadsheet_name,
                 "sheet_name": sheet_name,
             }
-        except transient_errors as e:
+        except (HttpError, *transient_errors) as e:
+            if isinstance(e, HttpError) and (http_status(e) or 0) < 500:
+                raise
             if attempt < max_attempts - 1:
                 wait = 2 ** (attempt + 1)
                 logger.warning(
@@ -166,52 +317,32 @@ async def create_spreadsheet_for_job(
         "created_at_epoch_ms": created_at_epoch_ms,
         "backfill_status": "pending",
     })
+    invalidate_sheets_config(job_id)
 
     return result
 
 
-def _write_row_sync(spreadsheet_id: str, sheet_name: str, row: list[str]) -> None:
-    service = build("sheets", "v4", credentials=_get_credentials())
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            service.spreadsheets().values().append(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A:B",
-                valueInputOption="RAW",
-                insertDataOption="INSERT_ROWS",
-                body={"values": [row]},
-            ).execute()
-            return
-        except Exception as e:
-            if attempt < max_retries - 1 and "429" in str(e):
-                wait = 2 ** (attempt + 1)
-                logger.warning("Rate limit Sheets, retry em %ds: %s", wait, e)
-                time.sleep(wait)
-            else:
-                raise
+def _write_row_sync(
+    spreadsheet_id: str, sheet_name: str, row: list[str], job_id: Optional[str] = None
+) -> None:
+    _batch_write_rows_sync(spreadsheet_id, sheet_name, [row], job_id)
 
 
-def _batch_write_rows_sync(spreadsheet_id: str, sheet_name: str, rows: list[list[str]]) -> None:
-    service = build("sheets", "v4", credentials=_get_credentials())
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            service.spreadsheets().values().append(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A:B",
-                valueInputOption="RAW",
-                insertDataOption="INSERT_ROWS",
-                body={"values": rows},
-            ).execute()
-            return
-        except Exception as e:
-            if attempt < max_retries - 1 and "429" in str(e):
-                wait = 2 ** (attempt + 1)
-                logger.warning("Rate limit Sheets (batch), retry em %ds: %s", wait, e)
-                time.sleep(wait)
-            else:
-                raise
+def _batch_write_rows_sync(
+    spreadsheet_id: str, sheet_name: str, rows: list[list[str]], job_id: Optional[str] = None
+) -> None:
+    """
+    values.append das linhas; quota, 429 e Retry-After ficam com execute_with_quota.
+    Append não é idempotente: um 5xx é propagado (as linhas podem ter sido gravadas).
+    """
+    service = _get_sheets_service()
+    execute_with_quota("sheets", service.spreadsheets().values().append(
+        spreadsheetId=spreadsheet_id,
+        range=f"{sheet_name}!A:B",
+        valueInputOption="RAW",
+        insertDataOption="INSERT_ROWS",
+        body={"values": rows},
+    ), job_id, idempotent=False)
 
 
 def write_ultra_batch_result_to_sheets_sync(
@@ -227,12 +358,8 @@ def write_ultra_batch_result_to_sheets_sync(
     Se created_at existe e processed_at/epoch é None, não escreve (evita duplicação).
     """
     try:
-        db = get_firestore_client()
-        config_doc = db.collection("google_sheets_config").document(job_id).get()
-        if not config_doc.exists:
-            return
-        config = config_doc.to_dict()
-        if not config.get("enabled"):
+        config = get_sheets_config(job_id)
+        if not config or not config.get("enabled"):
             return
         created_at_epoch_ms = config.get("created_at_epoch_ms")
         created_at = config.get("created_at")
@@ -250,7 +377,7 @@ def write_ultra_batch_result_to_sheets_sync(
         spreadsheet_id = config["spreadsheet_id"]
         sheet_name = config.get("sheet_name", "Resultados")
         message_limpa = _limpar_resposta_para_sheets(final_message)
-        _write_row_sync(spreadsheet_id, sheet_name, [account_number, message_limpa])
+        _write_row_sync(spreadsheet_id, sheet_name, [account_number, message_limpa], job_id)
         logger.debug("Linha escrita no Sheets job=%s account=%s", job_id, account_number)
     except Exception as e:
         logger.error(
@@ -258,6 +385,34 @@ def write_ultra_batch_result_to_sheets_sync(
         )
 
 
+def is_incremental_row(config: dict, processed_at_epoch_ms: Optional[int]) -> bool:
+    """
+    Indica se a linha pertence à escrita incremental (processed_at_epoch_ms >= created_at_epoch_ms).
+    Linhas anteriores à criação da planilha ficam com o backfill. Config antiga (sem
+    created_at_epoch_ms) aceita todas as linhas.
+    """
+    created_at_epoch_ms = config.get("created_at_epoch_ms")
+    if created_at_epoch_ms is None:
+        return True
+    return processed_at_epoch_ms is not None and processed_at_epoch_ms >= created_at_epoch_ms
+
+
+def append_rows_to_sheet_sync(config: dict, rows: list[list[str]], job_id: Optional[str] = None) -> None:
+    """
+    Faz um único values.append com as linhas já limpas na planilha do config,
+    registrando a latência nas estatísticas do pool. Propaga a exceção em caso de falha.
+    """
+    spreadsheet_id = config["spreadsheet_id"]
+    sheet_name = config.get("sheet_name", "Resultados")
+    started = time.perf_counter()
+    try:
+        _batch_write_rows_sync(spreadsheet_id, sheet_name, rows, job_id)
+    except Exception:
+        _record_flush(len(rows), (time.perf_counter() - started) * 1000, error=True)
+        raise
+    _record_flush(len(rows), (time.perf_counter() - started) * 1000)
+
+
 def batch_flush_rows_to_sheets_sync(
     job_id: str,
     rows: list[tuple[str, str, Optional[int]]],
@@ -270,25 +425,17 @@ def batch_flush_rows_to_sheets_sync(
     if not rows:
         return
     try:
-        db = get_firestore_client()
-        config_doc = db.collection("google_sheets_config").document(job_id).get()
-        if not config_doc.exists:
+        config = get_sheets_config(job_id)
+        if not config or not config.get("enabled"):
             return
-        config = config_doc.to_dict()
-        if not config.get("enabled"):
-            return
-        created_at_epoch_ms = config.get("created_at_epoch_ms")
-        to_write: list[list[str]] = []
-        for account_number, final_message, processed_at_epoch_ms in rows:
-            if created_at_epoch_ms is not None:
-                if processed_at_epoch_ms is None or processed_at_epoch_ms < created_at_epoch_ms:
-                    continue
-            to_write.append([account_number, _limpar_resposta_para_sheets(final_message)])
+        to_write = [
+            [account_number, _limpar_resposta_para_sheets(final_message)]
+            for account_number, final_message, processed_at_epoch_ms in rows
+            if is_incremental_row(config, processed_at_epoch_ms)
+        ]
         if not to_write:
             return
-        spreadsheet_id = config["spreadsheet_id"]
-        sheet_name = config.get("sheet_name", "Resultados")
-        _batch_write_rows_sync(spreadsheet_id, sheet_name, to_write)
+        append_rows_to_sheet_sync(config, to_write, job_id)
         logger.debug("Batch %d linhas escritas no Sheets job=%s", len(to_write), job_id)
     except Exception as e:
         logger.error(
@@ -296,65 +443,181 @@ def batch_flush_rows_to_sheets_sync(
         )
 
 
-def backfill_sheets_from_results_sync(job_id: str) -> int:
+def _is_backfill_row(data: dict, created_at_epoch_ms: Optional[int], created_at) -> bool:
+    """Resultado de sucesso processado antes da criação da planilha (o resto fica com o outbox)."""
+    if not data.get("success"):
+        return False
+    if created_at_epoch_ms is not None:
+        processed_at_epoch_ms = data.get("processedAt_epoch_ms")
+        return processed_at_epoch_ms is None or processed_at_epoch_ms < created_at_epoch_ms
+    processed_at = data.get("processedAt")
+    return created_at is None or processed_at is None or processed_at < created_at
+
+
+def backfill_sheets_from_results_sync(
+    job_id: str,
+    page_size: int = SHEETS_BACKFILL_PAGE_SIZE,
+    chunk_rows: int = SHEETS_BACKFILL_CHUNK_ROWS,
+) -> int:
     """
     Lê resultados do Firestore (apenas processedAt_epoch_ms < config.created_at_epoch_ms, ou fallback datetime)
-    e escreve na planilha. Atualiza doc com backfill_status e backfilled_rows.
+    e escreve na planilha.
+
+    Paginado e retomável: lê páginas de `page_size` documentos ordenadas por __name__
+    (start_after no último documento), acumula linhas até `chunk_rows` (fechando na
+    página corrente) e envia um values.append por chunk; após cada chunk grava backfill_cursor e backfilled_rows no config. Em falha o status
+    vira "failed" e uma nova execução continua do cursor. Um chunk pode ser reenviado se
+    a instância cair entre o append e a gravação do cursor.
+
+    Returns:
+        Linhas escritas nesta execução
     """
     db = get_firestore_client()
-    config_doc = db.collection("google_sheets_config").document(job_id).get()
+    config_ref = db.collection("google_sheets_config").document(job_id)
+    config_doc = config_ref.get()
     if not config_doc.exists:
         return 0
     config = config_doc.to_dict()
-    if not config.get("enabled"):
+    if not config.get("enabled") or config.get("backfill_status") == "completed":
         return 0
     created_at_epoch_ms = config.get("created_at_epoch_ms")
     created_at = config.get("created_at")
     spreadsheet_id = config["spreadsheet_id"]
     sheet_name = config.get("sheet_name", "Resultados")
     results_ref = db.collection("ultra_batch_jobs").document(job_id).collection("results")
+
+    cursor = config.get("backfill_cursor")
+    backfilled_rows = config.get("backfilled_rows", 0) if cursor else 0
+    written = 0
     rows: list[list[str]] = []
-    for doc in results_ref.order_by("__name__").stream():
-        data = doc.to_dict()
-        if not data.get("success"):
-            continue
-        if created_at_epoch_ms is not None:
-            processed_at_epoch_ms = data.get("processedAt_epoch_ms")
-            if processed_at_epoch_ms is not None and processed_at_epoch_ms >= created_at_epoch_ms:
-                continue
-        else:
-            processed_at = data.get("processedAt")
-            if created_at is not None and processed_at is not None and processed_at >= created_at:
-                continue
-        account = data.get("accountNumber", "")
-        message = data.get("final_message", "")
-        if account and message:
-            rows.append([account, _limpar_resposta_para_sheets(message)])
-    if not rows:
-        return 0
+    page_cursor = cursor
+
+    def flush_chunk(status: str) -> None:
+        nonlocal backfilled_rows, written, cursor, rows
+        if rows:
+            _batch_write_rows_sync(spreadsheet_id, sheet_name, rows, job_id)
+            backfilled_rows += len(rows)
+            written += len(rows)
+            rows = []
+        cursor = page_cursor
+        config_ref.update({
+            "backfill_status": status,
+            "backfill_cursor": cursor,
+            "backfilled_rows": backfilled_rows,
+            "backfill_updated_at_epoch_ms": int(time.time() * 1000),
+        })
+        invalidate_sheets_config(job_id)
+
     try:
-        _batch_write_rows_sync(spreadsheet_id, sheet_name, rows)
-        db.collection("google_sheets_config").document(job_id).update({
-            "backfill_status": "completed",
-            "backfilled_rows": len(rows),
+        config_ref.update({
+            "backfill_status": "running",
+            "backfill_updated_at_epoch_ms": int(time.time() * 1000),
         })
-        logger.info("Backfill concluído: %d linhas para job %s", len(rows), job_id)
-        return len(rows)
+        invalidate_sheets_config(job_id)
+        while True:
+            query = results_ref.order_by("__name__").limit(page_size)
+            if page_cursor:
+                query = query.start_after({"__name__": page_cursor})
+            page = list(query.stream())
+            for doc in page:
+                data = doc.to_dict()
+                if not _is_backfill_row(data, created_at_epoch_ms, created_at):
+                    continue
+                account = data.get("accountNumber", "")
+                message = data.get("final_message", "")
+                if account and message:
+                    rows.append([account, _limpar_resposta_para_sheets(message)])
+            if page:
+                page_cursor = page[-1].id
+            if len(page) < page_size:
+                break
+            if len(rows) >= chunk_rows:
+                flush_chunk("running")
+        flush_chunk("completed")
+        logger.info("Backfill concluído: %d linhas para job %s (%d no total)", written, job_id, backfilled_rows)
+        return written
     except Exception as e:
-        logger.exception("Backfill falhou para job %s: %s", job_id, e)
+        logger.exception("Backfill falhou para job %s (cursor=%s): %s", job_id, cursor, e)
         try:
-            db.collection("google_sheets_config").document(job_id).update({
+            # Mantém cursor/backfilled_rows do último chunk gravado para retomar
+            config_ref.update({
                 "backfill_status": "failed",
+                "backfill_updated_at_epoch_ms": int(time.time() * 1000),
             })
         except Exception:
             pass
-        return 0
+        invalidate_sheets_config(job_id)
+        return written
 
 
-def get_sheets_config(job_id: str) -> Optional[dict]:
-    """Retorna configuração de Sheets para um job, ou None."""
+def is_backfill_stale(config: dict, now_epoch_ms: Optional[int] = None) -> bool:
+    """Backfill "running" sem progresso há mais de SHEETS_BACKFILL_STALE_SECONDS (instância caiu)."""
+    if config.get("backfill_status") != "running":
+        return False
+    updated_at = config.get("backfill_updated_at_epoch_ms")
+    if updated_at is None:
+        return True
+    now_epoch_ms = now_epoch_ms if now_epoch_ms is not None else int(time.time() * 1000)
+    return now_epoch_ms - updated_at > SHEETS_BACKFILL_STALE_SECONDS * 1000
+
+
+# ==================== CACHE DE CONFIG ====================
+
+_config_cache_lock = threading.Lock()
+# job_id -> (expira_em monotonic, config ou None)
+_config_cache: "OrderedDict[str, tuple[float, Optional[dict]]]" = OrderedDict()
+_config_cache_stats = {"hits": 0, "negative_hits": 0, "misses": 0, "invalidations": 0}
+
+
+def invalidate_sheets_config(job_id: str) -> None:
+    """Descarta o config em cache do job (chamar sempre que o documento for alterado)."""
+    with _config_cache_lock:
+        _config_cache.pop(job_id, None)
+        _config_cache_stats["invalidations"] += 1
+
+
+def get_sheets_config(job_id: str, use_cache: bool = True) -> Optional[dict]:
+    """
+    Retorna configuração de Sheets para um job, ou None.
+    Cache em processo com TTL curto (também para "não existe"); use_cache=False força a
+    leitura no Firestore e atualiza o cache. O dict retornado é uma cópia.
+    """
+    if use_cache:
+        now = time.monotonic()
+        with _config_cache_lock:
+            entry = _config_cache.get(job_id)
+            if entry is not None and entry[0] > now:
+                _config_cache.move_to_end(job_id)
+                config = entry[1]
+                _config_cache_stats["hits" if config is not None else "negative_hits"] += 1
+                return dict(config) if config is not None else None
+            _config_cache_stats["misses"] += 1
+
     db = get_firestore_client()
     doc = db.collection("google_sheets_config").document(job_id).get()
-    if not doc.exists:
-        return None
-    return doc.to_dict()
+    config = doc.to_dict() if doc.exists else None
+
+    ttl = SHEETS_CONFIG_CACHE_TTL_SECONDS if config is not None else SHEETS_CONFIG_CACHE_NEGATIVE_TTL_SECONDS
+    with _config_cache_lock:
+        _config_cache[job_id] = (time.monotonic() + ttl, config)
+        _config_cache.move_to_end(job_id)
+        while len(_config_cache) > SHEETS_CONFIG_CACHE_MAX_ENTRIES:
+            _config_cache.popitem(last=False)
+    return dict(config) if config is not None else None
+
+
+def get_sheets_config_cache_stats() -> dict:
+    """Hits/misses do cache de config (hit_rate considera hits positivos e negativos)."""
+    with _config_cache_lock:
+        stats = {**_config_cache_stats, "entries": len(_config_cache)}
+    lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["hits"] + stats["negative_hits"]) / lookups, 3) if lookups else None
+    return stats
+
+
+def clear_sheets_config_cache() -> None:
+    """Esvazia o cache e zera as estatísticas (útil para testes)."""
+    with _config_cache_lock:
+        _config_cache.clear()
+        for key in _config_cache_stats:
+            _config_cache_stats[key] = 0
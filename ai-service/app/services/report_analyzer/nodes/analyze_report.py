@@ -5,9 +5,15 @@ Gera insights com drill-down nos ativos drivers de cada classe.
 import json
 import time
 import asyncio
-from typing import Dict, Any, Optional
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 from app.models.schema import ReportAnalysisState
+from app.monitoring import tracing
+from app.monitoring.pipeline_log import get_pipeline_logger, summary_incr, summary_set, timed_stage
 from app.services.report_analyzer.nodes.format_message import _filter_data_by_selection, _filter_data_for_analysis
+from app.services.report_analyzer import class_analysis_cache
+from app.services.report_analyzer.prompt_compaction import ANALYSIS_FIELDS, compact_json
 from app.services.report_analyzer.prompts import (
     XP_REPORT_ANALYSIS_PROMPT,
     XP_REPORT_ANALYSIS_PROMPT_PERSONALIZED
@@ -24,14 +30,18 @@ from app.config import (
     get_llm, 
     get_gemini_client,
     LLM_MAX_RETRIES,
-    LLM_RETRY_DELAY
+    LLM_RETRY_DELAY,
+    ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD,
+    ANALYSIS_MAP_REDUCE_MAX_WORKERS
 )
 import os
 from google.api_core.exceptions import ResourceExhausted
 
+log = get_pipeline_logger("analyze_report")
+
 def call_response_gemini(prompt: str, json_schema: dict = None) -> str:
     try:
-        print(f"[analyze_report]🔍 DEBUG - Chamando Gemini com prompt de {len(prompt)} caracteres")
+        log.debug("Chamando Gemini", prompt_chars=len(prompt), structured=bool(json_schema))
         client =  get_gemini_client()
 
         # ✅ STRUCTURED OUTPUT conforme documentação
@@ -42,15 +52,17 @@ def call_response_gemini(prompt: str, json_schema: dict = None) -> str:
         if json_schema:
             config["response_mime_type"] = "application/json"
             config["response_json_schema"] = json_schema
-            print(f"[analyze_report]🔍 Usando structured output")
         
-        response = client.models.generate_content(
-            model = MODEL_NAME,
-            contents = [{
-                "parts": [{"text": prompt}]
-            }],
-            config = config
-        )
+        with tracing.span("gemini.generate_content", model=MODEL_NAME, purpose="analysis",
+                          prompt_chars=len(prompt)) as gemini_span:
+            response = client.models.generate_content(
+                model = MODEL_NAME,
+                contents = [{
+                    "parts": [{"text": prompt}]
+                }],
+                config = config
+            )
+            tracing.set_gemini_usage(gemini_span, response)
         # print(f"[analyze_report]🔍 DEBUG - Resposta recebida: {type(response)}")
         # print(f"[analyze_report]🔍 DEBUG - Response.text: {repr(response.text)}") 
         result = response.text.strip()
@@ -61,9 +73,7 @@ def call_response_gemini(prompt: str, json_schema: dict = None) -> str:
         # Relançar ResourceExhausted para ser tratado no nível superior com backoff
         raise e
     except Exception as e:
-        print(f"❌ Erro na chamada do Gemini: {e}")
-        import traceback
-        print(f"❌ Traceback: {traceback.format_exc()}")
+        log.warning("Erro na chamada do Gemini", error=str(e), exc_info=True)
         raise e  # Relançar para retry genérico se necessário
 
 def validate_extracted_data(extracted_data: Dict[str, Any]) -> tuple[bool, Optional[str]]:
@@ -117,14 +127,14 @@ def parse_json_response(response_text: str) -> Optional[Dict[str, Any]]:
     
     # Se o texto estiver vazio, retornar erro
     if not text:
-        print("[analyze_report]❌ DEBUG - Texto vazio após limpeza!")
+        log.warning("Texto vazio após limpeza")
         return None
     
     try:
         data = json.loads(text)
         return data
     except json.JSONDecodeError as e:
-        print(f"[analyze_report]❌ JSON parse error: {e}")
+        log.warning("JSON parse error", error=str(e))
         return None
 
 
@@ -137,8 +147,22 @@ def call_llm_with_retry(
     """
     Chama o LLM com retry logic e Exponential Backoff para erro 429.
     """
-    
+    with tracing.span("llm.call_with_retry", max_retries=max_retries) as retry_span:
+        result = _call_llm_attempts(prompt, max_retries, simplify_on_last, json_schema, retry_span)
+        if result is None:
+            retry_span.set_error(f"Sem resposta válida após {max_retries} tentativas")
+        return result
+
+
+def _call_llm_attempts(
+    prompt: str,
+    max_retries: int,
+    simplify_on_last: bool,
+    json_schema: Optional[dict],
+    retry_span
+) -> Optional[Dict[str, Any]]:
     for attempt in range(max_retries):
+        retry_span.set(attempts=attempt + 1)
         try:
             # Ajustar prompt baseado na tentativa
             if attempt == 0:
@@ -153,7 +177,8 @@ def call_llm_with_retry(
             else:
                 current_prompt = prompt
             
-            print(f"🔄 Tentativa {attempt + 1}/{max_retries} de análise...")
+            summary_incr("llm_attempts")
+            log.debug("Tentativa de análise", attempt=attempt + 1, max_retries=max_retries)
             
             # Chamada ao Gemini
             response_text = call_response_gemini(current_prompt, json_schema=json_schema)
@@ -162,23 +187,24 @@ def call_llm_with_retry(
             parsed = parse_json_response(response_text)
             
             if parsed:
-                print(f"✅ Análise bem-sucedida na tentativa {attempt + 1}")
                 return parsed
             
             # Falha de parsing (JSON inválido)
-            print(f"⚠️ Falha no parsing na tentativa {attempt + 1}")
+            log.warning("Falha no parsing", attempt=attempt + 1)
             if attempt < max_retries - 1:
                 time.sleep(1)
             
         except ResourceExhausted:
             # Tratamento específico para Rate Limit (429)
             delay = LLM_RETRY_DELAY * (2 ** attempt)  # 2, 4, 8, 16...
-            print(f"⚠️ Quota Excedida (429). Aguardando {delay}s antes da tentativa {attempt + 2}...")
+            summary_incr("llm_quota_retries")
+            retry_span.incr("quota_retries")
+            log.warning("Quota Excedida (429)", attempt=attempt + 1, delay_seconds=delay)
             time.sleep(delay)
             continue
             
         except Exception as e:
-            print(f"❌ Erro genérico na tentativa {attempt + 1}: {e}")
+            log.warning("Erro genérico na tentativa", attempt=attempt + 1, error=str(e))
             if attempt < max_retries - 1:
                 time.sleep(1)
             continue
@@ -203,8 +229,184 @@ def validate_analysis_structure(analysis: Dict[str, Any]) -> tuple[bool, Optiona
     
     return True, None
 
+def _run_analysis(
+    extracted_data: Dict[str, Any],
+    analysis_mode: str
+) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Monta prompt/schema do modo, chama o LLM e valida a estrutura.
+
+    Returns:
+        (analysis, error_response) — error_response é o dict de erro do nó, se houver
+    """
+    extracted_data_json, _ = compact_json(
+        f"analysis_{analysis_mode}", extracted_data, fields=ANALYSIS_FIELDS, original_indent=2
+    )
+    
+    if analysis_mode == "personalized":
+        # ✅ PROMPT PERSONALIZADO: Incluir todos os ativos
+        prompt = XP_REPORT_ANALYSIS_PROMPT_PERSONALIZED.replace(
+            '{{extracted_data}}',
+            extracted_data_json
+        )
+        json_schema = ANALYSIS_SCHEMA_PERSONALIZED
+    else:
+        # ✅ PROMPT PADRÃO: Apenas highlights/detractors
+        prompt = XP_REPORT_ANALYSIS_PROMPT.replace(
+            '{{extracted_data}}',
+            extracted_data_json
+        )
+        json_schema = ANALYSIS_SCHEMA
+    
+    log.debug("Chamando LLM", analysis_mode=analysis_mode, prompt_chars=len(prompt))
+    
+    analysis = call_llm_with_retry(
+        prompt=prompt,
+        max_retries=LLM_MAX_RETRIES,
+        simplify_on_last=True,
+        json_schema=json_schema
+    )
+    
+    if not analysis:
+        log.error("LLM retornou análise vazia após 3 tentativas")
+        return None, {
+            'error': 'Falha ao gerar análise após 3 tentativas',
+            'file_name': '',
+            'highlights': [],
+            'detractors': []
+        }
+    
+    is_valid, error_msg = validate_analysis_structure(analysis)
+    if not is_valid:
+        log.error("Estrutura de análise inválida", error=error_msg)
+        return None, {
+            'error': f'Estrutura de análise inválida: {error_msg}',
+            'highlights': [],
+            'detractors': []
+        }
+    
+    return analysis, None
+
+
+def count_assets(extracted_data: Dict[str, Any]) -> int:
+    """Total de ativos em allAssets (0 quando ausente)."""
+    all_assets = extracted_data.get('allAssets') or {}
+    return sum(len(assets) for assets in all_assets.values() if isinstance(assets, list))
+
+
+def _should_map_reduce(extracted_data: Dict[str, Any], class_names: List[str]) -> bool:
+    """Map-reduce só compensa com mais de uma classe e carteira acima do limite de ativos."""
+    return len(class_names) > 1 and count_assets(extracted_data) > ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD
+
+
+def _analyze_classes(
+    filtered_data: Dict[str, Any],
+    class_names: List[str]
+) -> tuple[Dict[str, dict], List[dict], List[dict], set, Optional[Dict[str, Any]]]:
+    """
+    Analisa as classes informadas e devolve um pedaço ({highlight, detractor}) por classe.
+
+    Carteiras grandes (acima de ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD ativos) usam
+    map-reduce: uma chamada concorrente por classe, cada uma só com os ativos da
+    classe e os benchmarks. Abaixo do limite, uma única chamada com todas as classes.
+
+    Returns:
+        (pieces, highlights órfãos, detractors órfãos, classes cacheáveis, error_response)
+    """
+    subset = class_analysis_cache.subset_for_classes(filtered_data, class_names)
+    
+    if not _should_map_reduce(subset, class_names):
+        analysis, error_response = _run_analysis(subset, "personalized")
+        if error_response:
+            return {}, [], [], set(), error_response
+        
+        pieces, orphan_highlights, orphan_detractors = class_analysis_cache.split_analysis_by_class(analysis, class_names)
+        # Com o limite de detratores atingido, classes sem classificação são ambíguas: não cachear
+        detractor_cap_hit = len(analysis.get('detractors', [])) >= class_analysis_cache.MAX_DETRACTORS
+        cacheable = {
+            name for name, piece in pieces.items()
+            if not detractor_cap_hit or piece['highlight'] or piece['detractor']
+        }
+        return pieces, orphan_highlights, orphan_detractors, cacheable, None
+    
+    summary_set(map_reduce_classes=len(class_names))
+    log.debug("Map-reduce", classes=len(class_names), assets=count_assets(subset),
+              threshold=ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD, max_workers=ANALYSIS_MAP_REDUCE_MAX_WORKERS)
+    
+    # Cada thread roda numa cópia do contexto: logs e resumo continuam correlacionados ao arquivo
+    context = contextvars.copy_context()
+
+    def analyze_one(class_name: str):
+        return context.copy().run(
+            _run_analysis, class_analysis_cache.subset_for_classes(subset, [class_name]), "personalized"
+        )
+    
+    with ThreadPoolExecutor(max_workers=max(1, ANALYSIS_MAP_REDUCE_MAX_WORKERS)) as executor:
+        results = list(executor.map(analyze_one, class_names))
+    
+    pieces: Dict[str, dict] = {}
+    orphan_highlights: List[dict] = []
+    orphan_detractors: List[dict] = []
+    for class_name, (analysis, error_response) in zip(class_names, results):
+        if error_response:
+            log.error("Map-reduce falhou na classe", class_name=class_name)
+            return {}, [], [], set(), error_response
+        class_pieces, class_orphan_h, class_orphan_d = class_analysis_cache.split_analysis_by_class(analysis, [class_name])
+        pieces.update(class_pieces)
+        orphan_highlights.extend(class_orphan_h)
+        orphan_detractors.extend(class_orphan_d)
+    
+    # Cada chamada vê uma única classe: o limite de detratores não esconde nenhuma
+    return pieces, orphan_highlights, orphan_detractors, set(class_names), None
+
+
+def _analyze_personalized_incremental(
+    full_data: Dict[str, Any],
+    filtered_data: Dict[str, Any]
+) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, int]]:
+    """
+    Análise personalizada incremental: classes já analisadas na mesma sessão de
+    extração vêm do cache; apenas as demais vão ao LLM (ver _analyze_classes).
+    O resultado é remontado a partir dos pedaços por classe.
+    """
+    session = class_analysis_cache.session_key(full_data)
+    class_names = [c.get('className') for c in filtered_data.get('classPerformance', []) if c.get('className')]
+    
+    pieces: Dict[str, dict] = {}
+    missing = []
+    for name in class_names:
+        piece = class_analysis_cache.get_piece(class_analysis_cache.class_key(session, filtered_data, name))
+        if piece is None:
+            missing.append(name)
+        else:
+            pieces[name] = piece
+    
+    stats = {'hits': len(pieces), 'misses': len(missing)}
+    summary_set(class_cache_hits=stats['hits'], class_cache_misses=stats['misses'])
+    
+    orphan_highlights, orphan_detractors = [], []
+    if missing:
+        new_pieces, orphan_highlights, orphan_detractors, cacheable, error_response = _analyze_classes(
+            filtered_data, missing
+        )
+        if error_response:
+            return None, error_response, stats
+        
+        for name, piece in new_pieces.items():
+            pieces[name] = piece
+            if name in cacheable:
+                class_analysis_cache.put_piece(class_analysis_cache.class_key(session, filtered_data, name), piece)
+    
+    analysis = class_analysis_cache.assemble_analysis(
+        [pieces[name] for name in class_names],
+        extra_highlights=orphan_highlights,
+        extra_detractors=orphan_detractors,
+    )
+    return analysis, None, stats
+
+
+@timed_stage("analyze_report")
 def analyze_report(state: ReportAnalysisState) -> Dict[str, Any]:
-    print("[analyze_report] Iniciando análise de relatório")
     """
     Analisa dados extraídos e gera insights profundos com drill-down.
     
@@ -220,15 +422,14 @@ def analyze_report(state: ReportAnalysisState) -> Dict[str, Any]:
         - error: Mensagem de erro (se houver)
     """
     start_time = time.time()
+    log.debug("Iniciando análise de relatório")
     
     try:
         # 1. Validar extracted_data
-        print(f"[analyze_report] Validando dados de entrada...")
         extracted_data = state.get('extracted_data')
-        print(f"[analyze_report] extracted_data disponível: {bool(extracted_data)}")
         
         if not extracted_data:
-            print("[analyze_report] ❌ extracted_data não encontrado no state")
+            log.error("extracted_data não encontrado no state")
             return {
                 'error': 'extracted_data não encontrado no state',
                 'file_name': '',
@@ -239,7 +440,7 @@ def analyze_report(state: ReportAnalysisState) -> Dict[str, Any]:
         is_valid, error_msg = validate_extracted_data(extracted_data)
         if not is_valid:
             account_number = extracted_data.get('accountNumber', 'N/A')
-            print(f"[analyze_report] ❌ Dados extraídos inválidos (accountNumber: {account_number}): {error_msg}")
+            log.error("Dados extraídos inválidos", account_number=account_number, error=error_msg)
             return {
                 'error': f'Dados extraídos inválidos: {error_msg}',
                 'file_name': '',
@@ -249,87 +450,41 @@ def analyze_report(state: ReportAnalysisState) -> Dict[str, Any]:
         
         # 2. ✅ NOVA LÓGICA: Verificar analysis_mode
         analysis_mode = state.get('analysis_mode', 'auto')
-        print(f"[analyze_report] Modo de análise: {analysis_mode}")
+        log.debug("Modo de análise", analysis_mode=analysis_mode)
 
         # 3. ✅ NOVO: Filtrar dados se modo personalizado
         if analysis_mode == "personalized":
             selected_fields = state.get('selected_fields', {})
             if selected_fields:
-                print(f"[analyze_report] Filtrando dados baseado em selected_fields...")
                 extracted_data = _filter_data_for_analysis(extracted_data, selected_fields)
-                print(f"[analyze_report] Dados filtrados: {len(extracted_data.get('classPerformance', []))} classes selecionadas")
+                log.debug("Dados filtrados por selected_fields", classes=len(extracted_data.get('classPerformance', [])))
 
                 # Validar que após filtragem ainda há dados suficientes
                 if not extracted_data.get('classPerformance') or len(extracted_data.get('classPerformance', [])) == 0:
-                    print(f"[analyze_report] ⚠️ Nenhuma classe selecionada após filtragem")
+                    log.warning("Nenhuma classe selecionada após filtragem")
                     return {
                         'error': 'Nenhuma classe de ativo foi selecionada para análise',
                         'highlights': [],
                         'detractors': []
                     }
             else:
-                print(f"[analyze_report] ⚠️ Modo personalized mas selected_fields vazio - usando todos os dados")
-        
-        # 3. Preparar prompt baseado no modo de análise
-        extracted_data_json = json.dumps(extracted_data, indent=2, ensure_ascii=False)
+                log.warning("Modo personalized mas selected_fields vazio - usando todos os dados")
         
+        # 4. Chamar LLM (modo personalizado reaproveita classes já analisadas na sessão)
+        class_cache_stats = None
         if analysis_mode == "personalized":
-            # ✅ PROMPT PERSONALIZADO: Incluir todos os ativos
-            prompt = XP_REPORT_ANALYSIS_PROMPT_PERSONALIZED.replace(
-                '{{extracted_data}}',
-                extracted_data_json
+            analysis, error_response, class_cache_stats = _analyze_personalized_incremental(
+                state.get('extracted_data'), extracted_data
             )
-            print(f"[analyze_report] Usando prompt PERSONALIZADO para análise completa")
         else:
-            # ✅ PROMPT PADRÃO: Apenas highlights/detractors
-            prompt = XP_REPORT_ANALYSIS_PROMPT.replace(
-                '{{extracted_data}}',
-                extracted_data_json
-            )
-            print(f"[analyze_report] Usando prompt PADRÃO para análise automática")
+            analysis, error_response = _run_analysis(extracted_data, analysis_mode)
 
-            # Selecionar schema baseado no modo de análise
-        if analysis_mode == "personalized":
-            json_schema = ANALYSIS_SCHEMA_PERSONALIZED
-            print(f"[analyze_report] Usando schema PERSONALIZED")
-        else:
-            json_schema = ANALYSIS_SCHEMA
-            print(f"[analyze_report] Usando schema AUTOMÁTICO")
-        
-        print(f"[analyze_report] Chamando LLM com prompt de {len(prompt)} caracteres")
-        
-        # 4. Chamar LLM com retry
-        analysis = call_llm_with_retry(
-            prompt=prompt,
-            max_retries=LLM_MAX_RETRIES,
-            simplify_on_last=True,
-            json_schema=json_schema
-        )
-        
-        if not analysis:
-            print("[analyze_report] ❌ LLM retornou análise vazia após 3 tentativas")
-            return {
-                'error': 'Falha ao gerar análise após 3 tentativas',
-                'file_name': '',
-                'highlights': [],
-                'detractors': []
-            }
-        
-        print(f"[analyze_report] ✅ LLM retornou análise com {len(analysis)} campos")
-        
-        # 5. Validar estrutura da resposta
-        is_valid, error_msg = validate_analysis_structure(analysis)
-        if not is_valid:
-            print(f"[analyze_report] ❌ Estrutura de análise inválida: {error_msg}")
-            return {
-                'error': f'Estrutura de análise inválida: {error_msg}',
-                'highlights': [],
-                'detractors': []
-            }
+        if error_response:
+            return error_response
         
-        # 6. ✅ RETORNO CONDICIONAL baseado no modo de análise
+        # 5. ✅ RETORNO CONDICIONAL baseado no modo de análise
         processing_time = time.time() - start_time
-        print(f"[analyze_report] ✅ Análise concluída em {processing_time:.2f}s")
+        log.debug("Análise concluída", seconds=round(processing_time, 2))
         
         if analysis_mode == "personalized":
             # ✅ Para análise personalizada, retornar TODOS os ativos
@@ -340,7 +495,8 @@ def analyze_report(state: ReportAnalysisState) -> Dict[str, Any]:
                 'metadata': {
                     'analysis_time': processing_time,
                     'model_used': MODEL_NAME,
-                    'analysis_mode': 'personalized'
+                    'analysis_mode': 'personalized',
+                    'class_cache': class_cache_stats
                 },
                 'error': None
             }
@@ -358,9 +514,7 @@ def analyze_report(state: ReportAnalysisState) -> Dict[str, Any]:
             }
                     
     except Exception as e:
-        print(f"[analyze_report] ❌ Erro inesperado: {e}")
-        import traceback
-        print(f"[analyze_report] ❌ Traceback: {traceback.format_exc()}")
+        log.error("Erro inesperado", error=str(e), exc_info=True)
         return {
             'error': f'Erro interno: {str(e)}',
             'highlights': [],
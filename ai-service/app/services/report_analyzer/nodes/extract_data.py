@@ -6,23 +6,28 @@ Versão otimizada com prompts separados por modo de análise.
 import json
 import base64
 import re 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from app.models.schema import ReportAnalysisState
+from app.monitoring import tracing
+from app.monitoring.pipeline_log import get_pipeline_logger, summary_set, timed_stage
 from app.config import GOOGLE_API_KEY, LANGCHAIN_PROJECT_REPORT, MODEL_NAME, MODEL_TEMPERATURE, get_gemini_client, generate_content_with_timeout
 from app.services.report_analyzer.prompts import (
     XP_REPORT_EXTRACTION_PROMPT_OPTIMIZED,
     XP_REPORT_EXTRACTION_PROMPT_FULL
 )
+from app.services.report_analyzer.prompt_compaction import compact_raw_text
+from app.services.report_analyzer.schema_builder import build_extraction_prompt, build_extraction_schema
 from app.services.report_analyzer.schemas import (
     EXTRACTED_DATA_SCHEMA_OPTIMIZED,
     EXTRACTED_DATA_SCHEMA_FULL
 )
 import os
 
+log = get_pipeline_logger("extract_data")
 
-def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
 
-    print("[extract_data] 🔍 DEBUG - Iniciando extração de dados")
+@timed_stage("extract_data")
+def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
     """
     Extrai dados estruturados usando LLM multimodal.
     Usa prompt otimizado ou completo baseado no modo de análise.
@@ -36,41 +41,55 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
         - extracted_data: Dict (dados extraídos pelo LLM)
         - metadata: Dict (metadados da extração)
     """
+    log.debug("Iniciando extração de dados")
 
     try:
         # ========== ETAPA 1: VALIDAÇÃO DE ENTRADAS ==========
         # Verifica se os dados necessários estão presentes no estado
-        print(f"[extract_data] Verificando dados de entrada...")
-        print(f"[extract_data] raw_text disponível: {bool(state.get('raw_text'))}")
-        print(f"[extract_data] pdf_images disponível: {bool(state.get('pdf_images'))}")
-        print(f"[extract_data] analysis_mode: {state.get('analysis_mode', 'auto')}")
+        log.debug(
+            "Verificando dados de entrada",
+            has_raw_text=bool(state.get('raw_text')),
+            has_pdf_images=bool(state.get('pdf_images')),
+            analysis_mode=state.get('analysis_mode', 'auto'),
+        )
         
         if not state.get("raw_text"):
             error_msg = "Texto bruto não disponível para extração"
-            print(f"[extract_data] ❌ {error_msg}")
+            log.error(error_msg)
             return {"error": error_msg}
 
         if not state.get("pdf_images"):
             error_msg = "Imagens do PDF não disponíveis para extração"
-            print(f"[extract_data] ❌ {error_msg}")
+            log.error(error_msg)
             return {"error": error_msg}
 
         # ========== ETAPA 2: DETERMINAR MODO DE ANÁLISE ==========
         # O modo determina qual prompt usar e quais campos extrair
         analysis_mode = state.get("analysis_mode", "auto")
-        print(f"[extract_data] Modo de análise: {analysis_mode}")
+        summary_set(analysis_mode=analysis_mode)
+
+        # Personalizado com seleção conhecida: prompt/schema podados para os campos e classes pedidos
+        selected_fields = state.get("selected_fields")
+        use_dynamic_schema = analysis_mode == "personalized" and bool(selected_fields)
 
         # ========== ETAPA 3: CONSTRUIR PROMPT ==========
         # Prompt otimizado: menos campos (sem allAssets) - mais rápido
         # Prompt completo: todos os campos (com allAssets) - mais detalhado
-        if analysis_mode == "personalized" or analysis_mode == "extract_only":
-            print(f"[extract_data] Usando prompt completo (com allAssets)")
+        if use_dynamic_schema:
+            log.debug("Usando prompt dinâmico (campos/classes selecionados)")
+            prompt = _build_dynamic_extraction_prompt(
+                state["raw_text"],
+                state["pdf_images"],
+                selected_fields
+            )
+        elif analysis_mode == "personalized" or analysis_mode == "extract_only":
+            log.debug("Usando prompt completo (com allAssets)")
             prompt = _build_full_extraction_prompt(
                 state["raw_text"], 
                 state["pdf_images"]
             )
         else:
-            print(f"[extract_data] Usando prompt otimizado (sem allAssets)")
+            log.debug("Usando prompt otimizado (sem allAssets)")
             prompt = _build_optimized_extraction_prompt(
                 state["raw_text"], 
                 state["pdf_images"]
@@ -95,10 +114,8 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
                     "data": image_b64
                 })
                 
-                print(f"[extract_data] ✅ Imagem da página {img_data['page']} adicionada")
-                
             except Exception as e:
-                print(f"[extract_data] ⚠️ Erro ao processar imagem da página {img_data.get('page', '?')}: {e}")
+                log.warning("Erro ao processar imagem da página", page=img_data.get('page', '?'), error=str(e))
                 continue
 
         #os.environ["LANGCHAIN_PROJECT"] = LANGCHAIN_PROJECT_REPORT
@@ -106,7 +123,7 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
         # 5. Chamar LLM multimodal via LangChain
         #llm = get_llm()
 
-        print(f"[extract_data] Chamando LLM multimodal com {len(content_parts)-1} imagens...")
+        log.debug("Chamando LLM multimodal", images=len(content_parts) - 1, prompt_chars=len(prompt))
 
         # ========== ETAPA 5: PREPARAR FORMATO PARA GEMINI SDK ==========
         # Converter formato intermediário para formato do Gemini SDK
@@ -137,23 +154,23 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
          # ========== ETAPA 6: CHAMAR GEMINI SDK ==========
         try:
             client = get_gemini_client()
-            print(f"[extract_data] 🔍 DEBUG - Cliente Gemini criado com sucesso")
         except Exception as e:
-            print(f"[extract_data] ❌ Erro ao criar cliente Gemini: {e}")
+            log.error("Erro ao criar cliente Gemini", error=str(e))
             return {"error": f"Erro ao criar cliente Gemini: {str(e)}"}
 
         # Selecionar schema baseado no modo de análise
-        if analysis_mode == "personalized" or analysis_mode == "extract_only":
+        if use_dynamic_schema:
+            json_schema = build_extraction_schema(selected_fields)
+            log.debug("Usando schema DINÂMICO", fields=len(json_schema['properties']))
+        elif analysis_mode == "personalized" or analysis_mode == "extract_only":
             json_schema = EXTRACTED_DATA_SCHEMA_FULL
-            print(f"[extract_data] Usando schema FULL (personalizado)")
+            log.debug("Usando schema FULL (personalizado)")
         else:
             json_schema = EXTRACTED_DATA_SCHEMA_OPTIMIZED
-            print(f"[extract_data] Usando schema OPTIMIZED (automático)")
+            log.debug("Usando schema OPTIMIZED (automático)")
 
         # Se há imagens, usar formato multimodal
         if images:
-            print(f"[extract_data] Processando {len(images)} imagens + texto")
-            
             # Formato correto para multimodal - uma única mensagem com texto e imagens
             parts = []
             
@@ -175,36 +192,42 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
                 "parts": parts
             }]
             
-            response = client.models.generate_content(
-                model=MODEL_NAME,
-                contents=contents,
-                config={
-                "temperature": 0.1,
-                "max_output_tokens": 10000,
-                "response_mime_type": "application/json",
-                "response_json_schema": json_schema
-            }
-            )
+            with tracing.span("gemini.generate_content", model=MODEL_NAME, purpose="extraction",
+                              images=len(images), prompt_chars=len(text_content)) as gemini_span:
+                response = client.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=contents,
+                    config={
+                    "temperature": 0.1,
+                    "max_output_tokens": 10000,
+                    "response_mime_type": "application/json",
+                    "response_json_schema": json_schema
+                }
+                )
+                tracing.set_gemini_usage(gemini_span, response)
         else:
-            print("[extract_data] Processando apenas texto")
-            response = client.models.generate_content(
-                model=MODEL_NAME,
-                contents=contents,
-                config={
-                "temperature": 0.1,
-                "max_output_tokens": 10000,
-                "response_mime_type": "application/json",
-                "response_json_schema": json_schema
-            }
-            )
+            log.debug("Processando apenas texto")
+            with tracing.span("gemini.generate_content", model=MODEL_NAME, purpose="extraction",
+                              images=len(images), prompt_chars=len(text_content)) as gemini_span:
+                response = client.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=contents,
+                    config={
+                    "temperature": 0.1,
+                    "max_output_tokens": 10000,
+                    "response_mime_type": "application/json",
+                    "response_json_schema": json_schema
+                }
+                )
+                tracing.set_gemini_usage(gemini_span, response)
 
         # ========== ETAPA 7: VALIDAR RESPOSTA ==========
         if not response or not response.text:
             error_msg = "LLM retornou resposta vazia"
-            print(f"[extract_data] ❌ {error_msg}")
+            log.error(error_msg)
             return {"error": error_msg}
 
-        print(f"[extract_data] ✅ LLM respondeu com {len(response.text)} caracteres")
+        summary_set(extraction_response_chars=len(response.text))
 
         # ========== ETAPA 8: LIMPAR RESPOSTA ==========
         # Remove markdown, texto extra, e isola o JSON
@@ -212,7 +235,7 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
         
         # ✅ Validar se a limpeza retornou algo válido
         if not cleaned_response:
-            print(f"[extract_data] ⚠️ Limpeza retornou string vazia, tentando usar resposta original")
+            log.warning("Limpeza retornou string vazia, tentando usar resposta original")
             cleaned_response = response.text.strip()
         
         # 7. Parsear JSON
@@ -220,8 +243,7 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
             extracted_data = json.loads(cleaned_response)
         except json.JSONDecodeError as e:
             error_msg = f"Erro ao parsear JSON (mesmo com structured output): {str(e)}"
-            print(f"[extract_data] ❌ {error_msg}")
-            print(f"[extract_data] 🔍 Resposta recebida (primeiros 500 chars): {response.text[:500]}")
+            log.warning(error_msg, response_head=response.text[:500])
             # ✅ Tentar reparar JSON comum (strings não escapadas)
             try:
                 # Tentar escapar caracteres problemáticos
@@ -229,14 +251,19 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
                 # Tentar encontrar e fechar strings não terminadas
                 # (lógica mais complexa seria necessária aqui)
                 extracted_data = json.loads(repaired)
-                print(f"[extract_data] ✅ JSON reparado com sucesso")
+                log.debug("JSON reparado com sucesso")
             except:
+                log.error(error_msg)
                 return {"error": error_msg}
 
         # 8. Validar dados extraídos
-        validation_result = _validate_extracted_data(extracted_data, analysis_mode)
+        validation_result = _validate_extracted_data(
+            extracted_data,
+            analysis_mode,
+            required_fields=json_schema["required"] if use_dynamic_schema else None
+        )
         if validation_result.get("error"):
-            print(f"[extract_data] ⚠️ {validation_result['error']}")
+            log.warning(validation_result['error'], warnings=len(validation_result.get("warnings", [])))
             # Continuar mesmo com warnings de validação
 
         # 9. Retornar resultado
@@ -244,7 +271,7 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
             "extracted_data": extracted_data,
             "metadata": {
                 "extraction_mode": analysis_mode,
-                "prompt_used": "full" if (analysis_mode == "personalized" or analysis_mode == "extract_only") else "optimized",  
+                "prompt_used": "dynamic" if use_dynamic_schema else ("full" if (analysis_mode == "personalized" or analysis_mode == "extract_only") else "optimized"),
                 "response_length": len(response.text),
                 "fields_extracted": len(extracted_data),
                 "images_processed": len(content_parts) - 1,
@@ -252,18 +279,15 @@ def extract_data(state: ReportAnalysisState) -> Dict[str, Any]:
             }
         }
 
-        print(f"[extract_data] ✅ Extração concluída: {len(extracted_data)} campos extraídos, {len(content_parts)-1} imagens processadas")
-
-        print(f"[extract_data]: {(extracted_data)}")
+        summary_set(fields_extracted=len(extracted_data))
+        log.debug("Extração concluída", fields=sorted(extracted_data) if isinstance(extracted_data, dict) else None)
         return result
 
 
 
     except Exception as e:
         error_msg = f"Erro na extração de dados: {str(e)}"
-        print(f"[extract_data] ❌ {error_msg}")
-        import traceback
-        print(f"[extract_data] ❌ Traceback: {traceback.format_exc()}")
+        log.error(error_msg, exc_info=True)
         return {"error": error_msg}
 
 
@@ -275,8 +299,9 @@ def _build_optimized_extraction_prompt(raw_text: str, pdf_images: List[Dict]) ->
     images_context = f"**IMAGENS DISPONÍVEIS:** {len(pdf_images)} páginas do PDF para análise visual."
     
     # Usar prompt otimizado
+    compacted_text, _ = compact_raw_text("extraction_optimized.raw_text", raw_text)
     prompt = XP_REPORT_EXTRACTION_PROMPT_OPTIMIZED.format(
-        raw_text=raw_text,
+        raw_text=compacted_text,
         images_context=images_context
     )
     
@@ -291,14 +316,24 @@ def _build_full_extraction_prompt(raw_text: str, pdf_images: List[Dict]) -> str:
     images_context = f"**IMAGENS DISPONÍVEIS:** {len(pdf_images)} páginas do PDF para análise visual."
     
     # Usar prompt completo
+    compacted_text, _ = compact_raw_text("extraction_full.raw_text", raw_text)
     prompt = XP_REPORT_EXTRACTION_PROMPT_FULL.format(
-        raw_text=raw_text,
+        raw_text=compacted_text,
         images_context=images_context
     )
     
     return prompt
 
 
+def _build_dynamic_extraction_prompt(raw_text: str, pdf_images: List[Dict], selected_fields: Dict[str, Any]) -> str:
+    """
+    Constrói prompt de extração apenas com os campos/classes de selected_fields.
+    """
+    images_context = f"**IMAGENS DISPONÍVEIS:** {len(pdf_images)} páginas do PDF para análise visual."
+    compacted_text, _ = compact_raw_text("extraction_dynamic.raw_text", raw_text)
+    return build_extraction_prompt(compacted_text, images_context, selected_fields)
+
+
 def _clean_llm_response(response_text: str) -> str:
     """
     Limpa a resposta do LLM removendo markdown e texto extra.
@@ -309,7 +344,7 @@ def _clean_llm_response(response_text: str) -> str:
     """
     # ========== VALIDAÇÃO INICIAL ==========
     if not response_text or not response_text.strip():
-        print("[extract_data] ⚠️ Resposta do LLM está vazia")
+        log.warning("Resposta do LLM está vazia")
         return ""
     
     # ========== REMOVER MARKDOWN CODE BLOCKS ==========
@@ -331,8 +366,7 @@ def _clean_llm_response(response_text: str) -> str:
     
     # Determinar qual vem primeiro e qual tipo de JSON é
     if first_brace == -1 and first_bracket == -1:
-        print(f"[extract_data] ⚠️ Não encontrou '{{' ou '[' na resposta.")
-        print(f"[extract_data] 🔍 Primeiros 200 chars: {response_text[:200]}")
+        log.warning("Não encontrou '{' ou '[' na resposta", response_head=response_text[:200])
         return ""
     
     # Usar o que vier primeiro
@@ -366,27 +400,32 @@ def _clean_llm_response(response_text: str) -> str:
     
     # Validar se encontrou JSON completo (balanceado)
     if last_valid_pos == -1:
-        print(f"[extract_data] ⚠️ JSON incompleto ({json_type} não balanceado).")
-        print(f"[extract_data] 🔍 Primeiros 200 chars: {response_text[:200]}")
+        log.warning(f"JSON incompleto ({json_type} não balanceado)", response_head=response_text[:200])
         return ""
     
     cleaned = response_text[:last_valid_pos + 1].strip()
     
     # ========== VALIDAÇÃO FINAL ==========
     if not cleaned:
-        print("[extract_data] ⚠️ String vazia após limpeza")
+        log.warning("String vazia após limpeza")
         return ""
     
     return cleaned
 
-def _validate_extracted_data(data: Dict[str, Any], analysis_mode: str) -> Dict[str, Any]:
+def _validate_extracted_data(
+    data: Dict[str, Any],
+    analysis_mode: str,
+    required_fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
     """
     Valida dados extraídos e retorna warnings/erros.
+    `required_fields` substitui a lista padrão (ex.: schema dinâmico por seleção).
     """
     warnings = []
+    expects_all_assets = required_fields is None or "allAssets" in required_fields
     
     # Campos obrigatórios
-    required_fields = [
+    required_fields = required_fields or [
         "accountNumber", "reportMonth", "grossEquity", "monthlyReturn", "monthlyCdi", 
         "monthlyGain", "yearlyReturn", "yearlyCdi", "yearlyGain",
         "benchmarkValues", "classPerformance", "highlights", "detractors"
@@ -398,7 +437,7 @@ def _validate_extracted_data(data: Dict[str, Any], analysis_mode: str) -> Dict[s
             warnings.append(f"Campo obrigatório '{field}' não encontrado")
     
     # Verificar campo específico do modo
-    if (analysis_mode == "personalized" or analysis_mode == "extract_only") and "allAssets" not in data:
+    if (analysis_mode == "personalized" or analysis_mode == "extract_only") and expects_all_assets and "allAssets" not in data:
         warnings.append("Campo 'allAssets' obrigatório para análise personalizada não encontrado")
     
     # Verificar estrutura dos highlights/detractors
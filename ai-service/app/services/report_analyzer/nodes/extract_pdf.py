@@ -9,6 +9,8 @@ import tempfile
 import os
 from typing import Dict, Any, List
 from app.models.schema import ReportAnalysisState
+from app.monitoring import tracing
+from app.monitoring.pipeline_log import get_pipeline_logger, summary_set, timed_stage
 from PIL import Image
 
 # Importações com fallback
@@ -26,9 +28,27 @@ except ImportError:
 
 import pdfplumber  # Sempre disponível como fallback final
 
+log = get_pipeline_logger("extract_pdf")
 
+
+def _record_extraction(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Registra páginas/imagens/método no resumo do arquivo (e no span do nó) e devolve o resultado."""
+    metadata = result.get("metadata", {})
+    tracing.set_attributes(
+        images=metadata.get("images_count"),
+        extraction_method=metadata.get("extraction_method"),
+    )
+    summary_set(
+        images=metadata.get("images_count"),
+        text_chars=metadata.get("text_length"),
+        extraction_method=metadata.get("extraction_method"),
+    )
+    return result
+
+
+@timed_stage("extract_pdf")
 def extract_pdf(state: ReportAnalysisState) -> Dict[str, Any]:
-    print(f"[extract_pdf] Iniciando extração multimodal do PDF: {state.get('file_name', 'unknown')}")
+    log.debug("Iniciando extração multimodal do PDF")
     
     # Decodificar base64
     file_content = state["file_content"]
@@ -36,48 +56,45 @@ def extract_pdf(state: ReportAnalysisState) -> Dict[str, Any]:
         file_content = file_content.split(",")[1]
     
     pdf_bytes = base64.b64decode(file_content)
+    tracing.set_attributes(pdf_bytes=len(pdf_bytes))
     
     # ✅ MÉTODO PRINCIPAL: PyMuPDF (manter fluxo atual)
     if PYMUPDF_AVAILABLE:
         try:
-            print(f"[extract_pdf] Usando PyMuPDF (método principal)...")
             result = _extract_with_pymupdf(pdf_bytes)
             if result and not result.get("error"):
-                print(f"[extract_pdf] ✅ Sucesso com PyMuPDF")
-                return result
+                return _record_extraction(result)
             else:
-                print(f"[extract_pdf] ⚠️ PyMuPDF falhou: {result.get('error', 'Erro desconhecido')}")
+                log.warning("PyMuPDF falhou", error=result.get('error', 'Erro desconhecido'))
         except Exception as e:
-            print(f"[extract_pdf] ❌ PyMuPDF erro: {str(e)}")
+            log.warning("PyMuPDF erro", error=str(e))
     
     # 🔄 FALLBACK 1: pdf2image (só se PyMuPDF falhar)
     if PDF2IMAGE_AVAILABLE:
         try:
-            print(f"[extract_pdf] Fallback: tentando pdf2image...")
+            log.debug("Fallback: tentando pdf2image")
             result = _extract_with_pdf2image(pdf_bytes)
             if result and not result.get("error"):
-                print(f"[extract_pdf] ✅ Sucesso com pdf2image (fallback)")
-                return result
+                return _record_extraction(result)
             else:
-                print(f"[extract_pdf] ⚠️ pdf2image falhou: {result.get('error', 'Erro desconhecido')}")
+                log.warning("pdf2image falhou", error=result.get('error', 'Erro desconhecido'))
         except Exception as e:
-            print(f"[extract_pdf] ❌ pdf2image erro: {str(e)}")
+            log.warning("pdf2image erro", error=str(e))
     
     # 🔄 FALLBACK 2: pdfplumber (último recurso)
     try:
-        print(f"[extract_pdf] Fallback final: tentando pdfplumber...")
+        log.debug("Fallback final: tentando pdfplumber")
         result = _extract_with_pdfplumber(pdf_bytes)
         if result and not result.get("error"):
-            print(f"[extract_pdf] ✅ Sucesso com pdfplumber (fallback final)")
-            return result
+            return _record_extraction(result)
         else:
-            print(f"[extract_pdf] ⚠️ pdfplumber falhou: {result.get('error', 'Erro desconhecido')}")
+            log.warning("pdfplumber falhou", error=result.get('error', 'Erro desconhecido'))
     except Exception as e:
-        print(f"[extract_pdf] ❌ pdfplumber erro: {str(e)}")
+        log.warning("pdfplumber erro", error=str(e))
     
     # Se todos falharam
     error_msg = "Todos os métodos de extração falharam"
-    print(f"[extract_pdf] ❌ {error_msg}")
+    log.error(error_msg)
     return {"error": error_msg}
 
 
@@ -85,12 +102,13 @@ def _extract_with_pymupdf(pdf_bytes: bytes) -> Dict[str, Any]:
     """✅ MÉTODO PRINCIPAL: PyMuPDF (fluxo atual mantido)"""
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     total_pages = len(doc)
-    print(f"[extract_pdf] PDF aberto com PyMuPDF, {total_pages} páginas")
+    summary_set(pages=total_pages)
+    log.debug("PDF aberto com PyMuPDF", pages=total_pages)
 
     # OTIMIZAÇÃO: Remover última página (sempre duplicada)
     pages_to_process = total_pages - 1 if total_pages > 1 else total_pages
     if total_pages > 1:
-        print(f"[extract_pdf] ⚠️ Removendo última página duplicada ({total_pages} → {pages_to_process} páginas)")
+        log.debug("Removendo última página duplicada", pages_to_process=pages_to_process)
     
     raw_text = ""
     pdf_images = []
@@ -112,10 +130,10 @@ def _extract_with_pymupdf(pdf_bytes: bytes) -> Dict[str, Any]:
                 "page": page_num + 1,
                 "image_data": base64.b64encode(img_data).decode('utf-8')
             })
-            print(f"[extract_pdf] ✅ Página {page_num + 1} convertida para imagem")
+            log.debug("Página convertida para imagem", page=page_num + 1)
             
         except Exception as e:
-            print(f"[extract_pdf] ⚠️ Erro ao converter página {page_num + 1}: {e}")
+            log.warning("Erro ao converter página", page=page_num + 1, error=str(e))
             continue
     
     doc.close()
@@ -123,7 +141,7 @@ def _extract_with_pymupdf(pdf_bytes: bytes) -> Dict[str, Any]:
     if not raw_text.strip():
         return {"error": "Não foi possível extrair texto do PDF"}
     
-    print(f"[extract_pdf] ✅ Extraído: {len(raw_text)} chars, {len(pdf_images)} imagens")
+    log.debug("Extraído", chars=len(raw_text), images=len(pdf_images))
     
     return {
         "raw_text": raw_text.strip(),
@@ -144,6 +162,7 @@ def _extract_with_pdf2image(pdf_bytes: bytes) -> Dict[str, Any]:
     
     try:
         images = convert_from_path(tmp_path, dpi=200, fmt='PNG', thread_count=1)
+        summary_set(pages=len(images))
         
         raw_text = ""
         pdf_images = []
@@ -159,7 +178,7 @@ def _extract_with_pdf2image(pdf_bytes: bytes) -> Dict[str, Any]:
                 "page": i + 1,
                 "image_data": base64.b64encode(img_data).decode('utf-8')
             })
-            print(f"[extract_pdf] ✅ Página {i + 1} convertida (pdf2image)")
+            log.debug("Página convertida (pdf2image)", page=i + 1)
         
         return {
             "raw_text": raw_text.strip(),
@@ -186,7 +205,8 @@ def _extract_with_pdfplumber(pdf_bytes: bytes) -> Dict[str, Any]:
         pdf_images = []
         
         with pdfplumber.open(tmp_path) as pdf:
-            print(f"[extract_pdf] PDF aberto com pdfplumber, {len(pdf.pages)} páginas")
+            summary_set(pages=len(pdf.pages))
+            log.debug("PDF aberto com pdfplumber", pages=len(pdf.pages))
             
             for page_num, page in enumerate(pdf.pages):
                 page_text = page.extract_text() or ""
@@ -202,10 +222,10 @@ def _extract_with_pdfplumber(pdf_bytes: bytes) -> Dict[str, Any]:
                         "page": page_num + 1,
                         "image_data": base64.b64encode(img_data).decode('utf-8')
                     })
-                    print(f"[extract_pdf] ✅ Página {page_num + 1} convertida (pdfplumber)")
+                    log.debug("Página convertida (pdfplumber)", page=page_num + 1)
                     
                 except Exception as e:
-                    print(f"[extract_pdf] ⚠️ Erro página {page_num + 1} (pdfplumber): {e}")
+                    log.warning("Erro página (pdfplumber)", page=page_num + 1, error=str(e))
                     continue
         
         if not raw_text.strip():
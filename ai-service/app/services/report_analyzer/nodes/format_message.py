@@ -1,52 +1,63 @@
 """
 Nós para formatação de mensagens WhatsApp.
 """
-import json
 from typing import Dict, Any
 from typing_extensions import final
 from app.models.schema import ReportAnalysisState
+from app.monitoring import tracing
+from app.monitoring.pipeline_log import get_pipeline_logger, summary_set, timed_stage
 from app.services.report_analyzer.prompts import (
     XP_MESSAGE_FORMAT_PROMPT_AUTO,
     XP_MESSAGE_FORMAT_PROMPT_CUSTOM
 )
+from app.services.report_analyzer.prompt_compaction import FORMAT_AUTO_FIELDS, compact_json
 from app.config import GOOGLE_API_KEY, LANGCHAIN_PROJECT_REPORT, MODEL_NAME, MODEL_FLASH, MODEL_PRO, get_gemini_client
 import os
 
+log = get_pipeline_logger("format_message")
+
 def call_response_gemini(prompt: str) -> str:
     try:
         # Chamar Gemini direto do SDK
         client = get_gemini_client()
 
-        response = client.models.generate_content(
-            model = MODEL_FLASH,
-            contents = [{
-                "parts": [{"text": prompt}]
-            }]
-        )
+        with tracing.span("gemini.generate_content", model=MODEL_FLASH, purpose="format",
+                          prompt_chars=len(prompt)) as gemini_span:
+            response = client.models.generate_content(
+                model = MODEL_FLASH,
+                contents = [{
+                    "parts": [{"text": prompt}]
+                }]
+            )
+            tracing.set_gemini_usage(gemini_span, response)
         return response.text.strip()
     except Exception as e:
-        print(f"❌ Erro na chamada do Gemini: {e}")
+        log.error("Erro na chamada do Gemini", error=str(e))
         return ""
 
+def _sum_compaction(*stats: Dict[str, Any]) -> Dict[str, int]:
+    """Soma a economia dos trechos compactados de um mesmo prompt."""
+    return {
+        "saved_chars": sum(s["saved_chars"] for s in stats),
+        "saved_tokens_est": sum(s["saved_tokens_est"] for s in stats),
+    }
+
+@timed_stage("format_message")
 def format_message_auto(state: ReportAnalysisState) -> Dict[str, Any]:
     """
     Formata mensagem WhatsApp para análise automática (todos os dados).
     """
-    print("[format_message_auto] Iniciando formatação de mensagem automática")
+    log.debug("Iniciando formatação de mensagem automática")
     
     # IMPORTANTE: Configurar projeto LangSmith
     #os.environ["LANGCHAIN_PROJECT"] = LANGCHAIN_PROJECT_REPORT
     
     try:
         # 1. Validar dados necessários
-        print(f"[format_message_auto] Validando dados...")
-        print(f"[format_message_auto] extracted_data: {bool(state.get('extracted_data'))}")
-        print(f"[format_message_auto] highlights: {len(state.get('highlights', []))}")
-        print(f"[format_message_auto] detractors: {len(state.get('detractors', []))}")
-        
+        summary_set(highlights=len(state.get('highlights', [])), detractors=len(state.get('detractors', [])))
         
         if not state.get('extracted_data'):
-            print("[format_message_auto] ❌ extracted_data não encontrado")
+            log.error("extracted_data não encontrado")
             return {"error": "extracted_data não encontrado"}
         
         # 2. Ordenar highlights por diferença (maior primeiro)
@@ -65,7 +76,10 @@ def format_message_auto(state: ReportAnalysisState) -> Dict[str, Any]:
                 key=lambda x: parse_difference(x.get('benchmarkDifference', '0%')), 
                 reverse=True
             )
-            print(f"[format_message_auto] Highlights ordenados por diferença: {[h.get('className') + ' (' + str(h.get('benchmarkDifference', '0%')) + ')' for h in highlights_sorted]}")
+            log.debug(
+                "Highlights ordenados por diferença",
+                order=[f"{h.get('className')} ({h.get('benchmarkDifference', '0%')})" for h in highlights_sorted],
+            )
         else:
             highlights_sorted = highlights
         
@@ -77,49 +91,54 @@ def format_message_auto(state: ReportAnalysisState) -> Dict[str, Any]:
         }
         
         # 4. Construir prompt
+        highlights_json, highlights_stats = compact_json("format_auto.highlights", data_for_prompt['highlights'])
+        detractors_json, detractors_stats = compact_json("format_auto.detractors", data_for_prompt['detractors'])
+        extracted_json, extracted_stats = compact_json(
+            "format_auto.extracted_data", data_for_prompt['extracted_data'], fields=FORMAT_AUTO_FIELDS
+        )
         prompt = XP_MESSAGE_FORMAT_PROMPT_AUTO.format(
-            highlights=json.dumps(data_for_prompt['highlights'], ensure_ascii=False),
-            detractors=json.dumps(data_for_prompt['detractors'], ensure_ascii=False),
-            extracted_data=json.dumps(data_for_prompt['extracted_data'], ensure_ascii=False),
+            highlights=highlights_json,
+            detractors=detractors_json,
+            extracted_data=extracted_json,
             file_name=state.get('file_name', 'Relatório XP')
         )
         
         # 5. Chamar LLM via Langgraph
         #llm = get_llm()
         
-        print("[format_message_auto] Chamando LLM para formatação...")
+        log.debug("Chamando LLM para formatação", prompt_chars=len(prompt))
 
         final_message = call_response_gemini(prompt)
 
         if not final_message:  # ← CORRETO: string não tem .text
             return {"error": "LLM retornou resposta vazia"}
         
-        print(f"[format_message_auto] ✅ Mensagem formatada ({len(final_message)} caracteres)")
+        summary_set(message_chars=len(final_message))
         
         return {
             "final_message": final_message,
             "metadata": {
                 "format_mode": "auto",
                 "message_length": len(final_message),
-                "highlights_ordered": len(highlights_sorted)
+                "highlights_ordered": len(highlights_sorted),
+                "prompt_compaction": _sum_compaction(highlights_stats, detractors_stats, extracted_stats)
             }
         }
         
     except Exception as e:
-        print(f"[format_message_auto] ❌ Erro: {e}")
-        import traceback
-        print(f"[format_message_auto] ❌ Traceback: {traceback.format_exc()}")
+        log.error("Erro na formatação", error=str(e), exc_info=True)
         return {"error": f"Erro na formatação: {str(e)}"}
 
 
 
 
 
+@timed_stage("format_message")
 def format_message_custom(state: ReportAnalysisState) -> Dict[str, Any]:
     """
     Formata mensagem WhatsApp com campos personalizados selecionados pelo usuário.
     """
-    print("[format_message_custom] Iniciando formatação de mensagem personalizada")
+    log.debug("Iniciando formatação de mensagem personalizada")
     
     try:
         # 1. Validar dados necessários
@@ -143,43 +162,43 @@ def format_message_custom(state: ReportAnalysisState) -> Dict[str, Any]:
         highlights = state.get('highlights', [])
         detractors = state.get('detractors', [])
 
-        # 3. Debug antes da construção do prompt
-        print(f"[format_message_custom] DEBUG - filtered_data antes do prompt:")
-        print(f"  - Tipo: {type(filtered_data)}")
-        print(f"  - Conteúdo: {filtered_data}")
-        print(f"  - JSON serializado: {json.dumps(filtered_data, ensure_ascii=False)}")
-        print(f"[format_message_custom] Highlights recebidos: {len(highlights)}")
-        print(f"[format_message_custom] Detractors recebidos: {len(detractors)}")
+        # 3. Debug antes da construção do prompt (chaves, não o conteúdo da carteira)
+        log.debug("filtered_data antes do prompt", keys=sorted(filtered_data))
+        summary_set(highlights=len(highlights), detractors=len(detractors))
 
         # 4. Construir prompt diretamente
+        extracted_json, extracted_stats = compact_json("format_custom.extracted_data", filtered_data)
+        highlights_json, highlights_stats = compact_json("format_custom.highlights", highlights)  # ← Já filtrados pelo analyze_report
+        detractors_json, detractors_stats = compact_json("format_custom.detractors", detractors)  # ← Já filtrados pelo analyze_report
         prompt = XP_MESSAGE_FORMAT_PROMPT_CUSTOM.format(
-            extracted_data=json.dumps(filtered_data, ensure_ascii=False),
-            highlights=json.dumps(highlights, ensure_ascii=False),  # ← Já filtrados pelo analyze_report
-            detractors=json.dumps(detractors, ensure_ascii=False),  # ← Já filtrados pelo analyze_report
+            extracted_data=extracted_json,
+            highlights=highlights_json,
+            detractors=detractors_json,
             file_name=state.get('file_name', 'Relatório XP')
         )
 
         
-        print("[format_message_custom] Chamando LLM para formatação personalizada...")
+        log.debug("Chamando LLM para formatação personalizada", prompt_chars=len(prompt))
         
         final_message = call_response_gemini(prompt)
 
         if not final_message:  # ← CORRETO: string não tem .text
             return {"error": "LLM retornou resposta vazia"}
         
-        print(f"[format_message_custom] ✅ Mensagem personalizada formatada ({len(final_message)} caracteres)")
+        summary_set(message_chars=len(final_message))
         
         return {
             "final_message": final_message,
             "metadata": {
                 "format_mode": "custom",
                 "message_length": len(final_message),
-                "fields_selected": len(selected_fields)
+                "fields_selected": len(selected_fields),
+                "prompt_compaction": _sum_compaction(extracted_stats, highlights_stats, detractors_stats)
             }
         }
         
     except Exception as e:
-        print(f"[format_message_custom] ❌ Erro: {e}")
+        log.error("Erro na formatação personalizada", error=str(e))
         return {"error": f"Erro na formatação personalizada: {str(e)}"}
 
 
@@ -217,38 +236,25 @@ def _filter_data_by_selection(
                 if selected_classes.get(cls['className'], False)
             ]
 
-    # Filtrar allAssets - VERSÃO COM DEBUG DETALHADO
+    # Filtrar allAssets (uma linha DEBUG por categoria, não por ativo)
     if 'allAssets' in selected_fields and isinstance(selected_fields['allAssets'], dict):
         selected_assets = selected_fields['allAssets']
-        print(f"[_filter_data_by_selection] DEBUG - selected_assets: {selected_assets}")
         
         if 'allAssets' in extracted_data:
             filtered['allAssets'] = {}
             for category, assets in extracted_data['allAssets'].items():
-                print(f"[_filter_data_by_selection] DEBUG - Processando categoria: {category}")
-                print(f"[_filter_data_by_selection] DEBUG - Assets na categoria: {len(assets)}")
-                
                 if category in selected_assets:
                     selected_indices = selected_assets[category]
-                    print(f"[_filter_data_by_selection] DEBUG - selected_indices para {category}: {selected_indices}")
-                    print(f"[_filter_data_by_selection] DEBUG - Tipo de selected_indices: {type(selected_indices)}")
-                    
-                    filtered_assets = []
-                    for i, asset in enumerate(assets):
-                        print(f"[_filter_data_by_selection] DEBUG - Verificando índice {i} (tipo: {type(i)})")
-                        print(f"[_filter_data_by_selection] DEBUG - Asset: {asset}")
-                        print(f"[_filter_data_by_selection] DEBUG - selected_indices.get(str(i), False): {selected_indices.get(str(i), False)}")                        
-                        if selected_indices.get(str(i), False):
-                            filtered_assets.append(asset)
-                            print(f"[_filter_data_by_selection] DEBUG - ✅ Asset {i} incluído")
-                        else:
-                            print(f"[_filter_data_by_selection] DEBUG - ❌ Asset {i} excluído")
-                    
-                    print(f"[_filter_data_by_selection] DEBUG - filtered_assets final: {len(filtered_assets)}")
+                    filtered_assets = [
+                        asset for i, asset in enumerate(assets)
+                        if selected_indices.get(str(i), False)
+                    ]
+                    log.debug("Ativos filtrados por seleção", category=category,
+                              assets=len(assets), selected=len(filtered_assets))
                     if filtered_assets:
                         filtered['allAssets'][category] = filtered_assets
                 else:
-                    print(f"[_filter_data_by_selection] DEBUG - Categoria {category} não está em selected_assets")
+                    log.debug("Categoria fora de selected_assets", category=category)
     return filtered
 
 def _filter_data_for_analysis(
@@ -275,7 +281,7 @@ def _filter_data_for_analysis(
     # 2. ✅ CRÍTICO: Sempre incluir benchmarkValues (necessário para comparações)
     if 'benchmarkValues' in extracted_data:
         filtered['benchmarkValues'] = extracted_data['benchmarkValues']
-        print(f"[_filter_data_for_analysis] ✅ benchmarkValues incluído: {list(extracted_data['benchmarkValues'].keys())}")
+        log.debug("benchmarkValues incluído", benchmarks=list(extracted_data['benchmarkValues'].keys()))
     
     # 3. Incluir campos top-level se selecionados
     top_level_fields = [
@@ -302,7 +308,6 @@ def _filter_data_for_analysis(
         selected_assets = selected_fields['allAssets']
         for class_name in selected_assets.keys():
             selected_class_names.add(class_name)
-            print(f"[_filter_data_for_analysis] ✅ Classe '{class_name}' incluída implicitamente (via ativos selecionados)")
     
     # 4c. Filtrar classPerformance baseado nas classes identificadas
     if selected_class_names and 'classPerformance' in extracted_data:
@@ -310,7 +315,7 @@ def _filter_data_for_analysis(
             cls for cls in extracted_data['classPerformance']
             if cls['className'] in selected_class_names
         ]
-        print(f"[_filter_data_for_analysis] ✅ classPerformance filtrado: {len(filtered['classPerformance'])} classes")
+        log.debug("classPerformance filtrado", classes=len(filtered['classPerformance']))
     
     # 5. Filtrar allAssets - incluir TODOS os ativos das classes selecionadas (não apenas os ativos individuais selecionados)
     # Para análise, precisamos de todos os ativos da classe para fazer drill-down
@@ -320,7 +325,7 @@ def _filter_data_for_analysis(
             # Se a classe foi selecionada (explicitamente ou implicitamente), incluir TODOS os ativos dela
             if category in selected_class_names:
                 filtered['allAssets'][category] = assets
-                print(f"[_filter_data_for_analysis] ✅ allAssets incluído para classe '{category}': {len(assets)} ativos")
+                log.debug("allAssets incluído para classe", category=category, assets=len(assets))
     
     # 6. Se o usuário selecionou ativos específicos (não apenas classes), filtrar também
     if 'allAssets' in selected_fields and isinstance(selected_fields['allAssets'], dict):
@@ -333,6 +338,6 @@ def _filter_data_for_analysis(
                         asset for i, asset in enumerate(assets)
                         if selected_indices.get(str(i), False)
                     ]
-                    print(f"[_filter_data_for_analysis] ✅ allAssets refinado para '{category}': {len(filtered['allAssets'][category])} ativos selecionados")
+                    log.debug("allAssets refinado", category=category, selected=len(filtered['allAssets'][category]))
     
     return filtered
\ No newline at end of file
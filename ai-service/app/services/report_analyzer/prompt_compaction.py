@@ -0,0 +1,184 @@
+"""
+Camada de compactação dos dados embutidos nos prompts enviados ao Gemini.
+
+- JSON minificado, sem campos nulos/vazios e restrito aos campos que cada prompt usa
+- raw_text sem cabeçalhos/rodapés repetidos entre páginas e com espaços colapsados
+- Estatísticas de caracteres e tokens (estimados) economizados por prompt
+
+Os nós chamam estas funções ao montar o prompt; com PROMPT_COMPACTION_ENABLED=false
+o conteúdo original é devolvido (mesmo formato de antes) e a economia é zero.
+"""
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from app.config import PROMPT_COMPACTION_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Entra no fingerprint do result store: mudar a compactação invalida resultados antigos
+PROMPT_COMPACTION_VERSION = "1"
+
+# Campos top-level usados por cada prompt
+ANALYSIS_FIELDS = frozenset({
+    'accountNumber', 'reportMonth', 'benchmarkValues', 'classPerformance', 'topAssets', 'allAssets',
+})
+FORMAT_AUTO_FIELDS = frozenset({
+    'accountNumber', 'reportMonth', 'grossEquity', 'monthlyReturn', 'monthlyCdi', 'monthlyGain',
+    'yearlyReturn', 'yearlyCdi', 'yearlyGain', 'benchmarkValues', 'classPerformance', 'topAssets', 'allAssets',
+})
+
+# Uma linha é cabeçalho/rodapé quando aparece em pelo menos esta fração das páginas
+RAW_TEXT_REPEAT_MIN_RATIO = 0.6
+RAW_TEXT_REPEAT_MIN_PAGES = 3
+RAW_TEXT_REPEAT_MIN_LENGTH = 8
+
+_PAGE_MARKER_RE = re.compile(r'(--- p[áa]gina \d+ ---)', re.IGNORECASE)
+
+_totals_lock = threading.Lock()
+_totals: Dict[str, Dict[str, int]] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa grosseira de tokens (~4 caracteres por token)."""
+    return math.ceil(len(text) / 4)
+
+
+def prune_empty(value: Any) -> Any:
+    """Remove recursivamente valores None, strings vazias, listas e dicts vazios."""
+    if isinstance(value, dict):
+        pruned = {k: prune_empty(v) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if not _is_empty(v)}
+    if isinstance(value, list):
+        pruned = [prune_empty(v) for v in value]
+        return [v for v in pruned if not _is_empty(v)]
+    return value
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _select_fields(value: Any, fields: Optional[Iterable[str]]) -> Any:
+    if fields is None or not isinstance(value, dict):
+        return value
+    allowed = set(fields)
+    return {k: v for k, v in value.items() if k in allowed}
+
+
+def _record_stats(prompt_name: str, original: str, compacted: str) -> Dict[str, Any]:
+    """Calcula, acumula e loga a economia de um trecho de prompt."""
+    saved_chars = len(original) - len(compacted)
+    stats = {
+        'prompt': prompt_name,
+        'original_chars': len(original),
+        'compacted_chars': len(compacted),
+        'saved_chars': saved_chars,
+        'saved_tokens_est': estimate_tokens(original) - estimate_tokens(compacted),
+    }
+    with _totals_lock:
+        totals = _totals.setdefault(prompt_name, {'calls': 0, 'saved_chars': 0, 'saved_tokens_est': 0})
+        totals['calls'] += 1
+        totals['saved_chars'] += saved_chars
+        totals['saved_tokens_est'] += stats['saved_tokens_est']
+    if saved_chars:
+        logger.info(
+            "[prompt_compaction] %s: %d → %d caracteres (-%d, ~%d tokens)",
+            prompt_name, len(original), len(compacted), saved_chars, stats['saved_tokens_est'],
+        )
+    return stats
+
+
+def compact_json(
+    prompt_name: str,
+    value: Any,
+    fields: Optional[Iterable[str]] = None,
+    original_indent: Optional[int] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Serializa `value` para o prompt: só os `fields` top-level informados, sem vazios,
+    minificado. `original_indent` reproduz a serialização anterior (base da economia).
+
+    Returns:
+        (json para o prompt, estatísticas)
+    """
+    original = json.dumps(value, indent=original_indent, ensure_ascii=False)
+    if not PROMPT_COMPACTION_ENABLED:
+        return original, _record_stats(prompt_name, original, original)
+
+    compacted = json.dumps(
+        prune_empty(_select_fields(value, fields)),
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return compacted, _record_stats(prompt_name, original, compacted)
+
+
+def _collapse_whitespace(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _dedupe_pages(markers: list, bodies: list) -> str:
+    page_lines = [
+        [line for line in (_collapse_whitespace(l) for l in body.splitlines()) if line]
+        for body in bodies
+    ]
+    counts = Counter(line for lines in page_lines for line in set(lines))
+    min_pages = max(RAW_TEXT_REPEAT_MIN_PAGES, math.ceil(RAW_TEXT_REPEAT_MIN_RATIO * len(page_lines)))
+    repeated = {
+        line for line, n in counts.items()
+        if n >= min_pages and len(line) >= RAW_TEXT_REPEAT_MIN_LENGTH
+    }
+
+    seen = set()
+    pages = []
+    for marker, lines in zip(markers, page_lines):
+        kept = []
+        for line in lines:
+            if line in repeated:
+                # Mantém a primeira ocorrência do cabeçalho/rodapé
+                if line in seen:
+                    continue
+                seen.add(line)
+            kept.append(line)
+        pages.append("\n".join([marker] + kept))
+    return "\n".join(pages)
+
+
+def compact_raw_text(prompt_name: str, raw_text: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Compacta o texto do PDF: colapsa espaços, remove linhas vazias e linhas repetidas
+    na maioria das páginas (cabeçalhos/rodapés), preservando os marcadores de página.
+
+    Returns:
+        (texto para o prompt, estatísticas)
+    """
+    if not PROMPT_COMPACTION_ENABLED or not raw_text:
+        return raw_text, _record_stats(prompt_name, raw_text or "", raw_text or "")
+
+    parts = _PAGE_MARKER_RE.split(raw_text)
+    preamble, markers, bodies = parts[0], parts[1::2], parts[2::2]
+
+    sections = [
+        line for line in (_collapse_whitespace(l) for l in preamble.splitlines()) if line
+    ]
+    if markers:
+        sections.append(_dedupe_pages(markers, bodies))
+    compacted = "\n".join(sections)
+    return compacted, _record_stats(prompt_name, raw_text, compacted)
+
+
+def get_compaction_totals() -> Dict[str, Dict[str, int]]:
+    """Economia acumulada por prompt desde o início do processo."""
+    with _totals_lock:
+        return {name: dict(totals) for name, totals in _totals.items()}
+
+
+def reset_compaction_totals() -> None:
+    """Zera os acumulados (útil para testes)."""
+    with _totals_lock:
+        _totals.clear()
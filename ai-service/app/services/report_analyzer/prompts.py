@@ -397,6 +397,72 @@ Responda APENAS com o JSON, sem texto adicional.
 
 
 
+# Extração sob medida para selected_fields conhecidos de antemão (ver schema_builder.py)
+EXTRACTION_FIELD_INSTRUCTIONS = {
+    "accountNumber": "accountNumber: Número da conta do cliente",
+    "reportMonth": "reportMonth: Mês de referência do relatório (formato: MM/AAAA)",
+    "grossEquity": "grossEquity: Patrimônio total bruto (formato: R$ X.XXX,XX) - Procure por \"PATRIMÔNIO TOTAL BRUTO\" ou \"PATRIMÔNIO BRUTO\" no relatório",
+    "monthlyReturn": "monthlyReturn: Rentabilidade percentual do mês",
+    "monthlyCdi": "monthlyCdi: Rentabilidade em %CDI do mês",
+    "monthlyGain": "monthlyGain: Ganho financeiro do mês (formato: R$ X.XXX,XX)",
+    "yearlyReturn": "yearlyReturn: Rentabilidade percentual do ano",
+    "yearlyCdi": "yearlyCdi: Rentabilidade em %CDI do ano",
+    "yearlyGain": "yearlyGain: Ganho financeiro do ano (formato: R$ X.XXX,XX)",
+    "benchmarkValues": """benchmarkValues: Objeto com valores dos benchmarks do mês atual:
+- CDI: percentual
+- Ibovespa: percentual
+- IPCA: percentual (ATENÇÃO: pode ser negativo!)
+- Dólar: percentual (ATENÇÃO: pode ser negativo!)""",
+    "classPerformance": """classPerformance: Array com performance por classe de ativo:
+- className: nome da classe
+- classReturn: rentabilidade percentual do mês
+- benchmark: benchmark correspondente
+- benchmarkDifference: diferença em relação ao benchmark correspondente
+- Compare cada classe com seu benchmark específico:
+            * Pós Fixado → CDI
+            * Inflação → IPCA
+            * Renda Variável Brasil → Ibovespa
+            * Multimercado → CDI
+            * Fundos Listados → CDI""",
+}
+
+XP_REPORT_EXTRACTION_ASSETS_INSTRUCTION = """allAssets: Objeto com os ativos individuais APENAS das classes: {class_names}.
+Ignore os ativos das demais classes. Para cada classe listada, liste os ativos com:
+- assetName: Nome completo do ativo
+- assetReturn: Rentabilidade do mês
+- assetType: Tipo específico do ativo (opcional, mas recomendado para consistência)
+- MÁXIMO 10 ativos por classe, priorizando os de maior rentabilidade
+- Use a seção "POSIÇÃO DETALHADA DOS ATIVOS" para extrair os dados
+- Mantenha o nome completo do ativo exatamente como aparece no relatório"""
+
+XP_REPORT_EXTRACTION_PROMPT_DYNAMIC = """
+Você é um especialista em análise de relatórios financeiros da XP.
+Analise o TEXTO e as IMAGENS do PDF para extrair dados com máxima precisão.
+
+**INSTRUÇÕES CRÍTICAS:**
+1. Use o TEXTO para dados estruturados (números, percentuais, datas)
+2. Use as IMAGENS para entender layout, tabelas, gráficos e formatação visual
+3. Combine ambas as fontes para máxima precisão
+4. Preste atenção especial a sinais negativos (ex: -0,13%, -3,14%) - MUITO IMPORTANTE!
+5. Extraia SOMENTE os campos listados abaixo
+
+{images_context}
+
+**TEXTO EXTRAÍDO DO PDF:**
+{raw_text}
+
+**CAMPOS A EXTRAIR:**
+{fields_instructions}
+
+**FORMATO DE SAÍDA:**
+- Use formato brasileiro (vírgula para decimal)
+- Preserve sinais negativos (ex: -0,13%, -3,14%)
+- Valores monetários em formato R$ X.XXX,XX
+- Percentuais com símbolo % (ex: 1,06%)
+- Responda APENAS com JSON válido, sem texto adicional
+"""
+
+
 XP_MESSAGE_FORMAT_PROMPT_CUSTOM = """
 Você é um especialista em comunicação financeira. Sua tarefa é formatar uma análise PERSONALIZADA de performance em uma mensagem de WhatsApp, usando APENAS os dados selecionados pelo cliente.
 
@@ -0,0 +1,219 @@
+"""
+Store de resultados do report analyzer.
+
+Chave: sha256 do PDF + analysis_mode + digest de selected_fields + PROMPT_VERSION.
+Dois níveis: memória (LRU com TTL, por instância) e Firestore
+(report_result_store/{key}), compartilhado entre instâncias.
+
+PROMPT_VERSION é um fingerprint das constantes de prompts.py/schemas.py e dos
+modelos usados; qualquer alteração muda a chave e invalida as entradas antigas.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import (
+    MODEL_FLASH,
+    MODEL_NAME,
+    PROMPT_COMPACTION_ENABLED,
+    RESULT_STORE_ENABLED,
+    RESULT_STORE_MEMORY_MAX_ENTRIES,
+    RESULT_STORE_TTL_SECONDS,
+    get_firestore_client,
+)
+from app.monitoring import tracing
+from app.services.report_analyzer import prompts, schemas
+from app.services.report_analyzer.prompt_compaction import PROMPT_COMPACTION_VERSION
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_RESULT_STORE = "report_result_store"
+
+# Campos do state que compõem o resultado reaproveitável
+STORED_FIELDS = ("extracted_data", "highlights", "detractors", "final_message", "metadata")
+
+_memory_store: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _compute_prompt_version() -> str:
+    """
+    Fingerprint das constantes em maiúsculas de prompts.py e schemas.py
+    (mais os modelos configurados e a versão da compactação de prompts).
+    Muda sempre que um prompt/schema muda.
+    """
+    h = hashlib.sha256()
+    for module in (prompts, schemas):
+        for name in sorted(vars(module)):
+            if not name.isupper():
+                continue
+            value = getattr(module, name)
+            h.update(name.encode("utf-8"))
+            h.update(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    h.update(f"{MODEL_NAME}|{MODEL_FLASH}".encode("utf-8"))
+    compaction = PROMPT_COMPACTION_VERSION if PROMPT_COMPACTION_ENABLED else "off"
+    h.update(f"compaction={compaction}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+PROMPT_VERSION = _compute_prompt_version()
+
+
+def _pdf_digest(file_content: str) -> str:
+    """sha256 dos bytes do PDF (aceita data URI ou base64 puro)."""
+    payload = file_content.split(",", 1)[1] if file_content.startswith("data:") else file_content
+    try:
+        raw = base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        raw = payload.encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _selected_fields_digest(selected_fields: Optional[dict]) -> str:
+    """Digest estável de selected_fields (independe da ordem das chaves)."""
+    if not selected_fields:
+        return "none"
+    canonical = json.dumps(selected_fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def build_result_key(
+    file_content: str,
+    analysis_mode: str,
+    selected_fields: Optional[dict] = None,
+    prompt_version: Optional[str] = None,
+) -> str:
+    """
+    Monta a chave do store a partir do conteúdo do PDF, modo, seleção e versão dos prompts.
+    """
+    parts = [
+        _pdf_digest(file_content),
+        analysis_mode or "auto",
+        _selected_fields_digest(selected_fields),
+        prompt_version or PROMPT_VERSION,
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _is_storable(result: dict) -> bool:
+    """Só resultados completos e sem erro entram no store."""
+    return bool(result) and not result.get("error") and bool(result.get("final_message"))
+
+
+def _to_stored_result(result: dict) -> dict:
+    return {field: result.get(field) for field in STORED_FIELDS}
+
+
+def _with_hit_marker(stored: dict) -> dict:
+    """Retorna uma cópia do resultado marcada como vinda do store."""
+    hit = dict(stored)
+    hit["metadata"] = {**(stored.get("metadata") or {}), "result_store": "hit"}
+    hit["error"] = None
+    return hit
+
+
+def _memory_get(key: str) -> Optional[dict]:
+    now = time.monotonic()
+    with _memory_lock:
+        cached = _memory_store.get(key)
+        if cached is None:
+            return None
+        cached_at, value = cached
+        if now - cached_at >= RESULT_STORE_TTL_SECONDS:
+            del _memory_store[key]
+            return None
+        _memory_store.move_to_end(key)
+        return value
+
+
+def _memory_put(key: str, value: dict) -> None:
+    with _memory_lock:
+        _memory_store[key] = (time.monotonic(), value)
+        _memory_store.move_to_end(key)
+        while len(_memory_store) > RESULT_STORE_MEMORY_MAX_ENTRIES:
+            _memory_store.popitem(last=False)
+
+
+def _get_stored_result_sync(key: str) -> Optional[dict]:
+    """Busca na memória e, em seguida, no Firestore. Falhas viram miss."""
+    cached = _memory_get(key)
+    if cached is not None:
+        tracing.set_attributes(result_store="memory_hit")
+        return _with_hit_marker(cached)
+
+    try:
+        db = get_firestore_client()
+        with tracing.span("firestore.get", collection=COLLECTION_RESULT_STORE) as get_span:
+            doc = db.collection(COLLECTION_RESULT_STORE).document(key).get()
+            get_span.set(found=doc.exists)
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        expires_at = data.get("expires_at_epoch_ms") or 0
+        if expires_at and expires_at < int(time.time() * 1000):
+            return None
+        stored = {field: data.get(field) for field in STORED_FIELDS}
+    except Exception as e:
+        logger.warning("Erro ao ler result store (%s): %s", key[:12], e)
+        return None
+
+    _memory_put(key, stored)
+    return _with_hit_marker(stored)
+
+
+def _save_result_sync(key: str, result: dict, analysis_mode: Optional[str] = None) -> bool:
+    """Persiste o resultado na memória e no Firestore. Retorna True se gravou."""
+    if not _is_storable(result):
+        return False
+
+    stored = _to_stored_result(result)
+    _memory_put(key, stored)
+
+    try:
+        db = get_firestore_client()
+        now_ms = int(time.time() * 1000)
+        with tracing.span("firestore.set", collection=COLLECTION_RESULT_STORE):
+            db.collection(COLLECTION_RESULT_STORE).document(key).set({
+                **stored,
+                "analysis_mode": analysis_mode,
+                "prompt_version": PROMPT_VERSION,
+                "created_at_epoch_ms": now_ms,
+                "expires_at_epoch_ms": now_ms + RESULT_STORE_TTL_SECONDS * 1000,
+            })
+    except Exception as e:
+        logger.warning("Erro ao gravar result store (%s): %s", key[:12], e)
+    return True
+
+
+async def get_stored_result(key: str) -> Optional[dict]:
+    """
+    Retorna o resultado previamente armazenado para a chave (ou None).
+    A leitura do Firestore roda em executor para não bloquear o event loop.
+    """
+    if not RESULT_STORE_ENABLED:
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, tracing.with_current_context(_get_stored_result_sync, key))
+
+
+async def save_result(key: str, result: dict, analysis_mode: Optional[str] = None) -> bool:
+    """Armazena o resultado do workflow (ignorado se desabilitado ou com erro)."""
+    if not RESULT_STORE_ENABLED:
+        return False
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, tracing.with_current_context(_save_result_sync, key, result, analysis_mode)
+    )
+
+
+def clear_memory_store() -> None:
+    """Limpa o nível em memória (útil para testes)."""
+    with _memory_lock:
+        _memory_store.clear()
@@ -0,0 +1,98 @@
+"""
+Schema e prompt de extração gerados a partir de selected_fields.
+
+Quando a seleção do assessor é conhecida antes da extração, o schema
+EXTRACTED_DATA_SCHEMA_FULL e o prompt são podados para os campos top-level
+pedidos e para os ativos das classes selecionadas. Assim os tokens de saída
+(e a latência) da extração acompanham o que foi efetivamente pedido.
+
+Os artefatos são cacheados por assinatura da seleção (campos + classes).
+"""
+import copy
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.report_analyzer.prompts import (
+    EXTRACTION_FIELD_INSTRUCTIONS,
+    XP_REPORT_EXTRACTION_ASSETS_INSTRUCTION,
+    XP_REPORT_EXTRACTION_PROMPT_DYNAMIC,
+)
+from app.services.report_analyzer.schemas import EXTRACTED_DATA_SCHEMA_FULL
+
+# Necessários para identificar o relatório e para a análise por classe
+ALWAYS_EXTRACTED_FIELDS = ('accountNumber', 'reportMonth', 'benchmarkValues', 'classPerformance')
+
+# Campos top-level que o assessor pode marcar em selected_fields
+SELECTABLE_TOP_LEVEL_FIELDS = (
+    'grossEquity', 'monthlyReturn', 'monthlyCdi', 'monthlyGain',
+    'yearlyReturn', 'yearlyCdi', 'yearlyGain',
+)
+
+SelectionSignature = Tuple[Tuple[str, ...], Tuple[str, ...]]
+
+
+def selection_signature(selected_fields: Optional[Dict[str, Any]]) -> SelectionSignature:
+    """
+    Reduz selected_fields ao que muda a extração: campos top-level marcados e classes
+    selecionadas (explicitamente em classPerformance ou implicitamente via allAssets).
+    """
+    selected_fields = selected_fields or {}
+    fields = tuple(f for f in SELECTABLE_TOP_LEVEL_FIELDS if selected_fields.get(f))
+
+    classes = set()
+    class_selection = selected_fields.get('classPerformance')
+    if isinstance(class_selection, dict):
+        classes.update(name for name, is_selected in class_selection.items() if is_selected)
+    asset_selection = selected_fields.get('allAssets')
+    if isinstance(asset_selection, dict):
+        classes.update(asset_selection.keys())
+    return fields, tuple(sorted(classes))
+
+
+@lru_cache(maxsize=256)
+def _build_for_signature(signature: SelectionSignature) -> Tuple[Dict[str, Any], str]:
+    """Monta (schema, instruções de campos do prompt) para uma assinatura de seleção."""
+    fields, classes = signature
+    full_properties = EXTRACTED_DATA_SCHEMA_FULL['properties']
+    wanted = [f for f in full_properties if f in ALWAYS_EXTRACTED_FIELDS or f in fields]
+
+    properties = {f: copy.deepcopy(full_properties[f]) for f in wanted}
+    required = [f for f in EXTRACTED_DATA_SCHEMA_FULL.get('required', []) if f in properties]
+    instructions: List[str] = [EXTRACTION_FIELD_INSTRUCTIONS[f] for f in wanted]
+
+    if classes:
+        all_assets = full_properties['allAssets']
+        asset_list_schema = copy.deepcopy(all_assets['additionalProperties'])
+        properties['allAssets'] = {
+            'type': 'object',
+            'description': f"Ativos individuais apenas das classes: {', '.join(classes)}",
+            'properties': {name: copy.deepcopy(asset_list_schema) for name in classes},
+        }
+        required.append('allAssets')
+        instructions.append(XP_REPORT_EXTRACTION_ASSETS_INSTRUCTION.format(class_names=', '.join(classes)))
+
+    schema = {'type': 'object', 'properties': properties, 'required': required}
+    fields_instructions = "\n".join(f"{i}. {text}" for i, text in enumerate(instructions, start=1))
+    return schema, fields_instructions
+
+
+def build_extraction_schema(selected_fields: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Schema de extração podado para a seleção. O objeto é compartilhado pelo
+    cache: não deve ser modificado por quem o recebe.
+    """
+    return _build_for_signature(selection_signature(selected_fields))[0]
+
+
+def build_extraction_prompt(
+    raw_text: str,
+    images_context: str,
+    selected_fields: Optional[Dict[str, Any]],
+) -> str:
+    """Prompt de extração contendo apenas as instruções dos campos/classes selecionados."""
+    _, fields_instructions = _build_for_signature(selection_signature(selected_fields))
+    return XP_REPORT_EXTRACTION_PROMPT_DYNAMIC.format(
+        images_context=images_context,
+        raw_text=raw_text,
+        fields_instructions=fields_instructions,
+    )
@@ -0,0 +1,367 @@
+"""
+Outbox do Google Sheets para o ultra batch: um único escritor assíncrono por job.
+
+- As linhas entram na ordem de processamento e saem na mesma ordem
+- Linhas pendentes são coalescidas em poucos values.append (até
+  SHEETS_OUTBOX_MAX_ROWS_PER_APPEND por chamada, esperando até
+  SHEETS_OUTBOX_LINGER_SECONDS para juntar mais linhas)
+- Falhas são retentadas com backoff exponencial; um lote que esgota as
+  tentativas continua no início da fila (nada depois dele é entregue antes),
+  então a ordem da planilha é preservada
+- Só erros que garantem que o append não foi aplicado (429, falha antes do
+  envio) são retentados. Com resultado incerto (5xx, timeout) o escritor para:
+  as linhas do job ficam pendentes para conferência e recuperação manual, em
+  vez de arriscar linhas duplicadas
+- google_sheets_config/{job_id} é lido uma vez por job (enquanto não existe,
+  é reconsultado no máximo a cada SHEETS_OUTBOX_CONFIG_RECHECK_SECONDS)
+
+Persistência: o documento do resultado é gravado com sheets_pending=True e o flag
+só é limpo (em batch) depois que a linha chega à planilha. Se a instância cair
+antes disso, ou se o escritor parar por um resultado incerto, as linhas ficam
+pendentes até recover_pending_sheets_rows_sync reenviá-las. Não há recuperação
+automática: ela é disparada manualmente por POST
+/ultra-batch/sheets-recover/{job_id} (dono do job, na lista digital), depois
+de conferir a planilha.
+"""
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from app.config import (
+    SHEETS_OUTBOX_CLOSE_TIMEOUT_SECONDS,
+    SHEETS_OUTBOX_CONFIG_RECHECK_SECONDS,
+    SHEETS_OUTBOX_LINGER_SECONDS,
+    SHEETS_OUTBOX_MAX_RETRIES,
+    SHEETS_OUTBOX_MAX_ROWS_PER_APPEND,
+    get_firestore_client,
+)
+from app.monitoring import tracing
+from app.services.report_analyzer.google_sheets_service import (
+    _limpar_resposta_para_sheets,
+    append_rows_to_sheet_sync,
+    get_sheets_config,
+    is_incremental_row,
+)
+from app.services.report_analyzer.sheets_rate_limiter import is_safe_to_retry_write
+
+logger = logging.getLogger(__name__)
+
+PENDING_FIELD = "sheets_pending"
+BACKOFF_MAX_SECONDS = 30.0
+# Limite de operações de um WriteBatch do Firestore
+FIRESTORE_BATCH_LIMIT = 500
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {}
+
+
+def _empty_stats() -> Dict[str, int]:
+    return {
+        "appends": 0,
+        "rows_delivered": 0,
+        "rows_skipped": 0,
+        "retries": 0,
+        "rows_failed": 0,
+        "rows_recovered": 0,
+    }
+
+
+_stats = _empty_stats()
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def get_outbox_stats() -> Dict[str, int]:
+    """Acumulados de todos os outboxes do processo."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_outbox_stats() -> None:
+    """Zera os acumulados (útil para testes)."""
+    global _stats
+    with _stats_lock:
+        _stats = _empty_stats()
+
+
+@dataclass
+class PendingRow:
+    result_id: str
+    account_number: str
+    final_message: str
+    processed_at_epoch_ms: Optional[int]
+
+
+def _clear_pending_sync(job_id: str, result_ids: List[str]) -> None:
+    """Marca os resultados como entregues (sheets_pending=False) em WriteBatches."""
+    db = get_firestore_client()
+    results_ref = db.collection("ultra_batch_jobs").document(job_id).collection("results")
+    for start in range(0, len(result_ids), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for result_id in result_ids[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.update(results_ref.document(result_id), {PENDING_FIELD: False})
+        batch.commit()
+
+
+def _to_values(rows: List[PendingRow]) -> List[List[str]]:
+    return [[r.account_number, _limpar_resposta_para_sheets(r.final_message)] for r in rows]
+
+
+class SheetsOutbox:
+    """
+    Fila ordenada de linhas do Sheets de um job, drenada por uma única task.
+
+    Uso: enqueue() após gravar o resultado (com sheets_pending=True) e
+    `await close()` ao fim do job.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        max_rows_per_append: int = SHEETS_OUTBOX_MAX_ROWS_PER_APPEND,
+        linger_seconds: float = SHEETS_OUTBOX_LINGER_SECONDS,
+        max_retries: int = SHEETS_OUTBOX_MAX_RETRIES,
+        config_recheck_seconds: float = SHEETS_OUTBOX_CONFIG_RECHECK_SECONDS,
+        backoff_base_seconds: float = 1.0,
+    ):
+        self.job_id = job_id
+        self.max_rows_per_append = max(1, max_rows_per_append)
+        self.linger_seconds = linger_seconds
+        self.max_retries = max(1, max_retries)
+        self.config_recheck_seconds = config_recheck_seconds
+        self.backoff_base_seconds = backoff_base_seconds
+        self._pending: List[PendingRow] = []
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        # Append com resultado incerto: nada mais é enviado para este job
+        self._halted = False
+        self._task: Optional[asyncio.Task] = None
+        self._config: Optional[Dict[str, Any]] = None
+        self._config_loaded = False
+        self._config_checked_at: Optional[float] = None
+
+    def enqueue(
+        self,
+        result_id: str,
+        account_number: str,
+        final_message: str,
+        processed_at_epoch_ms: Optional[int],
+    ) -> None:
+        """Adiciona uma linha ao fim da fila e garante que o escritor está rodando."""
+        if self._closing:
+            logger.warning("[SHEETS-OUTBOX] Job %s: enqueue após close, linha fica pendente", self.job_id)
+            return
+        if self._halted:
+            _count("rows_failed")
+            return
+        self._pending.append(PendingRow(result_id, account_number, final_message, processed_at_epoch_ms))
+        self._ensure_writer()
+        if len(self._pending) >= self.max_rows_per_append:
+            self._wakeup.set()
+
+    def _ensure_writer(self) -> None:
+        """(Re)inicia o escritor se ainda não existe ou se terminou (ex.: erro inesperado)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: Optional[float] = SHEETS_OUTBOX_CLOSE_TIMEOUT_SECONDS) -> None:
+        """
+        Drena a fila e encerra o escritor. Idempotente. Se o timeout estourar, as
+        linhas restantes continuam marcadas como pendentes no Firestore.
+        """
+        self._closing = True
+        self._wakeup.set()
+        if self._pending and not self._halted:
+            self._ensure_writer()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "[SHEETS-OUTBOX] Job %s: timeout ao drenar outbox, %d linhas ficam pendentes",
+                self.job_id, len(self._pending),
+            )
+            self._task.cancel()
+
+    async def _wait_wakeup(self, timeout: Optional[float]) -> None:
+        self._wakeup.clear()
+        if self._closing:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _load_config(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Config do job: lido uma vez quando existe; ausente, reconsultado com intervalo
+        mínimo (ou imediatamente com force, usado no fechamento).
+        """
+        if self._config_loaded:
+            return self._config
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        recently_checked = (
+            self._config_checked_at is not None and now - self._config_checked_at < self.config_recheck_seconds
+        )
+        if recently_checked and not force:
+            return None
+        self._config_checked_at = now
+        try:
+            config = await loop.run_in_executor(None, get_sheets_config, self.job_id, not force)
+        except Exception as e:
+            logger.warning("[SHEETS-OUTBOX] Job %s: erro ao ler config do Sheets: %s", self.job_id, e)
+            return None
+        if config is not None:
+            self._config = config
+            self._config_loaded = True
+        return config
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                while not self._pending and not self._closing:
+                    await self._wait_wakeup(None)
+                if not self._pending:
+                    return
+                if len(self._pending) < self.max_rows_per_append:
+                    # Espera um pouco para coalescer mais linhas no mesmo append
+                    await self._wait_wakeup(self.linger_seconds)
+
+                config = await self._load_config(force=self._closing)
+                if config is None:
+                    if self._closing:
+                        # Sem planilha: o backfill cobre estas linhas se ela for criada depois
+                        _count("rows_skipped", len(self._pending))
+                        self._pending.clear()
+                        return
+                    await self._wait_wakeup(self.config_recheck_seconds)
+                    continue
+
+                batch = self._pending[:self.max_rows_per_append]
+                if await self._deliver(config, batch):
+                    del self._pending[:len(batch)]
+                    continue
+                if self._closing or self._halted:
+                    # Nada depois do lote que falhou foi entregue: a recuperação reenvia tudo em ordem
+                    _count("rows_failed", len(self._pending))
+                    logger.error(
+                        "[SHEETS-OUTBOX] Job %s: %d linhas não entregues (ficam pendentes)",
+                        self.job_id, len(self._pending),
+                    )
+                    self._pending.clear()
+                    return
+                # O lote continua no início da fila; nova rodada de tentativas após a pausa
+                await self._wait_wakeup(BACKOFF_MAX_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("[SHEETS-OUTBOX] Job %s: escritor interrompido: %s", self.job_id, e, exc_info=True)
+
+    async def _deliver(self, config: Dict[str, Any], batch: List[PendingRow]) -> bool:
+        """
+        Um values.append para o lote (com retry/backoff) e limpeza dos flags pendentes.
+        Retorna False se as tentativas se esgotaram (o lote deve continuar na fila)
+        ou se o resultado do append é incerto (o escritor para).
+        """
+        if not config.get("enabled"):
+            _count("rows_skipped", len(batch))
+            return True
+        rows = [r for r in batch if is_incremental_row(config, r.processed_at_epoch_ms)]
+        if not rows:
+            _count("rows_skipped", len(batch))
+            return True
+
+        loop = asyncio.get_running_loop()
+        values = _to_values(rows)
+        with tracing.span("sheets.append", job_id=self.job_id, rows=len(rows)) as append_span:
+            for attempt in range(self.max_retries):
+                append_span.set(attempts=attempt + 1)
+                try:
+                    await loop.run_in_executor(
+                        None, tracing.with_current_context(append_rows_to_sheet_sync, config, values, self.job_id)
+                    )
+                    break
+                except Exception as e:
+                    if not is_safe_to_retry_write(e):
+                        self._halted = True
+                        append_span.record_exception(e)
+                        logger.error(
+                            "[SHEETS-OUTBOX] Job %s: append de %d linhas com resultado incerto (%s); "
+                            "escritor parado, confira a planilha e recupere as pendentes via "
+                            "POST /ultra-batch/sheets-recover/{job_id}",
+                            self.job_id, len(rows), e,
+                        )
+                        return False
+                    if attempt == self.max_retries - 1:
+                        append_span.record_exception(e)
+                        logger.error(
+                            "[SHEETS-OUTBOX] Job %s: append de %d linhas falhou após %d tentativas: %s",
+                            self.job_id, len(rows), self.max_retries, e,
+                        )
+                        return False
+                    wait = min(self.backoff_base_seconds * 2 ** attempt, BACKOFF_MAX_SECONDS)
+                    _count("retries")
+                    logger.warning(
+                        "[SHEETS-OUTBOX] Job %s: falha no append (tentativa %d/%d), retry em %.1fs: %s",
+                        self.job_id, attempt + 1, self.max_retries, wait, e,
+                    )
+                    await asyncio.sleep(wait)
+
+        _count("rows_skipped", len(batch) - len(rows))
+        _count("appends")
+        _count("rows_delivered", len(rows))
+        logger.debug("[SHEETS-OUTBOX] Job %s: %d linhas entregues", self.job_id, len(rows))
+        try:
+            await loop.run_in_executor(None, _clear_pending_sync, self.job_id, [r.result_id for r in rows])
+        except Exception as e:
+            # As linhas já estão na planilha; uma recuperação posterior as duplicaria
+            logger.warning("[SHEETS-OUTBOX] Job %s: erro ao limpar %s: %s", self.job_id, PENDING_FIELD, e)
+        return True
+
+
+def recover_pending_sheets_rows_sync(
+    job_id: str,
+    max_rows_per_append: int = SHEETS_OUTBOX_MAX_ROWS_PER_APPEND,
+) -> int:
+    """
+    Reenvia para a planilha os resultados com sheets_pending=True (ex.: instância caiu
+    antes do outbox entregar). Respeita a ordem de processamento e o corte por
+    created_at_epoch_ms. Não deve rodar enquanto o job ainda está em processamento.
+
+    Returns:
+        Número de linhas reenviadas
+    """
+    config = get_sheets_config(job_id)
+    if not config or not config.get("enabled"):
+        return 0
+
+    db = get_firestore_client()
+    results_ref = db.collection("ultra_batch_jobs").document(job_id).collection("results")
+    rows: List[PendingRow] = []
+    for doc in results_ref.where(PENDING_FIELD, "==", True).stream():
+        data = doc.to_dict()
+        account = data.get("accountNumber", "")
+        message = data.get("final_message", "")
+        processed_at_epoch_ms = data.get("processedAt_epoch_ms")
+        if data.get("success") and account and message and is_incremental_row(config, processed_at_epoch_ms):
+            rows.append(PendingRow(doc.id, account, message, processed_at_epoch_ms))
+    rows.sort(key=lambda r: (r.processed_at_epoch_ms or 0, r.result_id))
+
+    recovered = 0
+    for start in range(0, len(rows), max(1, max_rows_per_append)):
+        chunk = rows[start:start + max_rows_per_append]
+        append_rows_to_sheet_sync(config, _to_values(chunk), job_id)
+        _clear_pending_sync(job_id, [r.result_id for r in chunk])
+        recovered += len(chunk)
+
+    if recovered:
+        _count("rows_recovered", recovered)
+        logger.info("[SHEETS-OUTBOX] Job %s: %d linhas pendentes recuperadas", job_id, recovered)
+    return recovered
@@ -0,0 +1,313 @@
+"""
+Limitador de quota das APIs Google Sheets/Drive, compartilhado por todo o processo.
+
+O Sheets limita requisições de escrita por minuto (por projeto e por usuário; aqui
+o usuário é a service account). Jobs de ultra batch simultâneos e backfills em
+BackgroundTasks disputam essa mesma quota, então:
+
+- Um token bucket por API (SHEETS_QUOTA_REQUESTS_PER_MINUTE / DRIVE_QUOTA_REQUESTS_PER_MINUTE)
+- Justiça entre jobs: com o bucket disputado, os tokens são entregues em round-robin
+  entre os jobs que estão esperando (FIFO dentro de cada job)
+- execute_with_quota lê o status do HttpError: 429 e 5xx são retentados
+  (respeitando Retry-After); um 429 também pausa o bucket inteiro. Escritas não
+  idempotentes (files.create, values.append) só são retentadas em 429: um 5xx
+  pode chegar depois de a escrita ter sido aplicada
+- get_quota_stats() expõe espera, throttling e uso por job, para estimar quantos
+  jobs com Sheets uma instância comporta
+
+As chamadas são síncronas (rodam em threads do executor), por isso o bucket usa
+threading.Condition.
+"""
+import logging
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
+from httplib2 import ServerNotFoundError
+
+from app.config import (
+    DRIVE_QUOTA_REQUESTS_PER_MINUTE,
+    GOOGLE_API_MAX_ATTEMPTS,
+    SHEETS_QUOTA_BURST,
+    SHEETS_QUOTA_REQUESTS_PER_MINUTE,
+)
+from app.monitoring import tracing
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# Janela usada para requisições/minuto e jobs ativos nas estatísticas
+STATS_WINDOW_SECONDS = 60.0
+# Chave de fairness para chamadas sem job (ex.: criação de planilha fora do ultra batch)
+NO_JOB = "_"
+# Jobs mais recentes mantidos em by_job (o processo é de longa duração)
+STATS_MAX_JOBS = 200
+# Erros que acontecem antes de a requisição chegar ao servidor (escrita não aplicada)
+PRE_SEND_ERRORS = (ConnectionRefusedError, socket.gaierror, ServerNotFoundError, RefreshError)
+
+
+class TokenBucket:
+    """Token bucket thread-safe com fila round-robin por job."""
+
+    def __init__(self, name: str, rate_per_minute: int, burst: Optional[int] = None):
+        self.name = name
+        self.rate_per_second = max(rate_per_minute, 1) / 60.0
+        self.capacity = float(max(burst if burst is not None else rate_per_minute, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        # job -> fila de tickets; ordem dos jobs define de quem é a vez
+        self._waiting: Dict[str, Deque[object]] = {}
+        self._turns: "OrderedDict[str, None]" = OrderedDict()
+        self._recent: Deque[tuple] = deque()
+        self._stats = self._empty_stats()
+        self._by_job: "OrderedDict[str, int]" = OrderedDict()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {
+            "acquired": 0,
+            "throttled": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "pauses": 0,
+        }
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_second)
+            self._updated_at = now
+
+    def _seconds_until_token(self, now: float) -> float:
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate_per_second
+
+    def waiting_count(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._waiting.values())
+
+    def acquire(self, job_id: Optional[str] = None) -> float:
+        """Bloqueia até obter um token na vez do job. Retorna os segundos esperados."""
+        job = job_id or NO_JOB
+        ticket = object()
+        started = time.monotonic()
+        with self._cond:
+            self._waiting.setdefault(job, deque()).append(ticket)
+            self._turns.setdefault(job, None)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._seconds_until_token(now)
+                my_turn = next(iter(self._turns)) == job and self._waiting[job][0] is ticket
+                if my_turn and wait <= 0:
+                    self._tokens -= 1
+                    self._grant(job, now)
+                    waited = now - started
+                    self._record_wait(job, waited)
+                    self._cond.notify_all()
+                    return waited
+                # Fora da vez: espera ser notificado; na vez: espera o próximo token
+                self._cond.wait(timeout=wait if my_turn else None)
+
+    def _grant(self, job: str, now: float) -> None:
+        self._waiting[job].popleft()
+        del self._turns[job]
+        if self._waiting[job]:
+            self._turns[job] = None
+        else:
+            del self._waiting[job]
+        self._recent.append((now, job))
+        while self._recent and now - self._recent[0][0] > STATS_WINDOW_SECONDS:
+            self._recent.popleft()
+
+    def _record_wait(self, job: str, waited: float) -> None:
+        stats = self._stats
+        stats["acquired"] += 1
+        self._by_job[job] = self._by_job.get(job, 0) + 1
+        self._by_job.move_to_end(job)
+        while len(self._by_job) > STATS_MAX_JOBS:
+            self._by_job.popitem(last=False)
+        if waited > 0.001:
+            stats["throttled"] += 1
+            stats["wait_seconds_total"] += waited
+            stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+
+    def pause(self, seconds: float) -> None:
+        """Suspende a entrega de tokens (quota estourada no servidor)."""
+        with self._cond:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated_at = now
+            self._stats["pauses"] += 1
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            recent = [job for ts, job in self._recent if now - ts <= STATS_WINDOW_SECONDS]
+            stats = {**self._stats, "by_job": dict(self._by_job)}
+            waiting = sum(len(q) for q in self._waiting.values())
+        rate_per_minute = self.rate_per_second * 60
+        active_jobs = len(set(recent) - {NO_JOB})
+        stats.update({
+            "rate_per_minute": round(rate_per_minute, 2),
+            "burst": self.capacity,
+            "waiting": waiting,
+            "requests_last_minute": len(recent),
+            "utilization": round(len(recent) / rate_per_minute, 3),
+            "active_jobs": active_jobs,
+            "wait_seconds_avg": (
+                round(stats["wait_seconds_total"] / stats["throttled"], 3) if stats["throttled"] else None
+            ),
+        })
+        # Quantos jobs no ritmo atual cabem na quota (só com jobs ativos na janela)
+        job_requests = len([job for job in recent if job != NO_JOB])
+        stats["estimated_job_capacity"] = (
+            int(rate_per_minute // (job_requests / active_jobs)) if active_jobs and job_requests else None
+        )
+        return stats
+
+
+_buckets_lock = threading.Lock()
+_buckets: Dict[str, TokenBucket] = {}
+_http_stats_lock = threading.Lock()
+_http_stats: Dict[str, Dict[str, int]] = {}
+
+_BUCKET_SETTINGS = {
+    "sheets": (SHEETS_QUOTA_REQUESTS_PER_MINUTE, SHEETS_QUOTA_BURST),
+    "drive": (DRIVE_QUOTA_REQUESTS_PER_MINUTE, None),
+}
+
+
+def get_bucket(api: str) -> TokenBucket:
+    """Bucket do processo para a API ("sheets" ou "drive")."""
+    with _buckets_lock:
+        bucket = _buckets.get(api)
+        if bucket is None:
+            rate, burst = _BUCKET_SETTINGS[api]
+            bucket = TokenBucket(api, rate, burst)
+            _buckets[api] = bucket
+        return bucket
+
+
+def _count_http(api: str, key: str) -> None:
+    with _http_stats_lock:
+        stats = _http_stats.setdefault(api, {"http_429": 0, "http_5xx": 0, "retries": 0, "errors": 0})
+        stats[key] += 1
+
+
+def http_status(error: HttpError) -> Optional[int]:
+    """Status HTTP de um HttpError (None se ausente)."""
+    try:
+        return int(error.resp.status)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(error: HttpError) -> Optional[float]:
+    """Valor do header Retry-After (em segundos), quando presente e numérico."""
+    try:
+        value = error.resp.get("retry-after")
+    except AttributeError:
+        return None
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_safe_to_retry_write(error: BaseException) -> bool:
+    """
+    True se o erro garante que uma escrita não foi aplicada: 429 (rejeitada pela
+    quota) ou falha antes do envio. 5xx, timeouts e conexões resetadas são incertos.
+    """
+    if isinstance(error, HttpError):
+        return http_status(error) == 429
+    return isinstance(error, PRE_SEND_ERRORS)
+
+
+def _backoff(attempt: int) -> float:
+    wait = min(BACKOFF_BASE_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS)
+    return wait + random.uniform(0, wait / 2)
+
+
+def execute_with_quota(
+    api: str,
+    request: Any,
+    job_id: Optional[str] = None,
+    max_attempts: int = GOOGLE_API_MAX_ATTEMPTS,
+    idempotent: bool = True,
+) -> Any:
+    """
+    Executa um HttpRequest do googleapiclient consumindo um token do bucket da API.
+    429/5xx são retentados com Retry-After ou backoff exponencial com jitter;
+    demais erros são propagados imediatamente. Com idempotent=False (criação de
+    arquivo, append de linhas) só o 429 é retentado.
+    """
+    retryable = RETRYABLE_STATUSES if idempotent else frozenset({429})
+    bucket = get_bucket(api)
+    quota_wait = 0.0
+    with tracing.span(f"google.{api}.execute", job_id=job_id) as request_span:
+        for attempt in range(max_attempts):
+            quota_wait += bucket.acquire(job_id)
+            request_span.set(attempts=attempt + 1, quota_wait_seconds=round(quota_wait, 3))
+            try:
+                return request.execute()
+            except HttpError as e:
+                status = http_status(e)
+                request_span.set(http_status_code=status)
+                if status == 429:
+                    _count_http(api, "http_429")
+                elif status is not None and status >= 500:
+                    _count_http(api, "http_5xx")
+                if status not in retryable or attempt == max_attempts - 1:
+                    _count_http(api, "errors")
+                    raise
+                wait = retry_after_seconds(e)
+                if wait is None:
+                    wait = _backoff(attempt)
+                if status == 429:
+                    # Quota do servidor estourada: todos os jobs esperam, não só este
+                    bucket.pause(wait)
+                _count_http(api, "retries")
+                logger.warning(
+                    "Google %s HTTP %s (job=%s, tentativa %d/%d), retry em %.1fs",
+                    api, status, job_id, attempt + 1, max_attempts, wait,
+                )
+                time.sleep(wait)
+
+
+def get_quota_stats() -> Dict[str, Any]:
+    """Snapshot por API: bucket (espera, throttling, uso por job) e respostas HTTP."""
+    with _buckets_lock:
+        buckets = dict(_buckets)
+    with _http_stats_lock:
+        http = {api: dict(stats) for api, stats in _http_stats.items()}
+    out: Dict[str, Any] = {}
+    for api in _BUCKET_SETTINGS:
+        out[api] = {
+            **(buckets[api].snapshot() if api in buckets else {}),
+            **http.get(api, {"http_429": 0, "http_5xx": 0, "retries": 0, "errors": 0}),
+        }
+    return out
+
+
+def reset_quota_limiter() -> None:
+    """Descarta buckets e estatísticas (útil para testes)."""
+    with _buckets_lock:
+        _buckets.clear()
+    with _http_stats_lock:
+        _http_stats.clear()
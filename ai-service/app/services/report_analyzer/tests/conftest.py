@@ -0,0 +1,19 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def run_async():
+    """
+    Executa corrotinas num loop próprio, sem instalá-lo como loop corrente:
+    asyncio.run() deixa a política sem loop e quebra testes que criam
+    asyncio.Future() fora de um loop (ex.: test_ultra_batch_sheets_latency).
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        yield loop.run_until_complete
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
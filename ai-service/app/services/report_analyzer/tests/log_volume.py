@@ -0,0 +1,141 @@
+"""
+Mede o volume de stdout/stderr do pipeline de relatórios num lote de N arquivos.
+
+Roda process_batch_reports de ponta a ponta (extract_pdf com PyMuPDF de verdade,
+sobre um PDF sintético) com o Gemini e o store de resultados substituídos por
+fakes, e conta linhas e bytes escritos no console durante o lote.
+
+Uso (a partir de ai-service):
+
+    python -m app.services.report_analyzer.tests.log_volume --files 100
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import sys
+from typing import Any, Dict
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import fitz
+
+from app.services.report_analyzer.batch_processing import process_batch_reports
+
+PDF_PAGES = 4
+
+_EXTRACTED = {
+    "accountNumber": "123456",
+    "reportMonth": "09/2024",
+    "grossEquity": "R$ 100.000,00",
+    "monthlyReturn": "1,06%",
+    "monthlyCdi": "91,38%",
+    "monthlyGain": "R$ 1.234,56",
+    "yearlyReturn": "12,34%",
+    "yearlyCdi": "136,78%",
+    "yearlyGain": "R$ 12.345,67",
+    "benchmarkValues": {"CDI": "1,16%", "IPCA": "-0,13%"},
+    "classPerformance": [
+        {"className": "Pós Fixado", "return": "1,17%", "cdiPercentage": "100,86%"},
+        {"className": "Inflação", "return": "0,52%", "cdiPercentage": "44,83%"},
+    ],
+    "highlights": {},
+    "detractors": {},
+}
+_ANALYSIS = {
+    "highlights": [{"className": "Pós Fixado", "benchmarkDifference": "0,01%", "drivers": []}],
+    "detractors": [{"className": "Inflação", "benchmarkDifference": "-0,64%"}],
+}
+
+
+def make_pdf(pages: int = PDF_PAGES) -> str:
+    """PDF pequeno com texto em todas as páginas, em base64."""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page(width=300, height=200)
+        page.insert_text((20, 40), f"Relatório XP - página {page_num + 1}")
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return base64.b64encode(pdf_bytes).decode("utf-8")
+
+
+def _fake_generate_content(model: str, contents: Any, config: Dict[str, Any] = None) -> MagicMock:
+    schema = (config or {}).get("response_json_schema")
+    if schema is None:
+        text = "Olá, 123456!\n🔎 Resumo da performance: sua carteira rendeu 1,06% no mês."
+    elif "classPerformance" in schema.get("properties", {}):
+        text = json.dumps(_EXTRACTED, ensure_ascii=False)
+    else:
+        text = json.dumps(_ANALYSIS, ensure_ascii=False)
+    return MagicMock(text=text)
+
+
+def fake_gemini_client() -> MagicMock:
+    client = MagicMock()
+    client.models.generate_content.side_effect = _fake_generate_content
+    return client
+
+
+@contextlib.contextmanager
+def patched_externals():
+    """Gemini e store de resultados falsos (sem rede, sem reaproveitamento)."""
+    client = fake_gemini_client()
+    nodes = "app.services.report_analyzer.nodes"
+    with patch(f"{nodes}.extract_data.get_gemini_client", return_value=client), \
+         patch(f"{nodes}.analyze_report.get_gemini_client", return_value=client), \
+         patch(f"{nodes}.format_message.get_gemini_client", return_value=client), \
+         patch("app.services.report_analyzer.batch_processing.get_stored_result", AsyncMock(return_value=None)), \
+         patch("app.services.report_analyzer.batch_processing.save_result", AsyncMock()):
+        yield client
+
+
+def run_on_private_loop(coro: Any) -> Any:
+    """
+    Executa a corrotina num loop próprio, sem instalá-lo como corrente: ao contrário
+    de asyncio.run(), não deixa a política do asyncio sem loop para os testes seguintes.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+
+def measure(file_count: int) -> Dict[str, Any]:
+    """Processa file_count arquivos e devolve o volume de console e o resultado do lote."""
+    data_uri = make_pdf()
+    files = [{"name": f"relatorio_{i:03d}.pdf", "dataUri": data_uri} for i in range(file_count)]
+    captured = io.StringIO()
+    with patched_externals():
+        with contextlib.redirect_stdout(captured), contextlib.redirect_stderr(captured):
+            results = run_on_private_loop(process_batch_reports(files, "uid-bench"))
+    output = captured.getvalue()
+    lines = output.count("\n")
+    return {
+        "files": file_count,
+        "succeeded": sum(1 for r in results if r.get("success")),
+        "lines": lines,
+        "bytes": len(output.encode("utf-8")),
+        "lines_per_file": round(lines / max(1, file_count), 2),
+        "output": output,
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Volume de console do pipeline de relatórios")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--show", action="store_true", help="Imprime as primeiras linhas capturadas")
+    args = parser.parse_args(argv)
+
+    report = measure(args.files)
+    output = report.pop("output")
+    print(json.dumps(report))
+    if args.show:
+        print("".join(output.splitlines(keepends=True)[:40]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
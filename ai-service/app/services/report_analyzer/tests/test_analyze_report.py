@@ -1,6 +1,7 @@
 """
 Testes unitários para o nó analyze_report.
 """
+import re
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from app.services.report_analyzer.nodes.analyze_report import (
@@ -432,4 +433,132 @@ def test_analyze_report_with_drivers(mock_llm_class):
     assert len(result['highlights']) == 1
     assert 'drivers' in result['highlights'][0]
     assert len(result['highlights'][0]['drivers']) == 2
-    assert result['highlights'][0]['drivers'][0]['asset'] == 'LCA BANCO ITAU'
\ No newline at end of file
+    assert result['highlights'][0]['drivers'][0]['asset'] == 'LCA BANCO ITAU'
+
+# ==================== TESTES DE ANÁLISE PERSONALIZADA INCREMENTAL ====================
+
+PERSONALIZED_DATA = {
+    'accountNumber': '123456',
+    'reportMonth': '09/2024',
+    'benchmarkValues': {'CDI': '1,16%', 'IPCA': '0,44%', 'Ibovespa': '3,40%'},
+    'classPerformance': [
+        {'className': 'Pós Fixado', 'return': '1,30%'},
+        {'className': 'Inflação', 'return': '0,20%'},
+        {'className': 'Renda Variável Brasil', 'return': '4,00%'},
+    ],
+    'allAssets': {
+        'Pós Fixado': [{'assetName': 'LCA BANCO ITAU', 'assetReturn': '1,30%'}],
+        'Inflação': [{'assetName': 'NTN-B 2030', 'assetReturn': '0,20%'}],
+        'Renda Variável Brasil': [{'assetName': 'PETR4', 'assetReturn': '4,00%'}],
+    },
+}
+
+LLM_BY_CLASS = {
+    'Pós Fixado': {'highlights': [{'className': 'Pós Fixado', 'benchmarkDifference': '0,14%', 'drivers': []}]},
+    'Inflação': {'detractors': [{'className': 'Inflação', 'benchmarkDifference': '-0,24%'}]},
+    'Renda Variável Brasil': {'highlights': [{'className': 'Renda Variável Brasil', 'benchmarkDifference': '0,60%', 'drivers': []}]},
+}
+
+
+def _prompt_has_class(prompt, name):
+    return re.search(rf'"className":\s*"{re.escape(name)}"', prompt) is not None
+
+
+def _fake_llm(prompt, **kwargs):
+    """Responde apenas pelas classes presentes no prompt."""
+    analysis = {'highlights': [], 'detractors': []}
+    for name, piece in LLM_BY_CLASS.items():
+        if _prompt_has_class(prompt, name):
+            for key, items in piece.items():
+                analysis[key].extend(items)
+    return analysis
+
+
+def _selection(*class_names):
+    return {'classPerformance': {name: True for name in class_names}}
+
+
+@pytest.fixture
+def clean_class_cache():
+    from app.services.report_analyzer import class_analysis_cache
+    class_analysis_cache.clear_cache()
+    yield
+    class_analysis_cache.clear_cache()
+
+
+@patch('app.services.report_analyzer.nodes.analyze_report.call_llm_with_retry', side_effect=_fake_llm)
+def test_personalized_reuses_classes_across_selections(mock_llm, clean_class_cache):
+    first = analyze_report({
+        'extracted_data': PERSONALIZED_DATA,
+        'analysis_mode': 'personalized',
+        'selected_fields': _selection('Pós Fixado', 'Inflação'),
+    })
+    assert first['error'] is None
+    assert first['metadata']['class_cache'] == {'hits': 0, 'misses': 2}
+    assert [d['className'] for d in first['detractors']] == ['Inflação']
+
+    second = analyze_report({
+        'extracted_data': PERSONALIZED_DATA,
+        'analysis_mode': 'personalized',
+        'selected_fields': _selection('Pós Fixado', 'Inflação', 'Renda Variável Brasil'),
+    })
+    assert second['metadata']['class_cache'] == {'hits': 2, 'misses': 1}
+    # Segunda chamada só envia a classe nova ao LLM
+    second_prompt = mock_llm.call_args_list[1].kwargs['prompt']
+    assert 'Renda Variável Brasil' in second_prompt
+    assert not _prompt_has_class(second_prompt, 'Pós Fixado')
+    # Highlights remontados em ordem de diferença
+    assert [h['className'] for h in second['highlights']] == ['Renda Variável Brasil', 'Pós Fixado']
+
+    third = analyze_report({
+        'extracted_data': PERSONALIZED_DATA,
+        'analysis_mode': 'personalized',
+        'selected_fields': _selection('Pós Fixado'),
+    })
+    assert third['metadata']['class_cache'] == {'hits': 1, 'misses': 0}
+    assert mock_llm.call_count == 2
+
+
+@patch('app.services.report_analyzer.nodes.analyze_report.call_llm_with_retry', side_effect=_fake_llm)
+def test_personalized_cache_is_scoped_to_extraction_session(mock_llm, clean_class_cache):
+    selection = _selection('Pós Fixado')
+    analyze_report({'extracted_data': PERSONALIZED_DATA, 'analysis_mode': 'personalized', 'selected_fields': selection})
+
+    other_report = {**PERSONALIZED_DATA, 'accountNumber': '999999'}
+    result = analyze_report({'extracted_data': other_report, 'analysis_mode': 'personalized', 'selected_fields': selection})
+
+    assert result['metadata']['class_cache'] == {'hits': 0, 'misses': 1}
+    assert mock_llm.call_count == 2
+
+
+@patch('app.services.report_analyzer.nodes.analyze_report.ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD', 2)
+@patch('app.services.report_analyzer.nodes.analyze_report.call_llm_with_retry', side_effect=_fake_llm)
+def test_personalized_map_reduce_one_call_per_class(mock_llm, clean_class_cache):
+    result = analyze_report({
+        'extracted_data': PERSONALIZED_DATA,
+        'analysis_mode': 'personalized',
+        'selected_fields': _selection('Pós Fixado', 'Inflação', 'Renda Variável Brasil'),
+    })
+
+    assert result['error'] is None
+    assert mock_llm.call_count == 3
+    for call in mock_llm.call_args_list:
+        prompt = call.kwargs['prompt']
+        assert sum(_prompt_has_class(prompt, name) for name in LLM_BY_CLASS) == 1
+    assert [h['className'] for h in result['highlights']] == ['Renda Variável Brasil', 'Pós Fixado']
+    assert [d['className'] for d in result['detractors']] == ['Inflação']
+    assert set(result['allAssets']) == set(LLM_BY_CLASS)
+
+
+@patch('app.services.report_analyzer.nodes.analyze_report.ANALYSIS_MAP_REDUCE_ASSET_THRESHOLD', 2)
+@patch('app.services.report_analyzer.nodes.analyze_report.call_llm_with_retry')
+def test_personalized_map_reduce_fails_if_a_class_fails(mock_llm, clean_class_cache):
+    mock_llm.side_effect = lambda prompt, **kwargs: None if _prompt_has_class(prompt, 'Inflação') else _fake_llm(prompt)
+
+    result = analyze_report({
+        'extracted_data': PERSONALIZED_DATA,
+        'analysis_mode': 'personalized',
+        'selected_fields': _selection('Pós Fixado', 'Inflação', 'Renda Variável Brasil'),
+    })
+
+    assert result['error'] == 'Falha ao gerar análise após 3 tentativas'
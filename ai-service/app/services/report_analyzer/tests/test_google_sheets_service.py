@@ -0,0 +1,256 @@
+"""
+Testes do pool de clientes Google Sheets/Drive (credenciais em cache, serviço por thread),
+do backfill paginado e do cache de google_sheets_config.
+"""
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services.report_analyzer import google_sheets_service as gss
+
+MODULE = "app.services.report_analyzer.google_sheets_service"
+
+
+@pytest.fixture(autouse=True)
+def _reset_pool():
+    gss.reset_sheets_client_pool()
+    gss.clear_sheets_config_cache()
+    yield
+    gss.reset_sheets_client_pool()
+    gss.clear_sheets_config_cache()
+
+
+@pytest.fixture
+def mock_google():
+    with patch(f"{MODULE}.get_google_sheets_credentials", return_value={"type": "service_account"}) as mock_creds_dict, \
+         patch(f"{MODULE}.Credentials.from_service_account_info", return_value=MagicMock()) as mock_creds, \
+         patch(f"{MODULE}.build", side_effect=lambda *a, **kw: MagicMock()) as mock_build:
+        yield mock_creds_dict, mock_creds, mock_build
+
+
+def test_credentials_parsed_once(mock_google):
+    mock_creds_dict, mock_creds, _ = mock_google
+
+    first = gss._get_credentials()
+    second = gss._get_credentials()
+
+    assert first is second
+    mock_creds_dict.assert_called_once()
+    mock_creds.assert_called_once()
+    assert gss.get_sheets_client_stats()["credentials_built"] == 1
+
+
+def test_service_reused_within_thread_and_built_per_thread(mock_google):
+    _, _, mock_build = mock_google
+
+    service = gss._get_sheets_service()
+    assert gss._get_sheets_service() is service
+    assert mock_build.call_count == 1
+    assert mock_build.call_args.kwargs["static_discovery"] is True
+    assert mock_build.call_args.kwargs["cache_discovery"] is False
+
+    other = {}
+    t = threading.Thread(target=lambda: other.setdefault("service", gss._get_sheets_service()))
+    t.start()
+    t.join()
+
+    assert other["service"] is not service
+    assert mock_build.call_count == 2
+    assert gss.get_sheets_client_stats()["services_built"]["sheets"] == 2
+
+
+def test_writes_reuse_pooled_service(mock_google):
+    _, _, mock_build = mock_google
+
+    for _ in range(3):
+        gss._batch_write_rows_sync("sid", "Resultados", [["1", "msg"]])
+    gss._write_row_sync("sid", "Resultados", ["2", "msg"])
+
+    assert mock_build.call_count == 1
+
+
+def test_batch_flush_records_latency(mock_google):
+    config = MagicMock()
+    config.exists = True
+    config.to_dict.return_value = {"enabled": True, "spreadsheet_id": "sid", "created_at_epoch_ms": 0}
+    db = MagicMock()
+    db.collection.return_value.document.return_value.get.return_value = config
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db):
+        gss.batch_flush_rows_to_sheets_sync("job1", [("123", "```Olá```", 10), ("456", "Oi", 20)])
+
+    stats = gss.get_sheets_client_stats()
+    assert stats["flushes"] == 1
+    assert stats["flush_rows"] == 2
+    assert stats["flush_errors"] == 0
+    assert stats["last_flush_latency_ms"] is not None
+    assert stats["flush_latency_ms_avg"] == round(stats["flush_latency_ms_total"], 2)
+
+
+class _FakeResultsQuery:
+    """order_by("__name__").limit(n).start_after({"__name__": id}).stream() sobre docs em memória."""
+
+    def __init__(self, docs, limit=None, after=None):
+        self._docs, self._limit, self._after = docs, limit, after
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, n):
+        return _FakeResultsQuery(self._docs, n, self._after)
+
+    def start_after(self, fields):
+        return _FakeResultsQuery(self._docs, self._limit, fields["__name__"])
+
+    def stream(self):
+        docs = sorted(self._docs, key=lambda d: d.id)
+        if self._after is not None:
+            docs = [d for d in docs if d.id > self._after]
+        return iter(docs[:self._limit])
+
+
+def _result_doc(doc_id, epoch_ms):
+    doc = MagicMock()
+    doc.id = doc_id
+    doc.to_dict.return_value = {
+        "success": True, "accountNumber": f"acc{doc_id}", "final_message": f"msg {doc_id}",
+        "processedAt_epoch_ms": epoch_ms,
+    }
+    return doc
+
+
+def _backfill_db(config, docs):
+    config_doc = MagicMock()
+    config_doc.exists = True
+    config_doc.to_dict.return_value = config
+    db = MagicMock()
+    config_ref = db.collection.return_value.document.return_value
+    config_ref.get.return_value = config_doc
+    config_ref.collection.return_value = _FakeResultsQuery(docs)
+    return db, config_ref
+
+
+def test_backfill_pages_and_records_cursor_per_chunk():
+    docs = [_result_doc(f"{i:04d}", 10) for i in range(25)] + [_result_doc("9999", 500)]
+    db, config_ref = _backfill_db({"enabled": True, "spreadsheet_id": "sid", "created_at_epoch_ms": 100}, docs)
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}._batch_write_rows_sync") as mock_write:
+        written = gss.backfill_sheets_from_results_sync("job1", page_size=5, chunk_rows=10)
+
+    assert written == 25
+    assert [len(c.args[2]) for c in mock_write.call_args_list] == [10, 10, 5]
+    assert [row[0] for c in mock_write.call_args_list for row in c.args[2]] == [f"acc{i:04d}" for i in range(25)]
+    updates = [c.args[0] for c in config_ref.update.call_args_list]
+    assert [u["backfill_status"] for u in updates] == ["running", "running", "running", "completed"]
+    assert [u.get("backfilled_rows") for u in updates[1:]] == [10, 20, 25]
+    assert updates[1]["backfill_cursor"] == "0009"
+
+
+def test_backfill_failure_keeps_progress_and_resumes_from_cursor():
+    docs = [_result_doc(f"{i:04d}", 10) for i in range(20)]
+    config = {"enabled": True, "spreadsheet_id": "sid", "created_at_epoch_ms": 100}
+    db, config_ref = _backfill_db(config, docs)
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}._batch_write_rows_sync", side_effect=[None, RuntimeError("quota")]):
+        assert gss.backfill_sheets_from_results_sync("job1", page_size=5, chunk_rows=5) == 5
+
+    updates = [c.args[0] for c in config_ref.update.call_args_list]
+    assert updates[-1]["backfill_status"] == "failed"
+    assert "backfill_cursor" not in updates[-1]
+    assert updates[1]["backfill_cursor"] == "0004"
+
+    resumed = {**config, "backfill_status": "failed", "backfill_cursor": "0004", "backfilled_rows": 5}
+    db, config_ref = _backfill_db(resumed, docs)
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}._batch_write_rows_sync") as mock_write:
+        assert gss.backfill_sheets_from_results_sync("job1", page_size=5, chunk_rows=5) == 15
+
+    assert mock_write.call_args_list[0].args[2][0][0] == "acc0005"
+    assert config_ref.update.call_args_list[-1].args[0]["backfilled_rows"] == 20
+
+
+def test_backfill_stale_detection():
+    assert gss.is_backfill_stale({"backfill_status": "running", "backfill_updated_at_epoch_ms": 0}, now_epoch_ms=10**9)
+    assert not gss.is_backfill_stale({"backfill_status": "running", "backfill_updated_at_epoch_ms": 10**9}, now_epoch_ms=10**9)
+    assert not gss.is_backfill_stale({"backfill_status": "failed"})
+
+
+def _config_db(config):
+    doc = MagicMock()
+    doc.exists = config is not None
+    doc.to_dict.return_value = config
+    db = MagicMock()
+    db.collection.return_value.document.return_value.get.return_value = doc
+    return db
+
+
+def test_config_cache_reads_firestore_once_per_job():
+    db = _config_db({"enabled": True, "spreadsheet_id": "sid", "created_at_epoch_ms": 0})
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}._batch_write_rows_sync"):
+        for i in range(5):
+            gss.batch_flush_rows_to_sheets_sync("job1", [("123", "msg", i)])
+        gss.write_ultra_batch_result_to_sheets_sync("job1", "123", "msg", processed_at_epoch_ms=10)
+
+    assert db.collection.return_value.document.return_value.get.call_count == 1
+    stats = gss.get_sheets_config_cache_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 5
+
+
+def test_config_cache_returns_copies_and_caches_missing_config():
+    db = _config_db(None)
+    with patch(f"{MODULE}.get_firestore_client", return_value=db):
+        assert gss.get_sheets_config("job1") is None
+        assert gss.get_sheets_config("job1") is None
+    assert gss.get_sheets_config_cache_stats()["negative_hits"] == 1
+
+    db = _config_db({"enabled": True})
+    with patch(f"{MODULE}.get_firestore_client", return_value=db):
+        gss.invalidate_sheets_config("job1")
+        config = gss.get_sheets_config("job1")
+        config["enabled"] = False
+        assert gss.get_sheets_config("job1")["enabled"] is True
+
+
+def test_config_cache_invalidated_on_create_and_bypassed_on_demand(run_async):
+    db = _config_db({"enabled": True, "spreadsheet_id": "old"})
+    created = {"spreadsheet_id": "new", "spreadsheet_url": "u", "spreadsheet_name": "n", "sheet_name": "Resultados"}
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}._create_spreadsheet_sync", return_value=created):
+        gss.get_sheets_config("job1")
+        run_async(gss.create_spreadsheet_for_job("job1", "u1"))
+        gss.get_sheets_config("job1")
+        gss.get_sheets_config("job1", use_cache=False)
+
+    assert db.collection.return_value.document.return_value.get.call_count == 3
+    assert gss.get_sheets_config_cache_stats()["invalidations"] == 1
+
+
+def test_create_retry_reuses_spreadsheet_created_before_5xx():
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    drive, sheets = MagicMock(), MagicMock()
+    drive.files.return_value.create.return_value.execute.side_effect = HttpError(
+        httplib2.Response({"status": 503}), b"{}"
+    )
+    drive.files.return_value.list.return_value.execute.return_value = {"files": [{"id": "sid", "webViewLink": "url"}]}
+
+    with patch(f"{MODULE}.SHARED_DRIVE_ID", "drive1"), \
+         patch(f"{MODULE}._get_drive_service", return_value=drive), \
+         patch(f"{MODULE}._get_sheets_service", return_value=sheets), \
+         patch(f"{MODULE}.time.sleep"):
+        result = gss._create_spreadsheet_sync("job1")
+
+    # O 503 não é retentado pelo limitador; o retry acha a planilha pelo appProperty
+    drive.files.return_value.create.return_value.execute.assert_called_once()
+    assert drive.files.return_value.create.call_args.kwargs["body"]["appProperties"] == {gss.JOB_APP_PROPERTY: "job1"}
+    assert "value='job1'" in drive.files.return_value.list.call_args.kwargs["q"]
+    assert (result["spreadsheet_id"], result["spreadsheet_url"]) == ("sid", "url")
+    sheets.spreadsheets.return_value.values.return_value.update.assert_called_once()
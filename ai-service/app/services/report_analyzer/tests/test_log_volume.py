@@ -0,0 +1,27 @@
+"""
+Volume de console do pipeline em lote: com nível INFO, uma linha de resumo por
+arquivo mais o início/fim do lote (ver log_volume.py para a medição com 100 arquivos).
+"""
+import json
+
+from app.monitoring import pipeline_log
+from app.monitoring.pipeline_log import SUMMARY_MESSAGE
+from app.services.report_analyzer.tests.log_volume import measure
+
+
+def test_batch_emits_one_summary_line_per_file():
+    pipeline_log.set_level("INFO")
+    report = measure(6)
+
+    lines = [json.loads(line) for line in report["output"].splitlines()]
+    summaries = [line for line in lines if line["message"] == SUMMARY_MESSAGE]
+
+    assert report["succeeded"] == 6
+    assert report["lines"] == 6 + 2
+    assert sorted(s["file_name"] for s in summaries) == [f"relatorio_{i:03d}.pdf" for i in range(6)]
+    assert len({s["job_id"] for s in summaries}) == 1
+    for summary in summaries:
+        assert summary["status"] == "success"
+        assert summary["extraction_method"] == "pymupdf_multimodal"
+        assert summary["llm_attempts"] == 1
+        assert {"extract_pdf", "extract_data", "analyze_report", "format_message"} <= set(summary["stages_ms"])
@@ -1,158 +1,241 @@
 """
 Testes unitários para o módulo de métricas.
-Cobre validação de metric_type (AT-M4), persistência de record_ultra_batch_complete (AT-M3),
-e gravação de sector para usuários digitais (AT-DS-004, AT-DS-005, AT-DS-006).
+Cobre validação de metric_type (AT-M4), buffer de incrementos em lote,
+registro de ultra_batch em subcoleção com contadores,
+persistência de record_ultra_batch_complete (AT-M3) e gravação de sector para
+usuários digitais (AT-DS-004, AT-DS-005, AT-DS-006).
 """
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 
 
+@pytest.fixture
+def buffer():
+    """Buffer isolado no lugar do singleton, sem thread de flush."""
+    from app.services.metrics_buffer import MetricsBuffer
+
+    buf = MetricsBuffer(flush_interval_seconds=3600)
+    buf._ensure_started = lambda: None
+    with patch("app.services.metrics_buffer.metrics_buffer", buf), \
+         patch("app.services.metrics_buffer.METRICS_BUFFER_ENABLED", True), \
+         patch("app.services.metrics_buffer.prefetch_user_emails") as mock_prefetch:
+        buf.prefetch = mock_prefetch
+        yield buf
+
+
+def _flush_db():
+    """Firestore simulado: devolve (db, {caminho: dados gravados})."""
+    writes = {}
+    db = MagicMock()
+
+    def ref_for(*path):
+        ref = MagicMock()
+        ref.path = "/".join(path)
+        return ref
+
+    db.collection.side_effect = lambda c: MagicMock(
+        document=lambda d: MagicMock(
+            collection=lambda sc: MagicMock(document=lambda sd: ref_for(c, d, sc, sd))
+        )
+    )
+    batch = MagicMock()
+    batch.set.side_effect = lambda ref, data, merge=False: writes.__setitem__(ref.path, data)
+    db.batch.return_value = batch
+    return db, writes
+
+
 class TestRecordMetricCall:
-    """Testes para record_metric_call - validação de metric_type."""
+    """Testes para record_metric_call - validação de metric_type e buffer de incrementos."""
 
-    @patch("app.services.metrics.is_digital", return_value=False)
-    @patch("app.services.metrics.get_firestore_client")
-    def test_rejects_invalid_metric_type(self, mock_get_firestore, mock_is_digital):
-        """metric_type inválido não persiste e não chama Firestore."""
+    def test_rejects_invalid_metric_type(self, buffer):
+        """metric_type inválido não é acumulado nem chama Firestore."""
         from app.services.metrics import record_metric_call
 
-        record_metric_call("user_123", "invalid_type")
+        with patch("app.services.metrics_buffer.get_firestore_client") as mock_get_firestore:
+            record_metric_call("user_123", "invalid_type")
 
+        assert buffer.pending() == 0
         mock_get_firestore.assert_not_called()
 
-    @patch("app.services.metrics.is_digital", return_value=False)
-    @patch("app.services.metrics._update_daily_total")
-    @patch("app.services.metrics.get_firestore_client")
     @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
-    def test_accepts_automatica_and_persists(
-        self, mock_date, mock_get_firestore, mock_update_daily, mock_is_digital
-    ):
-        """metric_type 'automatica' é aceito e dispara persistência."""
+    def test_calls_are_buffered_without_firestore(self, mock_date, buffer):
+        """Chamadas só acumulam; nenhuma escrita acontece no request."""
         from app.services.metrics import record_metric_call
 
-        mock_doc = MagicMock()
-        mock_doc.exists = False
-        mock_doc.get = MagicMock(return_value=0)
+        with patch("app.services.metrics_buffer.get_firestore_client") as mock_get_firestore:
+            for _ in range(3):
+                record_metric_call("user_123", "automatica")
+            record_metric_call("user_123", "personalized")
 
-        mock_doc_ref = MagicMock()
-        mock_doc_ref.get.return_value = mock_doc
+        mock_get_firestore.assert_not_called()
+        assert dict(buffer._users[("2025-02-13", "user_123")]) == {"automatica": 3, "personalized": 1}
+        assert dict(buffer._totals["2025-02-13"]) == {"automatica": 3, "personalized": 1}
 
-        mock_transaction = MagicMock()
-        mock_db = MagicMock()
-        mock_db.transaction.return_value = mock_transaction
-        mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value = (
-            mock_doc_ref
-        )
-        mock_get_firestore.return_value = mock_db
+    @patch("app.services.metrics_buffer.is_digital", return_value=False)
+    @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
+    def test_flush_writes_increments_in_one_batch(self, mock_date, mock_is_digital, buffer):
+        """Flush grava Increment no doc do usuário e no total, num único commit."""
+        from app.services.metrics import record_metric_call
 
-        with patch("app.services.metrics.firestore") as mock_fs:
-            mock_fs.transactional = lambda f: f
+        db, writes = _flush_db()
+        with patch("app.services.metrics_buffer.get_firestore_client", return_value=db), \
+             patch("app.services.metrics_buffer.firestore") as mock_fs:
+            mock_fs.Increment = lambda n: ("INC", n)
             mock_fs.SERVER_TIMESTAMP = "SERVER_TS"
-
             record_metric_call("user_123", "automatica")
+            record_metric_call("user_456", "automatica")
+            assert buffer.flush() == 3
+
+        assert writes["metrics/2025-02-13/users/user_123"]["automatica"] == ("INC", 1)
+        total_paths = [path for path in writes if path.startswith("metrics/2025-02-13/total/")]
+        assert len(total_paths) == 1 and total_paths[0].split("/")[-1].startswith("shard_")
+        assert writes[total_paths[0]]["automatica"] == ("INC", 2)
+        db.batch.return_value.commit.assert_called_once()
+        assert buffer.pending() == 0
+        # E-mails dos usuários do lote resolvidos de uma vez antes do is_digital
+        assert sorted(buffer.prefetch.call_args[0][0]) == ["user_123", "user_456"]
+
+    @patch("app.services.metrics_buffer.is_digital", return_value=True)
+    @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
+    def test_digital_user_gets_sector(self, mock_date, mock_is_digital, buffer):
+        """AT-DS-004: Usuário digital recebe sector='digital' no flush."""
+        from app.services.metrics import record_metric_call
 
-        mock_get_firestore.assert_called_once()
-        mock_update_daily.assert_called_once_with("2025-02-13", "automatica")
+        db, writes = _flush_db()
+        with patch("app.services.metrics_buffer.get_firestore_client", return_value=db):
+            record_metric_call("digital_user", "automatica")
+            buffer.flush()
 
-    @patch("app.services.metrics.is_digital", return_value=False)
-    @patch("app.services.metrics._update_daily_total")
-    @patch("app.services.metrics.get_firestore_client")
-    def test_accepts_personalized_and_persists(self, mock_get_firestore, mock_update_daily, mock_is_digital):
-        """metric_type 'personalized' é aceito e dispara persistência."""
+        assert writes["metrics/2025-02-13/users/digital_user"]["sector"] == "digital"
+        assert all("sector" not in data for path, data in writes.items() if "/total/" in path)
+
+    @patch("app.services.metrics_buffer.is_digital", return_value=False)
+    @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
+    def test_non_digital_user_no_sector(self, mock_date, mock_is_digital, buffer):
+        """AT-DS-005: Usuário não-digital não recebe campo sector."""
         from app.services.metrics import record_metric_call
 
-        mock_doc = MagicMock()
-        mock_doc.exists = False
+        db, writes = _flush_db()
+        with patch("app.services.metrics_buffer.get_firestore_client", return_value=db):
+            record_metric_call("normal_user", "automatica")
+            buffer.flush()
 
-        mock_doc_ref = MagicMock()
-        mock_doc_ref.get.return_value = mock_doc
+        assert "sector" not in writes["metrics/2025-02-13/users/normal_user"]
 
-        mock_transaction = MagicMock()
-        mock_db = MagicMock()
-        mock_db.transaction.return_value = mock_transaction
-        mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value = (
-            mock_doc_ref
-        )
-        mock_get_firestore.return_value = mock_db
+    @patch("app.services.metrics_buffer.is_digital", return_value=False)
+    @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
+    def test_failed_flush_keeps_increments(self, mock_date, mock_is_digital, buffer):
+        """Falha no commit devolve os incrementos ao buffer (nada se perde)."""
+        from app.services.metrics import record_metric_call
 
-        with patch("app.services.metrics.firestore") as mock_fs:
-            mock_fs.transactional = lambda f: f
-            mock_fs.SERVER_TIMESTAMP = "SERVER_TS"
+        db, _ = _flush_db()
+        db.batch.return_value.commit.side_effect = RuntimeError("unavailable")
+        with patch("app.services.metrics_buffer.get_firestore_client", return_value=db):
+            record_metric_call("user_123", "personalized")
+            assert buffer.flush() == 0
+            record_metric_call("user_123", "personalized")
 
-            record_metric_call("user_456", "personalized")
+        assert dict(buffer._users[("2025-02-13", "user_123")]) == {"personalized": 2}
+        assert buffer.stats["flush_errors"] == 1
 
-        mock_get_firestore.assert_called_once()
-        mock_update_daily.assert_called_once()
+    @patch("app.services.metrics_buffer.is_digital", return_value=False)
+    def test_partial_flush_requeues_only_uncommitted_batches(self, mock_is_digital, buffer):
+        """Se o 2º WriteBatch falha, só os incrementos dele voltam ao buffer (sem dupla contagem)."""
+        db, writes = _flush_db()
+        db.batch.return_value.commit.side_effect = [None, RuntimeError("unavailable")]
+        for i in range(3):
+            buffer.increment_user("2025-02-13", f"user_{i}", "personalized")
 
-    @patch("app.services.metrics.is_digital", return_value=True)
-    @patch("app.services.metrics._update_daily_total")
-    @patch("app.services.metrics.get_firestore_client")
-    @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
-    def test_digital_user_gets_sector_on_new_doc(
-        self, mock_date, mock_get_firestore, mock_update_daily, mock_is_digital
-    ):
-        """AT-DS-004: Usuário digital recebe sector='digital' ao criar doc."""
-        from app.services.metrics import record_metric_call
+        with patch("app.services.metrics_buffer.FIRESTORE_BATCH_LIMIT", 2), \
+             patch("app.services.metrics_buffer.get_firestore_client", return_value=db):
+            assert buffer.flush() == 2
 
-        mock_doc = MagicMock()
-        mock_doc.exists = False
+        assert {key: dict(c) for key, c in buffer._users.items()} == {("2025-02-13", "user_2"): {"personalized": 1}}
+        assert (buffer.stats["writes"], buffer.stats["flush_errors"]) == (2, 1)
 
-        mock_doc_ref = MagicMock()
-        mock_doc_ref.get.return_value = mock_doc
+        db.batch.return_value.commit.side_effect = None
+        with patch("app.services.metrics_buffer.get_firestore_client", return_value=db):
+            assert buffer.flush() == 1
+        assert buffer.pending() == 0
 
-        mock_transaction = MagicMock()
-        mock_db = MagicMock()
-        mock_db.transaction.return_value = mock_transaction
-        mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value = (
-            mock_doc_ref
-        )
-        mock_get_firestore.return_value = mock_db
 
-        with patch("app.services.metrics.firestore") as mock_fs:
-            mock_fs.transactional = lambda f: f
-            mock_fs.SERVER_TIMESTAMP = "SERVER_TS"
+class TestDailyTotalShards:
+    """Total diário distribuído em shards e lido pela soma."""
 
-            record_metric_call("digital_user", "automatica")
+    def test_shard_ids_within_configured_range(self):
+        from app.services.metrics_buffer import random_total_shard
 
-        call_args = mock_transaction.set.call_args
-        if call_args:
-            data = call_args[0][1]
-            assert data.get("sector") == "digital"
+        with patch("app.services.metrics_buffer.METRICS_TOTAL_SHARDS", 4):
+            shards = {random_total_shard() for _ in range(200)}
+        assert shards == {"shard_0", "shard_1", "shard_2", "shard_3"}
 
-    @patch("app.services.metrics.is_digital", return_value=False)
-    @patch("app.services.metrics._update_daily_total")
     @patch("app.services.metrics.get_firestore_client")
-    @patch("app.services.metrics._get_date_string", return_value="2025-02-13")
-    def test_non_digital_user_no_sector(
-        self, mock_date, mock_get_firestore, mock_update_daily, mock_is_digital
-    ):
-        """AT-DS-005: Usuário não-digital não recebe campo sector."""
-        from app.services.metrics import record_metric_call
+    def test_get_daily_total_sums_shards_and_legacy_doc(self, mock_get_firestore):
+        from app.services.metrics import get_daily_total
 
-        mock_doc = MagicMock()
-        mock_doc.exists = False
+        docs = []
+        for data in ({"automatica": 2, "personalized": 1}, {"automatica": 3, "ultra_batch_total_files": 10}, {"personalized": 4}):
+            doc = MagicMock()
+            doc.to_dict.return_value = data
+            docs.append(doc)
+        mock_get_firestore.return_value.collection.return_value.document.return_value.collection.return_value.stream.return_value = docs
 
-        mock_doc_ref = MagicMock()
-        mock_doc_ref.get.return_value = mock_doc
+        assert get_daily_total("2025-02-13") == {"automatica": 5, "personalized": 5, "ultra_batch_total_files": 10}
 
-        mock_transaction = MagicMock()
-        mock_db = MagicMock()
-        mock_db.transaction.return_value = mock_transaction
-        mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value = (
-            mock_doc_ref
-        )
+
+def _ultra_batch_db():
+    """Firestore simulado para ultra_batch: (db, doc do usuário, doc da execução)."""
+    mock_db = MagicMock()
+    user_ref = mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value
+    run_ref = user_ref.collection.return_value.document.return_value
+    return mock_db, user_ref, run_ref
+
+
+class TestRecordUltraBatchStart:
+    """Testes para record_ultra_batch_start - execução em subcoleção e contadores."""
+
+    @patch("app.services.metrics.buffer_total_increment")
+    @patch("app.services.metrics.is_digital", return_value=True)
+    @patch("app.services.metrics.get_firestore_client")
+    def test_creates_run_and_increments_counters_in_one_batch(self, mock_get_firestore, mock_is_digital, mock_total):
+        from app.services.metrics import record_ultra_batch_start
+
+        mock_db, user_ref, run_ref = _ultra_batch_db()
         mock_get_firestore.return_value = mock_db
 
         with patch("app.services.metrics.firestore") as mock_fs:
-            mock_fs.transactional = lambda f: f
+            mock_fs.Increment = lambda n: ("INC", n)
             mock_fs.SERVER_TIMESTAMP = "SERVER_TS"
+            record_ultra_batch_start("user_123", "job_abc", 5, date="2025-02-13")
+
+        batch = mock_db.batch.return_value
+        user_ref.collection.assert_called_once_with("ultra_batch_runs")
+        user_ref.collection.return_value.document.assert_called_once_with("job_abc")
+        batch.create.assert_called_once_with(run_ref, {"jobId": "job_abc", "file_count": 5})
+        updates = batch.set.call_args[0][1]
+        assert updates["ultra_batch_run_count"] == ("INC", 1)
+        assert updates["ultra_batch_files"] == ("INC", 5)
+        assert updates["sector"] == "digital"
+        assert "ultra_batch_runs" not in updates
+        assert batch.set.call_args[1] == {"merge": True}
+        batch.commit.assert_called_once()
+        mock_db.transaction.assert_not_called()
+        mock_total.assert_called_once_with("2025-02-13", "ultra_batch_total_files", 5)
+
+    @patch("app.services.metrics.buffer_total_increment")
+    @patch("app.services.metrics.is_digital", return_value=False)
+    @patch("app.services.metrics.get_firestore_client")
+    def test_duplicate_job_is_not_counted_twice(self, mock_get_firestore, mock_is_digital, mock_total):
+        from google.api_core.exceptions import AlreadyExists
+        from app.services.metrics import record_ultra_batch_start
 
-            record_metric_call("normal_user", "automatica")
+        mock_db, _, _ = _ultra_batch_db()
+        mock_db.batch.return_value.commit.side_effect = AlreadyExists("exists")
+        mock_get_firestore.return_value = mock_db
+
+        record_ultra_batch_start("user_123", "job_abc", 5, date="2025-02-13")
 
-        call_args = mock_transaction.set.call_args
-        if call_args:
-            data = call_args[0][1]
-            assert "sector" not in data
+        mock_total.assert_not_called()
 
 
 class TestRecordUltraBatchComplete:
@@ -160,25 +243,39 @@ class TestRecordUltraBatchComplete:
 
     @patch("app.services.metrics.is_digital", return_value=False)
     @patch("app.services.metrics.get_firestore_client")
-    def test_calls_firestore_and_updates_document(self, mock_get_firestore, mock_is_digital):
-        """Persistência de status: função obtém doc e executa transação."""
+    def test_updates_only_the_run_document(self, mock_get_firestore, mock_is_digital):
+        """Persistência de status: um update no doc da execução, sem ler o doc do usuário."""
         from app.services.metrics import record_ultra_batch_complete
 
+        mock_db, user_ref, run_ref = _ultra_batch_db()
+        mock_get_firestore.return_value = mock_db
+
+        record_ultra_batch_complete("user_123", "job_abc", date="2025-02-13")
+
+        run_ref.update.assert_called_once()
+        updates = run_ref.update.call_args[0][0]
+        assert updates["status"] == "completed"
+        assert "completedAt" in updates
+        user_ref.get.assert_not_called()
+        mock_db.transaction.assert_not_called()
+
+    @patch("app.services.metrics.is_digital", return_value=False)
+    @patch("app.services.metrics.get_firestore_client")
+    def test_legacy_run_in_array_is_completed_in_transaction(self, mock_get_firestore, mock_is_digital):
+        """Job registrado no array antigo: conclusão segue pela transação."""
+        from google.api_core.exceptions import NotFound
+        from app.services.metrics import record_ultra_batch_complete
+
+        mock_db, user_ref, run_ref = _ultra_batch_db()
+        run_ref.update.side_effect = NotFound("missing")
         mock_doc = MagicMock()
         mock_doc.exists = True
         mock_doc.get.return_value = [
             {"jobId": "job_abc", "file_count": 5},
         ]
-
-        mock_doc_ref = MagicMock()
-        mock_doc_ref.get.return_value = mock_doc
-
+        user_ref.get.return_value = mock_doc
         mock_transaction = MagicMock()
-        mock_db = MagicMock()
         mock_db.transaction.return_value = mock_transaction
-        mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value = (
-            mock_doc_ref
-        )
         mock_get_firestore.return_value = mock_db
 
         with patch("app.services.metrics.firestore") as mock_fs:
@@ -188,5 +285,6 @@ class TestRecordUltraBatchComplete:
             record_ultra_batch_complete("user_123", "job_abc", date="2025-02-13")
 
         mock_get_firestore.assert_called_once()
-        mock_doc_ref.get.assert_called()
-        assert mock_transaction.update.called
+        user_ref.get.assert_called()
+        runs = mock_transaction.update.call_args[0][1]["ultra_batch_runs"]
+        assert runs[0]["status"] == "completed"
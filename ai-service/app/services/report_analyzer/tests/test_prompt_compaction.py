@@ -0,0 +1,118 @@
+"""
+Testes da camada de compactação de prompts.
+
+Golden test: com o Gemini simulado (resposta derivada apenas dos dados presentes no
+prompt), analyze_report produz exatamente o mesmo resultado com e sem compactação.
+"""
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from app.services.report_analyzer import class_analysis_cache, prompt_compaction
+from app.services.report_analyzer.nodes.analyze_report import analyze_report
+from app.services.report_analyzer.prompt_compaction import (
+    ANALYSIS_FIELDS,
+    compact_json,
+    compact_raw_text,
+    prune_empty,
+)
+
+TESTS_DIR = os.path.dirname(__file__)
+FULL_RESULTS = os.path.join(TESTS_DIR, "full_results_XPerformance - 5629450 - Ref.29.08 (1).json")
+EXTRACTION_RESULTS = os.path.join(TESTS_DIR, "extraction_results_XPerformance - 5629450 - Ref.29.08 (1).json")
+FOOTER = "Relatório informativo de performance não destinado a fins fiscais Data de referência: 29/08/2025"
+
+
+@pytest.fixture
+def extracted_data():
+    with open(FULL_RESULTS, encoding="utf-8") as f:
+        return json.load(f)["extracted_data"]
+
+
+@pytest.fixture
+def raw_text():
+    with open(EXTRACTION_RESULTS, encoding="utf-8") as f:
+        return json.load(f)["pdf_extraction"]["raw_text"]
+
+
+def _data_from_prompt(prompt: str) -> dict:
+    start = prompt.index("**DADOS EXTRAÍDOS:**") + len("**DADOS EXTRAÍDOS:**")
+    end = prompt.index("**FORMATO DE RESPOSTA")
+    return json.loads(prompt[start:end])
+
+
+def _fake_gemini(prompt, **kwargs):
+    """Classifica classes pela rentabilidade vs. CDI usando apenas o que está no prompt."""
+    data = _data_from_prompt(prompt)
+    cdi = float(data["benchmarkValues"]["CDI"].replace("%", "").replace(",", "."))
+    analysis = {"highlights": [], "detractors": []}
+    for cls in data["classPerformance"]:
+        ret = float(cls["return"].replace("%", "").replace(",", "."))
+        item = {"className": cls["className"], "benchmarkDifference": f"{ret - cdi:.2f}%"}
+        if ret > cdi:
+            item["drivers"] = (data.get("allAssets") or {}).get(cls["className"], [])[:2]
+            analysis["highlights"].append(item)
+        else:
+            analysis["detractors"].append(item)
+    return analysis
+
+
+class TestCompactJson:
+    def test_keeps_every_used_non_empty_value(self, extracted_data):
+        compacted, stats = compact_json("analysis_auto", extracted_data, fields=ANALYSIS_FIELDS, original_indent=2)
+
+        expected = prune_empty({k: v for k, v in extracted_data.items() if k in ANALYSIS_FIELDS})
+        assert json.loads(compacted) == expected
+        assert stats["saved_chars"] > 0
+        assert stats["saved_tokens_est"] > 0
+
+    def test_prune_empty(self):
+        assert prune_empty({"a": None, "b": "", "c": [], "d": {}, "e": [{"x": None}], "f": "0,00%"}) == {"f": "0,00%"}
+
+    def test_disabled_returns_original_serialization(self, extracted_data):
+        with patch.object(prompt_compaction, "PROMPT_COMPACTION_ENABLED", False):
+            compacted, stats = compact_json("analysis_auto", extracted_data, fields=ANALYSIS_FIELDS, original_indent=2)
+
+        assert compacted == json.dumps(extracted_data, indent=2, ensure_ascii=False)
+        assert stats["saved_chars"] == 0
+
+
+class TestCompactRawText:
+    def test_dedupes_footer_and_keeps_page_markers(self, raw_text):
+        compacted, stats = compact_raw_text("extraction_full.raw_text", raw_text)
+
+        assert raw_text.count(FOOTER) > 1
+        assert compacted.count(FOOTER) == 1
+        for page in range(1, 12):
+            assert f"--- PÁGINA {page} ---" in compacted
+        assert stats["saved_chars"] > 0
+
+    def test_preserves_all_other_lines_in_order(self, raw_text):
+        compacted, _ = compact_raw_text("extraction_full.raw_text", raw_text)
+
+        original_lines = [" ".join(l.split()) for l in raw_text.splitlines()]
+        original_lines = [l for l in original_lines if l and l != FOOTER]
+        compacted_lines = [l for l in compacted.splitlines() if l != FOOTER]
+        assert compacted_lines == original_lines
+
+
+class TestGoldenAnalysis:
+    @pytest.mark.parametrize("mode", ["auto", "personalized"])
+    def test_analysis_output_unchanged(self, extracted_data, mode):
+        state = {"extracted_data": extracted_data, "analysis_mode": mode, "selected_fields": None}
+
+        with patch("app.services.report_analyzer.nodes.analyze_report.call_llm_with_retry", side_effect=_fake_gemini):
+            # Sem o cache por classe, para que as duas execuções cheguem ao LLM
+            class_analysis_cache.clear_cache()
+            with patch.object(prompt_compaction, "PROMPT_COMPACTION_ENABLED", False):
+                baseline = analyze_report(dict(state))
+            class_analysis_cache.clear_cache()
+            compacted = analyze_report(dict(state))
+            class_analysis_cache.clear_cache()
+
+        assert baseline["error"] is None
+        assert compacted["highlights"] == baseline["highlights"]
+        assert compacted["detractors"] == baseline["detractors"]
+        assert compacted.get("allAssets") == baseline.get("allAssets")
@@ -0,0 +1,136 @@
+"""
+Testes do store de resultados (hash do PDF + modo + seleção + versão dos prompts).
+"""
+import base64
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.services.report_analyzer import prompts
+from app.services.report_analyzer.result_store import (
+    _compute_prompt_version,
+    _get_stored_result_sync,
+    _save_result_sync,
+    build_result_key,
+    clear_memory_store,
+)
+
+PDF_B64 = base64.b64encode(b"%PDF-1.4 relatorio").decode()
+
+RESULT = {
+    "file_content": "data:application/pdf;base64," + PDF_B64,
+    "raw_text": "texto enorme",
+    "extracted_data": {"accountNumber": "123"},
+    "highlights": [{"className": "Pós Fixado"}],
+    "detractors": [],
+    "final_message": "Olá!",
+    "metadata": {"model_used": "gemini"},
+    "error": None,
+}
+
+
+@pytest.fixture(autouse=True)
+def _clear_store():
+    clear_memory_store()
+    yield
+    clear_memory_store()
+
+
+class TestBuildResultKey:
+    def test_data_uri_and_raw_base64_share_key(self):
+        assert build_result_key("data:application/pdf;base64," + PDF_B64, "auto") == build_result_key(PDF_B64, "auto")
+
+    def test_mode_and_selection_change_key(self):
+        base = build_result_key(PDF_B64, "auto")
+        assert build_result_key(PDF_B64, "personalized") != base
+        assert build_result_key(PDF_B64, "personalized", {"monthlyReturn": True}) != build_result_key(PDF_B64, "personalized")
+
+    def test_selection_key_order_is_irrelevant(self):
+        a = build_result_key(PDF_B64, "personalized", {"monthlyReturn": True, "yearlyReturn": True})
+        b = build_result_key(PDF_B64, "personalized", {"yearlyReturn": True, "monthlyReturn": True})
+        assert a == b
+
+    def test_prompt_change_changes_version(self):
+        before = _compute_prompt_version()
+        with patch.object(prompts, "XP_REPORT_ANALYSIS_PROMPT", prompts.XP_REPORT_ANALYSIS_PROMPT + " "):
+            after = _compute_prompt_version()
+        assert before != after
+        assert build_result_key(PDF_B64, "auto", prompt_version=after) != build_result_key(PDF_B64, "auto", prompt_version=before)
+
+
+class TestStore:
+    @patch("app.services.report_analyzer.result_store.get_firestore_client")
+    def test_save_then_memory_hit_skips_firestore_read(self, mock_get_db):
+        db = MagicMock()
+        mock_get_db.return_value = db
+
+        assert _save_result_sync("k1", RESULT, "auto") is True
+        db.collection.return_value.document.return_value.set.assert_called_once()
+        saved = db.collection.return_value.document.return_value.set.call_args[0][0]
+        assert "raw_text" not in saved and "file_content" not in saved
+
+        hit = _get_stored_result_sync("k1")
+        assert hit["final_message"] == "Olá!"
+        assert hit["metadata"]["result_store"] == "hit"
+        db.collection.return_value.document.return_value.get.assert_not_called()
+
+    @patch("app.services.report_analyzer.result_store.get_firestore_client")
+    def test_firestore_hit_populates_memory(self, mock_get_db):
+        db = MagicMock()
+        mock_get_db.return_value = db
+        doc = MagicMock()
+        doc.exists = True
+        doc.to_dict.return_value = {"final_message": "Oi", "metadata": {}, "expires_at_epoch_ms": 0}
+        db.collection.return_value.document.return_value.get.return_value = doc
+
+        assert _get_stored_result_sync("k2")["final_message"] == "Oi"
+        assert _get_stored_result_sync("k2")["final_message"] == "Oi"
+        assert db.collection.return_value.document.return_value.get.call_count == 1
+
+    @patch("app.services.report_analyzer.result_store.get_firestore_client")
+    def test_expired_firestore_entry_is_miss(self, mock_get_db):
+        doc = MagicMock()
+        doc.exists = True
+        doc.to_dict.return_value = {"final_message": "Oi", "expires_at_epoch_ms": 1}
+        mock_get_db.return_value.collection.return_value.document.return_value.get.return_value = doc
+
+        assert _get_stored_result_sync("k3") is None
+
+    @patch("app.services.report_analyzer.result_store.get_firestore_client")
+    def test_error_results_are_not_stored(self, mock_get_db):
+        assert _save_result_sync("k4", {**RESULT, "error": "falhou"}) is False
+        assert _save_result_sync("k4", {**RESULT, "final_message": None}) is False
+        mock_get_db.assert_not_called()
+
+
+class TestBatchUsesStore:
+    def test_hit_skips_workflow(self, run_async):
+        from app.services.report_analyzer import batch_processing
+
+        stored = {"final_message": "Olá!", "metadata": {"result_store": "hit"}}
+        with patch.object(batch_processing, "get_stored_result", AsyncMock(return_value=stored)), \
+             patch.object(batch_processing, "save_result", AsyncMock()) as mock_save, \
+             patch.object(batch_processing, "create_report_analysis_workflow") as mock_wf:
+            results = run_async(batch_processing.process_batch_reports(
+                [{"name": "a.pdf", "dataUri": "data:application/pdf;base64," + PDF_B64}], "uid"
+            ))
+
+        assert results == [{"success": True, "file_name": "a.pdf", "data": stored}]
+        mock_wf.assert_not_called()
+        mock_save.assert_not_called()
+
+    def test_miss_runs_workflow_and_saves(self, run_async):
+        from app.services.report_analyzer import batch_processing
+
+        app = MagicMock()
+        app.ainvoke = AsyncMock(return_value=RESULT)
+        with patch.object(batch_processing, "get_stored_result", AsyncMock(return_value=None)), \
+             patch.object(batch_processing, "save_result", AsyncMock()) as mock_save, \
+             patch.object(batch_processing, "create_report_analysis_workflow", return_value=app):
+            results = run_async(batch_processing.process_batch_reports(
+                [{"name": "a.pdf", "dataUri": "data:application/pdf;base64," + PDF_B64}], "uid"
+            ))
+
+        assert results[0]["success"] is True
+        mock_save.assert_awaited_once()
+        assert mock_save.call_args[0][0] == build_result_key(PDF_B64, "auto")
@@ -0,0 +1,97 @@
+"""
+Testes do schema/prompt de extração gerados a partir de selected_fields.
+"""
+import json
+from unittest.mock import MagicMock, patch
+
+from app.services.report_analyzer.nodes.extract_data import extract_data
+from app.services.report_analyzer.prompts import XP_REPORT_EXTRACTION_PROMPT_FULL
+from app.services.report_analyzer.schema_builder import (
+    build_extraction_prompt,
+    build_extraction_schema,
+    selection_signature,
+)
+from app.services.report_analyzer.schemas import EXTRACTED_DATA_SCHEMA_FULL
+
+SELECTION = {
+    "monthlyReturn": True,
+    "yearlyReturn": False,
+    "classPerformance": {"Pós Fixado": True, "Inflação": False},
+    "allAssets": {"Multimercado": {"0": True}},
+}
+
+
+class TestSelectionSignature:
+    def test_signature_keeps_only_what_changes_extraction(self):
+        assert selection_signature(SELECTION) == (("monthlyReturn",), ("Multimercado", "Pós Fixado"))
+
+    def test_signature_ignores_asset_indices(self):
+        other = {**SELECTION, "allAssets": {"Multimercado": {"3": True}}}
+        assert selection_signature(other) == selection_signature(SELECTION)
+
+
+class TestBuildExtractionSchema:
+    def test_prunes_top_level_fields_and_classes(self):
+        schema = build_extraction_schema(SELECTION)
+
+        assert set(schema["properties"]) == {
+            "accountNumber", "reportMonth", "benchmarkValues", "classPerformance", "monthlyReturn", "allAssets",
+        }
+        assert set(schema["properties"]["allAssets"]["properties"]) == {"Multimercado", "Pós Fixado"}
+        assert "additionalProperties" not in schema["properties"]["allAssets"]
+        assert set(schema["required"]) == set(schema["properties"])
+
+    def test_without_classes_drops_all_assets(self):
+        schema = build_extraction_schema({"monthlyReturn": True})
+        assert "allAssets" not in schema["properties"]
+        assert "allAssets" not in schema["required"]
+
+    def test_cached_per_signature_and_full_schema_untouched(self):
+        before = json.dumps(EXTRACTED_DATA_SCHEMA_FULL, sort_keys=True)
+        reordered = {"allAssets": {"Multimercado": {"1": True}}, "classPerformance": {"Pós Fixado": True}, "monthlyReturn": True}
+
+        assert build_extraction_schema(SELECTION) is build_extraction_schema(reordered)
+        assert json.dumps(EXTRACTED_DATA_SCHEMA_FULL, sort_keys=True) == before
+
+    def test_prompt_lists_only_selected_fields(self):
+        prompt = build_extraction_prompt("texto do pdf", "**IMAGENS DISPONÍVEIS:** 2", SELECTION)
+
+        assert "monthlyReturn:" in prompt
+        assert "yearlyGain:" not in prompt
+        assert "Multimercado, Pós Fixado" in prompt
+        assert "texto do pdf" in prompt
+        assert len(prompt) < len(XP_REPORT_EXTRACTION_PROMPT_FULL)
+
+
+class TestExtractDataUsesDynamicSchema:
+    def _state(self, selected_fields):
+        return {
+            "raw_text": "--- Página 1 ---\nconteúdo",
+            "pdf_images": [{"page": 1, "image_data": b"png"}],
+            "analysis_mode": "personalized",
+            "selected_fields": selected_fields,
+        }
+
+    @patch("app.services.report_analyzer.nodes.extract_data.get_gemini_client")
+    def test_personalized_with_selection_sends_pruned_schema(self, mock_client):
+        response = MagicMock()
+        response.text = json.dumps({"accountNumber": "1", "reportMonth": "08/2025"})
+        mock_client.return_value.models.generate_content.return_value = response
+
+        result = extract_data(self._state(SELECTION))
+
+        config = mock_client.return_value.models.generate_content.call_args.kwargs["config"]
+        assert config["response_json_schema"] is build_extraction_schema(SELECTION)
+        assert result["metadata"]["prompt_used"] == "dynamic"
+
+    @patch("app.services.report_analyzer.nodes.extract_data.get_gemini_client")
+    def test_personalized_without_selection_keeps_full_schema(self, mock_client):
+        response = MagicMock()
+        response.text = json.dumps({"accountNumber": "1"})
+        mock_client.return_value.models.generate_content.return_value = response
+
+        result = extract_data(self._state(None))
+
+        config = mock_client.return_value.models.generate_content.call_args.kwargs["config"]
+        assert config["response_json_schema"] is EXTRACTED_DATA_SCHEMA_FULL
+        assert result["metadata"]["prompt_used"] == "full"
@@ -0,0 +1,226 @@
+"""
+Testes do outbox do Sheets (escritor único por job, ordem, coalescência, retry e recuperação).
+"""
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from app.services.report_analyzer import sheets_outbox
+from app.services.report_analyzer.sheets_outbox import SheetsOutbox, recover_pending_sheets_rows_sync
+
+MODULE = "app.services.report_analyzer.sheets_outbox"
+CONFIG = {"enabled": True, "spreadsheet_id": "sid", "sheet_name": "Resultados", "created_at_epoch_ms": 100}
+
+
+@pytest.fixture(autouse=True)
+def _reset_stats():
+    sheets_outbox.reset_outbox_stats()
+    yield
+    sheets_outbox.reset_outbox_stats()
+
+
+@pytest.fixture
+def sheets():
+    """Simula config, append e limpeza dos flags; registra as chamadas em ordem."""
+    calls = {"config": 0, "appends": [], "cleared": []}
+
+    def fake_config(job_id, use_cache=True):
+        calls["config"] += 1
+        return CONFIG
+
+    with patch(f"{MODULE}.get_sheets_config", side_effect=fake_config), \
+         patch(f"{MODULE}.append_rows_to_sheet_sync", side_effect=lambda config, rows, job_id: calls["appends"].append(rows)), \
+         patch(f"{MODULE}._clear_pending_sync", side_effect=lambda job_id, ids: calls["cleared"].extend(ids)):
+        yield calls
+
+
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+
+def _outbox(**kwargs):
+    kwargs.setdefault("linger_seconds", 0.01)
+    kwargs.setdefault("backoff_base_seconds", 0)
+    return SheetsOutbox("job1", **kwargs)
+
+
+def test_rows_coalesced_in_order_and_config_read_once(sheets, run_async):
+    async def run():
+        outbox = _outbox(max_rows_per_append=3)
+        for i in range(7):
+            outbox.enqueue(str(i), f"acc{i}", f"```msg {i}```", 200 + i)
+        await outbox.close()
+
+    run_async(run())
+
+    assert [len(rows) for rows in sheets["appends"]] == [3, 3, 1]
+    flattened = [row for rows in sheets["appends"] for row in rows]
+    assert flattened == [[f"acc{i}", f"msg {i}"] for i in range(7)]
+    assert sheets["cleared"] == [str(i) for i in range(7)]
+    assert sheets["config"] == 1
+    assert sheets_outbox.get_outbox_stats()["appends"] == 3
+
+
+def test_rows_before_config_creation_are_left_to_backfill(sheets, run_async):
+    async def run():
+        outbox = _outbox()
+        outbox.enqueue("0", "acc0", "antiga", 50)
+        outbox.enqueue("1", "acc1", "nova", 150)
+        await outbox.close()
+
+    run_async(run())
+
+    assert sheets["appends"] == [[["acc1", "nova"]]]
+    assert sheets["cleared"] == ["1"]
+    assert sheets_outbox.get_outbox_stats()["rows_skipped"] == 1
+
+
+def test_retries_with_backoff_then_delivers(sheets, run_async):
+    attempts = {"n": 0}
+
+    def flaky(config, rows, job_id):
+        attempts["n"] += 1
+        if attempts["n"] < 3:
+            raise _http_error(429)
+        sheets["appends"].append(rows)
+
+    async def run():
+        outbox = _outbox()
+        outbox.enqueue("0", "acc0", "msg", 200)
+        await outbox.close()
+
+    with patch(f"{MODULE}.append_rows_to_sheet_sync", side_effect=flaky):
+        run_async(run())
+
+    assert attempts["n"] == 3
+    assert sheets["appends"] == [[["acc0", "msg"]]]
+    assert sheets_outbox.get_outbox_stats()["retries"] == 2
+
+
+def test_exhausted_retries_keep_rows_pending(sheets, run_async):
+    async def run():
+        outbox = _outbox(max_retries=2)
+        outbox.enqueue("0", "acc0", "msg", 200)
+        await outbox.close()
+
+    with patch(f"{MODULE}.append_rows_to_sheet_sync", side_effect=_http_error(429)):
+        run_async(run())
+
+    assert sheets["cleared"] == []
+    assert sheets_outbox.get_outbox_stats()["rows_failed"] == 1
+
+
+def test_failed_batch_stays_at_head_of_queue(sheets, run_async):
+    calls = {"n": 0}
+
+    def fails_first_round(config, rows, job_id):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise ConnectionRefusedError("connection refused")
+        sheets["appends"].append(rows)
+
+    async def run():
+        outbox = _outbox(max_rows_per_append=1, max_retries=1)
+        for i in range(3):
+            outbox.enqueue(str(i), f"acc{i}", f"msg {i}", 200 + i)
+        await asyncio.sleep(0.05)
+        await outbox.close()
+
+    with patch(f"{MODULE}.append_rows_to_sheet_sync", side_effect=fails_first_round):
+        run_async(run())
+
+    assert sheets["appends"] == [[[f"acc{i}", f"msg {i}"]] for i in range(3)]
+    assert sheets["cleared"] == ["0", "1", "2"]
+    assert sheets_outbox.get_outbox_stats()["rows_failed"] == 0
+
+
+def test_uncertain_append_stops_writer_without_resending(sheets, run_async):
+    calls = {"n": 0}
+
+    def server_error(config, rows, job_id):
+        calls["n"] += 1
+        raise _http_error(503)
+
+    async def run():
+        outbox = _outbox(max_rows_per_append=1)
+        outbox.enqueue("0", "acc0", "msg 0", 200)
+        await asyncio.sleep(0.05)
+        outbox.enqueue("1", "acc1", "msg 1", 201)
+        await outbox.close()
+
+    with patch(f"{MODULE}.append_rows_to_sheet_sync", side_effect=server_error):
+        run_async(run())
+
+    # O 503 pode ter gravado a linha: nenhum reenvio automático, nada entregue depois
+    assert calls["n"] == 1
+    assert sheets["cleared"] == []
+    stats = sheets_outbox.get_outbox_stats()
+    assert (stats["retries"], stats["rows_failed"]) == (0, 2)
+
+
+def test_writer_restarts_after_unexpected_error(sheets, run_async):
+    real_to_values = sheets_outbox._to_values
+    calls = {"n": 0}
+
+    def crashes_once(rows):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise ValueError("bug")
+        return real_to_values(rows)
+
+    async def run():
+        outbox = _outbox()
+        outbox.enqueue("0", "acc0", "msg 0", 200)
+        await asyncio.sleep(0.05)
+        assert outbox._task.done()
+        outbox.enqueue("1", "acc1", "msg 1", 201)
+        await outbox.close()
+
+    with patch(f"{MODULE}._to_values", side_effect=crashes_once):
+        run_async(run())
+
+    assert sheets["appends"] == [[["acc0", "msg 0"], ["acc1", "msg 1"]]]
+    assert sheets["cleared"] == ["0", "1"]
+
+
+def test_without_config_rows_are_not_written(run_async):
+    async def run():
+        outbox = _outbox()
+        outbox.enqueue("0", "acc0", "msg", 200)
+        await outbox.close()
+
+    with patch(f"{MODULE}.get_sheets_config", return_value=None), \
+         patch(f"{MODULE}.append_rows_to_sheet_sync") as mock_append:
+        run_async(run())
+
+    mock_append.assert_not_called()
+
+
+def test_recover_resends_pending_rows_in_processing_order():
+    docs = []
+    for doc_id, epoch, account in (("2", 300, "acc2"), ("0", 50, "acc0"), ("1", 200, "acc1")):
+        doc = MagicMock()
+        doc.id = doc_id
+        doc.to_dict.return_value = {
+            "success": True, "accountNumber": account, "final_message": f"msg {account}",
+            "processedAt_epoch_ms": epoch, "sheets_pending": True,
+        }
+        docs.append(doc)
+    db = MagicMock()
+    results_ref = db.collection.return_value.document.return_value.collection.return_value
+    results_ref.where.return_value.stream.return_value = docs
+
+    with patch(f"{MODULE}.get_sheets_config", return_value=CONFIG), \
+         patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}.append_rows_to_sheet_sync") as mock_append:
+        recovered = recover_pending_sheets_rows_sync("job1")
+
+    assert recovered == 2
+    results_ref.where.assert_called_once_with("sheets_pending", "==", True)
+    mock_append.assert_called_once_with(CONFIG, [["acc1", "msg acc1"], ["acc2", "msg acc2"]], "job1")
+    updated = [c.args[0] for c in db.batch.return_value.update.call_args_list]
+    assert updated == [results_ref.document.return_value] * 2
+    db.batch.return_value.commit.assert_called_once()
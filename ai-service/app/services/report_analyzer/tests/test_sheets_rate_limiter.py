@@ -0,0 +1,158 @@
+"""
+Testes do limitador de quota das APIs Google (token bucket, justiça entre jobs, HttpError).
+"""
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from app.services.report_analyzer import sheets_rate_limiter as limiter
+from app.services.report_analyzer.sheets_rate_limiter import TokenBucket, execute_with_quota
+
+MODULE = "app.services.report_analyzer.sheets_rate_limiter"
+
+
+@pytest.fixture(autouse=True)
+def _reset_limiter():
+    limiter.reset_quota_limiter()
+    yield
+    limiter.reset_quota_limiter()
+
+
+def _http_error(status, retry_after=None):
+    headers = {"status": status}
+    if retry_after is not None:
+        headers["retry-after"] = retry_after
+    return HttpError(httplib2.Response(headers), b"{}")
+
+
+def test_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket("sheets", rate_per_minute=600, burst=2)  # 10 tokens/s
+
+    waits = [bucket.acquire("job1") for _ in range(3)]
+
+    assert waits[0] < 0.01 and waits[1] < 0.01
+    assert waits[2] >= 0.05
+    stats = bucket.snapshot()
+    assert stats["acquired"] == 3
+    assert stats["throttled"] == 1
+    assert stats["by_job"] == {"job1": 3}
+
+
+def test_tokens_are_shared_round_robin_between_jobs():
+    bucket = TokenBucket("sheets", rate_per_minute=1200, burst=1)  # 20 tokens/s
+    bucket.acquire("warmup")
+    granted = []
+    lock = threading.Lock()
+
+    def worker(job):
+        bucket.acquire(job)
+        with lock:
+            granted.append(job)
+
+    threads = []
+    for job in ("A", "A", "A", "B"):
+        t = threading.Thread(target=worker, args=(job,))
+        t.start()
+        threads.append(t)
+        # Garante a ordem de chegada na fila
+        while bucket.waiting_count() < len(threads) and len(granted) == 0:
+            time.sleep(0.001)
+    for t in threads:
+        t.join(timeout=5)
+
+    assert granted == ["A", "B", "A", "A"]
+
+
+def test_stats_estimate_job_capacity():
+    bucket = TokenBucket("sheets", rate_per_minute=60, burst=10)
+    for _ in range(3):
+        bucket.acquire("job1")
+    bucket.acquire("job2")
+
+    stats = bucket.snapshot()
+
+    assert stats["requests_last_minute"] == 4
+    assert stats["active_jobs"] == 2
+    # 2 requisições/min por job → 30 jobs cabem em 60 req/min
+    assert stats["estimated_job_capacity"] == 30
+
+
+def test_execute_retries_429_honoring_retry_after_and_pauses_bucket():
+    request = MagicMock()
+    request.execute.side_effect = [_http_error(429, retry_after="0.05"), {"ok": True}]
+
+    with patch(f"{MODULE}.time.sleep") as mock_sleep:
+        result = execute_with_quota("sheets", request, job_id="job1")
+
+    assert result == {"ok": True}
+    mock_sleep.assert_called_once_with(0.05)
+    stats = limiter.get_quota_stats()["sheets"]
+    assert stats["http_429"] == 1
+    assert stats["retries"] == 1
+    assert stats["pauses"] == 1
+
+
+def test_execute_retries_5xx_with_backoff():
+    request = MagicMock()
+    request.execute.side_effect = [_http_error(503), _http_error(500), "ok"]
+
+    with patch(f"{MODULE}.time.sleep") as mock_sleep:
+        assert execute_with_quota("sheets", request) == "ok"
+
+    assert mock_sleep.call_count == 2
+    assert limiter.get_quota_stats()["sheets"]["http_5xx"] == 2
+
+
+def test_non_idempotent_execute_retries_only_429():
+    request = MagicMock()
+    request.execute.side_effect = [_http_error(429, retry_after="0"), _http_error(503), "ok"]
+
+    with patch(f"{MODULE}.time.sleep") as mock_sleep, pytest.raises(HttpError):
+        execute_with_quota("sheets", request, idempotent=False)
+
+    assert request.execute.call_count == 2
+    mock_sleep.assert_called_once_with(0.0)
+
+
+def test_safe_to_retry_write_only_when_not_applied():
+    assert limiter.is_safe_to_retry_write(_http_error(429))
+    assert limiter.is_safe_to_retry_write(ConnectionRefusedError())
+    assert not limiter.is_safe_to_retry_write(_http_error(503))
+    assert not limiter.is_safe_to_retry_write(TimeoutError())
+    assert not limiter.is_safe_to_retry_write(ConnectionResetError())
+
+
+def test_by_job_stats_keep_only_recent_jobs():
+    bucket = TokenBucket("sheets", rate_per_minute=60000, burst=1000)
+
+    with patch.object(limiter, "STATS_MAX_JOBS", 3):
+        for job in ("a", "b", "c", "a", "d"):
+            bucket.acquire(job)
+
+    assert bucket.snapshot()["by_job"] == {"c": 1, "a": 2, "d": 1}
+
+
+def test_execute_does_not_retry_client_errors():
+    request = MagicMock()
+    request.execute.side_effect = _http_error(400)
+
+    with patch(f"{MODULE}.time.sleep") as mock_sleep, pytest.raises(HttpError):
+        execute_with_quota("sheets", request)
+
+    request.execute.assert_called_once()
+    mock_sleep.assert_not_called()
+    assert limiter.get_quota_stats()["sheets"]["errors"] == 1
+
+
+def test_execute_gives_up_after_max_attempts():
+    request = MagicMock()
+    request.execute.side_effect = _http_error(429, retry_after="0")
+
+    with patch(f"{MODULE}.time.sleep"), pytest.raises(HttpError):
+        execute_with_quota("drive", request, max_attempts=3)
+
+    assert request.execute.call_count == 3
@@ -4,6 +4,7 @@ Testes da mitigação de latência: ultra-batch Sheets + whitelist.
 - check_whitelist e configure_sheets usam run_in_executor para is_digital.
 - configure_sheets retorna backfill_status "pending" e agenda backfill em background.
 - get_sheets_config retorna backfill_status e backfilled_rows quando presentes.
+- sheets-recover exige usuário na lista digital e dono do job.
 - backfill_sync e write_sync com idempotência (created_at / processedAt).
 """
 import asyncio
@@ -23,6 +24,14 @@ from main import app
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def _clear_sheets_config_cache():
+    from app.services.report_analyzer.google_sheets_service import clear_sheets_config_cache
+    clear_sheets_config_cache()
+    yield
+    clear_sheets_config_cache()
+
+
 def test_check_whitelist_uses_run_in_executor_for_is_digital():
     with patch("app.api.report.is_digital", return_value=True) as mock_is_digital:
         with patch("app.api.report.asyncio.get_running_loop") as mock_loop:
@@ -120,6 +129,46 @@ def test_get_sheets_config_includes_backfill_status_and_backfilled_rows():
         assert data["backfilled_rows"] == 10
 
 
+def _post_sheets_recover(job_data, authorized=True, user_id="u1"):
+    job_doc = MagicMock()
+    job_doc.exists = job_data is not None
+    job_doc.to_dict.return_value = job_data
+    with patch("app.api.report.is_digital", return_value=authorized), \
+            patch("app.api.report.get_firestore_client") as mock_db, \
+            patch("app.api.report.recover_pending_sheets_rows_sync") as mock_recover:
+        mock_db.return_value.collection.return_value.document.return_value.get.return_value = job_doc
+        response = client.post("/api/report/ultra-batch/sheets-recover/job1", json={"user_id": user_id})
+    return response, mock_recover
+
+
+def test_sheets_recover_schedules_recovery_for_job_owner():
+    response, mock_recover = _post_sheets_recover({"user_id": "u1", "status": "completed"})
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "status": "scheduled"}
+    mock_recover.assert_called_once_with("job1")
+
+
+@pytest.mark.parametrize(
+    "job_data, authorized, expected",
+    [
+        ({"user_id": "u1", "status": "completed"}, False, 403),
+        ({"user_id": "other", "status": "completed"}, True, 403),
+        ({"user_id": "u1", "status": "processing"}, True, 409),
+        (None, True, 404),
+    ],
+)
+def test_sheets_recover_rejects_without_running_recovery(job_data, authorized, expected):
+    response, mock_recover = _post_sheets_recover(job_data, authorized)
+    assert response.status_code == expected
+    mock_recover.assert_not_called()
+
+
+def test_sheets_recover_requires_user_id():
+    response, mock_recover = _post_sheets_recover({"user_id": "u1", "status": "completed"}, user_id=None)
+    assert response.status_code == 422
+    mock_recover.assert_not_called()
+
+
 def test_backfill_sync_only_includes_processed_at_before_created_at():
     from app.services.report_analyzer.google_sheets_service import (
         backfill_sheets_from_results_sync,
@@ -151,7 +200,7 @@ def test_backfill_sync_only_includes_processed_at_before_created_at():
     mock_results = [doc_before, doc_after]
     mock_db = MagicMock()
     mock_db.collection.return_value.document.return_value.get.return_value = mock_config_doc
-    mock_db.collection.return_value.document.return_value.collection.return_value.order_by.return_value.stream.return_value = mock_results
+    mock_db.collection.return_value.document.return_value.collection.return_value.order_by.return_value.limit.return_value.stream.return_value = mock_results
 
     with patch("app.services.report_analyzer.google_sheets_service.get_firestore_client", return_value=mock_db):
         with patch("app.services.report_analyzer.google_sheets_service._batch_write_rows_sync") as mock_batch:
@@ -1,28 +1,26 @@
 """
 Serviço de processamento ultra batch para relatórios XP.
-Escrita no Sheets: função sync em run_in_executor sem await (fire-and-forget);
-buffer por job (50 linhas ou 2s) para não saturar o thread pool.
+Escrita no Sheets: SheetsOutbox por job (sheets_outbox.py), um único escritor
+assíncrono que coalesce as linhas em ordem; resultados são gravados com
+sheets_pending=True até a entrega, para recuperação em caso de queda.
 """
 import asyncio
 import base64
 import gc
 import json
 import time
-from collections import defaultdict
 from typing import AsyncGenerator
 
 from firebase_admin import firestore
 
 from app.config import get_firestore_client, get_firebase_bucket
+from app.monitoring import tracing
+from app.monitoring.pipeline_log import file_context, get_pipeline_logger
 from app.services.report_analyzer.batch_processing import process_batch_reports
-from app.services.report_analyzer.google_sheets_service import (
-    batch_flush_rows_to_sheets_sync,
-    write_ultra_batch_result_to_sheets_sync,
-)
+from app.services.report_analyzer.sheets_outbox import PENDING_FIELD, SheetsOutbox
 from app.services.metrics import record_ultra_batch_complete
 
-SHEETS_BUFFER_SIZE = 50
-SHEETS_BUFFER_SECONDS = 2.0
+log = get_pipeline_logger("ultra_batch")
 
 async def read_file_from_gcs(storage_path: str) -> bytes:
     """
@@ -39,26 +37,25 @@ async def read_file_from_gcs(storage_path: str) -> bytes:
         Exception: Se o arquivo não existir ou houver erro na leitura
     """
     try:
-        print(f"[GCS-READ] Lendo arquivo do GCS: {storage_path}")
-        
         # Obter bucket usando função existente em config.py
         bucket = get_firebase_bucket()
         
         # Criar referência ao blob
         blob = bucket.blob(storage_path)
         
-        # Verificar se o arquivo existe
-        if not blob.exists():
-            raise Exception(f"Arquivo não encontrado no GCS: {storage_path}")
-        
-        # Ler bytes diretamente do GCS
-        file_bytes = blob.download_as_bytes()
+        with tracing.span("gcs.download", storage_path=storage_path) as download_span:
+            # Verificar se o arquivo existe
+            if not blob.exists():
+                raise Exception(f"Arquivo não encontrado no GCS: {storage_path}")
+            
+            # Ler bytes diretamente do GCS
+            file_bytes = blob.download_as_bytes()
+            download_span.set(bytes=len(file_bytes))
         
-        print(f"[GCS-READ] ✅ Arquivo lido: {len(file_bytes)} bytes")
+        log.debug("Arquivo lido do GCS", storage_path=storage_path, bytes=len(file_bytes))
         return file_bytes
         
     except Exception as e:
-        print(f"[GCS-READ] ❌ Erro ao ler {storage_path}: {e}")
         raise Exception(f"Erro ao ler arquivo do GCS {storage_path}: {str(e)}")
 
 async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str) -> AsyncGenerator[str, None]:
@@ -74,24 +71,15 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
     
     Yields:
         str: Eventos SSE
+
+    Tracing: o gerador retoma no contexto de quem o itera, então o span do job não
+    fica "corrente" entre yields; os spans internos recebem parent=job_span e
+    nunca envolvem um yield.
     """
-    print(f"[ULTRA-BATCH] Iniciando processamento STREAM para job {job_id}, batch {batch_id}")
+    log.info("Iniciando processamento STREAM", job_id=job_id, batch_id=batch_id)
     start_time = time.time()
-    loop = asyncio.get_running_loop()
-    sheets_buffer: dict[str, list[tuple[str, str, int]]] = defaultdict(list)
-    sheets_last_flush: dict[str, float] = {job_id: time.monotonic()}
-
-    def flush_sheets_buffer(jid: str, force: bool = False) -> None:
-        buf = sheets_buffer.get(jid, [])
-        if not buf:
-            return
-        if not force and len(buf) < SHEETS_BUFFER_SIZE:
-            if jid in sheets_last_flush and (time.monotonic() - sheets_last_flush[jid]) < SHEETS_BUFFER_SECONDS:
-                return
-        rows = buf.copy()
-        sheets_buffer[jid] = []
-        sheets_last_flush[jid] = time.monotonic()
-        loop.run_in_executor(None, batch_flush_rows_to_sheets_sync, jid, rows)
+    sheets_outbox = SheetsOutbox(job_id)
+    job_span = tracing.start_span("ultra_batch.job", job_id=job_id, batch_id=batch_id)
 
     storage_paths_to_delete: list[str] = []
     
@@ -102,7 +90,8 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
         
         # 2. Buscar metadados do batch no Firestore
         batch_ref = db.collection('ultra_batch_uploads').document(batch_id)
-        batch_doc = batch_ref.get()
+        with tracing.span("firestore.get", parent=job_span, collection="ultra_batch_uploads"):
+            batch_doc = batch_ref.get()
         
         if not batch_doc.exists:
             raise Exception(f"Batch {batch_id} não encontrado no Firestore")
@@ -111,7 +100,6 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
         file_names = batch_data.get('file_names', [])
         storage_paths = batch_data.get('storage_paths', [])
         
-        print(f"[ULTRA-BATCH] Batch encontrado: {len(file_names)} arquivos")
         
         # Emitir evento de início
         yield f"data: {json.dumps({
@@ -137,7 +125,8 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
         metadata_chunks = [all_files_metadata[i:i + chunk_size] for i in range(0, len(all_files_metadata), chunk_size)]
         total_chunks = len(metadata_chunks)
         
-        print(f"[ULTRA-BATCH] Dividido em {total_chunks} chunks de metadados")
+        log.info("Batch encontrado", job_id=job_id, files=len(file_names), chunks=total_chunks)
+        job_span.set(files=len(file_names), chunks=total_chunks)
         
         yield f"data: {json.dumps({
             'event': 'chunks_prepared',
@@ -163,7 +152,9 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                     "dataUri": file_base64
                 }
             except Exception as e:
-                print(f"[ULTRA-BATCH] ❌ Erro ao ler {file_name} do GCS: {e}")
+                # Arquivo não chega ao pipeline: o resumo do arquivo sai daqui
+                with file_context(file_name, job_id) as summary:
+                    summary.set(status="read_error", error=str(e), storage_path=storage_path)
                 return {
                     "name": file_name,
                     "dataUri": None,
@@ -172,7 +163,8 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
 
         # Loop principal de processamento
         for chunk_index, metadata_chunk in enumerate(metadata_chunks):
-            print(f"[ULTRA-BATCH] 🔄 Iniciando Chunk {chunk_index + 1}/{total_chunks} ({len(metadata_chunk)} arquivos)")
+            log.debug("Iniciando chunk", job_id=job_id, chunk=chunk_index + 1, total_chunks=total_chunks,
+                      files=len(metadata_chunk))
             
             # Emitir keep-alive antes de operação pesada
             yield ": keepalive\n\n"
@@ -185,7 +177,9 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
             ]
             
             # Carregar arquivos do chunk atual para a memória
-            chunk_files_data = await asyncio.gather(*read_tasks)
+            with tracing.span("ultra_batch.read_chunk", parent=job_span, chunk=chunk_index + 1,
+                              files=len(metadata_chunk)):
+                chunk_files_data = await asyncio.gather(*read_tasks)
             
             # Separar arquivos válidos e com erro de leitura
             files_to_process = []
@@ -197,7 +191,6 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                 else:
                     files_to_process.append(f)
             
-            print(f"[ULTRA-BATCH] Chunk carregado: {len(files_to_process)} prontos, {len(files_with_read_errors)} erros de leitura")
             
             # 2. Processar erros de leitura imediatamente
             current_chunk_offset = chunk_index * chunk_size
@@ -216,15 +209,16 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                     error_msg = f"Erro de leitura: {error_file.get('error')}"
                     
                     result_ref = job_ref.collection('results').document(str(global_file_index))
-                    result_ref.set({
-                        "fileName": error_file["name"],
-                        "accountNumber": "",
-                        "success": False,
-                        "final_message": None,
-                        "error": error_msg,
-                        "processedAt": firestore.SERVER_TIMESTAMP,
-                        "processedAt_epoch_ms": int(time.time() * 1000),
-                    })
+                    with tracing.span("firestore.set", parent=job_span, collection="results"):
+                        result_ref.set({
+                            "fileName": error_file["name"],
+                            "accountNumber": "",
+                            "success": False,
+                            "final_message": None,
+                            "error": error_msg,
+                            "processedAt": firestore.SERVER_TIMESTAMP,
+                            "processedAt_epoch_ms": int(time.time() * 1000),
+                        })
                     
                     processed_files += 1
                     failure_count += 1
@@ -246,7 +240,9 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                     
                     # Chama o processamento (que agora tem Semáforo global)
                     # Nota: Como chunk_size (5) < MAX_CONCURRENT (10), isso roda livre.
-                    ia_results = await process_batch_reports(files_to_process, user_id)
+                    with tracing.span("ultra_batch.process_chunk", parent=job_span, chunk=chunk_index + 1,
+                                      files=len(files_to_process)):
+                        ia_results = await process_batch_reports(files_to_process, user_id, job_id=job_id)
                     
                     # Salvar resultados da IA
                     for result in ia_results:
@@ -260,12 +256,13 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                         
                         # Fallback se não achar nome (improvável)
                         if relative_index == -1:
-                            print(f"[ULTRA-BATCH] ⚠️ Nome de arquivo não encontrado no metadado: {file_name}")
+                            log.warning("Nome de arquivo não encontrado no metadado", job_id=job_id, file_name=file_name)
                             continue
                             
                         global_file_index = current_chunk_offset + relative_index
                         
                         processed_at_epoch_ms = int(time.time() * 1000)
+                        sheets_row = None
                         result_data = {
                             "fileName": file_name,
                             "success": result.get("success", False),
@@ -286,13 +283,9 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                             success_count += 1
 
                             if account_number and result_data.get("final_message"):
-                                sheets_buffer[job_id].append(
-                                    (account_number, result_data["final_message"], processed_at_epoch_ms)
-                                )
-                                flush_sheets_buffer(
-                                    job_id,
-                                    force=(len(sheets_buffer[job_id]) >= SHEETS_BUFFER_SIZE),
-                                )
+                                # Pendente até o outbox entregar a linha na planilha
+                                result_data[PENDING_FIELD] = True
+                                sheets_row = (account_number, result_data["final_message"], processed_at_epoch_ms)
 
                             yield f"data: {json.dumps({
                                 'event': 'file_completed',
@@ -324,12 +317,18 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                         # Salvar no Firestore (persistência em background, não bloqueante na teoria, mas aqui é síncrono da lib)
                         # Como é rápido, mantemos.
                         result_ref = job_ref.collection('results').document(str(global_file_index))
-                        result_ref.set(result_data)
+                        with tracing.span("firestore.set", parent=job_span, collection="results"):
+                            result_ref.set(result_data)
+
+                        # Enfileirar só depois do set: o outbox atualiza este documento após a entrega
+                        if sheets_row:
+                            sheets_outbox.enqueue(str(global_file_index), *sheets_row)
                         
                         processed_files += 1
                         
                 except Exception as ia_error:
-                    print(f"[ULTRA-BATCH] ❌ Erro crítico no processamento do chunk: {ia_error}")
+                    log.error("Erro crítico no processamento do chunk", job_id=job_id,
+                              chunk=chunk_index + 1, error=str(ia_error))
                     # Se falhar o process_batch_reports inteiro, marcar todos os files_to_process como erro
                     for f in files_to_process:
                         file_name = f["name"]
@@ -345,14 +344,15 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                             error_msg = f"Erro IA: {str(ia_error)}"
                             
                             result_ref = job_ref.collection('results').document(str(global_file_index))
-                            result_ref.set({
-                                "fileName": file_name,
-                                "accountNumber": "",
-                                "success": False,
-                                "error": error_msg,
-                                "processedAt": firestore.SERVER_TIMESTAMP,
-                                "processedAt_epoch_ms": int(time.time() * 1000),
-                            })
+                            with tracing.span("firestore.set", parent=job_span, collection="results"):
+                                result_ref.set({
+                                    "fileName": file_name,
+                                    "accountNumber": "",
+                                    "success": False,
+                                    "error": error_msg,
+                                    "processedAt": firestore.SERVER_TIMESTAMP,
+                                    "processedAt_epoch_ms": int(time.time() * 1000),
+                                })
                             processed_files += 1
                             failure_count += 1
                             
@@ -365,13 +365,16 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                             })}\n\n"
 
             # 4. Atualizar progresso global no job
-            job_ref.update({
-                "processedFiles": processed_files,
-                "successCount": success_count,
-                "failureCount": failure_count
-            })
+            with tracing.span("firestore.update", parent=job_span, collection="ultra_batch_jobs"):
+                job_ref.update({
+                    "processedFiles": processed_files,
+                    "successCount": success_count,
+                    "failureCount": failure_count
+                })
             
-            print(f"[ULTRA-BATCH] Chunk {chunk_index + 1} concluído. Memória liberada.")
+            log.info("Chunk concluído", job_id=job_id, chunk=chunk_index + 1, total_chunks=total_chunks,
+                     processed=processed_files, succeeded=success_count, failed=failure_count,
+                     read_errors=len(files_with_read_errors))
             
             # LIBERAÇÃO EXPLÍCITA DE MEMÓRIA
             del chunk_files_data
@@ -386,13 +389,16 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
         # FIM DO LOOP DE CHUNKS - PROCESSO DE CONCLUSÃO NORMAL
         # =========================================================================================
 
-        flush_sheets_buffer(job_id, force=True)
+        await sheets_outbox.close()
 
-        # 6. Marcar job como concluído
-        job_ref.update({
-            "status": "completed",
-            "completedAt": firestore.SERVER_TIMESTAMP
-        })
+        # 6. Marcar job como concluído (trace_id liga o job ao trace exportado)
+        with tracing.span("firestore.update", parent=job_span, collection="ultra_batch_jobs"):
+            job_ref.update({
+                "status": "completed",
+                "completedAt": firestore.SERVER_TIMESTAMP,
+                **({"trace_id": job_span.trace_id} if job_span.trace_id else {}),
+            })
+        job_span.set(succeeded=success_count, failed=failure_count)
         
         # 7. 🔗 PADRÃO DE PONTEIRO: Atualizar statusJob no chat (se houver chat_id)
         try:
@@ -404,19 +410,19 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                     user_id_from_job = job_data.get('user_id')
                     chat_ref = db.collection('users').document(user_id_from_job).collection('chats').document(chat_id)
                     chat_ref.update({'statusJob': 'completed'})
-                    print(f"[ULTRA-BATCH] ✅ Status do chat {chat_id} atualizado para 'completed'")
+                    log.debug("Status do chat atualizado para 'completed'", job_id=job_id, chat_id=chat_id)
         except Exception as update_error:
-            print(f"[ULTRA-BATCH] ⚠️ Erro ao atualizar status do chat: {update_error}")
-        
-        print(f"[ULTRA-BATCH] ✅ Job {job_id} concluído! {success_count} sucessos, {failure_count} falhas")
+            log.warning("Erro ao atualizar status do chat", job_id=job_id, error=str(update_error))
         
         duration = time.time() - start_time
+        log.info("Job concluído", job_id=job_id, succeeded=success_count, failed=failure_count,
+                 duration_seconds=round(duration, 2))
         
         # Registrar conclusão de ultra-batch
         try:
             record_ultra_batch_complete(user_id, job_id)
         except Exception as e:
-            print(f"[ULTRA-BATCH] ⚠️ Erro ao registrar conclusão de métrica: {e}")
+            log.warning("Erro ao registrar conclusão de métrica", job_id=job_id, error=str(e))
             
         # Emitir evento final
         yield f"data: {json.dumps({
@@ -428,7 +434,8 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
         })}\n\n"
         
     except Exception as e:
-        print(f"[ULTRA-BATCH] ❌ Erro crítico no job {job_id}: {e}")
+        log.error("Erro crítico no job", job_id=job_id, error=str(e), exc_info=True)
+        job_span.record_exception(e)
         
         # Marcar job como falhado
         try:
@@ -436,7 +443,8 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
             job_ref.update({
                 "status": "failed",
                 "error": str(e),
-                "completedAt": firestore.SERVER_TIMESTAMP
+                "completedAt": firestore.SERVER_TIMESTAMP,
+                **({"trace_id": job_span.trace_id} if job_span.trace_id else {}),
             })
             
             # 🔗 PADRÃO DE PONTEIRO
@@ -452,7 +460,7 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
             except Exception:
                 pass
         except:
-            print(f"[ULTRA-BATCH] Não foi possível atualizar status de erro no Firestore")
+            log.error("Não foi possível atualizar status de erro no Firestore", job_id=job_id)
         
         # Emitir evento de erro fatal
         yield f"data: {json.dumps({
@@ -461,26 +469,35 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
         })}\n\n"
     
     finally:
+        # Drena o outbox também em falhas (idempotente se já foi fechado)
+        try:
+            await sheets_outbox.close()
+        except Exception as outbox_error:
+            log.warning("Erro ao fechar outbox do Sheets", job_id=job_id, error=str(outbox_error))
+
         # 8. LIMPEZA: Deletar arquivos do GCS após processamento (sucesso ou falha)
         if storage_paths_to_delete:
-            print(f"[CLEANUP] Iniciando limpeza de {len(storage_paths_to_delete)} arquivos do GCS...")
             try:
                 bucket = get_firebase_bucket()
                 deleted_count = 0
-                for storage_path in storage_paths_to_delete:
-                    try:
-                        blob = bucket.blob(storage_path)
-                        if blob.exists():
-                            blob.delete()
-                            deleted_count += 1
-                            print(f"[CLEANUP] ✅ Arquivo deletado: {storage_path}")
-                        else:
-                            print(f"[CLEANUP] ⚠️ Arquivo não encontrado (já deletado?): {storage_path}")
-                    except Exception as delete_error:
-                        print(f"[CLEANUP] ⚠️ Falha ao deletar {storage_path}: {delete_error}")
-                        # Não falhar o job se limpeza falhar
+                with tracing.span("gcs.delete", parent=job_span, files=len(storage_paths_to_delete)) as delete_span:
+                    for storage_path in storage_paths_to_delete:
+                        try:
+                            blob = bucket.blob(storage_path)
+                            if blob.exists():
+                                blob.delete()
+                                deleted_count += 1
+                            else:
+                                log.debug("Arquivo não encontrado na limpeza (já deletado?)", job_id=job_id,
+                                          storage_path=storage_path)
+                        except Exception as delete_error:
+                            log.warning("Falha ao deletar arquivo do GCS", job_id=job_id,
+                                        storage_path=storage_path, error=str(delete_error))
+                            # Não falhar o job se limpeza falhar
+                    delete_span.set(deleted=deleted_count)
                 
-                print(f"[CLEANUP] ✅ Limpeza concluída: {deleted_count}/{len(storage_paths_to_delete)} arquivos deletados")
+                log.info("Limpeza concluída", job_id=job_id, deleted=deleted_count,
+                         total=len(storage_paths_to_delete))
                 
                 # Atualizar status do batch no Firestore
                 try:
@@ -490,7 +507,9 @@ async def process_ultra_batch_reports(batch_id: str, user_id: str, job_id: str)
                         'cleaned_at': firestore.SERVER_TIMESTAMP
                     })
                 except Exception as update_error:
-                    print(f"[CLEANUP] ⚠️ Erro ao atualizar status do batch: {update_error}")
+                    log.warning("Erro ao atualizar status do batch", job_id=job_id, error=str(update_error))
                     
             except Exception as cleanup_error:
-                print(f"[CLEANUP] ❌ Erro crítico na limpeza: {cleanup_error}")
+                log.error("Erro crítico na limpeza", job_id=job_id, error=str(cleanup_error))
+
+        job_span.end()
@@ -1,11 +1,18 @@
 """
 Testes unitários para digital_whitelist.is_digital.
-Cobre: email na lista (True), fora da lista (False), documento ausente, lista vazia.
+Cobre: email na lista (True), fora da lista (False), documento ausente, lista vazia,
+LRU limitado, prefetch com get_all e stale-while-revalidate.
 """
 import pytest
 from unittest.mock import MagicMock, patch
 
-from app.services.digital_whitelist import is_digital, clear_cache
+from app.services import digital_whitelist
+from app.services.digital_whitelist import (
+    clear_cache,
+    get_whitelist_cache_stats,
+    is_digital,
+    prefetch_user_emails,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -131,3 +138,114 @@ class TestIsDigital:
         db.collection.return_value.document.side_effect = doc_side_effect
 
         assert is_digital("uid_case") is True
+
+
+def _db_with_users(emails_by_uid: dict, digital: list[str]) -> MagicMock:
+    """Firestore simulado com users/{uid} (get e get_all) e config/digital_team."""
+    db = MagicMock()
+
+    def doc_side_effect(doc_id):
+        m = MagicMock()
+        m.id = doc_id
+        if doc_id == "digital_team":
+            m.get.return_value = _mock_config_doc(digital)
+        else:
+            m.get.return_value = _mock_user_doc(emails_by_uid.get(doc_id), exists=doc_id in emails_by_uid)
+        return m
+
+    def get_all(refs):
+        for ref in refs:
+            doc = _mock_user_doc(emails_by_uid.get(ref.id), exists=ref.id in emails_by_uid)
+            doc.id = ref.id
+            yield doc
+
+    db.collection.return_value.document.side_effect = doc_side_effect
+    db.get_all.side_effect = get_all
+    return db
+
+
+class TestWhitelistCache:
+    @patch("app.services.digital_whitelist.get_firestore_client")
+    def test_prefetch_resolves_many_uids_with_one_get_all(self, mock_db_fn):
+        db = _db_with_users({"u1": "digital@3a.com", "u2": "other@3a.com"}, ["digital@3a.com"])
+        mock_db_fn.return_value = db
+
+        assert prefetch_user_emails(["u1", "u2", "u3", "u1"]) == 3
+        assert is_digital("u1") is True
+        assert is_digital("u2") is False
+        assert is_digital("u3") is False
+
+        db.get_all.assert_called_once()
+        assert [ref.id for ref in db.get_all.call_args[0][0]] == ["u1", "u2", "u3"]
+        stats = get_whitelist_cache_stats()
+        assert stats["hits"] == 3 and stats["misses"] == 0
+        assert stats["prefetched"] == 3
+        # Já em cache: nada a buscar
+        assert prefetch_user_emails(["u1", "u2"]) == 0
+
+    @patch("app.services.digital_whitelist.get_firestore_client")
+    def test_lru_is_bounded(self, mock_db_fn):
+        mock_db_fn.return_value = _db_with_users({f"u{i}": f"u{i}@3a.com" for i in range(5)}, [])
+
+        with patch.object(digital_whitelist, "_CACHE_MAX_ENTRIES", 3):
+            for i in range(5):
+                is_digital(f"u{i}")
+            is_digital("u2")  # u2 passa a ser o mais recente
+
+        assert list(digital_whitelist._email_resolution_cache) == ["u3", "u4", "u2"]
+        assert get_whitelist_cache_stats()["evictions"] == 2
+
+    @patch("app.services.digital_whitelist.get_firestore_client")
+    def test_stale_entry_is_served_while_refreshing_in_background(self, mock_db_fn):
+        emails = {"u1": "digital@3a.com"}
+        mock_db_fn.return_value = _db_with_users(emails, ["digital@3a.com"])
+        refreshes = []
+
+        with patch("app.services.digital_whitelist.time.monotonic", return_value=1000.0):
+            assert is_digital("u1") is True
+
+        # Removido da lista depois do cache: o refresh é agendado, não executado no request
+        emails["u1"] = "moved@3a.com"
+        with patch("app.services.digital_whitelist.time.monotonic", return_value=1000.0 + 400), \
+             patch("app.services.digital_whitelist._submit_refresh", side_effect=lambda key, fn: refreshes.append((key, fn))):
+            assert is_digital("u1") is True
+
+        assert sorted(key for key, _ in refreshes) == [":digital_team", "u1"]
+        stats = get_whitelist_cache_stats()
+        assert stats["stale_hits"] == 1
+
+        for _, fn in refreshes:
+            fn()
+        assert is_digital("u1") is False
+        assert get_whitelist_cache_stats()["refreshes"] >= 3
+
+    @patch("app.services.digital_whitelist.get_firestore_client")
+    def test_entry_past_max_stale_is_read_synchronously(self, mock_db_fn):
+        mock_db_fn.return_value = _db_with_users({"u1": "digital@3a.com"}, ["digital@3a.com"])
+
+        with patch("app.services.digital_whitelist.time.monotonic", return_value=1000.0):
+            is_digital("u1")
+        with patch("app.services.digital_whitelist.time.monotonic", return_value=1000.0 + 10_000), \
+             patch("app.services.digital_whitelist._submit_refresh") as mock_submit:
+            assert is_digital("u1") is True
+
+        mock_submit.assert_not_called()
+        assert get_whitelist_cache_stats()["misses"] == 2
+
+    def test_background_refresh_runs_once_per_key(self):
+        import threading
+
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(2)
+
+        digital_whitelist._submit_refresh("u1", slow)
+        assert started.wait(2)
+        digital_whitelist._submit_refresh("u1", slow)
+        release.set()
+
+        assert calls == [1]
@@ -0,0 +1,93 @@
+"""
+Testes unitários para metrics_summary: leitura em lote (get_all) e cache
+(mês fechado sem expirar, mês aberto com TTL).
+"""
+import pytest
+from unittest.mock import MagicMock, patch
+
+from app.services.metrics_summary import (
+    clear_metrics_summary_cache,
+    get_metrics_summaries_sync,
+    get_metrics_summary_cache_stats,
+)
+
+MODULE = "app.services.metrics_summary"
+
+
+@pytest.fixture(autouse=True)
+def _clear():
+    clear_metrics_summary_cache()
+    yield
+    clear_metrics_summary_cache()
+
+
+def _db(summaries: dict) -> MagicMock:
+    """Firestore simulado com metrics_summary/{month} servido por get_all."""
+    db = MagicMock()
+
+    def document(month):
+        ref = MagicMock()
+        ref.id = month
+        return ref
+
+    def get_all(refs):
+        for ref in refs:
+            doc = MagicMock()
+            doc.id = ref.id
+            doc.exists = ref.id in summaries
+            doc.to_dict.return_value = summaries.get(ref.id)
+            yield doc
+
+    db.collection.return_value.document.side_effect = document
+    db.get_all.side_effect = get_all
+    return db
+
+
+def test_all_months_read_in_one_get_all_in_order():
+    db = _db({"2025-01": {"closed": True, "mau": 1}, "2025-03": {"closed": False, "mau": 3}})
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db):
+        result = get_metrics_summaries_sync(["2025-01", "2025-02", "2025-03"])
+
+    assert [(r["month"], r["mau"]) for r in result] == [("2025-01", 1), ("2025-03", 3)]
+    db.get_all.assert_called_once()
+    db.collection.assert_called_once_with("metrics_summary")
+
+
+def test_repeat_view_within_ttl_does_not_read_firestore():
+    db = _db({"2025-01": {"closed": True}, "2025-02": {"closed": False}})
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db):
+        get_metrics_summaries_sync(["2025-01", "2025-02"])
+        get_metrics_summaries_sync(["2025-01", "2025-02"])
+
+    assert db.get_all.call_count == 1
+    stats = get_metrics_summary_cache_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["round_trips"] == 1
+
+
+def test_only_open_month_is_reread_after_ttl():
+    db = _db({"2025-01": {"closed": True}, "2025-02": {"closed": False}})
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}.METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS", 60), \
+         patch(f"{MODULE}.time.monotonic", return_value=1000.0):
+        get_metrics_summaries_sync(["2025-01", "2025-02"])
+    with patch(f"{MODULE}.get_firestore_client", return_value=db), \
+         patch(f"{MODULE}.METRICS_SUMMARY_OPEN_MONTH_TTL_SECONDS", 60), \
+         patch(f"{MODULE}.time.monotonic", return_value=1000.0 + 10_000):
+        get_metrics_summaries_sync(["2025-01", "2025-02"])
+
+    assert db.get_all.call_count == 2
+    assert [ref.id for ref in db.get_all.call_args[0][0]] == ["2025-02"]
+
+
+def test_returned_items_are_copies():
+    db = _db({"2025-01": {"closed": True, "volume": {"total": 1}}})
+
+    with patch(f"{MODULE}.get_firestore_client", return_value=db):
+        first = get_metrics_summaries_sync(["2025-01"])
+        first[0]["volume"]["total"] = 99
+        second = get_metrics_summaries_sync(["2025-01"])
+
+    assert second[0]["volume"]["total"] == 1
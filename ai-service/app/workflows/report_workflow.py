@@ -5,6 +5,8 @@ import os
 from langgraph.graph import StateGraph, END
 from app.models.schema import ReportAnalysisState
 from app.config import LANGCHAIN_PROJECT_REPORT
+from app.monitoring.pipeline_log import get_pipeline_logger
+from app.monitoring.tracing import traced
 from app.services.report_analyzer.nodes import (
     extract_pdf,
     extract_data,
@@ -13,6 +15,8 @@ from app.services.report_analyzer.nodes import (
     format_message_custom
 )
 
+log = get_pipeline_logger("report_workflow")
+
 
 def create_report_analysis_workflow():
     """
@@ -30,17 +34,17 @@ def create_report_analysis_workflow():
     
     # Configurar para este request específico
     os.environ["LANGCHAIN_PROJECT"] = LANGCHAIN_PROJECT_REPORT
-    print(f"[report_workflow] Configurado projeto LangSmith: {LANGCHAIN_PROJECT_REPORT}")
+    log.debug("Configurado projeto LangSmith", project=LANGCHAIN_PROJECT_REPORT)
     
      # Criar o grafo
     workflow = StateGraph(ReportAnalysisState)
     
-    # Adicionar nós
-    workflow.add_node("extract_pdf", extract_pdf)
-    workflow.add_node("extract_data", extract_data)
-    workflow.add_node("analyze_report", analyze_report)
-    workflow.add_node("format_message_auto", format_message_auto)
-    workflow.add_node("format_message_custom", format_message_custom) 
+    # Adicionar nós (um span por execução de nó)
+    workflow.add_node("extract_pdf", traced("node.extract_pdf")(extract_pdf))
+    workflow.add_node("extract_data", traced("node.extract_data")(extract_data))
+    workflow.add_node("analyze_report", traced("node.analyze_report")(analyze_report))
+    workflow.add_node("format_message_auto", traced("node.format_message_auto")(format_message_auto))
+    workflow.add_node("format_message_custom", traced("node.format_message_custom")(format_message_custom))
     
     # Definir ponto de entrada
     workflow.set_entry_point("extract_pdf")
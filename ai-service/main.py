@@ -2,13 +2,18 @@
 Entry point da aplicação FastAPI.
 """
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from app.config import ENVIRONMENT
+from app.config import ENVIRONMENT, LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS
 from app.api.report import router as report_router
 from app.api.test import router as test_router  # ⚠️ TEMPORÁRIO - REMOVER APÓS TESTES
+from app.services.metrics_buffer import flush_metrics
+from app.monitoring.logger import shutdown_logger
+from app.monitoring.tracing import shutdown_tracing
+from app.middleware.tracing import TracingMiddleware
 import sys
 
 # Importar error handlers
@@ -20,6 +25,28 @@ from app.middleware.error_handler import (
 
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Shutdown: grava as métricas ainda acumuladas no buffer
+    try:
+        flush_metrics()
+    except Exception as e:
+        print(f"[MAIN] ⚠️ Erro ao gravar métricas no shutdown: {e}")
+    # Envia os logs estruturados ainda na fila do exportador
+    try:
+        if not shutdown_logger():
+            print("[MAIN] ⚠️ Logs pendentes não enviados dentro do timeout de shutdown")
+    except Exception as e:
+        print(f"[MAIN] ⚠️ Erro ao enviar logs no shutdown: {e}")
+    # Exporta os spans ainda na fila do tracing
+    try:
+        if not shutdown_tracing(timeout=LOG_EXPORT_SHUTDOWN_TIMEOUT_SECONDS):
+            print("[MAIN] ⚠️ Spans pendentes não exportados dentro do timeout de shutdown")
+    except Exception as e:
+        print(f"[MAIN] ⚠️ Erro ao exportar spans no shutdown: {e}")
+
+
 # Criar instância do FastAPI
 app = FastAPI(
     title="Bob AI Services API",
@@ -27,6 +54,7 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/docs" if ENVIRONMENT != "production" else None,
     redoc_url="/redoc" if ENVIRONMENT != "production" else None,
+    lifespan=lifespan,
 )
 
 # Configurar CORS
@@ -60,6 +88,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Span raiz por request (adicionado por último = mais externo; no-op com TRACING_EXPORTER=none)
+app.add_middleware(TracingMiddleware)
+
 # ========================================
 # REGISTRAR ERROR HANDLERS
 # ========================================
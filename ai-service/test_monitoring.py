@@ -85,6 +85,9 @@ def test_logger():
         }
     )
     
+    # Logs são enviados em background; espera a fila esvaziar antes de sair
+    logger.flush()
+
     print("\n" + "="*60)
     if logger.enabled:
         print("✅ Testes concluídos!")
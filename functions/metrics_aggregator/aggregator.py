@@ -1,39 +1,118 @@
 import calendar
+import hashlib
 import logging
-from datetime import datetime, timezone
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from typing import Any
 
 from firebase_admin import firestore
 
 from config import (
+    BACKFILL_MAX_WORKERS,
     COLLECTION_CONFIG,
     COLLECTION_METRICS,
+    COLLECTION_METRICS_DAILY_PARTIALS,
     COLLECTION_METRICS_SUMMARY,
     COLLECTION_ULTRA_BATCH_JOBS,
     COLLECTION_USERS,
     DEFAULT_TOTAL_ASSESSORS,
     DOC_DIGITAL_TEAM,
+    DOC_DIGITAL_TEAM_UIDS,
     DOC_METRICS_CONFIG,
     DOC_TOTAL,
+    FIELD_ULTRA_BATCH_FILES,
+    FIELD_ULTRA_BATCH_RUN_COUNT,
+    FIRESTORE_BATCH_LIMIT,
+    FIRESTORE_IN_QUERY_LIMIT,
+    INCREMENTAL_AGGREGATION,
+    SCAN_MAX_WORKERS,
     SUBDOC_TOTAL,
     SUBDOC_USERS,
+    TOTAL_COUNTER_FIELDS,
+    TOTAL_SHARD_PREFIX,
+    UID_SET_BLOB_SUFFIX,
+    UID_SET_FIELDS,
+    WATERMARK_SKEW_SECONDS,
 )
+from uid_set_codec import decode_uid_set, encode_uid_set, intersect_uid_sets
 
 logger = logging.getLogger(__name__)
 
+# Campos projetados (select) em cada leitura do agregador
+USER_DAY_FIELDS: list[str] = [
+    "automatica",
+    "personalized",
+    FIELD_ULTRA_BATCH_RUN_COUNT,
+    FIELD_ULTRA_BATCH_FILES,
+    "ultra_batch_runs",  # layout antigo; ausente nos docs novos
+]
+JOB_QUALITY_FIELDS: list[str] = ["status", "successCount", "failureCount"]
+
+
+class ReadMeter:
+    """
+    Documentos lidos e bytes estimados (regras de tamanho de armazenamento do
+    Firestore aplicadas aos campos recebidos) ao longo do processo; thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.docs = 0
+        self.bytes = 0
+
+    def count(self, doc: Any) -> None:
+        size = 0
+        if getattr(doc, "exists", True):
+            size = len(str(doc.id)) + 1 + 16 + _value_size(doc.to_dict() or {})
+        with self._lock:
+            self.docs += 1
+            self.bytes += size
+
+    def snapshot(self) -> tuple[int, int]:
+        with self._lock:
+            return self.docs, self.bytes
+
+
+def _value_size(value: Any) -> int:
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + 1 + _value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(_value_size(v) for v in value)
+    return 8
+
+
+read_meter = ReadMeter()
+
+
+def _metered(docs: Any) -> Any:
+    """Repassa os documentos de um stream/get_all contabilizando-os no read_meter."""
+    for doc in docs:
+        read_meter.count(doc)
+        yield doc
+
+
+def _metered_get(ref: Any, field_paths: list[str] | None = None) -> Any:
+    doc = ref.get(field_paths=field_paths) if field_paths else ref.get()
+    read_meter.count(doc)
+    return doc
+
 
 def _month_range(year: int, month: int) -> list[str]:
     last = calendar.monthrange(year, month)[1]
     return [f"{year}-{month:02d}-{d:02d}" for d in range(1, last + 1)]
 
 
-def _get_month_bounds(year: int, month: int) -> tuple[datetime, datetime]:
-    start = datetime(year, month, 1, 0, 0, 0, tzinfo=timezone.utc)
-    last = calendar.monthrange(year, month)[1]
-    end = datetime(year, month, last, 23, 59, 59, 999999, tzinfo=timezone.utc)
-    return start, end
-
-
 def _prev_month(month_key: str) -> str:
     year, month = int(month_key[:4]), int(month_key[5:7])
     if month == 1:
@@ -43,10 +122,9 @@ def _prev_month(month_key: str) -> str:
 
 def _read_total_assessors(db: firestore.Client) -> int:
     try:
-        doc = (
-            db.collection(COLLECTION_CONFIG)
-            .document(DOC_METRICS_CONFIG)
-            .get()
+        doc = _metered_get(
+            db.collection(COLLECTION_CONFIG).document(DOC_METRICS_CONFIG),
+            ["total_assessors"],
         )
         if doc.exists:
             value = (doc.to_dict() or {}).get("total_assessors")
@@ -61,91 +139,431 @@ def _read_total_assessors(db: firestore.Client) -> int:
     return DEFAULT_TOTAL_ASSESSORS
 
 
-def _load_digital_uids(db: firestore.Client) -> tuple[set[str], int]:
+def _resolve_emails_batch(users_col: Any, emails: list[str]) -> dict[str, str]:
+    """Um filtro "in" para até FIRESTORE_IN_QUERY_LIMIT emails; retorna email → uid."""
+    found: dict[str, str] = {}
+    query = users_col.where("email", "in", emails).select(["email"])
+    for doc in _metered(query.stream()):
+        email = ((doc.to_dict() or {}).get("email") or "").strip().lower()
+        if email and email not in found:
+            found[email] = doc.id
+    return found
+
+
+def _resolve_emails_to_uids(
+    db: firestore.Client,
+    emails: list[str],
+    max_workers: int = SCAN_MAX_WORKERS,
+) -> dict[str, str]:
+    """
+    Resolve emails → uids com filtros "in" (até FIRESTORE_IN_QUERY_LIMIT por query),
+    executados em paralelo. Emails sem usuário ficam fora do resultado.
+    """
+    if not emails:
+        return {}
+    users_col = db.collection(COLLECTION_USERS)
+    chunks = [
+        emails[i:i + FIRESTORE_IN_QUERY_LIMIT]
+        for i in range(0, len(emails), FIRESTORE_IN_QUERY_LIMIT)
+    ]
+    resolved: dict[str, str] = {}
+    workers = max(1, min(max_workers, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="digital-uids") as pool:
+        futures = [pool.submit(_resolve_emails_batch, users_col, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                resolved.update(future.result())
+            except Exception as e:
+                logger.warning("Falha ao resolver %d emails→UID: %s", len(chunk), e)
+    return resolved
+
+
+def _load_digital_uids(
+    db: firestore.Client,
+    refresh_mapping: bool = False,
+) -> tuple[set[str], int]:
+    """
+    UIDs do time digital (config/digital_team.emails) e tamanho do time.
+
+    O mapeamento email → uid fica em config/digital_team_uids (campo uids, com
+    version incrementada a cada mudança): só emails novos no time (ou ainda sem
+    usuário) são consultados; emails removidos saem do mapeamento.
+    refresh_mapping=True reconsulta o time inteiro.
+    """
     try:
-        config_doc = (
-            db.collection(COLLECTION_CONFIG).document(DOC_DIGITAL_TEAM).get()
+        config_doc = _metered_get(
+            db.collection(COLLECTION_CONFIG).document(DOC_DIGITAL_TEAM), ["emails"]
         )
         if not config_doc.exists:
             logger.warning(
                 "config/digital_team não encontrado; métricas digitais zeradas."
             )
             return set(), 0
-        emails: list[str] = [
+        emails: list[str] = list(dict.fromkeys(
             e.strip().lower()
             for e in ((config_doc.to_dict() or {}).get("emails") or [])
             if isinstance(e, str) and e.strip()
-        ]
+        ))
         digital_team_size = len(emails)
     except Exception as e:
         logger.error("Falha ao ler config/digital_team: %s", e)
         return set(), 0
 
-    digital_uids: set[str] = set()
-    users_col = db.collection(COLLECTION_USERS)
-    for email in emails:
+    mapping_ref = db.collection(COLLECTION_CONFIG).document(DOC_DIGITAL_TEAM_UIDS)
+    cached: dict[str, str] = {}
+    version = 0
+    if not refresh_mapping:
         try:
-            docs = list(users_col.where("email", "==", email).limit(1).stream())
-            if docs:
-                digital_uids.add(docs[0].id)
-            else:
-                logger.warning("Email digital sem UID correspondente: %s", email)
+            mapping_doc = _metered_get(mapping_ref)
+            if mapping_doc.exists:
+                mapping_data = mapping_doc.to_dict() or {}
+                cached = dict(mapping_data.get("uids") or {})
+                version = mapping_data.get("version") or 0
         except Exception as e:
-            logger.warning("Falha ao resolver email→UID para %s: %s", email, e)
+            logger.warning("Falha ao ler config/digital_team_uids: %s", e)
+
+    team = set(emails)
+    mapping = {email: uid for email, uid in cached.items() if email in team}
+    to_resolve = [email for email in emails if email not in mapping]
+    mapping.update(_resolve_emails_to_uids(db, to_resolve))
+    for email in to_resolve:
+        if email not in mapping:
+            logger.warning("Email digital sem UID correspondente: %s", email)
 
+    if mapping != cached:
+        try:
+            mapping_ref.set({
+                "uids": mapping,
+                "version": version + 1,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            })
+        except Exception as e:
+            logger.warning("Falha ao gravar config/digital_team_uids: %s", e)
+
+    digital_uids = set(mapping.values())
     logger.info(
-        "Time digital: %d emails, %d UIDs resolvidos",
+        "Time digital: %d emails, %d UIDs resolvidos (%d consultados)",
         digital_team_size,
         len(digital_uids),
+        len(to_resolve),
     )
     return digital_uids, digital_team_size
 
 
-def _collect_active_uids(
+def _ultra_batch_usage(data: dict[str, Any]) -> tuple[int, int]:
+    """
+    (execuções, arquivos) de ultra batch de um doc de usuário do dia: contadores
+    pré-computados mais o array ultra_batch_runs dos docs no layout antigo.
+    """
+    legacy_runs = data.get("ultra_batch_runs") or []
+    runs = (data.get(FIELD_ULTRA_BATCH_RUN_COUNT) or 0) + len(legacy_runs)
+    files = (data.get(FIELD_ULTRA_BATCH_FILES) or 0) + sum(r.get("file_count") or 0 for r in legacy_runs)
+    return runs, files
+
+
+@dataclass
+class MonthScan:
+    """Acumulador do scan de um período: MAU, MAU digital e volumes."""
+
+    active_uids: set[str] = field(default_factory=set)
+    digital_active_uids: set[str] = field(default_factory=set)
+    digital_total_analyses: int = 0
+    total_analyses: int = 0
+    ultra_total: int = 0
+
+    def merge(self, other: "MonthScan") -> None:
+        self.active_uids |= other.active_uids
+        self.digital_active_uids |= other.digital_active_uids
+        self.digital_total_analyses += other.digital_total_analyses
+        self.total_analyses += other.total_analyses
+        self.ultra_total += other.ultra_total
+
+
+def _scan_day(
+    db: firestore.Client,
+    date_str: str,
+    digital_uids: set[str],
+    include_totals: bool = True,
+) -> MonthScan:
+    """Lê uma vez os docs de usuário do dia (e o total diário) e acumula tudo."""
+    scan = MonthScan()
+    users_ref = (
+        db.collection(COLLECTION_METRICS)
+        .document(date_str)
+        .collection(SUBDOC_USERS)
+    )
+    for doc in _metered(users_ref.select(USER_DAY_FIELDS).stream()):
+        data = doc.to_dict() or {}
+        automatica = data.get("automatica") or 0
+        personalized = data.get("personalized") or 0
+        ultra_batch_runs, file_count = _ultra_batch_usage(data)
+        active = automatica > 0 or personalized > 0 or ultra_batch_runs > 0
+        if active:
+            scan.active_uids.add(doc.id)
+        if doc.id in digital_uids:
+            if active:
+                scan.digital_active_uids.add(doc.id)
+            scan.digital_total_analyses += automatica + personalized + file_count
+
+    if include_totals:
+        totals = _read_daily_total(db, date_str)
+        ultra_batch_total_files = totals["ultra_batch_total_files"]
+        scan.total_analyses = totals["automatica"] + totals["personalized"] + ultra_batch_total_files
+        scan.ultra_total = ultra_batch_total_files
+    return scan
+
+
+def _scan_days(
     db: firestore.Client,
     date_list: list[str],
-    filter_uids: set[str] | None = None,
-) -> set[str]:
-    seen: set[str] = set()
-    for date_str in date_list:
-        users_ref = (
-            db.collection(COLLECTION_METRICS)
-            .document(date_str)
-            .collection(SUBDOC_USERS)
+    digital_uids: set[str],
+    include_totals: bool = True,
+    max_workers: int = SCAN_MAX_WORKERS,
+) -> list[MonthScan]:
+    """Um MonthScan por dia (na ordem de date_list), com os dias lidos em paralelo."""
+    if not date_list:
+        return []
+    workers = max(1, min(max_workers, len(date_list)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metrics-scan") as pool:
+        return list(pool.map(
+            lambda date_str: _scan_day(db, date_str, digital_uids, include_totals),
+            date_list,
+        ))
+
+
+def _scan_month(
+    db: firestore.Client,
+    date_list: list[str],
+    digital_uids: set[str],
+    include_totals: bool = True,
+    max_workers: int = SCAN_MAX_WORKERS,
+) -> MonthScan:
+    """
+    Scan único do período: cada dia é lido uma vez (usuários + total diário), com
+    os dias em paralelo num pool de threads, e os parciais somados num MonthScan.
+    """
+    scan = MonthScan()
+    for partial in _scan_days(db, date_list, digital_uids, include_totals, max_workers):
+        scan.merge(partial)
+    return scan
+
+
+# ─── Agregação incremental (parciais diários + watermark) ───────────────────
+
+def _digital_key(digital_uids: set[str]) -> str:
+    """Identifica o time digital usado num parcial (mudou o time, o parcial vence)."""
+    return hashlib.sha1("\n".join(sorted(digital_uids)).encode()).hexdigest()
+
+
+def _partial_to_doc(scan: MonthScan, watermark: datetime, digital_key: str) -> dict[str, Any]:
+    return {
+        "active_uids": sorted(scan.active_uids),
+        "digital_active_uids": sorted(scan.digital_active_uids),
+        "digital_total_analyses": scan.digital_total_analyses,
+        "total_analyses": scan.total_analyses,
+        "ultra_total": scan.ultra_total,
+        "digital_key": digital_key,
+        "watermark": watermark,
+    }
+
+
+def _partial_from_doc(data: dict[str, Any]) -> MonthScan:
+    return MonthScan(
+        active_uids=set(data.get("active_uids") or []),
+        digital_active_uids=set(data.get("digital_active_uids") or []),
+        digital_total_analyses=data.get("digital_total_analyses") or 0,
+        total_analyses=data.get("total_analyses") or 0,
+        ultra_total=data.get("ultra_total") or 0,
+    )
+
+
+def _day_changed_since(db: firestore.Client, date_str: str, watermark: datetime) -> bool:
+    """Algum doc de usuário ou shard do total do dia tem last_updated depois do watermark."""
+    day_ref = db.collection(COLLECTION_METRICS).document(date_str)
+    for sub in (SUBDOC_USERS, SUBDOC_TOTAL):
+        query = (
+            day_ref.collection(sub)
+            .where("last_updated", ">", watermark)
+            .select(["last_updated"])
+            .limit(1)
         )
-        for doc in users_ref.stream():
-            if filter_uids is not None and doc.id not in filter_uids:
-                continue
-            data = doc.to_dict() or {}
-            automatica = data.get("automatica") or 0
-            personalized = data.get("personalized") or 0
-            ultra_batch_runs = data.get("ultra_batch_runs") or []
-            if automatica > 0 or personalized > 0 or len(ultra_batch_runs) > 0:
-                seen.add(doc.id)
-    return seen
+        if any(True for _ in _metered(query.stream())):
+            return True
+    return False
+
 
+def _load_daily_partials(
+    db: firestore.Client,
+    date_list: list[str],
+    digital_uids: set[str],
+    max_workers: int = SCAN_MAX_WORKERS,
+) -> dict[str, MonthScan]:
+    """
+    Parciais diários do período. Os docs de metrics_daily_partials/{date} vêm num
+    get_all; só dias sem parcial, com time digital diferente ou com escrita depois do
+    watermark são reescaneados (e os parciais regravados com novo watermark).
+    """
+    if not date_list:
+        return {}
+    digital_key = _digital_key(digital_uids)
+    partials_col = db.collection(COLLECTION_METRICS_DAILY_PARTIALS)
+    stored = {
+        doc.id: doc.to_dict() or {}
+        for doc in _metered(db.get_all([partials_col.document(d) for d in date_list]))
+        if doc.exists
+    }
 
-def _get_uids_for_month(
+    candidates = [
+        d for d in date_list
+        if d in stored
+        and stored[d].get("digital_key") == digital_key
+        and stored[d].get("watermark") is not None
+    ]
+    workers = max(1, min(max_workers, len(candidates) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metrics-watermark") as pool:
+        changed = list(pool.map(
+            lambda d: _day_changed_since(db, d, stored[d]["watermark"]), candidates
+        ))
+    reusable = {d for d, was_changed in zip(candidates, changed) if not was_changed}
+
+    result = {d: _partial_from_doc(stored[d]) for d in reusable}
+    stale = [d for d in date_list if d not in reusable]
+    # Escritas durante o scan ficam depois do watermark e entram na próxima execução
+    watermark = datetime.now(timezone.utc) - timedelta(seconds=WATERMARK_SKEW_SECONDS)
+    fresh = _scan_days(db, stale, digital_uids, max_workers=max_workers)
+    _write_daily_partials(db, dict(zip(stale, fresh)), watermark, digital_key)
+    result.update(zip(stale, fresh))
+    logger.info(
+        "Agregação incremental: %d dias reaproveitados, %d reescaneados",
+        len(reusable),
+        len(stale),
+    )
+    return result
+
+
+def _write_daily_partials(
+    db: firestore.Client,
+    partials: dict[str, MonthScan],
+    watermark: datetime,
+    digital_key: str,
+) -> None:
+    if not partials:
+        return
+    partials_col = db.collection(COLLECTION_METRICS_DAILY_PARTIALS)
+    batch = db.batch()
+    for date_str, scan in partials.items():
+        batch.set(partials_col.document(date_str), _partial_to_doc(scan, watermark, digital_key))
+    batch.commit()
+
+
+def _scan_month_incremental(
+    db: firestore.Client,
+    date_list: list[str],
+    digital_uids: set[str],
+    max_workers: int = SCAN_MAX_WORKERS,
+) -> MonthScan:
+    """Mesmo resultado de _scan_month, montado a partir dos parciais diários."""
+    scan = MonthScan()
+    for partial in _load_daily_partials(db, date_list, digital_uids, max_workers).values():
+        scan.merge(partial)
+    return scan
+
+
+def verify_incremental_aggregation(
     db: firestore.Client,
     month_key: str,
-    uid_field: str = "active_uids",
-) -> set[str]:
-    ref = db.collection(COLLECTION_METRICS_SUMMARY).document(month_key)
-    doc = ref.get()
-    if doc.exists:
-        data = doc.to_dict() or {}
-        adoption = data.get("adoption") or {}
-        cached = adoption.get(uid_field)
-        if isinstance(cached, list) and cached:
-            return set(cached)
+    repair: bool = True,
+) -> dict[str, Any]:
+    """
+    Compara, dia a dia, os parciais da agregação incremental com um scan completo.
+    Com repair=True, dias divergentes têm o parcial regravado a partir do scan completo.
+    Escritas concorrentes podem gerar divergências transitórias.
+    """
+    year, month = int(month_key[:4]), int(month_key[5:7])
+    date_list = _month_range(year, month)
+    digital_uids, _ = _load_digital_uids(db)
 
+    incremental = _load_daily_partials(db, date_list, digital_uids)
+    watermark = datetime.now(timezone.utc) - timedelta(seconds=WATERMARK_SKEW_SECONDS)
+    full = dict(zip(date_list, _scan_days(db, date_list, digital_uids)))
+    mismatched = [d for d in date_list if incremental.get(d) != full[d]]
+
+    if mismatched:
+        logger.error(
+            "Agregação incremental divergente em %s: %s", month_key, ", ".join(mismatched)
+        )
+        if repair:
+            _write_daily_partials(
+                db, {d: full[d] for d in mismatched}, watermark, _digital_key(digital_uids)
+            )
+    else:
+        logger.info("Agregação incremental confere com o scan completo em %s", month_key)
+
+    return {
+        "month": month_key,
+        "matched": not mismatched,
+        "mismatched_days": mismatched,
+        "repaired": bool(mismatched) and repair,
+    }
+
+
+def _month_dates(month_key: str) -> list[str]:
     parts = month_key.split("-")
-    year, month = int(parts[0]), int(parts[1])
-    date_list = _month_range(year, month)
-    if uid_field == "digital_active_uids":
+    if len(parts) != 2:
+        raise ValueError(f"month_key deve ser YYYY-MM, recebido: {month_key}")
+    return _month_range(int(parts[0]), int(parts[1]))
+
+
+def _read_cached_uid_sets(db: firestore.Client, month_key: str) -> dict[str, set[str]]:
+    """
+    Conjuntos active_uids / digital_active_uids guardados no resumo do mês: blob
+    compacto ou lista do formato antigo. Só vale para mês fechado; o resumo de um mês
+    aberto é parcial e subcontaria a persistência, então fica de fora (reescaneia).
+    """
+    ref = db.collection(COLLECTION_METRICS_SUMMARY).document(month_key)
+    doc = _metered_get(
+        ref,
+        ["closed"]
+        + [f"adoption.{f}{UID_SET_BLOB_SUFFIX}" for f in UID_SET_FIELDS]
+        + [f"adoption.{f}" for f in UID_SET_FIELDS],
+    )
+    if not doc.exists:
+        return {}
+    data = doc.to_dict() or {}
+    if data.get("closed") is not True:
+        return {}
+    adoption = data.get("adoption") or {}
+    cached: dict[str, set[str]] = {}
+    for uid_field in UID_SET_FIELDS:
+        blob = adoption.get(f"{uid_field}{UID_SET_BLOB_SUFFIX}")
+        if blob:
+            try:
+                cached[uid_field] = decode_uid_set(blob)
+                continue
+            except (ValueError, zlib.error) as e:
+                logger.warning("Conjunto de UIDs inválido em %s.%s: %s", month_key, uid_field, e)
+        legacy = adoption.get(uid_field)
+        if isinstance(legacy, list) and legacy:
+            cached[uid_field] = set(legacy)
+    return cached
+
+
+def _get_month_uid_sets(
+    db: firestore.Client,
+    month_key: str,
+    digital_uids: set[str] | None = None,
+) -> tuple[set[str], set[str]]:
+    """
+    (UIDs ativos, UIDs digitais ativos) do mês: do resumo quando o mês está fechado e
+    ambos estão guardados, senão de um único scan do mês (sem totais).
+    """
+    cached = _read_cached_uid_sets(db, month_key)
+    if all(f in cached for f in UID_SET_FIELDS):
+        return cached["active_uids"], cached["digital_active_uids"]
+    if digital_uids is None:
         digital_uids, _ = _load_digital_uids(db)
-        return _collect_active_uids(db, date_list, filter_uids=digital_uids)
-    return _collect_active_uids(db, date_list)
+    scan = _scan_month(db, _month_dates(month_key), digital_uids, include_totals=False)
+    return scan.active_uids, scan.digital_active_uids
 
 
 def _compute_persistence(
@@ -153,86 +571,78 @@ def _compute_persistence(
     uids_m1: set[str],
     uids_m2: set[str],
 ) -> int:
-    return len(uids_m & uids_m1 & uids_m2)
-
-
-def _compute_volume_and_ultra_files(
-    db: firestore.Client, date_list: list[str]
-) -> tuple[int, int]:
-    total_analyses = 0
-    ultra_total = 0
+    return len(intersect_uid_sets(uids_m, uids_m1, uids_m2))
+
+
+def _read_daily_total(db: firestore.Client, date_str: str) -> dict[str, int]:
+    """
+    Soma os contadores do total diário: todos os docs de metrics/{date}/total
+    (shards shard_{i} e, antes da migração, o doc único "total").
+    """
+    totals = {field: 0 for field in TOTAL_COUNTER_FIELDS}
+    total_col = (
+        db.collection(COLLECTION_METRICS)
+        .document(date_str)
+        .collection(SUBDOC_TOTAL)
+    )
+    for doc in _metered(total_col.select(list(TOTAL_COUNTER_FIELDS)).stream()):
+        data = doc.to_dict() or {}
+        for field in TOTAL_COUNTER_FIELDS:
+            totals[field] += data.get(field) or 0
+    return totals
+
+
+def migrate_daily_total_to_shards(db: firestore.Client, date_list: list[str]) -> int:
+    """
+    Migra o layout antigo metrics/{date}/total/total para shard_0: soma os contadores
+    no shard (Increment) e apaga o doc antigo no mesmo batch. Idempotente (dias já
+    migrados não têm mais o doc "total"). Retorna quantos dias foram migrados.
+    """
+    migrated = 0
     for date_str in date_list:
-        total_ref = (
+        total_col = (
             db.collection(COLLECTION_METRICS)
             .document(date_str)
             .collection(SUBDOC_TOTAL)
-            .document(DOC_TOTAL)
         )
-        doc = total_ref.get()
-        if not doc.exists:
+        legacy_ref = total_col.document(DOC_TOTAL)
+        legacy = legacy_ref.get()
+        if not legacy.exists:
             continue
-        data = doc.to_dict() or {}
-        automatica = data.get("automatica") or 0
-        personalized = data.get("personalized") or 0
-        ultra_batch_total_files = data.get("ultra_batch_total_files") or 0
-        total_analyses += automatica + personalized + ultra_batch_total_files
-        ultra_total += ultra_batch_total_files
-    return total_analyses, ultra_total
-
-
-def _compute_digital_volume(
-    db: firestore.Client,
-    date_list: list[str],
-    digital_uids: set[str],
-) -> int:
-    total = 0
-    for date_str in date_list:
-        users_ref = (
-            db.collection(COLLECTION_METRICS)
-            .document(date_str)
-            .collection(SUBDOC_USERS)
-        )
-        for doc in users_ref.stream():
-            if doc.id not in digital_uids:
-                continue
-            data = doc.to_dict() or {}
-            automatica = data.get("automatica") or 0
-            personalized = data.get("personalized") or 0
-            runs = data.get("ultra_batch_runs") or []
-            file_count = sum(r.get("file_count") or 0 for r in runs)
-            total += automatica + personalized + file_count
-    return total
+        data = legacy.to_dict() or {}
+        updates: dict[str, Any] = {
+            field: firestore.Increment(data.get(field) or 0)
+            for field in TOTAL_COUNTER_FIELDS
+        }
+        updates["date"] = date_str
+        batch = db.batch()
+        batch.set(total_col.document(f"{TOTAL_SHARD_PREFIX}0"), updates, merge=True)
+        batch.delete(legacy_ref)
+        batch.commit()
+        migrated += 1
+    logger.info("Migração do total diário para shards: %d dias", migrated)
+    return migrated
 
 
 def _compute_quality_and_scale(
-    db: firestore.Client, start_ts: datetime, end_ts: datetime
+    db: firestore.Client, month_key: str
 ) -> tuple[float, float, int]:
-    jobs_ref = db.collection(COLLECTION_ULTRA_BATCH_JOBS)
-    try:
-        query = jobs_ref.where("created_at", ">=", start_ts).where(
-            "created_at", "<=", end_ts
-        )
-        jobs = list(query.stream())
-    except Exception as e:
-        logger.warning(
-            "Query por created_at falhou (índice composto pode ser necessário): %s. "
-            "Varrendo coleção e filtrando em memória.",
-            e,
-        )
-        jobs = [
-            d
-            for d in jobs_ref.stream()
-            if d.to_dict()
-            and _timestamp_in_range(
-                d.to_dict().get("created_at"), start_ts, end_ts
-            )
-        ]
+    """
+    Qualidade dos jobs de ultra batch criados no mês: igualdade em created_at_month
+    (índice de campo único, automático) e só os campos usados no cálculo. Jobs sem
+    created_at_month ficam de fora: backfill_created_at_month é pré-requisito.
+    """
+    query = (
+        db.collection(COLLECTION_ULTRA_BATCH_JOBS)
+        .where("created_at_month", "==", month_key)
+        .select(JOB_QUALITY_FIELDS)
+    )
 
     sum_success = 0
     sum_failure = 0
     completed_count = 0
     final_count = 0
-    for doc in jobs:
+    for doc in _metered(query.stream()):
         data = doc.to_dict() or {}
         status = (data.get("status") or "").lower()
         sum_success += data.get("successCount") or 0
@@ -252,36 +662,49 @@ def _compute_quality_and_scale(
     return success_rate_pct, jobs_completed_rate_pct, sum_success + sum_failure
 
 
-def _timestamp_in_range(
-    ts: Any, start: datetime, end: datetime
-) -> bool:
-    if ts is None:
-        return False
-    if hasattr(ts, "timestamp"):
-        t = ts.timestamp()
-    else:
-        return False
-    return start.timestamp() <= t <= end.timestamp()
-
-
-def run_monthly_aggregation(
+def backfill_created_at_month(db: firestore.Client) -> int:
+    """
+    Preenche created_at_month (YYYY-MM, UTC) nos ultra_batch_jobs antigos que só têm
+    created_at. Idempotente; lê apenas os dois campos. Retorna quantos jobs atualizou.
+    """
+    jobs_ref = db.collection(COLLECTION_ULTRA_BATCH_JOBS)
+    updated = 0
+    batch = db.batch()
+    pending = 0
+    for doc in _metered(jobs_ref.select(["created_at", "created_at_month"]).stream()):
+        data = doc.to_dict() or {}
+        created_at = data.get("created_at")
+        if data.get("created_at_month") or not hasattr(created_at, "astimezone"):
+            continue
+        month_key = created_at.astimezone(timezone.utc).strftime("%Y-%m")
+        batch.update(jobs_ref.document(doc.id), {"created_at_month": month_key})
+        pending += 1
+        updated += 1
+        if pending == FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    logger.info("created_at_month preenchido em %d jobs", updated)
+    return updated
+
+
+def _write_month_summary(
     db: firestore.Client,
     month_key: str,
     closed: bool,
+    scan: MonthScan,
+    total_assessors: int,
+    digital_team_size: int,
+    prev_uid_sets: list[tuple[set[str], set[str]]],
 ) -> None:
-    parts = month_key.split("-")
-    if len(parts) != 2:
-        raise ValueError(f"month_key deve ser YYYY-MM, recebido: {month_key}")
-    year, month = int(parts[0]), int(parts[1])
-    date_list = _month_range(year, month)
-    start_ts, end_ts = _get_month_bounds(year, month)
-
-    total_assessors = _read_total_assessors(db)
-
-    digital_uids, digital_team_size = _load_digital_uids(db)
-
-    active_uids = _collect_active_uids(db, date_list)
-    digital_uids_active = _collect_active_uids(db, date_list, filter_uids=digital_uids)
+    """
+    Monta e grava metrics_summary/{month_key} a partir do scan do mês e dos conjuntos
+    (ativos, digitais ativos) dos dois meses anteriores (M-1, M-2).
+    """
+    active_uids = scan.active_uids
+    digital_uids_active = scan.digital_active_uids
 
     mau = len(active_uids)
     digital_mau = len(digital_uids_active)
@@ -290,33 +713,27 @@ def run_monthly_aggregation(
         (digital_mau / digital_team_size * 100.0) if digital_team_size else 0.0
     )
 
-    prev1 = _prev_month(month_key)
-    prev2 = _prev_month(prev1)
-    uids_m1 = _get_uids_for_month(db, prev1, "active_uids")
-    uids_m2 = _get_uids_for_month(db, prev2, "active_uids")
-    d_uids_m1 = _get_uids_for_month(db, prev1, "digital_active_uids")
-    d_uids_m2 = _get_uids_for_month(db, prev2, "digital_active_uids")
-
+    (uids_m1, d_uids_m1), (uids_m2, d_uids_m2) = prev_uid_sets
     persistence = _compute_persistence(active_uids, uids_m1, uids_m2)
     digital_persistence = _compute_persistence(digital_uids_active, d_uids_m1, d_uids_m2)
 
-    total_analyses, ultra_total = _compute_volume_and_ultra_files(db, date_list)
-    digital_total_analyses = _compute_digital_volume(db, date_list, digital_uids)
+    total_analyses, ultra_total = scan.total_analyses, scan.ultra_total
+    digital_total_analyses = scan.digital_total_analyses
     pct_volume_ultra_batch = (
         (ultra_total / total_analyses * 100.0) if total_analyses else 0.0
     )
 
     success_rate_pct, jobs_completed_rate_pct, _ = _compute_quality_and_scale(
-        db, start_ts, end_ts
+        db, month_key
     )
 
+    # Conjuntos compactos (ver uid_set_codec) para a persistência dos próximos meses
     adoption_payload: dict = {
         "mau": mau,
         "mau_percent": round(mau_percent, 2),
+        f"active_uids{UID_SET_BLOB_SUFFIX}": encode_uid_set(active_uids),
+        f"digital_active_uids{UID_SET_BLOB_SUFFIX}": encode_uid_set(digital_uids_active),
     }
-    if closed:
-        adoption_payload["active_uids"] = list(active_uids)
-        adoption_payload["digital_active_uids"] = list(digital_uids_active)
 
     payload: dict[str, Any] = {
         "month": month_key,
@@ -349,12 +766,116 @@ def run_monthly_aggregation(
     )
 
 
+def _log_reads(label: str, reads_before: tuple[int, int]) -> None:
+    docs_read, bytes_read = read_meter.snapshot()
+    logger.info(
+        "Leituras da agregação %s: %d docs, ~%.1f KiB",
+        label,
+        docs_read - reads_before[0],
+        (bytes_read - reads_before[1]) / 1024,
+    )
+
+
+def run_monthly_aggregation(
+    db: firestore.Client,
+    month_key: str,
+    closed: bool,
+    incremental: bool = False,
+) -> None:
+    date_list = _month_dates(month_key)
+    reads_before = read_meter.snapshot()
+
+    total_assessors = _read_total_assessors(db)
+
+    digital_uids, digital_team_size = _load_digital_uids(db)
+
+    if incremental:
+        scan = _scan_month_incremental(db, date_list, digital_uids)
+    else:
+        scan = _scan_month(db, date_list, digital_uids)
+
+    prev1 = _prev_month(month_key)
+    prev2 = _prev_month(prev1)
+    prev_uid_sets = [
+        _get_month_uid_sets(db, prev1, digital_uids),
+        _get_month_uid_sets(db, prev2, digital_uids),
+    ]
+
+    _write_month_summary(
+        db, month_key, closed, scan, total_assessors, digital_team_size, prev_uid_sets
+    )
+    _log_reads(month_key, reads_before)
+
+
+def run_backfill(
+    db: firestore.Client,
+    months: list[str],
+    max_workers: int = BACKFILL_MAX_WORKERS,
+) -> None:
+    """
+    Reagrega vários meses (closed=True) compartilhando trabalho entre eles:
+
+    - total_assessors e time digital são lidos uma vez
+    - cada mês do backfill é escaneado uma única vez, em paralelo com os demais
+    - a persistência de cada mês usa os conjuntos já calculados para M-1 e M-2;
+      só meses anteriores fora do backfill são lidos do resumo (ou escaneados)
+    - os resumos são gravados um a um, em ordem cronológica, depois que todas as
+      dependências estão prontas
+    """
+    months = sorted({_validated_month(m) for m in months})
+    if not months:
+        return
+    reads_before = read_meter.snapshot()
+    total_assessors = _read_total_assessors(db)
+    digital_uids, digital_team_size = _load_digital_uids(db)
+
+    deps = {m: [_prev_month(m), _prev_month(_prev_month(m))] for m in months}
+    external = sorted({p for prevs in deps.values() for p in prevs} - set(months))
+
+    workers = max(1, min(max_workers, len(months) + len(external)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metrics-backfill") as pool:
+        scan_futures = {
+            m: pool.submit(_scan_month, db, _month_dates(m), digital_uids) for m in months
+        }
+        external_futures = {
+            m: pool.submit(_get_month_uid_sets, db, m, digital_uids) for m in external
+        }
+        scans = {m: f.result() for m, f in scan_futures.items()}
+        uid_sets = {m: f.result() for m, f in external_futures.items()}
+    uid_sets.update({m: (s.active_uids, s.digital_active_uids) for m, s in scans.items()})
+
+    for m in months:
+        _write_month_summary(
+            db,
+            m,
+            True,
+            scans[m],
+            total_assessors,
+            digital_team_size,
+            [uid_sets[p] for p in deps[m]],
+        )
+
+    logger.info(
+        "Backfill: %d meses, %d scans de meses anteriores fora do intervalo",
+        len(months),
+        len(external),
+    )
+    _log_reads(f"backfill {months[0]}..{months[-1]}", reads_before)
+
+
+def _validated_month(month_key: str) -> str:
+    month_key = month_key.strip()
+    _month_dates(month_key)
+    return month_key
+
+
 def run_monthly_aggregation_for_scheduler(
     db: firestore.Client,
     current_month: str,
     close_previous_month: bool,
+    incremental: bool = INCREMENTAL_AGGREGATION,
 ) -> None:
     if close_previous_month:
         prev_month = _prev_month(current_month)
-        run_monthly_aggregation(db, prev_month, closed=True)
-    run_monthly_aggregation(db, current_month, closed=False)
+        run_monthly_aggregation(db, prev_month, closed=True, incremental=incremental)
+    run_monthly_aggregation(db, current_month, closed=False, incremental=incremental)
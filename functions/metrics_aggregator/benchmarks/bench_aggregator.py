@@ -0,0 +1,285 @@
+"""
+Benchmark do metrics_aggregator contra um Firestore em memória com latência injetada.
+
+Cenários (todos sobre o mesmo dataset sintético):
+- monthly: run_monthly_aggregation do último mês fechado, com M-1/M-2 já resumidos
+- scheduler_cold: caminho do scheduler (fecha o mês anterior + mês corrente,
+  incremental) sem parciais diários
+- scheduler_warm: mesmo caminho após uma execução, com escrita nova só no último dia
+- backfill: run_backfill de todos os meses do dataset
+
+Para cada cenário: tempo de parede, documentos lidos (contagem do fake e estimativa
+de bytes do read_meter), RPCs de leitura, escritas e pico de memória (tracemalloc,
+numa segunda execução para não distorcer o tempo). O resultado vai para JSON;
+com --baseline, compara com uma execução anterior.
+
+Uso (a partir de functions/metrics_aggregator):
+
+    python -m benchmarks.bench_aggregator --users 2000 --months 24 --latency-ms 20 \\
+        --output bench_results.json --baseline bench_baseline.json
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from aggregator import (
+    _prev_month,
+    read_meter,
+    run_backfill,
+    run_monthly_aggregation,
+    run_monthly_aggregation_for_scheduler,
+)
+from config import (
+    COLLECTION_CONFIG,
+    COLLECTION_METRICS,
+    COLLECTION_METRICS_DAILY_PARTIALS,
+    COLLECTION_METRICS_SUMMARY,
+    DOC_DIGITAL_TEAM_UIDS,
+    SUBDOC_USERS,
+    UID_SET_BLOB_SUFFIX,
+)
+from uid_set_codec import encode_uid_set
+
+from benchmarks.dataset import Dataset, DatasetParams, build_dataset
+from benchmarks.fake_firestore import FakeFirestore
+
+logger = logging.getLogger(__name__)
+
+# Métricas comparadas com o baseline (todas: menor é melhor)
+REGRESSION_METRICS = ("wall_seconds", "docs_read", "read_rpcs", "peak_memory_mib")
+# Docs de usuário do último dia reescritos antes do cenário scheduler_warm
+WARM_TOUCHED_DOCS = 5
+
+
+def _reset_derived_state(db: FakeFirestore) -> None:
+    """Remove o que o agregador grava (resumos, parciais e mapeamento do time digital)."""
+    db.drop_collection(COLLECTION_METRICS_SUMMARY)
+    db.drop_collection(COLLECTION_METRICS_DAILY_PARTIALS)
+    db.collection(COLLECTION_CONFIG).document(DOC_DIGITAL_TEAM_UIDS).delete()
+
+
+def _seed_summary(db: FakeFirestore, dataset: Dataset, month_key: str) -> None:
+    """Resumo mínimo de um mês (só os conjuntos de UIDs usados na persistência)."""
+    db.put((COLLECTION_METRICS_SUMMARY, month_key), {
+        "month": month_key,
+        "closed": True,
+        "adoption": {
+            f"active_uids{UID_SET_BLOB_SUFFIX}": encode_uid_set(dataset.active_by_month.get(month_key, set())),
+            f"digital_active_uids{UID_SET_BLOB_SUFFIX}": encode_uid_set(
+                dataset.digital_active_by_month.get(month_key, set())
+            ),
+        },
+    })
+
+
+def _touch_last_day(db: FakeFirestore, dataset: Dataset) -> None:
+    last_day = dataset.active_days[dataset.months[-1]][-1]
+    users = db.collection(COLLECTION_METRICS).document(last_day).collection(SUBDOC_USERS)
+    now = datetime.now(timezone.utc) + timedelta(minutes=5)
+    for doc_id in sorted(db._documents_of(users._path))[:WARM_TOUCHED_DOCS]:
+        users.document(doc_id).update({"automatica": 1, "last_updated": now})
+
+
+Scenario = tuple[Callable[[FakeFirestore, Dataset], None], Callable[[FakeFirestore, Dataset], None]]
+
+
+def _monthly_setup(db: FakeFirestore, dataset: Dataset) -> None:
+    _reset_derived_state(db)
+    prev1 = _prev_month(dataset.months[-2])
+    for month_key in (prev1, _prev_month(prev1)):
+        _seed_summary(db, dataset, month_key)
+
+
+def _monthly_run(db: FakeFirestore, dataset: Dataset) -> None:
+    run_monthly_aggregation(db, dataset.months[-2], closed=True)
+
+
+def _scheduler_run(db: FakeFirestore, dataset: Dataset) -> None:
+    run_monthly_aggregation_for_scheduler(
+        db, current_month=dataset.months[-1], close_previous_month=True, incremental=True
+    )
+
+
+def _scheduler_cold_setup(db: FakeFirestore, dataset: Dataset) -> None:
+    _reset_derived_state(db)
+    for month_key in dataset.months[:-1]:
+        _seed_summary(db, dataset, month_key)
+
+
+def _scheduler_warm_setup(db: FakeFirestore, dataset: Dataset) -> None:
+    _scheduler_cold_setup(db, dataset)
+    _scheduler_run(db, dataset)
+    _touch_last_day(db, dataset)
+
+
+def _backfill_setup(db: FakeFirestore, dataset: Dataset) -> None:
+    _reset_derived_state(db)
+
+
+def _backfill_run(db: FakeFirestore, dataset: Dataset) -> None:
+    run_backfill(db, dataset.months)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "monthly": (_monthly_setup, _monthly_run),
+    "scheduler_cold": (_scheduler_cold_setup, _scheduler_run),
+    "scheduler_warm": (_scheduler_warm_setup, _scheduler_run),
+    "backfill": (_backfill_setup, _backfill_run),
+}
+
+
+def _measure(db: FakeFirestore, dataset: Dataset, scenario: Scenario, track_memory: bool) -> dict[str, Any]:
+    setup, run = scenario
+    setup(db, dataset)
+    db.reset_stats()
+    meter_before = read_meter.snapshot()
+    started = time.perf_counter()
+    run(db, dataset)
+    wall_seconds = time.perf_counter() - started
+    meter_after = read_meter.snapshot()
+    result: dict[str, Any] = {
+        "wall_seconds": round(wall_seconds, 4),
+        **db.stats.as_dict(),
+        "metered_docs": meter_after[0] - meter_before[0],
+        "bytes_read_estimated": meter_after[1] - meter_before[1],
+    }
+
+    if track_memory:
+        setup(db, dataset)
+        tracemalloc.start()
+        try:
+            run(db, dataset)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        result["peak_memory_mib"] = round(peak / (1024 * 1024), 3)
+    return result
+
+
+def run_benchmarks(
+    params: DatasetParams,
+    latency_ms: float = 0.0,
+    scenarios: list[str] | None = None,
+    track_memory: bool = True,
+) -> dict[str, Any]:
+    """Gera o dataset, roda os cenários e devolve o relatório (mesmo formato do JSON)."""
+    if params.months < 3:
+        raise ValueError("O benchmark precisa de pelo menos 3 meses de dados")
+    db = FakeFirestore()
+    started = time.perf_counter()
+    dataset = build_dataset(db, params)
+    load_seconds = time.perf_counter() - started
+    db.read_latency_seconds = latency_ms / 1000.0
+
+    results = {}
+    for name in scenarios or list(SCENARIOS):
+        logger.info("Cenário %s...", name)
+        results[name] = _measure(db, dataset, SCENARIOS[name], track_memory)
+        logger.info("Cenário %s: %s", name, results[name])
+
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {**asdict(params), "latency_ms": latency_ms},
+        "dataset": {
+            "months": dataset.months,
+            "user_day_docs": dataset.user_day_docs,
+            "jobs": dataset.jobs,
+            "documents": db.document_count(),
+            "load_seconds": round(load_seconds, 3),
+        },
+        "scenarios": results,
+    }
+
+
+def compare_with_baseline(
+    report: dict[str, Any],
+    baseline: dict[str, Any],
+    max_regression_pct: float | None = None,
+) -> list[str]:
+    """
+    Imprime a variação de cada métrica em relação ao baseline. Retorna as regressões
+    acima de max_regression_pct (vazio se não houver limite).
+    """
+    if report["params"] != baseline.get("params"):
+        print("Aviso: parâmetros diferentes do baseline; comparação pode não ser válida")
+    regressions = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            if metric not in current or metric not in previous:
+                continue
+            old, new = previous[metric], current[metric]
+            change_pct = ((new - old) / old * 100.0) if old else 0.0
+            print(f"{name:16s} {metric:16s} {old:>14} -> {new:>14} ({change_pct:+.1f}%)")
+            if max_regression_pct is not None and change_pct > max_regression_pct:
+                regressions.append(f"{name}.{metric}: {change_pct:+.1f}%")
+    return regressions
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    defaults = DatasetParams()
+    parser = argparse.ArgumentParser(description="Benchmark do metrics_aggregator com Firestore em memória")
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--months", type=int, default=defaults.months)
+    parser.add_argument("--end-month", default=defaults.end_month)
+    parser.add_argument("--days-per-month", type=int, default=defaults.days_per_month,
+                        help="Dias com atividade por mês (0 = todos)")
+    parser.add_argument("--active-ratio", type=float, default=defaults.active_ratio)
+    parser.add_argument("--run-density", type=float, default=defaults.run_density)
+    parser.add_argument("--digital-ratio", type=float, default=defaults.digital_ratio)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latência por RPC de leitura")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Cenário a rodar (repetível; padrão: todos)")
+    parser.add_argument("--no-memory", action="store_true", help="Não mede pico de memória")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--max-regression-pct", type=float,
+                        help="Com --baseline, sai com código 1 se alguma métrica piorar mais que isso")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    params = DatasetParams(
+        users=args.users,
+        months=args.months,
+        end_month=args.end_month,
+        days_per_month=args.days_per_month or None,
+        active_ratio=args.active_ratio,
+        run_density=args.run_density,
+        digital_ratio=args.digital_ratio,
+        seed=args.seed,
+    )
+    report = run_benchmarks(params, args.latency_ms, args.scenario, track_memory=not args.no_memory)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for name, result in report["scenarios"].items():
+        print(f"{name}: {json.dumps(result)}")
+    print(f"Resultado gravado em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.max_regression_pct)
+        if regressions:
+            print("Regressões: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Dataset sintético para os benchmarks: assessores, dias com atividade, ultra batch e jobs.
+
+A carga segue o layout que o ai-service grava (metrics/{date}/users/{uid},
+total diário em shards, ultra_batch_jobs com created_at_month, config/*), e
+o gerador guarda os conjuntos de ativos esperados por mês para conferência.
+"""
+import calendar
+import random
+import string
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from config import (
+    COLLECTION_CONFIG,
+    COLLECTION_METRICS,
+    COLLECTION_ULTRA_BATCH_JOBS,
+    COLLECTION_USERS,
+    DOC_DIGITAL_TEAM,
+    DOC_METRICS_CONFIG,
+    FIELD_ULTRA_BATCH_FILES,
+    FIELD_ULTRA_BATCH_RUN_COUNT,
+    SUBDOC_TOTAL,
+    SUBDOC_USERS,
+    TOTAL_SHARD_PREFIX,
+)
+
+from benchmarks.fake_firestore import FakeFirestore
+
+_UID_ALPHABET = string.ascii_letters + string.digits
+
+
+@dataclass
+class DatasetParams:
+    users: int = 1000
+    months: int = 12
+    # Último mês do dataset (YYYY-MM); é o "mês corrente" do cenário do scheduler
+    end_month: str = "2025-12"
+    # Dias com atividade por mês (None = todos os dias do calendário)
+    days_per_month: int | None = 22
+    # Probabilidade de um assessor ter atividade num dia com atividade
+    active_ratio: float = 0.2
+    # Fração dos docs de usuário do dia com execução de ultra batch
+    run_density: float = 0.05
+    # Fração dos assessores no time digital
+    digital_ratio: float = 0.1
+    total_shards: int = 10
+    seed: int = 42
+
+
+@dataclass
+class Dataset:
+    params: DatasetParams
+    months: list[str]
+    active_days: dict[str, list[str]]
+    active_by_month: dict[str, set[str]] = field(default_factory=dict)
+    digital_active_by_month: dict[str, set[str]] = field(default_factory=dict)
+    digital_uids: set[str] = field(default_factory=set)
+    user_day_docs: int = 0
+    jobs: int = 0
+
+
+def month_keys(end_month: str, count: int) -> list[str]:
+    year, month = int(end_month[:4]), int(end_month[5:7])
+    keys = []
+    for _ in range(count):
+        keys.append(f"{year}-{month:02d}")
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return keys[::-1]
+
+
+def _uid(rng: random.Random) -> str:
+    return "".join(rng.choice(_UID_ALPHABET) for _ in range(28))
+
+
+def build_dataset(db: FakeFirestore, params: DatasetParams) -> Dataset:
+    """Carrega o dataset no fake (sem contabilizar escritas) e devolve o gabarito."""
+    rng = random.Random(params.seed)
+    uids = [_uid(rng) for _ in range(params.users)]
+    emails = {uid: f"assessor{i:05d}@example.com" for i, uid in enumerate(uids)}
+    digital = set(rng.sample(uids, int(params.users * params.digital_ratio)))
+
+    for uid in uids:
+        db.put((COLLECTION_USERS, uid), {"email": emails[uid], "displayName": uid[:8]})
+    db.put((COLLECTION_CONFIG, DOC_DIGITAL_TEAM), {"emails": sorted(emails[u] for u in digital)})
+    db.put((COLLECTION_CONFIG, DOC_METRICS_CONFIG), {"total_assessors": params.users})
+
+    months = month_keys(params.end_month, params.months)
+    dataset = Dataset(params=params, months=months, active_days={}, digital_uids=digital)
+    for month_key in months:
+        year, month = int(month_key[:4]), int(month_key[5:7])
+        days = list(range(1, calendar.monthrange(year, month)[1] + 1))
+        if params.days_per_month is not None and params.days_per_month < len(days):
+            days = sorted(rng.sample(days, params.days_per_month))
+        dates = [f"{month_key}-{d:02d}" for d in days]
+        dataset.active_days[month_key] = dates
+        active: set[str] = set()
+        for date_str in dates:
+            active |= _load_day(db, rng, dataset, date_str, uids, digital)
+        dataset.active_by_month[month_key] = active
+        dataset.digital_active_by_month[month_key] = active & digital
+    return dataset
+
+
+def _load_day(
+    db: FakeFirestore,
+    rng: random.Random,
+    dataset: Dataset,
+    date_str: str,
+    uids: list[str],
+    digital: set[str],
+) -> set[str]:
+    params = dataset.params
+    day_start = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    totals = {"automatica": 0, "personalized": 0, "ultra_batch_total_files": 0}
+    active: set[str] = set()
+    for uid in uids:
+        if rng.random() >= params.active_ratio:
+            continue
+        doc = {
+            "automatica": rng.randint(0, 6),
+            "personalized": rng.randint(0, 3),
+            "last_updated": day_start + timedelta(seconds=rng.randint(0, 86_399)),
+            "date": date_str,
+        }
+        if rng.random() < params.run_density:
+            runs = rng.randint(1, 2)
+            files = sum(rng.randint(5, 60) for _ in range(runs))
+            doc[FIELD_ULTRA_BATCH_RUN_COUNT] = runs
+            doc[FIELD_ULTRA_BATCH_FILES] = files
+            totals["ultra_batch_total_files"] += files
+            for _ in range(runs):
+                _load_job(db, rng, dataset, day_start, uid)
+        if not doc["automatica"] and not doc["personalized"] and FIELD_ULTRA_BATCH_RUN_COUNT not in doc:
+            doc["automatica"] = 1
+        if uid in digital:
+            doc["sector"] = "digital"
+        totals["automatica"] += doc["automatica"]
+        totals["personalized"] += doc["personalized"]
+        db.put((COLLECTION_METRICS, date_str, SUBDOC_USERS, uid), doc)
+        dataset.user_day_docs += 1
+        active.add(uid)
+
+    # Total diário espalhado pelos shards, como no buffer de métricas do ai-service
+    shards: dict[int, dict[str, int]] = {}
+    for counter, amount in totals.items():
+        for _ in range(amount):
+            shard = shards.setdefault(rng.randrange(params.total_shards), {})
+            shard[counter] = shard.get(counter, 0) + 1
+    for index, counters in shards.items():
+        db.put(
+            (COLLECTION_METRICS, date_str, SUBDOC_TOTAL, f"{TOTAL_SHARD_PREFIX}{index}"),
+            {**counters, "last_updated": day_start + timedelta(hours=23), "date": date_str},
+        )
+    return active
+
+
+def _load_job(
+    db: FakeFirestore,
+    rng: random.Random,
+    dataset: Dataset,
+    day_start: datetime,
+    uid: str,
+) -> None:
+    dataset.jobs += 1
+    file_count = rng.randint(5, 60)
+    failures = rng.randint(0, 2)
+    created_at = day_start + timedelta(seconds=rng.randint(0, 86_399))
+    db.put((COLLECTION_ULTRA_BATCH_JOBS, f"job{dataset.jobs:07d}"), {
+        "userId": uid,
+        "status": rng.choice(("completed", "completed", "completed", "failed")),
+        "fileCount": file_count,
+        "successCount": file_count - failures,
+        "failureCount": failures,
+        "created_at": created_at,
+        "created_at_month": created_at.strftime("%Y-%m"),
+        # Campos volumosos que a projeção dos jobs deixa de fora
+        "fileNames": [f"relatorio_{i:03d}.pdf" for i in range(file_count)],
+        "customPrompt": "x" * 400,
+    })
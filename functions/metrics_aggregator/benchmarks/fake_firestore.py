@@ -0,0 +1,321 @@
+"""
+Firestore em memória para os benchmarks do agregador.
+
+Implementa só a superfície usada por aggregator.py: collection/document,
+get (com field_paths), set/update/delete, subcoleções, where (==, in, >, >=,
+<, <=), select, limit, stream, get_all e WriteBatch. SERVER_TIMESTAMP e
+Increment são aplicados na escrita.
+
+Cada RPC de leitura (get, get_all e cada página de um stream) espera
+read_latency_seconds, simulando a ida e volta ao Firestore, e é contabilizado
+em FakeStats junto com os documentos lidos (consultas vazias contam 1 leitura,
+como na cobrança do Firestore).
+"""
+import copy
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator, Optional
+
+from google.cloud.firestore_v1 import transforms
+
+# Documentos por página de um stream (cada página é uma ida ao servidor)
+STREAM_PAGE_SIZE = 300
+
+Path = tuple[str, ...]
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    "in": lambda a, b: a in b,
+}
+
+
+@dataclass
+class FakeStats:
+    read_rpcs: int = 0
+    docs_read: int = 0
+    writes: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {"read_rpcs": self.read_rpcs, "docs_read": self.docs_read, "writes": self.writes}
+
+
+def _get_path(data: dict, field_path: str) -> tuple[bool, Any]:
+    value: Any = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _set_path(data: dict, field_path: str, value: Any) -> None:
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+def _project(data: dict, field_paths: Optional[Iterable[str]]) -> dict:
+    if field_paths is None:
+        return copy.deepcopy(data)
+    projected: dict = {}
+    for field_path in field_paths:
+        found, value = _get_path(data, field_path)
+        if found:
+            _set_path(projected, field_path, copy.deepcopy(value))
+    return projected
+
+
+def _apply_transforms(current: Any, value: Any) -> Any:
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, dict):
+        return {k: _apply_transforms(None, v) for k, v in value.items()}
+    return value
+
+
+def _merge(current: dict, data: dict) -> dict:
+    """set(merge=True): mapas aninhados são mesclados campo a campo."""
+    merged = dict(current)
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = _apply_transforms(merged.get(key), value)
+    return merged
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[dict]:
+        return self._data
+
+    def get(self, field_path: str) -> Any:
+        return _get_path(self._data or {}, field_path)[1]
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeFirestore", path: Path):
+        self._client = client
+        self._path = path
+        self._filters: list[tuple[str, str, Any]] = []
+        self._fields: Optional[list[str]] = None
+        self._limit: Optional[int] = None
+
+    def _copy(self) -> "FakeQuery":
+        query = FakeQuery(self._client, self._path)
+        query._filters = list(self._filters)
+        query._fields = self._fields
+        query._limit = self._limit
+        return query
+
+    def where(self, field_path: str, op_string: str, value: Any) -> "FakeQuery":
+        if op_string not in _OPERATORS:
+            raise NotImplementedError(f"Operador não suportado no fake: {op_string}")
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def select(self, field_paths: Iterable[str]) -> "FakeQuery":
+        query = self._copy()
+        query._fields = list(field_paths)
+        return query
+
+    def limit(self, count: int) -> "FakeQuery":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def _matches(self, data: dict) -> bool:
+        for field_path, op_string, value in self._filters:
+            found, current = _get_path(data, field_path)
+            if not found:
+                return False
+            try:
+                if not _OPERATORS[op_string](current, value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def stream(self) -> Iterator[FakeSnapshot]:
+        client = self._client
+        docs = client._documents_of(self._path)
+        results = []
+        for doc_id in sorted(docs):
+            if self._matches(docs[doc_id]):
+                results.append((doc_id, _project(docs[doc_id], self._fields)))
+                if self._limit is not None and len(results) >= self._limit:
+                    break
+        pages = max(1, -(-len(results) // STREAM_PAGE_SIZE))
+        client._record_read(rpcs=pages, docs=max(1, len(results)))
+        collection = FakeCollectionReference(client, self._path)
+        for doc_id, data in results:
+            yield FakeSnapshot(collection.document(doc_id), data)
+
+
+class FakeCollectionReference(FakeQuery):
+    @property
+    def id(self) -> str:
+        return self._path[-1]
+
+    def document(self, document_id: str) -> "FakeDocumentReference":
+        return FakeDocumentReference(self._client, self._path + (document_id,))
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestore", path: Path):
+        self._client = client
+        self._path = path
+        self.id = path[-1]
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self._client, self._path + (name,))
+
+    def get(self, field_paths: Optional[Iterable[str]] = None) -> FakeSnapshot:
+        self._client._record_read(rpcs=1, docs=1)
+        return self._client._snapshot(self, field_paths)
+
+    def create(self, document_data: dict) -> None:
+        self._client._write(self._path, document_data, mode="create")
+
+    def set(self, document_data: dict, merge: bool = False) -> None:
+        self._client._write(self._path, document_data, mode="merge" if merge else "set")
+
+    def update(self, field_updates: dict) -> None:
+        self._client._write(self._path, field_updates, mode="update")
+
+    def delete(self) -> None:
+        self._client._write(self._path, None, mode="delete")
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self._client = client
+        self._ops: list[tuple[Path, Optional[dict], str]] = []
+
+    def create(self, reference: FakeDocumentReference, document_data: dict) -> None:
+        self._ops.append((reference._path, document_data, "create"))
+
+    def set(self, reference: FakeDocumentReference, document_data: dict, merge: bool = False) -> None:
+        self._ops.append((reference._path, document_data, "merge" if merge else "set"))
+
+    def update(self, reference: FakeDocumentReference, field_updates: dict) -> None:
+        self._ops.append((reference._path, field_updates, "update"))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._ops.append((reference._path, None, "delete"))
+
+    def commit(self) -> None:
+        with self._client._lock:
+            for path, data, mode in self._ops:
+                self._client._write(path, data, mode)
+        self._ops = []
+
+
+class FakeFirestore:
+    """Cliente Firestore em memória, thread-safe, com latência de leitura configurável."""
+
+    def __init__(self, read_latency_seconds: float = 0.0):
+        self.read_latency_seconds = read_latency_seconds
+        self.stats = FakeStats()
+        # Caminho da coleção → {id do doc: dados}
+        self._collections: dict[Path, dict[str, dict]] = {}
+        self._lock = threading.RLock()
+
+    # API do cliente
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, (name,))
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def get_all(
+        self,
+        references: Iterable[FakeDocumentReference],
+        field_paths: Optional[Iterable[str]] = None,
+    ) -> Iterator[FakeSnapshot]:
+        references = list(references)
+        self._record_read(rpcs=1, docs=max(1, len(references)))
+        for reference in references:
+            yield self._snapshot(reference, field_paths)
+
+    # Apoio aos benchmarks (fora da API do Firestore)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = FakeStats()
+
+    def put(self, path: Path, data: dict) -> None:
+        """Grava sem contabilizar escrita (carga inicial do dataset)."""
+        with self._lock:
+            self._collections.setdefault(path[:-1], {})[path[-1]] = data
+
+    def drop_collection(self, name: str) -> None:
+        """Remove uma coleção raiz e todas as suas subcoleções."""
+        with self._lock:
+            for path in [p for p in self._collections if p[0] == name]:
+                del self._collections[path]
+
+    def document_count(self) -> int:
+        with self._lock:
+            return sum(len(docs) for docs in self._collections.values())
+
+    # Internos
+
+    def _record_read(self, rpcs: int, docs: int) -> None:
+        if self.read_latency_seconds:
+            time.sleep(self.read_latency_seconds * rpcs)
+        with self._lock:
+            self.stats.read_rpcs += rpcs
+            self.stats.docs_read += docs
+
+    def _documents_of(self, collection_path: Path) -> dict[str, dict]:
+        with self._lock:
+            return dict(self._collections.get(collection_path, {}))
+
+    def _snapshot(
+        self, reference: FakeDocumentReference, field_paths: Optional[Iterable[str]]
+    ) -> FakeSnapshot:
+        with self._lock:
+            data = self._collections.get(reference._path[:-1], {}).get(reference.id)
+            projected = _project(data, field_paths) if data is not None else None
+        return FakeSnapshot(reference, projected)
+
+    def _write(self, path: Path, data: Optional[dict], mode: str) -> None:
+        with self._lock:
+            docs = self._collections.setdefault(path[:-1], {})
+            current = docs.get(path[-1])
+            if mode == "delete":
+                docs.pop(path[-1], None)
+            elif mode == "create":
+                if current is not None:
+                    raise ValueError(f"Documento já existe: {'/'.join(path)}")
+                docs[path[-1]] = _apply_transforms(None, data)
+            elif mode == "set":
+                docs[path[-1]] = _apply_transforms(None, data)
+            elif mode == "merge":
+                docs[path[-1]] = _merge(current or {}, data)
+            else:
+                if current is None:
+                    raise KeyError(f"Documento não encontrado: {'/'.join(path)}")
+                updated = copy.deepcopy(current)
+                for field_path, value in data.items():
+                    _, existing = _get_path(updated, field_path)
+                    _set_path(updated, field_path, _apply_transforms(existing, value))
+                docs[path[-1]] = updated
+            self.stats.writes += 1
@@ -9,8 +9,35 @@ COLLECTION_CONFIG: Final[str] = "config"
 COLLECTION_USERS: Final[str] = "users"
 DOC_METRICS_CONFIG: Final[str] = "metrics_config"
 DOC_DIGITAL_TEAM: Final[str] = "digital_team"
+# Mapeamento persistido email → uid do time digital (com versão)
+DOC_DIGITAL_TEAM_UIDS: Final[str] = "digital_team_uids"
+# Máximo de valores em um filtro "in" do Firestore
+FIRESTORE_IN_QUERY_LIMIT: Final[int] = 30
+# Máximo de operações de um WriteBatch
+FIRESTORE_BATCH_LIMIT: Final[int] = 500
 SUBDOC_USERS: Final[str] = "users"
 SUBDOC_TOTAL: Final[str] = "total"
 DOC_TOTAL: Final[str] = "total"
+# Total diário em N shards metrics/{date}/total/shard_{i}; "total" é o layout antigo (doc único)
+TOTAL_SHARD_PREFIX: Final[str] = "shard_"
+TOTAL_COUNTER_FIELDS: Final[tuple] = ("automatica", "personalized", "ultra_batch_total_files")
+# Execuções de ultra batch: subcoleção metrics/{date}/users/{uid}/ultra_batch_runs/{jobId}
+# com contadores no doc do usuário; o array ultra_batch_runs é o layout antigo
+FIELD_ULTRA_BATCH_RUN_COUNT: Final[str] = "ultra_batch_run_count"
+FIELD_ULTRA_BATCH_FILES: Final[str] = "ultra_batch_files"
 TIMEZONE_UTC: Final[str] = "UTC"
 MAX_MONTHS_QUERY: Final[int] = int(os.environ.get("METRICS_SUMMARY_MAX_MONTHS", "24"))
+# Dias do mês lidos em paralelo pelo scan de agregação
+SCAN_MAX_WORKERS: Final[int] = int(os.environ.get("METRICS_SCAN_MAX_WORKERS", "8"))
+# Parciais diários persistidos para a agregação incremental (metrics_daily_partials/{date})
+COLLECTION_METRICS_DAILY_PARTIALS: Final[str] = "metrics_daily_partials"
+INCREMENTAL_AGGREGATION: Final[bool] = (
+    os.environ.get("METRICS_INCREMENTAL_AGGREGATION", "true").lower() == "true"
+)
+# Margem do watermark para diferença entre o relógio da função e o SERVER_TIMESTAMP
+WATERMARK_SKEW_SECONDS: Final[int] = int(os.environ.get("METRICS_WATERMARK_SKEW_SECONDS", "60"))
+# adoption.{active_uids,digital_active_uids}_blob: conjuntos codificados por uid_set_codec
+UID_SET_BLOB_SUFFIX: Final[str] = "_blob"
+UID_SET_FIELDS: Final[tuple] = ("active_uids", "digital_active_uids")
+# Meses processados em paralelo no backfill (cada um com seu pool de SCAN_MAX_WORKERS)
+BACKFILL_MAX_WORKERS: Final[int] = int(os.environ.get("METRICS_BACKFILL_MAX_WORKERS", "3"))
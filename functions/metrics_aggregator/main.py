@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import re
@@ -7,7 +8,15 @@ import functions_framework
 from firebase_admin import credentials, firestore
 import firebase_admin
 
-from aggregator import run_monthly_aggregation, run_monthly_aggregation_for_scheduler
+from aggregator import (
+    _load_digital_uids,
+    backfill_created_at_month,
+    _month_range,
+    migrate_daily_total_to_shards,
+    run_backfill,
+    run_monthly_aggregation_for_scheduler,
+    verify_incremental_aggregation,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,6 +38,51 @@ def metrics_aggregator(request):
         return ("Unauthorized", 401)
 
     data = request.get_json(silent=True) or {}
+    migrate_months = data.get("migrate_total_shards")
+    if isinstance(migrate_months, list) and migrate_months:
+        months = [m.strip() for m in migrate_months if isinstance(m, str) and MONTH_PATTERN.match(m.strip())]
+        if not months:
+            return ("migrate_total_shards deve ser uma lista de strings YYYY-MM", 400)
+        try:
+            db = _get_firestore_client()
+            for month_key in months:
+                migrate_daily_total_to_shards(db, _month_range(int(month_key[:4]), int(month_key[5:7])))
+            return ("OK", 200)
+        except Exception as e:
+            logger.exception("Migração do total diário falhou: %s", e)
+            return (str(e), 500)
+
+    if data.get("refresh_digital_uids") is True:
+        try:
+            db = _get_firestore_client()
+            _load_digital_uids(db, refresh_mapping=True)
+            return ("OK", 200)
+        except Exception as e:
+            logger.exception("Atualização do mapeamento email→UID falhou: %s", e)
+            return (str(e), 500)
+
+    if data.get("backfill_created_at_month") is True:
+        try:
+            db = _get_firestore_client()
+            updated = backfill_created_at_month(db)
+            return (json.dumps({"updated": updated}), 200, {"Content-Type": "application/json"})
+        except Exception as e:
+            logger.exception("Backfill de created_at_month falhou: %s", e)
+            return (str(e), 500)
+
+    verify_months = data.get("verify_incremental")
+    if isinstance(verify_months, list) and verify_months:
+        months = [m.strip() for m in verify_months if isinstance(m, str) and MONTH_PATTERN.match(m.strip())]
+        if not months:
+            return ("verify_incremental deve ser uma lista de strings YYYY-MM", 400)
+        try:
+            db = _get_firestore_client()
+            results = [verify_incremental_aggregation(db, month_key) for month_key in months]
+            return (json.dumps(results), 200, {"Content-Type": "application/json"})
+        except Exception as e:
+            logger.exception("Verificação da agregação incremental falhou: %s", e)
+            return (str(e), 500)
+
     backfill_months = data.get("backfill_months")
     if isinstance(backfill_months, list) and backfill_months:
         months = [m for m in backfill_months if isinstance(m, str) and MONTH_PATTERN.match(m.strip())]
@@ -36,8 +90,7 @@ def metrics_aggregator(request):
             return ("backfill_months deve ser uma lista de strings YYYY-MM", 400)
         try:
             db = _get_firestore_client()
-            for month_key in months:
-                run_monthly_aggregation(db, month_key.strip(), closed=True)
+            run_backfill(db, months)
             return ("OK", 200)
         except Exception as e:
             logger.exception("Backfill falhou: %s", e)
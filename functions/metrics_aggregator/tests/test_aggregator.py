@@ -1,5 +1,5 @@
 import sys
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock, call, patch
 
 import pytest
@@ -7,18 +7,27 @@ import pytest
 sys.path.insert(0, ".")
 
 from aggregator import (
-    _collect_active_uids,
-    _compute_digital_volume,
+    MonthScan,
     _compute_persistence,
     _compute_quality_and_scale,
-    _compute_volume_and_ultra_files,
-    _get_uids_for_month,
+    _get_month_uid_sets,
     _load_digital_uids,
+    _metered,
+    _month_range,
     _prev_month,
+    _read_daily_total,
     _read_total_assessors,
+    _scan_month,
+    _scan_month_incremental,
+    backfill_created_at_month,
+    migrate_daily_total_to_shards,
+    read_meter,
+    run_backfill,
     run_monthly_aggregation,
     run_monthly_aggregation_for_scheduler,
+    verify_incremental_aggregation,
 )
+from uid_set_codec import decode_uid_set, encode_uid_set
 
 
 def _mock_doc(data: dict, doc_id: str = "") -> MagicMock:
@@ -36,6 +45,7 @@ def _mock_stream(docs: list) -> MagicMock:
 
     m = MagicMock()
     m.stream.side_effect = stream
+    m.select.return_value = m  # projeção não altera o mock
     return m
 
 
@@ -71,27 +81,90 @@ def test_read_total_assessors_fallback_when_value_invalid():
 
 # ─── _load_digital_uids ───────────────────────────────────────────────────────
 
-def test_load_digital_uids_resolves_emails_to_uids():
+def _digital_db(team_emails: list, users: dict, mapping: dict | None = None):
+    """
+    config/digital_team, config/digital_team_uids (opcional) e users consultados
+    por filtro "in". Retorna (db, ref do mapeamento, lista de emails por query).
+    """
     db = MagicMock()
-    config_doc = _mock_doc({"emails": ["a@x.com", "b@x.com"]})
-    uid_doc_a = MagicMock()
-    uid_doc_a.id = "uid_a"
-    uid_doc_b = MagicMock()
-    uid_doc_b.id = "uid_b"
+    team_ref = MagicMock()
+    team_ref.get.return_value = _mock_doc({"emails": team_emails})
+    mapping_ref = MagicMock()
+    if mapping is None:
+        mapping_ref.get.return_value = MagicMock(exists=False)
+    else:
+        mapping_ref.get.return_value = _mock_doc(mapping)
+    queries = []
+
+    def fake_where(field, op, values):
+        assert (field, op) == ("email", "in")
+        queries.append(list(values))
+        q = MagicMock()
+        q.select.return_value = q
+        q.stream.return_value = iter(
+            [_mock_doc({"email": e}, users[e]) for e in values if e in users]
+        )
+        return q
+
+    def collection(name):
+        col = MagicMock()
+        col.document.side_effect = lambda doc_id: team_ref if doc_id == "digital_team" else mapping_ref
+        col.where.side_effect = fake_where
+        return col
+
+    db.collection.side_effect = collection
+    return db, mapping_ref, queries
 
-    def fake_where(field, op, val):
-        m = MagicMock()
-        result = uid_doc_a if val == "a@x.com" else uid_doc_b
-        m.limit.return_value.stream.return_value = iter([result])
-        return m
 
-    db.collection.return_value.document.return_value.get.return_value = config_doc
-    db.collection.return_value.where.side_effect = fake_where
+def test_load_digital_uids_resolves_emails_to_uids():
+    db, mapping_ref, queries = _digital_db(
+        ["a@x.com", "B@x.com"], {"a@x.com": "uid_a", "b@x.com": "uid_b"}
+    )
 
     uids, size = _load_digital_uids(db)
     assert size == 2
-    assert "uid_a" in uids
-    assert "uid_b" in uids
+    assert uids == {"uid_a", "uid_b"}
+    assert queries == [["a@x.com", "b@x.com"]]
+    written = mapping_ref.set.call_args[0][0]
+    assert written["uids"] == {"a@x.com": "uid_a", "b@x.com": "uid_b"}
+    assert written["version"] == 1
+
+
+def test_load_digital_uids_batches_in_queries_up_to_limit():
+    emails = [f"u{i}@x.com" for i in range(65)]
+    db, _, queries = _digital_db(emails, {e: e.split("@")[0] for e in emails})
+
+    uids, size = _load_digital_uids(db)
+    assert size == 65
+    assert len(uids) == 65
+    assert sorted(len(q) for q in queries) == [5, 30, 30]
+
+
+def test_load_digital_uids_only_resolves_new_emails():
+    db, mapping_ref, queries = _digital_db(
+        ["a@x.com", "c@x.com"],
+        {"c@x.com": "uid_c"},
+        mapping={"uids": {"a@x.com": "uid_a", "b@x.com": "uid_b"}, "version": 4},
+    )
+
+    uids, _ = _load_digital_uids(db)
+    assert uids == {"uid_a", "uid_c"}
+    assert queries == [["c@x.com"]]
+    written = mapping_ref.set.call_args[0][0]
+    # b@x.com saiu do time; c@x.com entrou
+    assert written["uids"] == {"a@x.com": "uid_a", "c@x.com": "uid_c"}
+    assert written["version"] == 5
+
+
+def test_load_digital_uids_unchanged_mapping_is_not_queried_or_written():
+    db, mapping_ref, queries = _digital_db(
+        ["a@x.com"], {}, mapping={"uids": {"a@x.com": "uid_a"}, "version": 2},
+    )
+
+    uids, _ = _load_digital_uids(db)
+    assert uids == {"uid_a"}
+    assert queries == []
+    mapping_ref.set.assert_not_called()
 
 
 def test_load_digital_uids_returns_empty_when_config_missing():
@@ -104,51 +177,68 @@ def test_load_digital_uids_returns_empty_when_config_missing():
     assert size == 0
 
 
-# ─── AT-301 / AT-302 / AT-303: _collect_active_uids ─────────────────────────
+# ─── AT-301 / AT-302 / AT-303: _scan_month (usuários ativos) ─────────────────
 
-def test_collect_active_uids_all_users_no_filter():
-    user1 = _mock_doc({"automatica": 1, "personalized": 0, "ultra_batch_runs": []}, "u1")
-    user2 = _mock_doc({"automatica": 0, "personalized": 2, "ultra_batch_runs": []}, "u2")
-    user3 = _mock_doc({"automatica": 0, "personalized": 0, "ultra_batch_runs": [{"jobId": "j1"}]}, "u3")
-    users_col = MagicMock()
-    users_col.stream.return_value = iter([user1, user2, user3])
+def _db_with_days(user_docs: list, total_docs: list | None = None) -> MagicMock:
+    """Todo dia tem os mesmos docs em users e em total (streams reiteráveis)."""
+    users_col = _mock_stream(user_docs)
+    total_col = _mock_stream(total_docs or [])
     doc_ref = MagicMock()
-    doc_ref.collection.return_value = users_col
+    doc_ref.collection.side_effect = lambda name: users_col if name == "users" else total_col
     db = MagicMock()
     db.collection.return_value.document.return_value = doc_ref
-    result = _collect_active_uids(db, ["2025-01-01"])
-    assert result == {"u1", "u2", "u3"}
+    return db
 
 
-def test_collect_active_uids_with_filter_returns_intersection():
+def test_scan_month_active_uids_all_users():
     user1 = _mock_doc({"automatica": 1, "personalized": 0, "ultra_batch_runs": []}, "u1")
     user2 = _mock_doc({"automatica": 0, "personalized": 2, "ultra_batch_runs": []}, "u2")
-    users_col = MagicMock()
-    users_col.stream.return_value = iter([user1, user2])
-    doc_ref = MagicMock()
-    doc_ref.collection.return_value = users_col
-    db = MagicMock()
-    db.collection.return_value.document.return_value = doc_ref
-    result = _collect_active_uids(db, ["2025-01-01"], filter_uids={"u1"})
-    assert result == {"u1"}
+    user3 = _mock_doc({"automatica": 0, "personalized": 0, "ultra_batch_runs": [{"jobId": "j1"}]}, "u3")
+    db = _db_with_days([user1, user2, user3])
+    scan = _scan_month(db, ["2025-01-01"], set())
+    assert scan.active_uids == {"u1", "u2", "u3"}
+    assert scan.digital_active_uids == set()
+
+
+def test_scan_month_digital_active_is_intersection():
+    user1 = _mock_doc({"automatica": 1, "personalized": 0, "ultra_batch_runs": []}, "u1")
+    user2 = _mock_doc({"automatica": 0, "personalized": 2, "ultra_batch_runs": []}, "u2")
+    user3 = _mock_doc({"automatica": 0, "personalized": 0}, "u3")
+    db = _db_with_days([user1, user2, user3])
+    scan = _scan_month(db, ["2025-01-01"], digital_uids={"u1", "u3"})
+    assert scan.active_uids == {"u1", "u2"}
+    assert scan.digital_active_uids == {"u1"}
 
 
-def test_collect_active_uids_ignores_users_with_no_activity():
+def test_scan_month_ignores_users_with_no_activity():
     user1 = _mock_doc({"automatica": 0, "personalized": 0, "ultra_batch_runs": []}, "u1")
-    users_col = MagicMock()
-    users_col.stream.return_value = iter([user1])
-    doc_ref = MagicMock()
-    doc_ref.collection.return_value = users_col
-    db = MagicMock()
-    db.collection.return_value.document.return_value = doc_ref
-    result = _collect_active_uids(db, ["2025-01-01"])
-    assert result == set()
+    db = _db_with_days([user1])
+    assert _scan_month(db, ["2025-01-01"], set()).active_uids == set()
 
 
-def test_collect_active_uids_empty_date_list():
+def test_scan_month_counts_ultra_batch_run_counter():
+    user1 = _mock_doc({"ultra_batch_run_count": 1, "ultra_batch_files": 4}, "u1")
+    user2 = _mock_doc({"ultra_batch_run_count": 0}, "u2")
+    db = _db_with_days([user1, user2])
+    assert _scan_month(db, ["2025-01-01"], set()).active_uids == {"u1"}
+
+
+def test_scan_month_empty_date_list():
     db = MagicMock()
-    result = _collect_active_uids(db, [])
-    assert result == set()
+    assert _scan_month(db, [], {"u1"}) == MonthScan()
+    db.collection.assert_not_called()
+
+
+def test_scan_month_reads_each_day_once():
+    user1 = _mock_doc({"automatica": 2}, "u1")
+    total = _mock_doc({"automatica": 2}, "shard_0")
+    db = _db_with_days([user1], [total])
+    days = [f"2025-01-{d:02d}" for d in range(1, 32)]
+    scan = _scan_month(db, days, {"u1"}, max_workers=4)
+    users_col = db.collection.return_value.document.return_value.collection("users")
+    assert users_col.stream.call_count == 31
+    assert scan.digital_total_analyses == 62
+    assert scan.total_analyses == 62
 
 
 # ─── AT-201 / AT-202: _compute_persistence ───────────────────────────────────
@@ -169,75 +259,149 @@ def test_compute_persistence_all_in_common():
     assert _compute_persistence(uids, uids, uids) == 3
 
 
-# ─── AT-205: _get_uids_for_month ─────────────────────────────────────────────
+# ─── AT-205: _get_month_uid_sets ─────────────────────────────────────────────
 
-def test_get_uids_for_month_reads_from_cache():
+def test_get_month_uid_sets_reads_legacy_lists_from_cache():
     db = MagicMock()
     cached_doc = _mock_doc({
-        "adoption": {"active_uids": ["u1", "u2"]},
+        "adoption": {"active_uids": ["u1", "u2"], "digital_active_uids": ["u1"]},
         "closed": True,
     })
     db.collection.return_value.document.return_value.get.return_value = cached_doc
-    result = _get_uids_for_month(db, "2025-11", "active_uids")
-    assert result == {"u1", "u2"}
+    assert _get_month_uid_sets(db, "2025-11", {"u1"}) == ({"u1", "u2"}, {"u1"})
+    db.collection.return_value.document.return_value.collection.assert_not_called()
 
 
-def test_get_uids_for_month_fallback_when_no_cache():
+def test_get_month_uid_sets_prefers_compact_blob():
+    db = MagicMock()
+    cached_doc = _mock_doc({
+        "adoption": {
+            "active_uids_blob": encode_uid_set({"u3", "u4"}),
+            "digital_active_uids_blob": encode_uid_set({"u3"}),
+            "active_uids": ["old"],
+        },
+        "closed": True,
+    })
+    db.collection.return_value.document.return_value.get.return_value = cached_doc
+    assert _get_month_uid_sets(db, "2025-11", set()) == ({"u3", "u4"}, {"u3"})
+
+
+def test_get_month_uid_sets_rescans_open_month():
+    db = MagicMock()
+    cached_doc = _mock_doc({
+        "adoption": {
+            "active_uids_blob": encode_uid_set({"u1"}),
+            "digital_active_uids_blob": encode_uid_set(set()),
+        },
+        "closed": False,
+    })
+    db.collection.return_value.document.return_value.get.return_value = cached_doc
+    user1 = _mock_doc({"automatica": 1}, "u1")
+    user2 = _mock_doc({"automatica": 2}, "u2")
+    users_col = _mock_stream([user1, user2])
+    db.collection.return_value.document.return_value.collection.return_value = users_col
+
+    # Resumo parcial de mês aberto não serve: o scan acha u2, ativo depois do snapshot
+    assert _get_month_uid_sets(db, "2025-11", {"u2"}) == ({"u1", "u2"}, {"u2"})
+    assert users_col.stream.call_count == 30
+
+
+def test_get_month_uid_sets_empty_blob_is_a_cached_empty_set():
+    db = MagicMock()
+    empty = encode_uid_set(set())
+    cached_doc = _mock_doc({
+        "adoption": {"active_uids_blob": empty, "digital_active_uids_blob": empty},
+        "closed": True,
+    })
+    db.collection.return_value.document.return_value.get.return_value = cached_doc
+    assert _get_month_uid_sets(db, "2025-11", set()) == (set(), set())
+    db.collection.return_value.document.return_value.collection.assert_not_called()
+
+
+def test_get_month_uid_sets_scans_once_when_not_cached():
     db = MagicMock()
     missing = MagicMock()
     missing.exists = False
     db.collection.return_value.document.return_value.get.return_value = missing
 
-    users_col = MagicMock()
     user1 = _mock_doc({"automatica": 5, "personalized": 0, "ultra_batch_runs": []}, "u1")
-    users_col.stream.return_value = iter([user1])
+    user2 = _mock_doc({"automatica": 1}, "u2")
+    users_col = _mock_stream([user1, user2])
     db.collection.return_value.document.return_value.collection.return_value = users_col
 
-    result = _get_uids_for_month(db, "2025-11", "active_uids")
-    assert "u1" in result
+    active, digital = _get_month_uid_sets(db, "2025-11", {"u2"})
+    assert active == {"u1", "u2"}
+    assert digital == {"u2"}
+    # Um stream de users por dia, nenhum de total
+    assert users_col.stream.call_count == 30
 
 
-# ─── _compute_volume_and_ultra_files ─────────────────────────────────────────
+# ─── _scan_month (total diário) ──────────────────────────────────────────────
 
-def test_compute_volume_and_ultra_files():
-    total_doc = _mock_doc({
-        "automatica": 10,
-        "personalized": 5,
-        "ultra_batch_total_files": 3,
-    })
-    total_doc.exists = True
-    total_ref = MagicMock()
-    total_ref.get.return_value = total_doc
-    subdoc_total = MagicMock()
-    subdoc_total.document.return_value = total_ref
+def _db_with_total_docs(docs: list) -> MagicMock:
     doc_ref = MagicMock()
-    doc_ref.collection.return_value = subdoc_total
+    doc_ref.collection.return_value = _mock_stream(docs)
     db = MagicMock()
     db.collection.return_value.document.return_value = doc_ref
-    total_analyses, ultra_total = _compute_volume_and_ultra_files(
-        db, ["2025-01-01", "2025-01-02"]
-    )
-    assert total_analyses == (10 + 5 + 3) * 2
-    assert ultra_total == 3 * 2
+    return db
 
 
-def test_compute_volume_skips_missing_days():
-    total_ref = MagicMock()
-    total_ref.get.return_value = MagicMock(exists=False)
-    subdoc_total = MagicMock()
-    subdoc_total.document.return_value = total_ref
-    doc_ref = MagicMock()
-    doc_ref.collection.return_value = subdoc_total
+def test_scan_month_volume_and_ultra_files():
+    db = _db_with_days([], [_mock_doc({
+        "automatica": 10,
+        "personalized": 5,
+        "ultra_batch_total_files": 3,
+    }, "total")])
+    scan = _scan_month(db, ["2025-01-01", "2025-01-02"], set())
+    assert scan.total_analyses == (10 + 5 + 3) * 2
+    assert scan.ultra_total == 3 * 2
+
+
+def test_scan_month_volume_sums_shards_and_legacy_doc():
+    total_docs = [
+        _mock_doc({"automatica": 4, "personalized": 1}, "shard_0"),
+        _mock_doc({"automatica": 6, "ultra_batch_total_files": 3}, "shard_7"),
+        _mock_doc({"personalized": 4}, "total"),
+    ]
+    assert _read_daily_total(_db_with_total_docs(total_docs), "2025-01-01") == {
+        "automatica": 10, "personalized": 5, "ultra_batch_total_files": 3,
+    }
+    scan = _scan_month(_db_with_days([], total_docs), ["2025-01-01"], set())
+    assert scan.total_analyses == 18
+    assert scan.ultra_total == 3
+
+
+def test_scan_month_volume_skips_missing_days():
+    scan = _scan_month(_db_with_days([]), ["2025-01-01"], set())
+    assert scan.total_analyses == 0
+    assert scan.ultra_total == 0
+
+
+def test_migrate_daily_total_moves_legacy_doc_to_shard():
+    legacy = _mock_doc({"automatica": 7, "personalized": 2, "ultra_batch_total_files": 1}, "total")
+    missing = MagicMock(exists=False)
+    total_col = MagicMock()
+    total_col.document.return_value.get.side_effect = [legacy, missing]
     db = MagicMock()
-    db.collection.return_value.document.return_value = doc_ref
-    total_analyses, ultra_total = _compute_volume_and_ultra_files(db, ["2025-01-01"])
-    assert total_analyses == 0
-    assert ultra_total == 0
+    db.collection.return_value.document.return_value.collection.return_value = total_col
+
+    with patch("aggregator.firestore") as mock_fs:
+        mock_fs.Increment = lambda n: ("INC", n)
+        migrated = migrate_daily_total_to_shards(db, ["2025-01-01", "2025-01-02"])
 
+    assert migrated == 1
+    batch = db.batch.return_value
+    data = batch.set.call_args[0][1]
+    assert data["automatica"] == ("INC", 7)
+    assert batch.set.call_args[1] == {"merge": True}
+    total_col.document.assert_any_call("shard_0")
+    batch.delete.assert_called_once()
+    batch.commit.assert_called_once()
 
-# ─── _compute_digital_volume ─────────────────────────────────────────────────
 
-def test_compute_digital_volume_sums_only_digital_uids():
+# ─── _scan_month (volume digital) ────────────────────────────────────────────
+
+def test_scan_month_digital_volume_sums_only_digital_uids():
     u1 = _mock_doc(
         {"automatica": 3, "personalized": 2, "ultra_batch_runs": [{"file_count": 5}]},
         "uid_digital",
@@ -246,21 +410,170 @@ def test_compute_digital_volume_sums_only_digital_uids():
         {"automatica": 10, "personalized": 1, "ultra_batch_runs": []},
         "uid_other",
     )
-    users_col = MagicMock()
-    users_col.stream.return_value = iter([u1, u2])
-    doc_ref = MagicMock()
-    doc_ref.collection.return_value = users_col
-    db = MagicMock()
-    db.collection.return_value.document.return_value = doc_ref
-    total = _compute_digital_volume(db, ["2025-01-01"], digital_uids={"uid_digital"})
-    assert total == 3 + 2 + 5
+    scan = _scan_month(_db_with_days([u1, u2]), ["2025-01-01"], digital_uids={"uid_digital"})
+    assert scan.digital_total_analyses == 3 + 2 + 5
+
+
+def test_scan_month_digital_volume_reads_counters_and_legacy_array():
+    # Dia da migração: contador novo + array antigo no mesmo doc
+    u1 = _mock_doc(
+        {"automatica": 1, "ultra_batch_run_count": 2, "ultra_batch_files": 7,
+         "ultra_batch_runs": [{"file_count": 5}]},
+        "uid_digital",
+    )
+    scan = _scan_month(_db_with_days([u1]), ["2025-01-01"], digital_uids={"uid_digital"})
+    assert scan.digital_total_analyses == 1 + 7 + 5
+
+
+# ─── Agregação incremental ──────────────────────────────────────────────────
+
+class _FakeIncrementalDb:
+    """
+    Firestore mínimo em memória: metrics/{date}/users|total (docs com last_updated),
+    metrics_daily_partials/{date} via get_all/batch, e contagem de scans por dia.
+    """
+
+    def __init__(self, days: dict):
+        self.days = days  # date -> {"users": {uid: data}, "total": {id: data}}
+        self.partials: dict = {}
+        self.scans: list = []
+
+    def _docs(self, date_str, sub):
+        return [_mock_doc(data, doc_id) for doc_id, data in self.days.get(date_str, {}).get(sub, {}).items()]
+
+    def collection(self, name):
+        col = MagicMock()
+        if name == "metrics_daily_partials":
+            def document(date_str):
+                ref = MagicMock()
+                ref.id = date_str
+                return ref
+            col.document.side_effect = document
+            return col
+
+        def day(date_str):
+            day_ref = MagicMock()
+
+            def sub(sub_name):
+                sub_col = MagicMock()
+
+                def stream():
+                    if sub_name == "users":
+                        self.scans.append(date_str)
+                    return iter(self._docs(date_str, sub_name))
+
+                def where(field, op, value):
+                    query = MagicMock()
+                    newer = [
+                        d for d in self._docs(date_str, sub_name)
+                        if d.to_dict().get("last_updated") and d.to_dict()["last_updated"] > value
+                    ]
+                    query.select.return_value = query
+                    query.limit.return_value.stream.side_effect = lambda: iter(newer[:1])
+                    return query
+
+                sub_col.select.return_value = sub_col
+                sub_col.stream.side_effect = stream
+                sub_col.where.side_effect = where
+                return sub_col
+
+            day_ref.collection.side_effect = sub
+            return day_ref
+
+        col.document.side_effect = day
+        return col
+
+    def get_all(self, refs):
+        for ref in refs:
+            doc = MagicMock()
+            doc.id = ref.id
+            doc.exists = ref.id in self.partials
+            doc.to_dict.return_value = self.partials.get(ref.id)
+            yield doc
+
+    def batch(self):
+        batch = MagicMock()
+        batch.set.side_effect = lambda ref, data: self.partials.__setitem__(ref.id, data)
+        return batch
+
+
+_T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _incremental_days():
+    return {
+        "2025-01-01": {
+            "users": {"u1": {"automatica": 2, "last_updated": _T0}, "u2": {"personalized": 1, "last_updated": _T0}},
+            "total": {"shard_0": {"automatica": 2, "personalized": 1, "last_updated": _T0}},
+        },
+        "2025-01-02": {
+            "users": {"u1": {"ultra_batch_run_count": 1, "ultra_batch_files": 4, "last_updated": _T0}},
+            "total": {"shard_3": {"ultra_batch_total_files": 4, "last_updated": _T0}},
+        },
+    }
+
+
+def test_incremental_matches_full_scan_and_reuses_unchanged_days():
+    db = _FakeIncrementalDb(_incremental_days())
+    dates = ["2025-01-01", "2025-01-02"]
+
+    first = _scan_month_incremental(db, dates, {"u1"})
+    assert first == _scan_month(db, dates, {"u1"})
+    assert set(db.partials) == set(dates)
+
+    db.scans.clear()
+    second = _scan_month_incremental(db, dates, {"u1"})
+    assert second == first
+    assert db.scans == []  # nenhum dia reescaneado
+
+
+def test_incremental_rescans_only_days_written_after_watermark():
+    days = _incremental_days()
+    db = _FakeIncrementalDb(days)
+    dates = ["2025-01-01", "2025-01-02"]
+    _scan_month_incremental(db, dates, {"u1"})
+
+    days["2025-01-02"]["users"]["u3"] = {"automatica": 1, "last_updated": datetime.now(timezone.utc) + timedelta(hours=1)}
+    db.scans.clear()
+    scan = _scan_month_incremental(db, dates, {"u1"})
+
+    assert db.scans == ["2025-01-02"]
+    assert scan.active_uids == {"u1", "u2", "u3"}
+    assert scan == _scan_month(db, dates, {"u1"})
+
+
+def test_incremental_rescans_when_digital_team_changes():
+    db = _FakeIncrementalDb(_incremental_days())
+    dates = ["2025-01-01", "2025-01-02"]
+    _scan_month_incremental(db, dates, {"u1"})
+
+    db.scans.clear()
+    scan = _scan_month_incremental(db, dates, {"u2"})
+
+    assert sorted(db.scans) == dates
+    assert scan.digital_active_uids == {"u2"}
+
+
+def test_verify_incremental_detects_and_repairs_divergent_day():
+    db = _FakeIncrementalDb(_incremental_days())
+    dates = _month_range(2025, 1)
+    with patch("aggregator._load_digital_uids", return_value=({"u1"}, 1)):
+        _scan_month_incremental(db, dates, {"u1"})
+        assert verify_incremental_aggregation(db, "2025-01")["matched"] is True
+
+        # Parcial corrompido sem mudança nos docs (watermark não o invalida)
+        db.partials["2025-01-01"]["total_analyses"] = 999
+        result = verify_incremental_aggregation(db, "2025-01")
+
+        assert result == {"month": "2025-01", "matched": False, "mismatched_days": ["2025-01-01"], "repaired": True}
+        assert db.partials["2025-01-01"]["total_analyses"] == 3
+        assert verify_incremental_aggregation(db, "2025-01")["matched"] is True
 
 
 # ─── _compute_quality_and_scale ──────────────────────────────────────────────
 
 def test_compute_quality_and_scale():
     start = datetime(2025, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
-    end = datetime(2025, 1, 31, 23, 59, 59, tzinfo=timezone.utc)
     j1 = _mock_doc({
         "created_at": start,
         "status": "completed",
@@ -273,14 +586,56 @@ def test_compute_quality_and_scale():
         "successCount": 0,
         "failureCount": 5,
     })
-    query = MagicMock()
-    query.stream.return_value = iter([j1, j2])
-    query.where.return_value = query
     db = MagicMock()
-    db.collection.return_value.where.return_value = query
-    success_pct, jobs_pct, _ = _compute_quality_and_scale(db, start, end)
+    jobs = db.collection.return_value
+    jobs.where.return_value.select.return_value.stream.return_value = iter([j1, j2])
+    success_pct, jobs_pct, _ = _compute_quality_and_scale(db, "2025-01")
     assert abs(success_pct - (90 / (90 + 10 + 5) * 100)) < 0.01
     assert jobs_pct == 50.0
+    jobs.where.assert_called_once_with("created_at_month", "==", "2025-01")
+    jobs.where.return_value.select.assert_called_once_with(["status", "successCount", "failureCount"])
+    jobs.stream.assert_not_called()
+
+
+def test_scan_day_projects_only_counter_fields():
+    users_col = _mock_stream([_mock_doc({"automatica": 1}, "u1")])
+    total_col = _mock_stream([])
+    doc_ref = MagicMock()
+    doc_ref.collection.side_effect = lambda name: users_col if name == "users" else total_col
+    db = MagicMock()
+    db.collection.return_value.document.return_value = doc_ref
+
+    _scan_month(db, ["2025-01-01"], set())
+
+    assert users_col.select.call_args[0][0] == [
+        "automatica", "personalized", "ultra_batch_run_count", "ultra_batch_files", "ultra_batch_runs",
+    ]
+    assert total_col.select.call_args[0][0] == ["automatica", "personalized", "ultra_batch_total_files"]
+
+
+def test_read_meter_counts_docs_and_estimated_bytes():
+    before = read_meter.snapshot()
+    docs = [_mock_doc({"automatica": 1, "name": "abc"}, "u1"), MagicMock(exists=False)]
+    assert list(_metered(docs)) == docs
+    docs_read, bytes_read = read_meter.snapshot()
+    assert docs_read - before[0] == 2
+    # id "u1" (3) + 16 + "automatica"(11)+8 + "name"(5)+"abc"(4)
+    assert bytes_read - before[1] == 3 + 16 + 19 + 9
+
+
+def test_backfill_created_at_month_updates_only_missing_jobs():
+    db = MagicMock()
+    jobs = db.collection.return_value
+    old = _mock_doc({"created_at": datetime(2024, 12, 31, 23, 30, tzinfo=timezone.utc)}, "j_old")
+    new = _mock_doc({"created_at": datetime(2025, 1, 2, tzinfo=timezone.utc), "created_at_month": "2025-01"}, "j_new")
+    jobs.select.return_value.stream.return_value = iter([old, new])
+
+    assert backfill_created_at_month(db) == 1
+    jobs.select.assert_called_once_with(["created_at", "created_at_month"])
+    batch = db.batch.return_value
+    batch.update.assert_called_once_with(jobs.document.return_value, {"created_at_month": "2024-12"})
+    jobs.document.assert_called_once_with("j_old")
+    batch.commit.assert_called_once()
 
 
 # ─── _prev_month ─────────────────────────────────────────────────────────────
@@ -298,26 +653,23 @@ def test_prev_month_jan_wraps_to_december():
 @patch("aggregator._read_total_assessors", return_value=139)
 @patch("aggregator._load_digital_uids", return_value=({"u1", "u4"}, 7))
 @patch("aggregator._compute_quality_and_scale")
-@patch("aggregator._compute_digital_volume")
-@patch("aggregator._compute_volume_and_ultra_files")
-@patch("aggregator._get_uids_for_month")
-@patch("aggregator._collect_active_uids")
+@patch("aggregator._get_month_uid_sets")
+@patch("aggregator._scan_month")
 def test_run_monthly_aggregation_new_schema(
-    mock_uids,
+    mock_scan,
     mock_get_uids,
-    mock_vol,
-    mock_digital_vol,
     mock_qual,
     mock_load_digital,
     mock_assessors,
 ):
-    mock_uids.side_effect = [
-        {"u1", "u2", "u3"},
-        {"u1"},
-    ]
-    mock_get_uids.return_value = set()
-    mock_vol.return_value = (100, 20)
-    mock_digital_vol.return_value = 30
+    mock_scan.return_value = MonthScan(
+        active_uids={"u1", "u2", "u3"},
+        digital_active_uids={"u1"},
+        digital_total_analyses=30,
+        total_analyses=100,
+        ultra_total=20,
+    )
+    mock_get_uids.return_value = (set(), set())
     mock_qual.return_value = (95.0, 100.0, 100)
     db = MagicMock()
     summary_ref = MagicMock()
@@ -333,29 +685,35 @@ def test_run_monthly_aggregation_new_schema(
     assert payload["digital"]["mau"] == 1
     assert abs(payload["digital"]["mau_percent"] - (1 / 7 * 100)) < 0.01
     assert payload["digital"]["total_analyses"] == 30
+    assert payload["scale"]["pct_volume_ultra_batch"] == 20.0
+    # Um único scan do mês para MAU, MAU digital e volumes
+    mock_scan.assert_called_once()
+    assert mock_scan.call_args[0][2] == {"u1", "u4"}
     assert "active_uids" not in payload["adoption"]
+    # Mês aberto também grava o conjunto compacto
+    assert decode_uid_set(payload["adoption"]["active_uids_blob"]) == {"u1", "u2", "u3"}
 
 
 @patch("aggregator._read_total_assessors", return_value=139)
 @patch("aggregator._load_digital_uids", return_value=({"u1"}, 2))
 @patch("aggregator._compute_quality_and_scale")
-@patch("aggregator._compute_digital_volume")
-@patch("aggregator._compute_volume_and_ultra_files")
-@patch("aggregator._get_uids_for_month")
-@patch("aggregator._collect_active_uids")
+@patch("aggregator._get_month_uid_sets")
+@patch("aggregator._scan_month")
 def test_run_monthly_aggregation_closed_includes_active_uids(
-    mock_uids,
+    mock_scan,
     mock_get_uids,
-    mock_vol,
-    mock_digital_vol,
     mock_qual,
     mock_load_digital,
     mock_assessors,
 ):
-    mock_uids.side_effect = [{"u1", "u2"}, {"u1"}]
-    mock_get_uids.return_value = set()
-    mock_vol.return_value = (50, 10)
-    mock_digital_vol.return_value = 5
+    mock_scan.return_value = MonthScan(
+        active_uids={"u1", "u2"},
+        digital_active_uids={"u1"},
+        digital_total_analyses=5,
+        total_analyses=50,
+        ultra_total=10,
+    )
+    mock_get_uids.return_value = (set(), set())
     mock_qual.return_value = (98.0, 100.0, 50)
     db = MagicMock()
     summary_ref = MagicMock()
@@ -365,9 +723,9 @@ def test_run_monthly_aggregation_closed_includes_active_uids(
 
     payload = summary_ref.set.call_args[0][0]
     assert payload["closed"] is True
-    assert "active_uids" in payload["adoption"]
-    assert set(payload["adoption"]["active_uids"]) == {"u1", "u2"}
-    assert "digital_active_uids" in payload["adoption"]
+    assert decode_uid_set(payload["adoption"]["active_uids_blob"]) == {"u1", "u2"}
+    assert decode_uid_set(payload["adoption"]["digital_active_uids_blob"]) == {"u1"}
+    assert "active_uids" not in payload["adoption"]
 
 
 # ─── run_monthly_aggregation_for_scheduler ───────────────────────────────────
@@ -375,23 +733,19 @@ def test_run_monthly_aggregation_closed_includes_active_uids(
 @patch("aggregator._read_total_assessors", return_value=139)
 @patch("aggregator._load_digital_uids", return_value=(set(), 0))
 @patch("aggregator._compute_quality_and_scale")
-@patch("aggregator._compute_digital_volume")
-@patch("aggregator._compute_volume_and_ultra_files")
-@patch("aggregator._get_uids_for_month")
-@patch("aggregator._collect_active_uids")
+@patch("aggregator._get_month_uid_sets")
+@patch("aggregator._scan_month")
 def test_run_monthly_aggregation_for_scheduler_current_only(
-    mock_uids, mock_get_uids, mock_vol, mock_digital_vol, mock_qual, mock_load_digital, mock_assessors,
+    mock_scan, mock_get_uids, mock_qual, mock_load_digital, mock_assessors,
 ):
-    mock_uids.return_value = set()
-    mock_get_uids.return_value = set()
-    mock_vol.return_value = (0, 0)
-    mock_digital_vol.return_value = 0
+    mock_scan.return_value = MonthScan()
+    mock_get_uids.return_value = (set(), set())
     mock_qual.return_value = (0.0, 0.0, 0)
     db = MagicMock()
     summary_ref = MagicMock()
     db.collection.return_value.document.return_value = summary_ref
     run_monthly_aggregation_for_scheduler(
-        db, current_month="2025-02", close_previous_month=False
+        db, current_month="2025-02", close_previous_month=False, incremental=False
     )
     assert summary_ref.set.call_count == 1
     payload = summary_ref.set.call_args[0][0]
@@ -401,23 +755,19 @@ def test_run_monthly_aggregation_for_scheduler_current_only(
 @patch("aggregator._read_total_assessors", return_value=139)
 @patch("aggregator._load_digital_uids", return_value=(set(), 0))
 @patch("aggregator._compute_quality_and_scale")
-@patch("aggregator._compute_digital_volume")
-@patch("aggregator._compute_volume_and_ultra_files")
-@patch("aggregator._get_uids_for_month")
-@patch("aggregator._collect_active_uids")
+@patch("aggregator._get_month_uid_sets")
+@patch("aggregator._scan_month")
 def test_run_monthly_aggregation_for_scheduler_closes_previous(
-    mock_uids, mock_get_uids, mock_vol, mock_digital_vol, mock_qual, mock_load_digital, mock_assessors,
+    mock_scan, mock_get_uids, mock_qual, mock_load_digital, mock_assessors,
 ):
-    mock_uids.return_value = set()
-    mock_get_uids.return_value = set()
-    mock_vol.return_value = (0, 0)
-    mock_digital_vol.return_value = 0
+    mock_scan.return_value = MonthScan()
+    mock_get_uids.return_value = (set(), set())
     mock_qual.return_value = (0.0, 0.0, 0)
     db = MagicMock()
     summary_ref = MagicMock()
     db.collection.return_value.document.return_value = summary_ref
     run_monthly_aggregation_for_scheduler(
-        db, current_month="2025-02", close_previous_month=True
+        db, current_month="2025-02", close_previous_month=True, incremental=False
     )
     assert summary_ref.set.call_count == 2
     calls = [summary_ref.set.call_args_list[i][0][0] for i in range(2)]
@@ -426,3 +776,90 @@ def test_run_monthly_aggregation_for_scheduler_closes_previous(
     assert "2025-02" in months
     closed_jan = next(c for c in calls if c["month"] == "2025-01")
     assert closed_jan["closed"] is True
+
+
+@patch("aggregator._read_total_assessors", return_value=139)
+@patch("aggregator._load_digital_uids", return_value=(set(), 0))
+@patch("aggregator._compute_quality_and_scale", return_value=(0.0, 0.0, 0))
+@patch("aggregator._get_month_uid_sets", return_value=(set(), set()))
+@patch("aggregator._scan_month")
+@patch("aggregator._scan_month_incremental", return_value=MonthScan())
+def test_run_monthly_aggregation_for_scheduler_incremental_uses_partials(
+    mock_incremental, mock_scan, mock_get_uids, mock_qual, mock_load_digital, mock_assessors,
+):
+    db = MagicMock()
+    run_monthly_aggregation_for_scheduler(
+        db, current_month="2025-02", close_previous_month=False, incremental=True
+    )
+    mock_incremental.assert_called_once()
+    mock_scan.assert_not_called()
+
+
+# ─── run_backfill ────────────────────────────────────────────────────────────
+
+def _scan_for(month_key: str) -> MonthScan:
+    uid = f"u{month_key}"
+    return MonthScan(active_uids={uid, "always"}, digital_active_uids={"always"}, total_analyses=1)
+
+
+@patch("aggregator._read_total_assessors", return_value=10)
+@patch("aggregator._load_digital_uids", return_value=({"always"}, 1))
+@patch("aggregator._compute_quality_and_scale", return_value=(0.0, 0.0, 0))
+@patch("aggregator._get_month_uid_sets")
+@patch("aggregator._scan_month")
+def test_run_backfill_scans_each_month_once_and_reuses_sets(
+    mock_scan, mock_get_sets, mock_qual, mock_load_digital, mock_assessors,
+):
+    months = [f"2025-{m:02d}" for m in range(12, 0, -1)] + ["2025-06"]
+    month_of = {}
+    for m in range(1, 13):
+        dates = tuple(_month_range(2025, m))
+        month_of[dates] = f"2025-{m:02d}"
+    mock_scan.side_effect = lambda db, dates, digital: _scan_for(month_of[tuple(dates)])
+    mock_get_sets.return_value = ({"always"}, {"always"})
+    db = MagicMock()
+    payloads = {}
+    db.collection.return_value.document.side_effect = lambda key: MagicMock(
+        set=lambda payload: payloads.__setitem__(key, payload)
+    )
+
+    run_backfill(db, months, max_workers=4)
+
+    # 12 scans (um por mês); só 2024-11 e 2024-12 vêm de fora do intervalo
+    assert mock_scan.call_count == 12
+    assert sorted(c.args[1] for c in mock_get_sets.call_args_list) == ["2024-11", "2024-12"]
+    mock_load_digital.assert_called_once()
+    mock_assessors.assert_called_once()
+    # Gravados em ordem cronológica, mesmo com os meses pedidos fora de ordem
+    assert list(payloads) == [f"2025-{m:02d}" for m in range(1, 13)]
+    assert all(p["closed"] is True for p in payloads.values())
+    assert payloads["2025-03"]["persistence"]["users_3m_streak"] == 1
+    assert payloads["2025-03"]["digital"]["users_3m_streak"] == 1
+
+
+@patch("aggregator._read_total_assessors", return_value=10)
+@patch("aggregator._load_digital_uids", return_value=(set(), 0))
+@patch("aggregator._compute_quality_and_scale", return_value=(0.0, 0.0, 0))
+@patch("aggregator._get_month_uid_sets")
+@patch("aggregator._scan_month")
+def test_run_backfill_persistence_uses_in_memory_predecessors(
+    mock_scan, mock_get_sets, mock_qual, mock_load_digital, mock_assessors,
+):
+    sets = {
+        "2025-01": {"a", "b", "c"},
+        "2025-02": {"a", "b"},
+        "2025-03": {"a", "c"},
+    }
+    month_of = {tuple(_month_range(2025, m)): f"2025-{m:02d}" for m in (1, 2, 3)}
+    mock_scan.side_effect = lambda db, dates, digital: MonthScan(active_uids=sets[month_of[tuple(dates)]])
+    mock_get_sets.return_value = (set(), set())
+    db = MagicMock()
+    payloads = {}
+    db.collection.return_value.document.side_effect = lambda key: MagicMock(
+        set=lambda payload: payloads.__setitem__(key, payload)
+    )
+
+    run_backfill(db, ["2025-03", "2025-01", "2025-02"])
+
+    assert payloads["2025-03"]["persistence"]["users_3m_streak"] == 1
+    assert payloads["2025-02"]["persistence"]["users_3m_streak"] == 0
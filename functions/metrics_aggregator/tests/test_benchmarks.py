@@ -0,0 +1,57 @@
+"""Smoke test do benchmark: dataset pequeno, sem latência, conferindo o gabarito."""
+import json
+import sys
+
+sys.path.insert(0, ".")
+
+from aggregator import run_backfill
+from benchmarks.bench_aggregator import SCENARIOS, compare_with_baseline, main, run_benchmarks
+from benchmarks.dataset import DatasetParams, build_dataset
+from benchmarks.fake_firestore import FakeFirestore
+from config import COLLECTION_METRICS_SUMMARY
+from uid_set_codec import decode_uid_set
+
+SMALL = DatasetParams(users=40, months=4, days_per_month=5, active_ratio=0.3, run_density=0.2, seed=7)
+
+
+def test_backfill_on_fake_matches_generated_ground_truth():
+    db = FakeFirestore()
+    dataset = build_dataset(db, SMALL)
+
+    run_backfill(db, dataset.months)
+
+    for month_key in dataset.months:
+        summary = db.collection(COLLECTION_METRICS_SUMMARY).document(month_key).get().to_dict()
+        adoption = summary["adoption"]
+        assert adoption["mau"] == len(dataset.active_by_month[month_key])
+        assert decode_uid_set(adoption["active_uids_blob"]) == dataset.active_by_month[month_key]
+        assert decode_uid_set(adoption["digital_active_uids_blob"]) == dataset.digital_active_by_month[month_key]
+
+
+def test_run_benchmarks_reports_every_scenario():
+    report = run_benchmarks(SMALL, track_memory=False)
+
+    assert set(report["scenarios"]) == set(SCENARIOS)
+    for result in report["scenarios"].values():
+        assert result["docs_read"] > 0
+        assert result["wall_seconds"] >= 0
+    # Execução morna reaproveita os parciais: lê bem menos que a fria
+    assert report["scenarios"]["scheduler_warm"]["docs_read"] < report["scenarios"]["scheduler_cold"]["docs_read"]
+    assert report["scenarios"]["scheduler_warm"]["writes"] < report["scenarios"]["scheduler_cold"]["writes"]
+
+
+def test_main_writes_json_and_flags_regressions(tmp_path):
+    output = tmp_path / "bench.json"
+    argv = [
+        "--users", "20", "--months", "3", "--days-per-month", "3",
+        "--scenario", "monthly", "--output", str(output),
+    ]
+    assert main(argv) == 0
+    report = json.loads(output.read_text())
+    assert report["params"]["users"] == 20
+    assert "peak_memory_mib" in report["scenarios"]["monthly"]
+
+    baseline = json.loads(output.read_text())
+    baseline["scenarios"]["monthly"]["docs_read"] = 1
+    regressions = compare_with_baseline(report, baseline, max_regression_pct=10.0)
+    assert [r.split(":")[0] for r in regressions] == ["monthly.docs_read"]
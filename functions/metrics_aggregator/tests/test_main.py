@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 from unittest.mock import MagicMock, patch
@@ -42,3 +43,63 @@ def test_returns_500_on_aggregation_error():
                 response, status = metrics_aggregator(request)
                 assert status == 500
                 assert "firestore error" in response
+
+
+def test_migrate_total_shards_runs_per_month():
+    with patch.dict(os.environ, {"SCHEDULER_SECRET": ""}):
+        request = MagicMock()
+        request.get_json.return_value = {"migrate_total_shards": ["2025-02"]}
+        with patch("main._get_firestore_client") as mock_db:
+            with patch("main.migrate_daily_total_to_shards") as mock_migrate:
+                response, status = metrics_aggregator(request)
+                assert status == 200
+                dates = mock_migrate.call_args[0][1]
+                assert dates[0] == "2025-02-01"
+                assert dates[-1] == "2025-02-28"
+
+
+def test_refresh_digital_uids_rebuilds_mapping():
+    with patch.dict(os.environ, {"SCHEDULER_SECRET": ""}):
+        request = MagicMock()
+        request.get_json.return_value = {"refresh_digital_uids": True}
+        with patch("main._get_firestore_client") as mock_db:
+            with patch("main._load_digital_uids") as mock_load:
+                response, status = metrics_aggregator(request)
+                assert status == 200
+                mock_load.assert_called_once_with(mock_db.return_value, refresh_mapping=True)
+
+
+def test_verify_incremental_returns_json_per_month():
+    with patch.dict(os.environ, {"SCHEDULER_SECRET": ""}):
+        request = MagicMock()
+        request.get_json.return_value = {"verify_incremental": ["2025-02", "bad"]}
+        with patch("main._get_firestore_client"):
+            with patch("main.verify_incremental_aggregation", return_value={"month": "2025-02", "matched": True}) as mock_verify:
+                response, status, headers = metrics_aggregator(request)
+                assert status == 200
+                assert headers["Content-Type"] == "application/json"
+                assert json.loads(response) == [{"month": "2025-02", "matched": True}]
+                mock_verify.assert_called_once()
+
+
+def test_backfill_created_at_month():
+    with patch.dict(os.environ, {"SCHEDULER_SECRET": ""}):
+        request = MagicMock()
+        request.get_json.return_value = {"backfill_created_at_month": True}
+        with patch("main._get_firestore_client") as mock_db:
+            with patch("main.backfill_created_at_month", return_value=3) as mock_backfill:
+                response, status, _ = metrics_aggregator(request)
+                assert status == 200
+                assert json.loads(response) == {"updated": 3}
+                mock_backfill.assert_called_once_with(mock_db.return_value)
+
+
+def test_backfill_months_runs_single_shared_backfill():
+    with patch.dict(os.environ, {"SCHEDULER_SECRET": ""}):
+        request = MagicMock()
+        request.get_json.return_value = {"backfill_months": ["2025-02", " 2025-01", "x"]}
+        with patch("main._get_firestore_client") as mock_db:
+            with patch("main.run_backfill") as mock_backfill:
+                response, status = metrics_aggregator(request)
+                assert status == 200
+                mock_backfill.assert_called_once_with(mock_db.return_value, ["2025-02", " 2025-01"])
@@ -0,0 +1,45 @@
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, ".")
+
+from uid_set_codec import decode_uid_set, encode_uid_set, intersect_uid_sets
+
+
+def test_roundtrip_ignores_order_and_duplicates():
+    uids = ["b7Kq2", "a1", "a1", "a10", "Zz", "ação"]
+    blob = encode_uid_set(uids)
+    assert decode_uid_set(blob) == set(uids)
+    assert blob == encode_uid_set(reversed(uids))
+
+
+def test_empty_set():
+    assert decode_uid_set(encode_uid_set([])) == set()
+
+
+def test_compact_for_large_base():
+    # UIDs de 28 caracteres como os do Firebase Auth
+    uids = {f"uid{i:06d}xYz0123456789abcdefg"[:28] for i in range(20_000)}
+    blob = encode_uid_set(uids)
+    plain = sum(len(u) for u in uids)
+    assert decode_uid_set(blob) == uids
+    assert len(blob) < plain / 10
+
+
+def test_intersection_accepts_blobs_and_sets():
+    m = encode_uid_set({"u1", "u2", "u3"})
+    m1 = {"u2", "u3", "u4"}
+    m2 = encode_uid_set({"u3", "u2", "u9"})
+    assert intersect_uid_sets(m, m1, m2) == {"u2", "u3"}
+    assert intersect_uid_sets(m, set()) == set()
+
+
+def test_rejects_unknown_version_and_garbage():
+    with pytest.raises(ValueError):
+        decode_uid_set(b"\x09" + zlib.compress(b""))
+    with pytest.raises(ValueError):
+        decode_uid_set(b"")
+    with pytest.raises(zlib.error):
+        decode_uid_set(b"\x01not-zlib")
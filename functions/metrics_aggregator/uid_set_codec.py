@@ -0,0 +1,98 @@
+"""
+Codificação compacta de conjuntos de UIDs para metrics_summary.
+
+Formato (versão 1): byte de versão + zlib(sequência ordenada de UIDs com front
+coding). Cada UID é gravado como varint(prefixo comum com o anterior),
+varint(tamanho do sufixo) e o sufixo em UTF-8. A ordenação garante o maior
+prefixo compartilhado entre vizinhos e torna a codificação determinística.
+"""
+import zlib
+from typing import Iterable, Union
+
+FORMAT_VERSION = 1
+
+UidSet = Union[set[str], frozenset[str], bytes, bytearray]
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Conjunto de UIDs truncado")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _common_prefix(a: bytes, b: bytes) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def encode_uid_set(uids: Iterable[str]) -> bytes:
+    """Codifica o conjunto (duplicatas e ordem de entrada são irrelevantes)."""
+    raw = bytearray()
+    previous = b""
+    for uid in sorted(set(uids)):
+        current = uid.encode("utf-8")
+        shared = _common_prefix(previous, current)
+        _write_varint(raw, shared)
+        _write_varint(raw, len(current) - shared)
+        raw += current[shared:]
+        previous = current
+    return bytes([FORMAT_VERSION]) + zlib.compress(bytes(raw), 9)
+
+
+def decode_uid_set(blob: bytes) -> set[str]:
+    """Decodifica um blob gerado por encode_uid_set."""
+    if not blob:
+        raise ValueError("Conjunto de UIDs vazio (sem cabeçalho)")
+    if blob[0] != FORMAT_VERSION:
+        raise ValueError(f"Versão de conjunto de UIDs não suportada: {blob[0]}")
+    raw = zlib.decompress(bytes(blob[1:]))
+    uids: set[str] = set()
+    previous = b""
+    pos = 0
+    while pos < len(raw):
+        shared, pos = _read_varint(raw, pos)
+        length, pos = _read_varint(raw, pos)
+        current = previous[:shared] + raw[pos:pos + length]
+        pos += length
+        uids.add(current.decode("utf-8"))
+        previous = current
+    return uids
+
+
+def _as_set(value: UidSet) -> set[str]:
+    if isinstance(value, (bytes, bytearray)):
+        return decode_uid_set(value)
+    return set(value)
+
+
+def intersect_uid_sets(first: UidSet, *others: UidSet) -> set[str]:
+    """Interseção de conjuntos (já decodificados ou em blob), partindo do menor."""
+    sets = sorted((_as_set(s) for s in (first, *others)), key=len)
+    result = sets[0]
+    for other in sets[1:]:
+        if not result:
+            break
+        result = result & other
+    return result